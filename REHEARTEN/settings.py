@@ -100,6 +100,25 @@ AUTHENTICATION_BACKENDS = [
 SESSION_ENGINE = 'django.contrib.sessions.backends.cache'
 SESSION_CACHE_ALIAS = 'default'
 
+# Shared cache for sessions, the fare calendar and trip manifests. Cached entries are
+# dropped when their rows change, so every worker process must use the same store:
+# Redis when REDIS_URL is set (needs the redis package), otherwise the django_cache
+# table (python manage.py createcachetable).
+if os.getenv('REDIS_URL'):
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': os.getenv('REDIS_URL'),
+        }
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.db.DatabaseCache',
+            'LOCATION': 'django_cache',
+        }
+    }
+
 # Password validation
 # https://docs.djangoproject.com/en/5.2/ref/settings/#auth-password-validators
 
@@ -151,6 +170,26 @@ DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 SOCIAL_AUTH_GOOGLE_OAUTH2_KEY = os.getenv('GOOGLE_OAUTH2_CLIENT_ID', '')
 SOCIAL_AUTH_GOOGLE_OAUTH2_SECRET = os.getenv('GOOGLE_OAUTH2_CLIENT_SECRET', '')
 SOCIAL_AUTH_GOOGLE_OAUTH2_SCOPE = ['email', 'profile']
+# Shared secret for HMAC-SHA256 signatures on /api/payments/callback/<gateway>/
+# (X-Callback-Signature header). Required unless DEBUG is on: without it callbacks are
+# refused with 503; unsigned callbacks are only accepted in development (DEBUG).
+PAYMENT_CALLBACK_SECRET = os.getenv('PAYMENT_CALLBACK_SECRET', '')
+# User whose wallet receives wallet payments (Wallet.pay) and pays wallet refunds back
+ADMIN_WALLET_USER_ID = int(os.getenv('ADMIN_WALLET_USER_ID', '1'))
+# Payment status long-polls (GET /api/payments/{id}/wait-status/) allowed to wait at
+# once per process. Each one occupies a worker thread, so keep this below the number of
+# threads per worker; 0 turns waiting off (requests get the current status at once).
+PAYMENT_STATUS_MAX_WAITERS = int(os.getenv('PAYMENT_STATUS_MAX_WAITERS', '8'))
+# Key that signs ticket codes checked at boarding (bookings/ticket_codes.py).
+# Falls back to SECRET_KEY; changing it invalidates every issued code.
+TICKET_CODE_SECRET = os.getenv('TICKET_CODE_SECRET', '')
+# Rendered ticket PDFs, stored by content hash (written by render_ticket_documents)
+TICKET_DOCUMENT_ROOT = os.getenv('TICKET_DOCUMENT_ROOT', str(BASE_DIR / 'media' / 'tickets'))
+# Outgoing mail for customer notifications (delivered by process_waitlist).
+# Messages are printed to the console unless EMAIL_BACKEND is configured.
+EMAIL_BACKEND = os.getenv('EMAIL_BACKEND', 'django.core.mail.backends.console.EmailBackend')
+DEFAULT_FROM_EMAIL = os.getenv('DEFAULT_FROM_EMAIL', 'no-reply@localhost')
+
 LOGIN_URL = '/login/'
 LOGIN_REDIRECT_URL = '/dashboard/'
 LOGOUT_REDIRECT_URL = '/'
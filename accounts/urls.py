@@ -20,6 +20,7 @@ urlpatterns = [
     
     # APIs
     path('api/users/', views.api_user_list, name='api_user_list'),
+    path('api/users/export/', views.api_user_export, name='api_user_export'),
     path('api/change-user-role/', views.api_change_user_role, name='api_change_user_role'),
     path('api/toggle-user-status/', views.api_toggle_user_status, name='api_toggle_user_status'),
     path('api/change-password/', views.api_change_password, name='api_change_password'),
@@ -508,6 +508,20 @@ def api_user_list(request):
         return JsonResponse({'error': f'Có lỗi xảy ra: {str(e)}'}, status=500)
 
 
+@login_required
+def api_user_export(request):
+    """Xuất danh sách người dùng dạng CSV hoặc JSON lines (stream, chỉ admin)"""
+    user = get_current_user(request)
+    if not user.is_admin():
+        return JsonResponse({'error': 'Chỉ admin mới có thể xuất danh sách người dùng'}, status=403)
+
+    from utils.exports import export_response
+    try:
+        return export_response('users', request.GET, request.GET.get('format', 'csv'))
+    except ValueError as e:
+        return JsonResponse({'error': str(e)}, status=400)
+
+
 @csrf_exempt
 @login_required
 def api_get_profile(request):
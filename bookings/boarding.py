@@ -0,0 +1,77 @@
+"""
+Boarding check-in with signed ticket codes (No ORM)
+
+A scan is verified from the code alone (see ticket_codes) plus the trip's
+revocation list, so checking a passenger in never reads the ticket. The accepted
+scans of a request are written to boarding_scans with one statement before the
+response is sent; the first stored scan of a ticket wins, so a ticket scanned again
+through any process or device is reported as already boarded. Offline devices
+download a boarding pack (trip key, revoked and boarded tickets), check codes
+locally and upload their scans here later.
+"""
+from django.utils.timezone import now
+from typing import List, Dict, Any
+import base64
+from .models import BoardingScan, TicketRevocation
+from .ticket_codes import verify, trip_key, InvalidTicketCode, VERSION
+
+
+def check_in(scans: List[Dict[str, Any]], trip_id: int = None, device_id: str = '') -> List[Dict[str, Any]]:
+    """
+    Verify scans ({'code', 'scanned_at'}) and record the valid ones in boarding_scans.
+    Each result has a status: boarded, already_boarded, invalid, expired, revoked or
+    wrong_trip (the code belongs to another trip than the one being boarded).
+    """
+    current_time = now()
+    revoked: Dict[int, set] = {}
+    accepted: Dict[int, tuple] = {}
+    results = []
+    for scan in scans:
+        scanned_at = min(scan.get('scanned_at') or current_time, current_time)
+        result = {'code': scan['code'], 'ticket_id': None, 'seat_number': None}
+        try:
+            ticket = verify(scan['code'])
+        except InvalidTicketCode as e:
+            result.update(status='invalid', error=str(e))
+            results.append(result)
+            continue
+
+        result.update(ticket_id=ticket.ticket_id, trip_id=ticket.trip_id, seat_number=ticket.seat_number)
+        if trip_id is not None and ticket.trip_id != trip_id:
+            result['status'] = 'wrong_trip'
+        elif ticket.is_expired(scanned_at):
+            result['status'] = 'expired'
+        else:
+            if ticket.trip_id not in revoked:
+                revoked[ticket.trip_id] = set(TicketRevocation.get_ticket_ids(ticket.trip_id))
+            if ticket.ticket_id in revoked[ticket.trip_id]:
+                result['status'] = 'revoked'
+            elif ticket.ticket_id in accepted:
+                result['status'] = 'already_boarded'
+            else:
+                accepted[ticket.ticket_id] = (ticket.ticket_id, ticket.trip_id, scanned_at, device_id)
+                result['status'] = 'boarded'
+        results.append(result)
+
+    # A ticket the table already held (scanned through any process or device) keeps its first scan
+    inserted = set(BoardingScan.record_many(list(accepted.values())))
+    boarded_at = BoardingScan.get_scanned_at([ticket_id for ticket_id in accepted if ticket_id not in inserted])
+    for result in results:
+        ticket_id = result['ticket_id']
+        if result['status'] == 'boarded' and ticket_id not in inserted:
+            result['status'] = 'already_boarded'
+        if result['status'] == 'already_boarded':
+            result['boarded_at'] = boarded_at.get(ticket_id, accepted[ticket_id][2])
+    return results
+
+
+def boarding_pack(trip_id: int) -> Dict[str, Any]:
+    """What an offline device needs to board one trip"""
+    return {
+        'trip_id': trip_id,
+        'code_version': VERSION,
+        'key': base64.b64encode(trip_key(trip_id)).decode(),
+        'revoked_ticket_ids': TicketRevocation.get_ticket_ids(trip_id),
+        'boarded_ticket_ids': BoardingScan.get_ticket_ids(trip_id),
+        'generated_at': now(),
+    }
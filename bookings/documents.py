@@ -0,0 +1,190 @@
+"""
+Ticket documents: one PDF page per ticket with its boarding QR code (No ORM)
+
+The booking page never renders anything itself: it queues the booking in
+ticket_documents and shows a placeholder. The render_ticket_documents worker loads
+queued bookings, renders their PDFs in a process pool (render_pdf only takes plain
+data, so it runs in any worker process without Django or a DB connection) and
+stores each file under the SHA-256 of its bytes in TICKET_DOCUMENT_ROOT. Rendering
+is deterministic, so an unchanged booking renders to the same file and URL and
+browsers can cache it for good.
+
+PDFs are written directly with the base-14 fonts, which only cover Latin-1, so text
+is printed without Vietnamese diacritics, as on airline tickets.
+"""
+from django.conf import settings
+from django.utils.timezone import localtime
+from concurrent.futures import Executor
+from pathlib import Path
+from typing import List, Dict, Any, Optional
+import hashlib
+import os
+import tempfile
+import unicodedata
+import zlib
+import qrcode
+from .models import Booking, Ticket, TicketDocument
+from .ticket_codes import sign
+
+# A5 portrait, in points
+PAGE_WIDTH, PAGE_HEIGHT = 420, 595
+MARGIN = 36
+QR_SIZE = 200
+FONTS = {'F1': 'Helvetica', 'F2': 'Helvetica-Bold', 'F3': 'Courier'}
+
+
+def fold(text: Any) -> str:
+    """ASCII version of a Vietnamese text (diacritics removed, đ -> d)"""
+    text = str(text).replace('đ', 'd').replace('Đ', 'D').replace('→', '->')
+    text = ''.join(char for char in unicodedata.normalize('NFKD', text) if not unicodedata.combining(char))
+    return text.encode('ascii', 'replace').decode()
+
+
+def _text(x: float, y: float, font: str, size: int, text: str) -> str:
+    escaped = fold(text).replace('\\', '\\\\').replace('(', '\\(').replace(')', '\\)')
+    return f"BT /{font} {size} Tf {x:.1f} {y:.1f} Td ({escaped}) Tj ET"
+
+
+def _qr(x: float, y: float, size: float, data: str) -> str:
+    """QR code as filled rectangles, one per horizontal run of dark modules"""
+    code = qrcode.QRCode(error_correction=qrcode.constants.ERROR_CORRECT_M, border=0)
+    code.add_data(data)
+    code.make(fit=True)
+    matrix = code.get_matrix()
+    module = size / len(matrix)
+    rects = []
+    for row, modules in enumerate(matrix):
+        column = 0
+        while column < len(modules):
+            if modules[column]:
+                start = column
+                while column < len(modules) and modules[column]:
+                    column += 1
+                rects.append(f"{x + start * module:.2f} {y + size - (row + 1) * module:.2f} "
+                             f"{(column - start) * module:.2f} {module:.2f} re")
+            else:
+                column += 1
+    return "0 g\n" + "\n".join(rects) + "\nf"
+
+
+def _page(document: Dict[str, Any], ticket: Dict[str, Any]) -> bytes:
+    lines = [
+        _text(MARGIN, PAGE_HEIGHT - 60, 'F2', 20, 'REHEARTEN - VE XE KHACH'),
+        _text(MARGIN, PAGE_HEIGHT - 84, 'F1', 11, f"Ma dat ve: {document['booking_id']}"),
+        _text(MARGIN, PAGE_HEIGHT - 120, 'F2', 14, f"{document['start_location']} -> {document['end_location']}"),
+        _text(MARGIN, PAGE_HEIGHT - 142, 'F1', 11, f"Khoi hanh: {document['departure']}"),
+        _text(MARGIN, PAGE_HEIGHT - 158, 'F1', 11, f"Du kien den: {document['arrival']}"),
+        _text(MARGIN, PAGE_HEIGHT - 174, 'F1', 11, f"Xe: {document['bus']}"),
+        _text(MARGIN, PAGE_HEIGHT - 210, 'F1', 11, 'Hanh khach'),
+        _text(MARGIN, PAGE_HEIGHT - 228, 'F2', 16, fold(ticket['passenger_name']).upper()),
+        _text(PAGE_WIDTH - MARGIN - 90, PAGE_HEIGHT - 210, 'F1', 11, 'So ghe'),
+        _text(PAGE_WIDTH - MARGIN - 90, PAGE_HEIGHT - 234, 'F2', 24, ticket['seat_number']),
+        _text(MARGIN, PAGE_HEIGHT - 252, 'F1', 11, f"Gia ve: {ticket['price']} VND"),
+        _qr((PAGE_WIDTH - QR_SIZE) / 2, 120, QR_SIZE, ticket['code']),
+        _text(MARGIN, 96, 'F3', 9, ticket['code'][:32]),
+        _text(MARGIN, 84, 'F3', 9, ticket['code'][32:]),
+        _text(MARGIN, 56, 'F1', 9, 'Vui long co mat truoc gio khoi hanh 15 phut va xuat trinh ma QR khi len xe.'),
+    ]
+    return "\n".join(lines).encode('ascii')
+
+
+def render_pdf(document: Dict[str, Any]) -> bytes:
+    """
+    PDF of a booking's tickets from the plain data built by load_document(). Runs in
+    the worker pool; the output depends only on the input.
+    """
+    pages = [_page(document, ticket) for ticket in document['tickets']]
+    font_ids = {name: 3 + index for index, name in enumerate(FONTS)}
+    first_page = 3 + len(FONTS)
+    page_ids = [first_page + 2 * index for index in range(len(pages))]
+
+    objects = [
+        b"<< /Type /Catalog /Pages 2 0 R >>",
+        f"<< /Type /Pages /Kids [{' '.join(f'{i} 0 R' for i in page_ids)}] /Count {len(pages)} >>".encode(),
+    ]
+    for name, base_font in FONTS.items():
+        objects.append(f"<< /Type /Font /Subtype /Type1 /BaseFont /{base_font} "
+                       f"/Encoding /WinAnsiEncoding >>".encode())
+    fonts = ' '.join(f"/{name} {object_id} 0 R" for name, object_id in font_ids.items())
+    for page_id, content in zip(page_ids, pages):
+        objects.append(f"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 {PAGE_WIDTH} {PAGE_HEIGHT}] "
+                       f"/Resources << /Font << {fonts} >> >> /Contents {page_id + 1} 0 R >>".encode())
+        stream = zlib.compress(content, 6)
+        objects.append(f"<< /Length {len(stream)} /Filter /FlateDecode >>\nstream\n".encode()
+                       + stream + b"\nendstream")
+
+    output = bytearray(b"%PDF-1.4\n%\xe2\xe3\xcf\xd3\n")
+    offsets = []
+    for object_id, body in enumerate(objects, start=1):
+        offsets.append(len(output))
+        output += f"{object_id} 0 obj\n".encode() + body + b"\nendobj\n"
+    xref = len(output)
+    output += f"xref\n0 {len(objects) + 1}\n0000000000 65535 f \n".encode()
+    output += b"".join(f"{offset:010d} 00000 n \n".encode() for offset in offsets)
+    output += f"trailer\n<< /Size {len(objects) + 1} /Root 1 0 R >>\nstartxref\n{xref}\n%%EOF\n".encode()
+    return bytes(output)
+
+
+def load_document(booking_id: int) -> Optional[Dict[str, Any]]:
+    """Everything printed on a booking's tickets, or None if it has none to print"""
+    booking = Booking.get_by_id(booking_id)
+    if not booking or booking['status'] == 'Canceled':
+        return None
+    tickets = Ticket.get_by_booking_id(booking_id)
+    if not tickets:
+        return None
+    return {
+        'booking_id': booking_id,
+        'start_location': booking['start_location_name'],
+        'end_location': booking['end_location_name'],
+        'departure': localtime(booking['departure_time']).strftime('%H:%M %d/%m/%Y'),
+        'arrival': localtime(booking['arrival_time']).strftime('%H:%M %d/%m/%Y'),
+        'bus': f"{booking['bus_model']} ({booking['bus_license_plate']})",
+        'tickets': [{
+            'seat_number': ticket['seat_number'],
+            'passenger_name': ticket['passenger_name'],
+            'price': f"{ticket['price']:,.0f}",
+            'code': sign(ticket['id'], ticket['trip_id'], ticket['seat_number'], ticket['arrival_time']),
+        } for ticket in tickets],
+    }
+
+
+def document_path(digest: str) -> Path:
+    return Path(settings.TICKET_DOCUMENT_ROOT) / digest[:2] / f"{digest}.pdf"
+
+
+def store(content: bytes) -> str:
+    """Write a rendered file under its SHA-256 (once) and return the digest"""
+    digest = hashlib.sha256(content).hexdigest()
+    path = document_path(digest)
+    if not path.exists():
+        path.parent.mkdir(parents=True, exist_ok=True)
+        with tempfile.NamedTemporaryFile(dir=path.parent, delete=False) as tmp:
+            tmp.write(content)
+        os.replace(tmp.name, path)
+    return digest
+
+
+def render_pending(pool: Executor, batch_size: int = 20) -> Dict[str, int]:
+    """Claim queued documents, render them in the pool and publish the results"""
+    totals = {'rendered': 0, 'failed': 0, 'discarded': 0}
+    jobs = []
+    for claim in TicketDocument.claim_pending(batch_size):
+        document = load_document(claim['booking_id'])
+        if document is None:
+            TicketDocument.discard([claim['booking_id']])
+            totals['discarded'] += 1
+        else:
+            jobs.append((claim, pool.submit(render_pdf, document)))
+
+    for claim, future in jobs:
+        try:
+            content = future.result()
+            digest = store(content)
+        except Exception as e:
+            TicketDocument.mark_failed(claim['booking_id'], claim['requested_at'], f"{type(e).__name__}: {e}")
+            totals['failed'] += 1
+            continue
+        TicketDocument.mark_ready(claim['booking_id'], claim['requested_at'], digest, len(content))
+        totals['rendered'] += 1
+    return totals
@@ -0,0 +1,77 @@
+"""
+Rebuild the booking, trip and payment rollup tables from the base tables
+"""
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.conf import settings
+from utils.db_utils import execute_update
+from bookings.models import Booking
+from payments.models import Payment
+from transport.models import Trip
+import time
+
+
+class Command(BaseCommand):
+    help = 'Recompute booking_daily_stats, trip_booking_stats and payment_method_daily_stats from scratch'
+
+    def handle(self, *args, **options):
+        started = time.monotonic()
+        tz = settings.TIME_ZONE
+
+        with transaction.atomic():
+            # Block writers so triggers cannot race the rebuild; readers are unaffected
+            execute_update(f"LOCK TABLE {Booking.TABLE_NAME}, {Payment.TABLE_NAME} IN SHARE MODE")
+            execute_update(
+                f"TRUNCATE {Booking.STATS_TABLE_NAME}, {Trip.STATS_TABLE_NAME}, {Payment.STATS_TABLE_NAME}"
+            )
+
+            days = execute_update(f"""
+                INSERT INTO {Booking.STATS_TABLE_NAME}
+                (stat_date, total_bookings, pending_bookings, confirmed_bookings, canceled_bookings,
+                 booked_seats, canceled_seats, booked_amount)
+                SELECT
+                    (booking_time AT TIME ZONE %s)::date,
+                    COUNT(*),
+                    COUNT(*) FILTER (WHERE status = 'Pending'),
+                    COUNT(*) FILTER (WHERE status = 'Confirmed'),
+                    COUNT(*) FILTER (WHERE status = 'Canceled'),
+                    COALESCE(SUM(number_of_seats) FILTER (WHERE status != 'Canceled'), 0),
+                    COALESCE(SUM(number_of_seats) FILTER (WHERE status = 'Canceled'), 0),
+                    COALESCE(SUM(total_amount) FILTER (WHERE status != 'Canceled'), 0)
+                FROM {Booking.TABLE_NAME}
+                GROUP BY 1
+            """, (tz,))
+
+            trips = execute_update(f"""
+                INSERT INTO {Trip.STATS_TABLE_NAME}
+                (trip_id, booked_seats, active_bookings, canceled_bookings, canceled_seats, revenue)
+                SELECT
+                    trip_id,
+                    COALESCE(SUM(number_of_seats) FILTER (WHERE status != 'Canceled'), 0),
+                    COUNT(*) FILTER (WHERE status != 'Canceled'),
+                    COUNT(*) FILTER (WHERE status = 'Canceled'),
+                    COALESCE(SUM(number_of_seats) FILTER (WHERE status = 'Canceled'), 0),
+                    COALESCE(SUM(total_amount) FILTER (WHERE status != 'Canceled'), 0)
+                FROM {Booking.TABLE_NAME}
+                GROUP BY trip_id
+            """)
+
+            methods = execute_update(f"""
+                INSERT INTO {Payment.STATS_TABLE_NAME}
+                (stat_date, payment_method, completed_payments, revenue, refunded_payments, refunded_amount)
+                SELECT
+                    (payment_time AT TIME ZONE %s)::date,
+                    payment_method,
+                    COUNT(*),
+                    SUM(amount),
+                    COUNT(*) FILTER (WHERE status = 'Refunded'),
+                    COALESCE(SUM(amount) FILTER (WHERE status = 'Refunded'), 0)
+                FROM {Payment.TABLE_NAME}
+                WHERE status IN ('Completed', 'Refunded')
+                GROUP BY 1, 2
+            """, (tz,))
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Rebuilt rollups in {time.monotonic() - started:.2f}s: {days} booking days, "
+            f"{trips} trips, {methods} payment method days"
+        ))
@@ -0,0 +1,36 @@
+"""
+Worker that expires lapsed waitlist holds and delivers the notification outbox
+"""
+from django.core.management.base import BaseCommand
+from bookings.models import Waitlist, NotificationOutbox
+from bookings.notifications import dispatch_notifications
+import time
+
+
+class Command(BaseCommand):
+    help = 'Expire lapsed waitlist holds, promote the next waiters and send queued notifications'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=100,
+                            help='Notifications claimed per transaction (default: 100)')
+        parser.add_argument('--loop', action='store_true',
+                            help='Keep processing instead of exiting once the outbox is empty')
+        parser.add_argument('--interval', type=float, default=5.0,
+                            help='Seconds to sleep between runs when --loop is set (default: 5)')
+
+    def handle(self, *args, **options):
+        while True:
+            holds = Waitlist.expire_holds()
+            totals = dispatch_notifications(batch_size=options['batch_size'])
+            if holds['expired'] or any(totals.values()):
+                self.stdout.write(self.style.SUCCESS(
+                    f"{holds['expired']} holds expired, {holds['promoted']} waiters promoted; "
+                    f"{totals['sent']} notifications sent, {totals['failed']} failed"
+                ))
+            if not options['loop']:
+                break
+            time.sleep(options['interval'])
+
+        remaining = NotificationOutbox.count_unsent()
+        if remaining:
+            self.stdout.write(f"{remaining} notifications still queued")
@@ -0,0 +1,42 @@
+"""
+Worker that renders queued ticket PDFs in a process pool
+"""
+from django.core.management.base import BaseCommand
+from concurrent.futures import ProcessPoolExecutor
+from bookings.models import TicketDocument
+from bookings.documents import render_pending
+import os
+import time
+
+
+class Command(BaseCommand):
+    help = 'Render queued ticket documents (PDF with QR codes) and store them by content hash'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=os.cpu_count() or 2,
+                            help='Rendering processes (default: CPU count)')
+        parser.add_argument('--batch-size', type=int, default=20,
+                            help='Documents claimed per run (default: 20)')
+        parser.add_argument('--loop', action='store_true',
+                            help='Keep processing instead of exiting once the queue is empty')
+        parser.add_argument('--interval', type=float, default=1.0,
+                            help='Seconds to sleep when the queue is empty and --loop is set (default: 1)')
+
+    def handle(self, *args, **options):
+        with ProcessPoolExecutor(max_workers=options['workers']) as pool:
+            while True:
+                totals = render_pending(pool, batch_size=options['batch_size'])
+                if any(totals.values()):
+                    self.stdout.write(self.style.SUCCESS(
+                        f"{totals['rendered']} documents rendered, {totals['failed']} failed, "
+                        f"{totals['discarded']} discarded"
+                    ))
+                    # More may be queued behind this batch
+                    continue
+                if not options['loop']:
+                    break
+                time.sleep(options['interval'])
+
+        remaining = TicketDocument.count_pending()
+        if remaining:
+            self.stdout.write(f"{remaining} documents still queued")
@@ -6,17 +6,26 @@ from utils.db_utils import (
     execute_insert, execute_update, execute_delete,
     build_where_clause, build_order_clause
 )
+from utils.partitions import recent_cutoff
 from typing import List, Dict, Any, Optional
-from datetime import datetime
+from datetime import date, datetime, timedelta
 from django.utils.timezone import now
 from decimal import Decimal
+import json
 import uuid
 
+UNIQUE_VIOLATION = '23505'
+
+
+class BookingConflictError(Exception):
+    """Seats could not be reserved (taken or trip changed since validation)"""
+
 
 class Booking:
     """Booking model using raw SQL"""
 
     TABLE_NAME = 'bookings'
+    STATS_TABLE_NAME = 'booking_daily_stats'
     STATUS_CHOICES = [
         ('Pending', 'Chờ xử lý'),
         ('Confirmed', 'Đã xác nhận'),
@@ -29,12 +38,13 @@ class Booking:
         """Create a new booking"""
         booking_time = now()
 
+        from transport.models import Trip
+
         # Auto-calculate total_amount if not provided
         if total_amount is None:
-            from transport.models import Trip
-            trip = Trip.get_by_id(trip_id)
-            if trip:
-                total_amount = number_of_seats * trip['price_per_seat']
+            price = Trip.get_price(trip_id)
+            if price is not None:
+                total_amount = number_of_seats * price
 
         # Use DEFAULT for id to let PostgreSQL auto-generate it
         query = f"""
@@ -45,15 +55,130 @@ class Booking:
         """
         result = execute_query(query, (number_of_seats, total_amount,
                                       booking_time, status, trip_id, user_id))
+        if result:
+            Trip.invalidate_fare_calendar([trip_id])
+            Trip.invalidate_manifest([trip_id])
         return result[0] if result else None
 
+    @classmethod
+    def create_journey(cls, user_id: int, legs: List[Dict[str, Any]],
+                       payment: Dict[str, Any] = None) -> Dict[str, Any]:
+        """
+        Book several trips (e.g. outbound and return) in one transaction.
+        Each leg is {'trip_id', 'tickets': [{'seat_id', 'passenger_name'}]}; legs with
+        'auto_assign' get their seats picked by transport.seating under the same locks.
+        Trips are share-locked in id order and tickets inserted in (trip_id, seat_id)
+        order, so concurrent journeys over the same trips wait instead of deadlocking.
+        One payment for the whole journey is recorded against the lead booking.
+        Raises BookingConflictError if a seat or trip changed since validation.
+        """
+        from django.db import transaction, IntegrityError
+        from payments.models import Payment
+        from transport.models import Trip
+        from transport.seating import assign_seats, SeatAssignmentError
+
+        trip_ids = sorted(leg['trip_id'] for leg in legs)
+        booking_time = now()
+        try:
+            with transaction.atomic():
+                # Keep the trips (bus, departure, fare) fixed until the journey commits
+                trips = {row['id']: row for row in execute_query("""
+                    SELECT id, bus_id, departure_time, price_per_seat
+                    FROM trips
+                    WHERE id = ANY(%s)
+                    ORDER BY id
+                    FOR SHARE
+                """, (trip_ids,))}
+                for trip_id in trip_ids:
+                    if trip_id not in trips or trips[trip_id]['departure_time'] <= booking_time:
+                        raise BookingConflictError(f'Trip {trip_id} is no longer available.')
+
+                journey_id = execute_query_one(
+                    "SELECT nextval('booking_journey_id_seq') as id"
+                )['id']
+                bookings = execute_query(f"""
+                    INSERT INTO {cls.TABLE_NAME}
+                    (number_of_seats, total_amount, booking_time, status, trip_id, user_id, journey_id)
+                    SELECT v.seats, v.seats * t.price_per_seat, %s, 'Pending', t.id, %s, %s
+                    FROM unnest(%s::bigint[], %s::integer[]) AS v(trip_id, seats)
+                    JOIN trips t ON t.id = v.trip_id
+                    RETURNING id, trip_id, total_amount
+                """, (booking_time, user_id, journey_id,
+                      [leg['trip_id'] for leg in legs], [len(leg['tickets']) for leg in legs]))
+                for row in bookings:
+                    Waitlist.consume_hold(row['trip_id'], user_id, row['id'])
+
+                # Lead booking first: the leg departing earliest
+                bookings.sort(key=lambda row: (trips[row['trip_id']]['departure_time'], row['id']))
+                booking_ids = {row['trip_id']: row['id'] for row in bookings}
+
+                tickets = []
+                for leg in sorted(legs, key=lambda leg: leg['trip_id']):
+                    seat_ids = [ticket.get('seat_id') for ticket in leg['tickets']]
+                    if leg.get('auto_assign'):
+                        try:
+                            seat_ids = assign_seats(leg['trip_id'], len(leg['tickets']))
+                        except SeatAssignmentError as e:
+                            raise BookingConflictError(f'Trip {leg["trip_id"]}: {e}') from e
+                    tickets.extend((leg['trip_id'], seat_id, ticket['passenger_name'])
+                                   for seat_id, ticket in zip(seat_ids, leg['tickets']))
+                tickets.sort()
+                # Seats must still belong to the trip's bus (buses may have been reassigned)
+                created = execute_query(f"""
+                    INSERT INTO {Ticket.TABLE_NAME}
+                    (booking_id, seat_id, trip_id, price, passenger_name, departure_time)
+                    SELECT v.booking_id, s.id, t.id, t.price_per_seat, v.passenger_name, t.departure_time
+                    FROM unnest(%s::bigint[], %s::bigint[], %s::bigint[], %s::text[])
+                        WITH ORDINALITY AS v(booking_id, trip_id, seat_id, passenger_name, idx)
+                    JOIN trips t ON t.id = v.trip_id
+                    JOIN seats s ON s.id = v.seat_id AND s.bus_id = t.bus_id
+                    ORDER BY v.idx
+                    RETURNING seat_id
+                """, ([booking_ids[trip_id] for trip_id, _, _ in tickets],
+                      [trip_id for trip_id, _, _ in tickets],
+                      [seat_id for _, seat_id, _ in tickets],
+                      [name for _, _, name in tickets]))
+                if len(created) != len(tickets):
+                    raise BookingConflictError('A selected seat is no longer on the trip\'s bus.')
+                execute_update("UPDATE seats SET is_available = FALSE WHERE id = ANY(%s)",
+                               ([seat_id for _, seat_id, _ in tickets],))
+
+                lead_booking_id = bookings[0]['id']
+                total_amount = sum((row['total_amount'] for row in bookings), Decimal('0'))
+                journey_payment = None
+                if payment:
+                    journey_payment = Payment.create(
+                        booking_id=lead_booking_id,
+                        amount=total_amount,
+                        payment_method=payment['payment_method'],
+                        transaction_code=payment['transaction_code'],
+                        wallet_id=str(payment['wallet_id']) if payment.get('wallet_id') else None
+                    )
+                Trip.invalidate_fare_calendar(trip_ids)
+                Trip.invalidate_manifest(trip_ids)
+        except IntegrityError as e:
+            if getattr(e.__cause__, 'pgcode', None) != UNIQUE_VIOLATION:
+                raise
+            raise BookingConflictError('A selected seat was just booked by someone else.') from e
+
+        return {
+            'journey_id': journey_id,
+            'lead_booking_id': lead_booking_id,
+            'total_amount': total_amount,
+            'bookings': [cls.get_by_id(row['id']) for row in bookings],
+            'payment': journey_payment,
+        }
+
     @classmethod
     def get_by_id(cls, booking_id: int) -> Optional[Dict[str, Any]]:
-        """Get booking by ID with full details"""
+        """
+        Get booking by ID with full details. Without booking_time no partition is pruned;
+        every live month is probed through its (id, booking_time) primary key.
+        """
         query = f"""
             SELECT
                 b.id, b.user_id, b.trip_id, b.number_of_seats, b.total_amount,
-                b.booking_time, b.status,
+                b.booking_time, b.status, b.journey_id,
                 t.route_id, t.bus_id, t.departure_time, t.arrival_time, t.price_per_seat,
                 r.start_location_id, r.end_location_id, r.distance_km,
                 sl.name as start_location_name, sl.city as start_location_city,
@@ -72,8 +197,11 @@ class Booking:
 
     @classmethod
     def get_all(cls, user_id: int = None, trip_id: int = None, status: str = None,
-                ordering: List[str] = None) -> List[Dict[str, Any]]:
-        """Get all bookings with optional filters"""
+                include_history: bool = False, ordering: List[str] = None) -> List[Dict[str, Any]]:
+        """
+        Get all bookings with optional filters. Only bookings made within the recent
+        window are read unless include_history is set, so older partitions are pruned.
+        """
         conditions = []
         params = []
 
@@ -86,6 +214,9 @@ class Booking:
         if status:
             conditions.append("b.status = %s")
             params.append(status)
+        if not include_history:
+            conditions.append("b.booking_time >= %s")
+            params.append(recent_cutoff())
 
         where_clause = f"WHERE {' AND '.join(conditions)}" if conditions else ""
         order_clause = build_order_clause(ordering or ['-booking_time'])
@@ -93,7 +224,7 @@ class Booking:
         query = f"""
             SELECT
                 b.id, b.user_id, b.trip_id, b.number_of_seats, b.total_amount,
-                b.booking_time, b.status,
+                b.booking_time, b.status, b.journey_id,
                 t.route_id, t.bus_id, t.departure_time, t.arrival_time, t.price_per_seat,
                 r.start_location_id, r.end_location_id, r.distance_km,
                 sl.name as start_location_name, sl.city as start_location_city,
@@ -133,38 +264,104 @@ class Booking:
             return False
 
         params.append(booking_id)
-        query = f"UPDATE {cls.TABLE_NAME} SET {', '.join(updates)} WHERE id = %s"
-        return execute_update(query, tuple(params)) > 0
+        query = f"UPDATE {cls.TABLE_NAME} SET {', '.join(updates)} WHERE id = %s RETURNING trip_id"
+        result = execute_query(query, tuple(params))
+        if result and (number_of_seats is not None or status is not None):
+            from transport.models import Trip
+            Trip.invalidate_fare_calendar([result[0]['trip_id']])
+            Trip.invalidate_manifest([result[0]['trip_id']])
+        return bool(result)
 
     @classmethod
     def delete(cls, booking_id: int) -> bool:
         """Delete a booking"""
-        query = f"DELETE FROM {cls.TABLE_NAME} WHERE id = %s"
-        return execute_delete(query, (booking_id,)) > 0
+        query = f"DELETE FROM {cls.TABLE_NAME} WHERE id = %s RETURNING trip_id"
+        result = execute_query(query, (booking_id,))
+        if result:
+            TicketDocument.discard([booking_id])
+            from transport.models import Trip
+            Trip.invalidate_fare_calendar([result[0]['trip_id']])
+            Trip.invalidate_manifest([result[0]['trip_id']])
+        return bool(result)
 
     @classmethod
-    def cancel_booking(cls, booking_id: int) -> bool:
-        """Cancel the booking, reset seats, delete tickets and remove booking record"""
-        # First, get all tickets for this booking to find seat IDs
-        tickets = Ticket.get_by_booking_id(booking_id)
+    def cancel_booking(cls, booking_id: int, reason: str = 'Khách hàng hủy vé') -> bool:
+        """Cancel the booking, reset seats, delete tickets and refund its payment"""
+        return cls.cancel_bookings([booking_id], reason=reason)['canceled_bookings'] > 0
 
-        # Reset all seats to available and delete tickets
-        if tickets:
-            from transport.models import Seat
-            for ticket in tickets:
-                # Reset seat to available
-                Seat.update(ticket['seat_id'], is_available=True)
-                # Delete the ticket
-                Ticket.delete(ticket['id'])
+    @classmethod
+    def cancel_bookings(cls, booking_ids: List[int], reason: str = 'Khách hàng hủy vé') -> Dict[str, Any]:
+        """
+        Cancel many bookings in one transaction with set-based statements:
+        release their seats, delete their tickets, write refund ledger entries for
+        completed payments, move wallet payments back from the admin wallet to the
+        customers' wallets, close the payments and promote waitlisted customers into
+        the released seats.
+        Bookings are kept with status 'Canceled' so payments stay reconcilable.
+        """
+        from django.db import transaction
+        from payments.models import Payment, Refund, Wallet
+        from transport.models import Trip
 
-        # Delete any associated payments
-        from payments.models import Payment
-        payment = Payment.get_by_booking_id(booking_id)
-        if payment:
-            Payment.delete(payment['id'])
+        with transaction.atomic():
+            # Lock the bookings so concurrent cancellations cannot refund twice.
+            # A journey shares one payment, so cancelling any leg cancels all of them.
+            booking_ids = [int(booking_id) for booking_id in booking_ids]
+            rows = execute_query(f"""
+                SELECT id FROM {cls.TABLE_NAME}
+                WHERE (id = ANY(%s) OR journey_id IN (
+                          SELECT journey_id FROM {cls.TABLE_NAME}
+                          WHERE id = ANY(%s) AND journey_id IS NOT NULL))
+                  AND status != 'Canceled'
+                ORDER BY id
+                FOR UPDATE
+            """, (booking_ids, booking_ids))
+            ids = [row['id'] for row in rows]
+            if not ids:
+                return {'canceled_bookings': 0, 'refunds': [], 'refunded_amount': Decimal('0')}
+
+            execute_update("""
+                UPDATE seats SET is_available = TRUE
+                WHERE id IN (SELECT seat_id FROM tickets WHERE booking_id = ANY(%s))
+            """, (ids,))
+            TicketRevocation.revoke_for_bookings(ids)
+            TicketDocument.discard(ids)
+            execute_delete(f"DELETE FROM {Ticket.TABLE_NAME} WHERE booking_id = ANY(%s)", (ids,))
+
+            refunds = Refund.create_for_bookings(ids, reason)
+            credits = {}
+            for refund in refunds:
+                if refund['wallet_id']:
+                    wallet_id = str(refund['wallet_id'])
+                    credits[wallet_id] = credits.get(wallet_id, Decimal('0')) + refund['amount']
+            Wallet.refund_many(credits)
+            Payment.close_for_bookings(ids)
 
-        # Delete the booking record entirely
-        return cls.delete(booking_id)
+            canceled = execute_query(
+                f"UPDATE {cls.TABLE_NAME} SET status = 'Canceled' WHERE id = ANY(%s) RETURNING trip_id",
+                (ids,)
+            )
+            trip_ids = sorted({row['trip_id'] for row in canceled})
+            Trip.invalidate_fare_calendar(trip_ids)
+            Trip.invalidate_manifest(trip_ids)
+
+            # Offer the released seats to the waitlists before anyone else can take them
+            Waitlist.promote(trip_ids)
+
+        return {
+            'canceled_bookings': len(ids),
+            'refunds': refunds,
+            'refunded_amount': sum((refund['amount'] for refund in refunds), Decimal('0'))
+        }
+
+    @classmethod
+    def cancel_trip_bookings(cls, trip_id: int, reason: str = 'Chuyến xe bị hủy') -> Dict[str, Any]:
+        """Cancel every active booking of a withdrawn trip in one pass"""
+        rows = execute_query(
+            f"SELECT id FROM {cls.TABLE_NAME} WHERE trip_id = %s AND status != 'Canceled'",
+            (trip_id,)
+        )
+        return cls.cancel_bookings([row['id'] for row in rows], reason=reason)
 
     @classmethod
     def confirm_booking(cls, booking_id: int) -> bool:
@@ -190,24 +387,66 @@ class Booking:
         return booking['status'] == 'Pending' and not cls.is_past_booking(booking)
 
     @classmethod
-    def get_statistics(cls) -> Dict[str, int]:
-        """Get booking statistics"""
+    def get_statistics(cls, date_from: date = None, date_to: date = None) -> Dict[str, Any]:
+        """
+        Get booking statistics from the booking_daily_stats rollup
+        (optionally for booking dates in [date_from, date_to])
+        """
+        conditions = []
+        params = []
+        if date_from:
+            conditions.append("stat_date >= %s")
+            params.append(date_from)
+        if date_to:
+            conditions.append("stat_date <= %s")
+            params.append(date_to)
+        where_clause = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+
         query = f"""
             SELECT
-                COUNT(*) as total_bookings,
-                COUNT(CASE WHEN status = 'Pending' THEN 1 END) as pending_bookings,
-                COUNT(CASE WHEN status = 'Confirmed' THEN 1 END) as confirmed_bookings,
-                COUNT(CASE WHEN status = 'Canceled' THEN 1 END) as canceled_bookings
-            FROM {cls.TABLE_NAME}
+                COALESCE(SUM(total_bookings), 0) as total_bookings,
+                COALESCE(SUM(pending_bookings), 0) as pending_bookings,
+                COALESCE(SUM(confirmed_bookings), 0) as confirmed_bookings,
+                COALESCE(SUM(canceled_bookings), 0) as canceled_bookings,
+                COALESCE(SUM(booked_seats), 0) as booked_seats,
+                COALESCE(SUM(canceled_seats), 0) as canceled_seats,
+                COALESCE(SUM(booked_amount), 0) as booked_amount
+            FROM {cls.STATS_TABLE_NAME}
+            {where_clause}
         """
-        result = execute_query_one(query)
+        result = execute_query_one(query, tuple(params))
         return result if result else {
             'total_bookings': 0,
             'pending_bookings': 0,
             'confirmed_bookings': 0,
-            'canceled_bookings': 0
+            'canceled_bookings': 0,
+            'booked_seats': 0,
+            'canceled_seats': 0,
+            'booked_amount': Decimal('0')
         }
 
+    @classmethod
+    def get_daily_statistics(cls, date_from: date = None, date_to: date = None) -> List[Dict[str, Any]]:
+        """Get one booking_daily_stats row per booking date"""
+        conditions = []
+        params = []
+        if date_from:
+            conditions.append("stat_date >= %s")
+            params.append(date_from)
+        if date_to:
+            conditions.append("stat_date <= %s")
+            params.append(date_to)
+        where_clause = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+
+        query = f"""
+            SELECT stat_date, total_bookings, pending_bookings, confirmed_bookings,
+                   canceled_bookings, booked_seats, canceled_seats, booked_amount
+            FROM {cls.STATS_TABLE_NAME}
+            {where_clause}
+            ORDER BY stat_date
+        """
+        return execute_query(query, tuple(params))
+
     @classmethod
     def get_status_display(cls, status: str) -> str:
         """Get display text for status"""
@@ -225,14 +464,19 @@ class Ticket:
     @classmethod
     def create(cls, booking_id: int, seat_id: int, trip_id: int,
                price: Decimal, passenger_name: str) -> Dict[str, Any]:
-        """Create a new ticket"""
+        """Create a new ticket (stored in its trip's departure month partition)"""
         query = f"""
             INSERT INTO {cls.TABLE_NAME}
-            (booking_id, seat_id, trip_id, price, passenger_name)
-            VALUES (%s, %s, %s, %s, %s)
+            (booking_id, seat_id, trip_id, price, passenger_name, departure_time)
+            SELECT %s, %s, t.id, %s, %s, t.departure_time
+            FROM trips t
+            WHERE t.id = %s
             RETURNING id, booking_id, seat_id, trip_id, price, passenger_name
         """
-        result = execute_query(query, (booking_id, seat_id, trip_id, price, passenger_name))
+        result = execute_query(query, (booking_id, seat_id, price, passenger_name, trip_id))
+        if result:
+            from transport.models import Trip
+            Trip.invalidate_manifest([trip_id])
         return result[0] if result else None
 
     @classmethod
@@ -249,7 +493,7 @@ class Ticket:
             FROM {cls.TABLE_NAME} tk
             JOIN seats s ON tk.seat_id = s.id
             JOIN buses b ON s.bus_id = b.id
-            JOIN trips t ON tk.trip_id = t.id
+            JOIN trips t ON tk.trip_id = t.id AND tk.departure_time = t.departure_time
             JOIN routes r ON t.route_id = r.id
             JOIN locations sl ON r.start_location_id = sl.id
             JOIN locations el ON r.end_location_id = el.id
@@ -259,8 +503,11 @@ class Ticket:
 
     @classmethod
     def get_all(cls, booking_id: int = None, trip_id: int = None,
-                user_id: int = None) -> List[Dict[str, Any]]:
-        """Get all tickets with optional filters"""
+                user_id: int = None, include_history: bool = False) -> List[Dict[str, Any]]:
+        """
+        Get all tickets with optional filters. Only tickets for trips departing within
+        the recent window are read unless include_history is set.
+        """
         conditions = []
         params = []
 
@@ -273,6 +520,10 @@ class Ticket:
         if user_id is not None:
             conditions.append("bk.user_id = %s")
             params.append(user_id)
+        if not include_history:
+            cutoff = recent_cutoff()
+            conditions.append("tk.departure_time >= %s AND t.departure_time >= %s")
+            params.extend([cutoff, cutoff])
 
         where_clause = f"WHERE {' AND '.join(conditions)}" if conditions else ""
 
@@ -287,7 +538,7 @@ class Ticket:
             FROM {cls.TABLE_NAME} tk
             JOIN seats s ON tk.seat_id = s.id
             JOIN buses b ON s.bus_id = b.id
-            JOIN trips t ON tk.trip_id = t.id
+            JOIN trips t ON tk.trip_id = t.id AND tk.departure_time = t.departure_time
             JOIN routes r ON t.route_id = r.id
             JOIN locations sl ON r.start_location_id = sl.id
             JOIN locations el ON r.end_location_id = el.id
@@ -301,7 +552,7 @@ class Ticket:
     @classmethod
     def get_by_booking_id(cls, booking_id: int) -> List[Dict[str, Any]]:
         """Get all tickets for a booking"""
-        return cls.get_all(booking_id=booking_id)
+        return cls.get_all(booking_id=booking_id, include_history=True)
 
     @classmethod
     def update(cls, ticket_id: int, passenger_name: str = None,
@@ -321,14 +572,25 @@ class Ticket:
             return False
 
         params.append(ticket_id)
-        query = f"UPDATE {cls.TABLE_NAME} SET {', '.join(updates)} WHERE id = %s"
-        return execute_update(query, tuple(params)) > 0
+        query = f"UPDATE {cls.TABLE_NAME} SET {', '.join(updates)} WHERE id = %s RETURNING trip_id, booking_id"
+        result = execute_query(query, tuple(params))
+        if result:
+            from transport.models import Trip
+            Trip.invalidate_manifest([result[0]['trip_id']])
+            TicketDocument.refresh([result[0]['booking_id']])
+        return bool(result)
 
     @classmethod
     def delete(cls, ticket_id: int) -> bool:
         """Delete a ticket"""
-        query = f"DELETE FROM {cls.TABLE_NAME} WHERE id = %s"
-        return execute_delete(query, (ticket_id,)) > 0
+        TicketRevocation.revoke_tickets([ticket_id])
+        query = f"DELETE FROM {cls.TABLE_NAME} WHERE id = %s RETURNING trip_id, booking_id"
+        result = execute_query(query, (ticket_id,))
+        if result:
+            from transport.models import Trip
+            Trip.invalidate_manifest([result[0]['trip_id']])
+            TicketDocument.refresh([result[0]['booking_id']])
+        return bool(result)
 
     @classmethod
     def check_seat_booked(cls, trip_id: int, seat_id: int) -> bool:
@@ -338,8 +600,9 @@ class Ticket:
             FROM {cls.TABLE_NAME} tk
             JOIN bookings bk ON tk.booking_id = bk.id
             WHERE tk.trip_id = %s AND tk.seat_id = %s AND bk.status != 'Canceled'
+              AND tk.departure_time = (SELECT departure_time FROM trips WHERE id = %s)
         """
-        result = execute_query_one(query, (trip_id, seat_id))
+        result = execute_query_one(query, (trip_id, seat_id, trip_id))
         return result['count'] > 0 if result else False
 
     @classmethod
@@ -350,5 +613,447 @@ class Ticket:
             FROM {cls.TABLE_NAME} tk
             JOIN bookings bk ON tk.booking_id = bk.id
             WHERE tk.trip_id = %s AND bk.status != 'Canceled'
+              AND tk.departure_time = (SELECT departure_time FROM trips WHERE id = %s)
+        """
+        return execute_query(query, (trip_id, trip_id))
+
+
+class Waitlist:
+    """Per-trip FIFO queue of customers waiting for seats, using raw SQL"""
+
+    TABLE_NAME = 'trip_waitlist'
+    HOLD_DURATION = timedelta(minutes=15)
+    STATUS_CHOICES = [
+        ('Waiting', 'Đang chờ'),
+        ('Held', 'Đang giữ chỗ'),
+        ('Booked', 'Đã đặt vé'),
+        ('Expired', 'Hết hạn giữ chỗ'),
+        ('Left', 'Đã rời hàng chờ'),
+    ]
+
+    @classmethod
+    def join(cls, trip_id: int, user_id: int, number_of_seats: int) -> Optional[Dict[str, Any]]:
+        """Queue the customer for seats on the trip"""
+        query = f"""
+            INSERT INTO {cls.TABLE_NAME} (trip_id, user_id, number_of_seats, status, joined_at)
+            VALUES (%s, %s, %s, 'Waiting', %s)
+            RETURNING id
+        """
+        entry_id = execute_insert(query, (trip_id, user_id, number_of_seats, now()))
+        return cls.get_by_id(entry_id) if entry_id else None
+
+    @classmethod
+    def get_by_id(cls, entry_id: int) -> Optional[Dict[str, Any]]:
+        """Get a waitlist entry with its place in the queue"""
+        return (cls._get(["w.id = %s"], [entry_id]) or [None])[0]
+
+    @classmethod
+    def get_open(cls, trip_id: int, user_id: int) -> Optional[Dict[str, Any]]:
+        """The customer's waiting or held entry for the trip"""
+        entries = cls._get(["w.trip_id = %s", "w.user_id = %s", "w.status IN ('Waiting', 'Held')"],
+                           [trip_id, user_id])
+        return entries[0] if entries else None
+
+    @classmethod
+    def get_for_user(cls, user_id: int) -> List[Dict[str, Any]]:
+        """The customer's waiting and held entries"""
+        return cls._get(["w.user_id = %s", "w.status IN ('Waiting', 'Held')"], [user_id])
+
+    @classmethod
+    def _get(cls, conditions: List[str], params: List[Any]) -> List[Dict[str, Any]]:
+        query = f"""
+            SELECT
+                w.id, w.trip_id, w.user_id, w.number_of_seats, w.status, w.joined_at,
+                w.hold_expires_at, w.booking_id,
+                CASE WHEN w.status = 'Waiting' THEN (
+                    SELECT COUNT(*) FROM {cls.TABLE_NAME} q
+                    WHERE q.trip_id = w.trip_id AND q.status = 'Waiting' AND q.id <= w.id
+                ) END as position,
+                t.departure_time, sl.name as start_location_name, el.name as end_location_name
+            FROM {cls.TABLE_NAME} w
+            JOIN trips t ON w.trip_id = t.id
+            JOIN routes r ON t.route_id = r.id
+            JOIN locations sl ON r.start_location_id = sl.id
+            JOIN locations el ON r.end_location_id = el.id
+            WHERE {' AND '.join(conditions)}
+            ORDER BY w.id
+        """
+        return execute_query(query, tuple(params))
+
+    @classmethod
+    def leave(cls, entry_id: int, user_id: int) -> bool:
+        """Leave the queue; a held entry gives its seats to the next waiters"""
+        from django.db import transaction
+
+        with transaction.atomic():
+            result = execute_query(f"""
+                UPDATE {cls.TABLE_NAME} w SET status = 'Left'
+                FROM {cls.TABLE_NAME} old
+                WHERE w.id = %s AND w.user_id = %s AND w.status IN ('Waiting', 'Held')
+                  AND old.id = w.id
+                RETURNING w.trip_id, old.status as previous_status
+            """, (entry_id, user_id))
+            if result and result[0]['previous_status'] == 'Held':
+                cls.promote([result[0]['trip_id']])
+        return bool(result)
+
+    @classmethod
+    def consume_hold(cls, trip_id: int, user_id: int, booking_id: int) -> bool:
+        """Close the customer's entry for the trip once they have booked it"""
+        query = f"""
+            UPDATE {cls.TABLE_NAME}
+            SET status = 'Booked', booking_id = %s
+            WHERE trip_id = %s AND user_id = %s AND status IN ('Waiting', 'Held')
+        """
+        return execute_update(query, (booking_id, trip_id, user_id)) > 0
+
+    @classmethod
+    def promote(cls, trip_ids: List[int]) -> List[Dict[str, Any]]:
+        """
+        Turn the longest FIFO prefix of each trip's queue that fits in its free seats
+        into holds, and queue a notification for each. Call inside the transaction
+        that freed the seats; promotions of a trip are serialized by an advisory lock.
         """
-        return execute_query(query, (trip_id,))
+        if not trip_ids:
+            return []
+        trip_ids = sorted(int(trip_id) for trip_id in trip_ids)
+        for trip_id in trip_ids:
+            execute_query("SELECT pg_advisory_xact_lock(hashtext('trip_waitlist'), %s::integer)",
+                          (trip_id,))
+
+        current_time = now()
+        promoted = execute_query(f"""
+            WITH free AS (
+                SELECT
+                    t.id as trip_id,
+                    b.total_seats
+                    - COALESCE((SELECT SUM(bk.number_of_seats) FROM bookings bk
+                                WHERE bk.trip_id = t.id AND bk.status != 'Canceled'), 0)
+                    - COALESCE((SELECT SUM(h.number_of_seats) FROM {cls.TABLE_NAME} h
+                                WHERE h.trip_id = t.id AND h.status = 'Held'
+                                  AND h.hold_expires_at > %s), 0) as seats
+                FROM trips t
+                JOIN buses b ON t.bus_id = b.id
+                WHERE t.id = ANY(%s) AND t.departure_time > %s
+            ),
+            queue AS (
+                SELECT id, trip_id,
+                       SUM(number_of_seats) OVER (PARTITION BY trip_id ORDER BY id) as queued_seats
+                FROM {cls.TABLE_NAME}
+                WHERE trip_id = ANY(%s) AND status = 'Waiting'
+            )
+            UPDATE {cls.TABLE_NAME} w
+            SET status = 'Held', hold_expires_at = %s
+            FROM queue q
+            JOIN free f ON f.trip_id = q.trip_id
+            WHERE w.id = q.id AND q.queued_seats <= f.seats
+            RETURNING w.id, w.trip_id, w.user_id, w.number_of_seats, w.hold_expires_at
+        """, (current_time, trip_ids, current_time, trip_ids, current_time + cls.HOLD_DURATION))
+
+        NotificationOutbox.create_many([
+            (entry['user_id'], 'waitlist_hold', {
+                'waitlist_id': entry['id'],
+                'trip_id': entry['trip_id'],
+                'number_of_seats': entry['number_of_seats'],
+                'hold_expires_at': entry['hold_expires_at'].isoformat(),
+            })
+            for entry in promoted
+        ])
+        return promoted
+
+    @classmethod
+    def expire_holds(cls) -> Dict[str, int]:
+        """Expire lapsed holds and promote the next waiters of their trips"""
+        from django.db import transaction
+
+        with transaction.atomic():
+            expired = execute_query(f"""
+                UPDATE {cls.TABLE_NAME}
+                SET status = 'Expired'
+                WHERE status = 'Held' AND hold_expires_at <= %s
+                RETURNING id, trip_id, user_id
+            """, (now(),))
+            NotificationOutbox.create_many([
+                (entry['user_id'], 'waitlist_expired', {'waitlist_id': entry['id'], 'trip_id': entry['trip_id']})
+                for entry in expired
+            ])
+            promoted = cls.promote(list({entry['trip_id'] for entry in expired}))
+        return {'expired': len(expired), 'promoted': len(promoted)}
+
+    @classmethod
+    def get_status_display(cls, status: str) -> str:
+        """Get display text for status"""
+        for choice in cls.STATUS_CHOICES:
+            if choice[0] == status:
+                return choice[1]
+        return status
+
+
+class NotificationOutbox:
+    """Customer notifications written in the transaction that caused them (outbox pattern)"""
+
+    TABLE_NAME = 'notification_outbox'
+    MAX_ATTEMPTS = 5
+
+    @classmethod
+    def create_many(cls, notifications: List[tuple]) -> int:
+        """Queue (user_id, kind, payload) notifications with one INSERT"""
+        if not notifications:
+            return 0
+        query = f"""
+            INSERT INTO {cls.TABLE_NAME} (user_id, kind, payload, created_at)
+            SELECT user_id, kind, payload::jsonb, %s
+            FROM unnest(%s::bigint[], %s::text[], %s::text[]) AS v(user_id, kind, payload)
+        """
+        return execute_update(query, (
+            now(),
+            [user_id for user_id, _, _ in notifications],
+            [kind for _, kind, _ in notifications],
+            [json.dumps(payload) for _, _, payload in notifications],
+        ))
+
+    @classmethod
+    def claim_pending(cls, limit: int = 100) -> List[Dict[str, Any]]:
+        """
+        Lock the oldest undelivered notifications for the current transaction.
+        SKIP LOCKED lets several workers drain the outbox without blocking each other.
+        """
+        query = f"""
+            SELECT o.id, o.user_id, o.kind, o.payload, o.attempts,
+                   u.email, u.username, u.first_name
+            FROM {cls.TABLE_NAME} o
+            JOIN users u ON o.user_id = u.id
+            WHERE o.sent_at IS NULL AND o.attempts < %s
+            ORDER BY o.id
+            LIMIT %s
+            FOR UPDATE OF o SKIP LOCKED
+        """
+        notifications = execute_query(query, (cls.MAX_ATTEMPTS, limit))
+        # Django hands jsonb back as text
+        for notification in notifications:
+            if isinstance(notification['payload'], str):
+                notification['payload'] = json.loads(notification['payload'])
+        return notifications
+
+    @classmethod
+    def mark_sent(cls, notification_ids: List[int]) -> int:
+        """Mark notifications as delivered"""
+        if not notification_ids:
+            return 0
+        query = f"UPDATE {cls.TABLE_NAME} SET sent_at = %s, attempts = attempts + 1 WHERE id = ANY(%s)"
+        return execute_update(query, (now(), list(notification_ids)))
+
+    @classmethod
+    def mark_failed(cls, notification_id: int, error: str) -> int:
+        """Record a failed delivery attempt; it is retried until MAX_ATTEMPTS"""
+        query = f"UPDATE {cls.TABLE_NAME} SET attempts = attempts + 1, last_error = %s WHERE id = %s"
+        return execute_update(query, (error[:1000], notification_id))
+
+    @classmethod
+    def count_unsent(cls) -> int:
+        """Number of notifications still waiting for delivery"""
+        query = f"SELECT COUNT(*) as count FROM {cls.TABLE_NAME} WHERE sent_at IS NULL AND attempts < %s"
+        result = execute_query_one(query, (cls.MAX_ATTEMPTS,))
+        return result['count'] if result else 0
+
+
+
+class TicketRevocation:
+    """Codes of cancelled or deleted tickets, rejected at boarding until they expire"""
+
+    TABLE_NAME = 'ticket_revocations'
+    PURGE_BATCH = 100
+
+    @classmethod
+    def revoke_for_bookings(cls, booking_ids: List[int]) -> int:
+        """Revoke the tickets of these bookings; call before the tickets are deleted"""
+        return cls._revoke("tk.booking_id = ANY(%s)", [int(booking_id) for booking_id in booking_ids])
+
+    @classmethod
+    def revoke_tickets(cls, ticket_ids: List[int]) -> int:
+        """Revoke these tickets; call before they are deleted"""
+        return cls._revoke("tk.id = ANY(%s)", [int(ticket_id) for ticket_id in ticket_ids])
+
+    @classmethod
+    def _revoke(cls, condition: str, ids: List[int]) -> int:
+        from .ticket_codes import CODE_GRACE
+
+        if not ids:
+            return 0
+        rows = execute_query(f"""
+            INSERT INTO {cls.TABLE_NAME} (ticket_id, trip_id, expires_at)
+            SELECT tk.id, tk.trip_id, t.arrival_time + %s
+            FROM {Ticket.TABLE_NAME} tk
+            JOIN trips t ON t.id = tk.trip_id AND t.departure_time = tk.departure_time
+            WHERE {condition} AND t.arrival_time + %s > %s
+            ON CONFLICT (ticket_id) DO NOTHING
+            RETURNING ticket_id
+        """, (CODE_GRACE, ids, CODE_GRACE, now()))
+        execute_delete(f"""
+            DELETE FROM {cls.TABLE_NAME} WHERE ticket_id IN (
+                SELECT ticket_id FROM {cls.TABLE_NAME} WHERE expires_at < %s LIMIT %s
+            )
+        """, (now(), cls.PURGE_BATCH))
+        return len(rows)
+
+    @classmethod
+    def get_ticket_ids(cls, trip_id: int) -> List[int]:
+        """
+        Revoked ticket ids of a trip. Read from the table on every call (it only holds
+        unexpired revocations and is indexed per trip) so a revocation committed by any
+        process is seen by the next check-in.
+        """
+        rows = execute_query(
+            f"SELECT ticket_id FROM {cls.TABLE_NAME} WHERE trip_id = %s ORDER BY ticket_id",
+            (trip_id,)
+        )
+        return [row['ticket_id'] for row in rows]
+
+
+class BoardingScan:
+    """First accepted boarding scan of each ticket"""
+
+    TABLE_NAME = 'boarding_scans'
+
+    @classmethod
+    def record_many(cls, scans: List[tuple]) -> List[int]:
+        """
+        Insert (ticket_id, trip_id, scanned_at, device_id) tuples with one statement.
+        A ticket scanned before keeps its first scan. Returns the ticket ids of the new rows.
+        """
+        if not scans:
+            return []
+        from transport.models import Trip
+
+        ticket_ids, trip_ids, scanned_ats, device_ids = (list(column) for column in zip(*scans))
+        query = f"""
+            INSERT INTO {cls.TABLE_NAME} (ticket_id, trip_id, scanned_at, device_id)
+            SELECT * FROM unnest(%s::bigint[], %s::bigint[], %s::timestamptz[], %s::varchar[])
+            ON CONFLICT (ticket_id) DO NOTHING
+            RETURNING ticket_id, trip_id
+        """
+        rows = execute_query(query, (ticket_ids, trip_ids, scanned_ats, device_ids))
+        if rows:
+            Trip.invalidate_manifest(sorted({row['trip_id'] for row in rows}))
+        return [row['ticket_id'] for row in rows]
+
+    @classmethod
+    def get_scanned_at(cls, ticket_ids: List[int]) -> Dict[int, Any]:
+        """First scan time of each of these tickets that has boarded"""
+        if not ticket_ids:
+            return {}
+        query = f"SELECT ticket_id, scanned_at FROM {cls.TABLE_NAME} WHERE ticket_id = ANY(%s)"
+        return {row['ticket_id']: row['scanned_at'] for row in execute_query(query, (list(ticket_ids),))}
+
+    @classmethod
+    def get_ticket_ids(cls, trip_id: int) -> List[int]:
+        """Tickets of a trip that have boarded"""
+        query = f"SELECT ticket_id FROM {cls.TABLE_NAME} WHERE trip_id = %s ORDER BY ticket_id"
+        return [row['ticket_id'] for row in execute_query(query, (trip_id,))]
+
+
+class TicketDocument:
+    """Rendered ticket PDF of a booking, produced by the render_ticket_documents worker"""
+
+    TABLE_NAME = 'ticket_documents'
+    MAX_ATTEMPTS = 3
+    # A claim older than this is assumed to belong to a worker that died
+    CLAIM_TIMEOUT = timedelta(minutes=10)
+
+    @classmethod
+    def request(cls, booking_ids: List[int]) -> int:
+        """Queue rendering for bookings that have no document (queued or ready) yet"""
+        if not booking_ids:
+            return 0
+        query = f"""
+            INSERT INTO {cls.TABLE_NAME} (booking_id, requested_at)
+            SELECT booking_id, %s FROM unnest(%s::bigint[]) AS v(booking_id)
+            ON CONFLICT (booking_id) DO NOTHING
+        """
+        return execute_update(query, (now(), [int(booking_id) for booking_id in booking_ids]))
+
+    @classmethod
+    def refresh(cls, booking_ids: List[int]) -> int:
+        """Render the existing documents of these bookings again (their tickets changed)"""
+        if not booking_ids:
+            return 0
+        query = f"""
+            UPDATE {cls.TABLE_NAME}
+            SET status = 'Pending', requested_at = %s, attempts = 0, last_error = NULL
+            WHERE booking_id = ANY(%s)
+        """
+        return execute_update(query, (now(), [int(booking_id) for booking_id in booking_ids]))
+
+    @classmethod
+    def refresh_for_trips(cls, trip_ids: List[int]) -> int:
+        """Render the documents of bookings on these trips again (times or bus changed)"""
+        if not trip_ids:
+            return 0
+        query = f"""
+            UPDATE {cls.TABLE_NAME}
+            SET status = 'Pending', requested_at = %s, attempts = 0, last_error = NULL
+            WHERE booking_id IN (SELECT id FROM {Booking.TABLE_NAME} WHERE trip_id = ANY(%s))
+        """
+        return execute_update(query, (now(), [int(trip_id) for trip_id in trip_ids]))
+
+    @classmethod
+    def discard(cls, booking_ids: List[int]) -> int:
+        """Forget the documents of cancelled or deleted bookings"""
+        if not booking_ids:
+            return 0
+        query = f"DELETE FROM {cls.TABLE_NAME} WHERE booking_id = ANY(%s)"
+        return execute_delete(query, ([int(booking_id) for booking_id in booking_ids],))
+
+    @classmethod
+    def get(cls, booking_id: int) -> Optional[Dict[str, Any]]:
+        query = f"""
+            SELECT booking_id, status, digest, size, attempts, last_error, requested_at, rendered_at
+            FROM {cls.TABLE_NAME} WHERE booking_id = %s
+        """
+        return execute_query_one(query, (booking_id,))
+
+    @classmethod
+    def claim_pending(cls, limit: int = 20) -> List[Dict[str, Any]]:
+        """Mark up to `limit` queued documents as Rendering and return them, oldest first"""
+        current_time = now()
+        query = f"""
+            UPDATE {cls.TABLE_NAME}
+            SET status = 'Rendering', claimed_at = %s, attempts = attempts + 1
+            WHERE booking_id IN (
+                SELECT booking_id FROM {cls.TABLE_NAME}
+                WHERE (status = 'Pending' OR (status = 'Rendering' AND claimed_at < %s))
+                  AND attempts < %s
+                ORDER BY requested_at
+                LIMIT %s
+                FOR UPDATE SKIP LOCKED
+            )
+            RETURNING booking_id, requested_at, attempts
+        """
+        return execute_query(query, (current_time, current_time - cls.CLAIM_TIMEOUT,
+                                     cls.MAX_ATTEMPTS, limit))
+
+    @classmethod
+    def mark_ready(cls, booking_id: int, requested_at: datetime, digest: str, size: int) -> bool:
+        """Publish a rendered file, unless the booking changed again while it was rendering"""
+        query = f"""
+            UPDATE {cls.TABLE_NAME}
+            SET status = 'Ready', digest = %s, size = %s, rendered_at = %s, last_error = NULL
+            WHERE booking_id = %s AND requested_at = %s AND status = 'Rendering'
+        """
+        return execute_update(query, (digest, size, now(), booking_id, requested_at)) > 0
+
+    @classmethod
+    def mark_failed(cls, booking_id: int, requested_at: datetime, error: str) -> int:
+        """Record a failed render; it is retried until MAX_ATTEMPTS"""
+        query = f"""
+            UPDATE {cls.TABLE_NAME}
+            SET status = CASE WHEN attempts >= %s THEN 'Failed' ELSE 'Pending' END, last_error = %s
+            WHERE booking_id = %s AND requested_at = %s AND status = 'Rendering'
+        """
+        return execute_update(query, (cls.MAX_ATTEMPTS, error[:1000], booking_id, requested_at))
+
+    @classmethod
+    def count_pending(cls) -> int:
+        query = f"SELECT COUNT(*) as count FROM {cls.TABLE_NAME} WHERE status IN ('Pending', 'Rendering')"
+        result = execute_query_one(query)
+        return result['count'] if result else 0
@@ -0,0 +1,66 @@
+"""
+Delivery of queued customer notifications (transactional outbox).
+
+Waitlist promotions and expiries write rows to notification_outbox in the same
+transaction as the change, so a notification exists exactly when the change
+committed. dispatch_notifications() claims batches with SKIP LOCKED, sends them
+by email and marks them sent; failed deliveries are retried up to
+NotificationOutbox.MAX_ATTEMPTS times.
+"""
+from django.conf import settings
+from django.core.mail import send_mail
+from django.db import transaction
+from django.utils.dateparse import parse_datetime
+from django.utils.timezone import localtime
+from typing import Dict, Any, Tuple
+import logging
+from .models import NotificationOutbox
+
+logger = logging.getLogger(__name__)
+
+
+def render(notification: Dict[str, Any]) -> Tuple[str, str]:
+    """Subject and body of a notification"""
+    payload = notification['payload']
+    name = notification['first_name'] or notification['username']
+    if notification['kind'] == 'waitlist_hold':
+        expires = localtime(parse_datetime(payload['hold_expires_at'])).strftime('%H:%M %d/%m/%Y')
+        return (
+            f"Đã có chỗ cho chuyến xe #{payload['trip_id']}",
+            f"Xin chào {name},\n\n"
+            f"{payload['number_of_seats']} chỗ trên chuyến xe #{payload['trip_id']} đang được giữ cho bạn "
+            f"đến {expires}. Hãy đặt vé trước thời điểm này để giữ chỗ."
+        )
+    if notification['kind'] == 'waitlist_expired':
+        return (
+            f"Hết hạn giữ chỗ chuyến xe #{payload['trip_id']}",
+            f"Xin chào {name},\n\n"
+            f"Chỗ giữ cho bạn trên chuyến xe #{payload['trip_id']} đã hết hạn."
+        )
+    raise ValueError(f"Unknown notification kind: {notification['kind']}")
+
+
+def dispatch_notifications(batch_size: int = 100) -> Dict[str, int]:
+    """Deliver queued notifications one batch per transaction until the outbox is drained"""
+    totals = {'sent': 0, 'failed': 0}
+    while True:
+        with transaction.atomic():
+            notifications = NotificationOutbox.claim_pending(batch_size)
+            if not notifications:
+                break
+            sent = []
+            for notification in notifications:
+                try:
+                    subject, body = render(notification)
+                    send_mail(subject, body, settings.DEFAULT_FROM_EMAIL, [notification['email']])
+                except Exception as e:
+                    logger.warning('Notification %s not delivered: %s', notification['id'], e)
+                    NotificationOutbox.mark_failed(notification['id'], str(e))
+                    totals['failed'] += 1
+                else:
+                    sent.append(notification['id'])
+            NotificationOutbox.mark_sent(sent)
+            totals['sent'] += len(sent)
+        if len(notifications) < batch_size:
+            break
+    return totals
@@ -2,8 +2,12 @@
 Bookings serializers for dictionary data (No ORM)
 """
 from rest_framework import serializers
-from .models import Booking, Ticket
+from django.db import transaction, IntegrityError
+from .models import Booking, Ticket, Waitlist, BookingConflictError, UNIQUE_VIOLATION
+from payments.models import Payment
 from transport.models import Trip, Seat
+from transport.seating import assign_seats, SeatAssignmentError
+from .ticket_codes import sign as sign_ticket
 from decimal import Decimal
 
 
@@ -49,9 +53,16 @@ class TicketSerializer(serializers.Serializer):
     """Serializer for Ticket"""
     id = serializers.IntegerField(read_only=True)
     seat_number = serializers.CharField(read_only=True)
-    seat_id = serializers.IntegerField(write_only=True)
+    seat_id = serializers.IntegerField(write_only=True, required=False)
     price = serializers.DecimalField(max_digits=10, decimal_places=2, read_only=True)
     passenger_name = serializers.CharField(max_length=100, required=True)
+    code = serializers.SerializerMethodField(read_only=True)
+
+    def get_code(self, obj):
+        """Signed code checked at boarding (needs the trip's arrival time)"""
+        if isinstance(obj, dict) and obj.get('arrival_time') and obj.get('seat_number'):
+            return sign_ticket(obj['id'], obj['trip_id'], obj['seat_number'], obj['arrival_time'])
+        return None
 
 
 class BookingSerializer(serializers.Serializer):
@@ -66,6 +77,7 @@ class BookingSerializer(serializers.Serializer):
     booking_time = serializers.DateTimeField(read_only=True)
     status = serializers.CharField(read_only=True)
     status_display = serializers.SerializerMethodField(read_only=True)
+    journey_id = serializers.IntegerField(read_only=True)
     tickets = serializers.SerializerMethodField(read_only=True)
 
     def get_user_name(self, obj):
@@ -102,6 +114,8 @@ class BookingCreateSerializer(serializers.Serializer):
     trip_id = serializers.IntegerField(required=True)
     number_of_seats = serializers.IntegerField(min_value=1, required=True)
     tickets = TicketSerializer(many=True, required=True)
+    # Pick the best block of free seats instead of the tickets' seat_id
+    auto_assign = serializers.BooleanField(default=False)
 
     def validate(self, data):
         """Validate booking creation data"""
@@ -122,8 +136,10 @@ class BookingCreateSerializer(serializers.Serializer):
                 'tickets': f'Number of tickets ({len(tickets)}) must match number of seats ({number_of_seats}).'
             })
 
-        # Check if trip has enough available seats
-        available_seats = Trip.available_seats(trip_id)
+        # Check if trip has enough available seats (seats the waitlist holds
+        # for this customer count as available to them)
+        user = self.context['request'].user if 'request' in self.context else None
+        available_seats = Trip.available_seats(trip_id, user_id=getattr(user, 'id', None))
         if available_seats < number_of_seats:
             raise serializers.ValidationError({
                 'number_of_seats': f'Only {available_seats} seats available for this trip.'
@@ -135,6 +151,10 @@ class BookingCreateSerializer(serializers.Serializer):
                 'trip_id': 'Cannot book a trip that has already departed.'
             })
 
+        # Seats are picked when the booking is written
+        if data.get('auto_assign'):
+            return data
+
         # Validate seat availability for each ticket
         seat_ids = []
         for ticket in tickets:
@@ -185,34 +205,156 @@ class BookingCreateSerializer(serializers.Serializer):
             # For testing with anonymous users, use a default user_id
             user_id = 1
 
-        # Get trip to calculate total_amount
-        trip = Trip.get_by_id(trip_id)
+        try:
+            with transaction.atomic():
+                # Current (dynamic) fare, share-locked until the booking commits
+                price_per_seat = Trip.get_price(trip_id)
+
+                if validated_data.get('auto_assign'):
+                    try:
+                        seat_ids = assign_seats(trip_id, len(tickets_data))
+                    except SeatAssignmentError as e:
+                        raise BookingConflictError(str(e)) from e
+                    for ticket_data, seat_id in zip(tickets_data, seat_ids):
+                        ticket_data['seat_id'] = seat_id
+
+                # Create booking
+                booking = Booking.create(
+                    user_id=user_id,
+                    trip_id=trip_id,
+                    number_of_seats=validated_data['number_of_seats'],
+                    total_amount=validated_data['number_of_seats'] * price_per_seat
+                )
+
+                # Create tickets and mark seats as unavailable
+                for ticket_data in tickets_data:
+                    seat_id = ticket_data['seat_id']
+
+                    # Create ticket
+                    Ticket.create(
+                        booking_id=booking['id'],
+                        seat_id=seat_id,
+                        trip_id=trip_id,
+                        price=price_per_seat,
+                        passenger_name=ticket_data['passenger_name']
+                    )
+
+                    # Mark seat as unavailable
+                    Seat.update(seat_id, is_available=False)
+
+                # The booking uses up the customer's waitlist hold on this trip
+                Waitlist.consume_hold(trip_id, user_id, booking['id'])
+        except IntegrityError as e:
+            if getattr(e.__cause__, 'pgcode', None) != UNIQUE_VIOLATION:
+                raise
+            raise BookingConflictError('A selected seat was just booked by someone else.') from e
 
-        # Create booking
-        booking = Booking.create(
-            user_id=user_id,
-            trip_id=trip_id,
-            number_of_seats=validated_data['number_of_seats']
+        # Fetch full booking details
+        return Booking.get_by_id(booking['id'])
+
+
+class JourneyPaymentSerializer(serializers.Serializer):
+    """Serializer for the single payment covering every leg of a journey"""
+    payment_method = serializers.ChoiceField(
+        choices=[choice[0] for choice in Payment.PAYMENT_METHODS],
+        required=True
+    )
+    transaction_code = serializers.CharField(max_length=100, required=True)
+    wallet_id = serializers.UUIDField(required=False)
+
+
+class JourneyCreateSerializer(serializers.Serializer):
+    """Serializer for booking several trips (e.g. outbound and return) at once"""
+    MAX_LEGS = 6
+
+    legs = BookingCreateSerializer(many=True, required=True)
+    payment = JourneyPaymentSerializer(required=False)
+
+    def validate_legs(self, legs):
+        """Validate that the legs are distinct, consecutive trips"""
+        if not 2 <= len(legs) <= self.MAX_LEGS:
+            raise serializers.ValidationError(f'A journey has between 2 and {self.MAX_LEGS} legs.')
+
+        trip_ids = [leg['trip_id'] for leg in legs]
+        if len(trip_ids) != len(set(trip_ids)):
+            raise serializers.ValidationError('Each trip can only appear once in a journey.')
+
+        # Legs must not overlap in time: each departs after the previous one arrives
+        trips = sorted((Trip.get_by_id(trip_id) for trip_id in trip_ids),
+                       key=lambda trip: trip['departure_time'])
+        for previous, trip in zip(trips, trips[1:]):
+            if trip['departure_time'] < previous['arrival_time']:
+                raise serializers.ValidationError(
+                    f'Trip {trip["id"]} departs before trip {previous["id"]} arrives.'
+                )
+        return legs
+
+    def create(self, validated_data):
+        """
+        Create every booking of the journey and its payment in one transaction.
+        BookingViewSet.journey only lets authenticated users through.
+        """
+        return Booking.create_journey(
+            user_id=self.context['request'].user.id,
+            legs=validated_data['legs'],
+            payment=validated_data.get('payment')
         )
 
-        # Create tickets and mark seats as unavailable
-        for ticket_data in tickets_data:
-            seat_id = ticket_data['seat_id']
 
-            # Create ticket
-            Ticket.create(
-                booking_id=booking['id'],
-                seat_id=seat_id,
-                trip_id=trip_id,
-                price=trip['price_per_seat'],
-                passenger_name=ticket_data['passenger_name']
-            )
+class WaitlistSerializer(serializers.Serializer):
+    """Serializer for a waitlist entry"""
+    id = serializers.IntegerField(read_only=True)
+    trip_id = serializers.IntegerField(required=True)
+    number_of_seats = serializers.IntegerField(min_value=1, required=True)
+    status = serializers.CharField(read_only=True)
+    status_display = serializers.SerializerMethodField(read_only=True)
+    position = serializers.IntegerField(read_only=True, allow_null=True)
+    joined_at = serializers.DateTimeField(read_only=True)
+    hold_expires_at = serializers.DateTimeField(read_only=True, allow_null=True)
+    departure_time = serializers.DateTimeField(read_only=True)
+    trip_info = serializers.SerializerMethodField(read_only=True)
+
+    def get_status_display(self, obj):
+        """Get status display"""
+        if isinstance(obj, dict) and 'status' in obj:
+            return Waitlist.get_status_display(obj['status'])
+        return ''
+
+    def get_trip_info(self, obj):
+        """Get trip info"""
+        if isinstance(obj, dict):
+            return f"{obj.get('start_location_name', '')} → {obj.get('end_location_name', '')}"
+        return ''
+
+    def validate(self, data):
+        """Only sold-out upcoming trips can be waited for, once per customer"""
+        trip = Trip.get_by_id(data['trip_id'])
+        if not trip:
+            raise serializers.ValidationError({'trip_id': 'Trip not found.'})
+        if not Trip.is_upcoming(trip):
+            raise serializers.ValidationError({'trip_id': 'Cannot wait for a trip that has already departed.'})
+        if data['number_of_seats'] > trip['bus_total_seats']:
+            raise serializers.ValidationError({
+                'number_of_seats': f'The bus only has {trip["bus_total_seats"]} seats.'
+            })
 
-            # Mark seat as unavailable
-            Seat.update(seat_id, is_available=False)
+        user_id = self.context['user_id']
+        if Waitlist.get_open(data['trip_id'], user_id):
+            raise serializers.ValidationError({'trip_id': 'You are already on the waitlist for this trip.'})
+        available_seats = Trip.available_seats(data['trip_id'], user_id=user_id)
+        if available_seats >= data['number_of_seats']:
+            raise serializers.ValidationError({
+                'number_of_seats': f'{available_seats} seats are available; book them directly.'
+            })
+        return data
 
-        # Fetch full booking details
-        return Booking.get_by_id(booking['id'])
+    def create(self, validated_data):
+        """Join the waitlist"""
+        return Waitlist.join(
+            trip_id=validated_data['trip_id'],
+            user_id=self.context['user_id'],
+            number_of_seats=validated_data['number_of_seats']
+        )
 
 
 class BookingListSerializer(serializers.Serializer):
@@ -246,3 +388,25 @@ class BookingListSerializer(serializers.Serializer):
         if isinstance(obj, dict) and 'status' in obj:
             return Booking.get_status_display(obj['status'])
         return ''
+
+
+class BoardingScanSerializer(serializers.Serializer):
+    """One scanned ticket code"""
+    code = serializers.CharField(max_length=100)
+    scanned_at = serializers.DateTimeField(required=False)
+
+
+class CheckInSerializer(serializers.Serializer):
+    """Boarding scans uploaded by a check-in device, live or after working offline"""
+    MAX_SCANS = 500
+
+    trip_id = serializers.IntegerField(required=False)
+    device_id = serializers.CharField(max_length=64, required=False, allow_blank=True, default='')
+    scans = BoardingScanSerializer(many=True)
+
+    def validate_scans(self, value):
+        if not value:
+            raise serializers.ValidationError('At least one scan is required.')
+        if len(value) > self.MAX_SCANS:
+            raise serializers.ValidationError(f'At most {self.MAX_SCANS} scans per request.')
+        return value
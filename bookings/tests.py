@@ -1,3 +1,305 @@
-from django.test import TestCase
+from datetime import datetime, timedelta
+from importlib import import_module
+from unittest import mock
+import json
 
-# Create your tests here.
+from django.conf import settings
+from django.contrib.auth.models import AnonymousUser
+from django.db import connection
+from django.http import JsonResponse
+from django.test import RequestFactory, SimpleTestCase, TestCase, override_settings
+from django.utils.timezone import make_aware, now
+from rest_framework import serializers
+from rest_framework.response import Response
+from rest_framework.test import APIRequestFactory
+
+from transport.models import Trip
+from utils.idempotency import idempotent
+from . import ticket_codes
+from .boarding import check_in
+from .models import BoardingScan, TicketRevocation, Waitlist
+from .serializers import JourneyCreateSerializer
+from .views import BookingViewSet
+
+
+def _at(hour, day=1):
+    return make_aware(datetime(2030, 1, day, hour))
+
+
+class JourneyLegTests(SimpleTestCase):
+    """Legs of a round trip or multi-trip journey"""
+
+    TRIPS = {
+        1: {'id': 1, 'departure_time': _at(8), 'arrival_time': _at(12)},
+        2: {'id': 2, 'departure_time': _at(12), 'arrival_time': _at(15)},
+        3: {'id': 3, 'departure_time': _at(11), 'arrival_time': _at(14)},
+        4: {'id': 4, 'departure_time': _at(9, day=3), 'arrival_time': _at(13, day=3)},
+    }
+
+    def validate(self, *trip_ids):
+        legs = [{'trip_id': trip_id} for trip_id in trip_ids]
+        with mock.patch.object(Trip, 'get_by_id', side_effect=self.TRIPS.get):
+            return JourneyCreateSerializer().validate_legs(legs)
+
+    def test_consecutive_legs(self):
+        self.assertEqual(len(self.validate(1, 2, 4)), 3)
+
+    def test_legs_are_checked_in_departure_order(self):
+        self.assertEqual(len(self.validate(4, 1)), 2)
+
+    def test_leg_departing_before_previous_arrives(self):
+        with self.assertRaisesMessage(serializers.ValidationError, 'Trip 3 departs before trip 1 arrives.'):
+            self.validate(1, 3)
+
+    def test_repeated_trip(self):
+        with self.assertRaisesMessage(serializers.ValidationError, 'only appear once'):
+            self.validate(1, 1)
+
+    def test_leg_count(self):
+        with self.assertRaisesMessage(serializers.ValidationError, 'between 2 and'):
+            self.validate(1)
+        with self.assertRaisesMessage(serializers.ValidationError, 'between 2 and'):
+            self.validate(*range(1, JourneyCreateSerializer.MAX_LEGS + 2))
+
+    def test_anonymous_callers_cannot_book_journeys(self):
+        request = APIRequestFactory().post('/api/bookings/journey/', {'legs': []}, format='json')
+        with mock.patch.object(JourneyCreateSerializer, 'save') as save:
+            # The router passes the action's own settings, such as its permissions
+            response = BookingViewSet.as_view({'post': 'journey'}, **BookingViewSet.journey.kwargs)(request)
+        self.assertEqual(response.status_code, 403)
+        save.assert_not_called()
+
+
+class WaitlistPromotionTests(TestCase):
+    """Waitlist.promote against the waitlist migration and the columns it reads"""
+
+    @classmethod
+    def setUpTestData(cls):
+        with connection.cursor() as cursor:
+            cursor.execute("""
+                CREATE TABLE buses (id bigint primary key, total_seats integer not null);
+                CREATE TABLE trips (id bigint primary key, bus_id bigint not null,
+                                    departure_time timestamp with time zone not null);
+                CREATE TABLE bookings (id bigint generated by default as identity primary key,
+                                       trip_id bigint not null, number_of_seats integer not null,
+                                       status varchar(10) not null);
+            """)
+            with open(settings.BASE_DIR / 'migrations' / '0016_trip_waitlist.sql') as migration:
+                cursor.execute(migration.read())
+
+            tomorrow = now() + timedelta(days=1)
+            cursor.execute("INSERT INTO buses VALUES (1, 10)")
+            cursor.execute("INSERT INTO trips VALUES (1, 1, %s), (2, 1, %s)",
+                           (tomorrow, now() - timedelta(hours=1)))
+            # Trip 1 has 4 free seats: 6 booked, the canceled booking does not count
+            cursor.execute("""
+                INSERT INTO bookings (trip_id, number_of_seats, status)
+                VALUES (1, 6, 'Confirmed'), (1, 3, 'Canceled'), (2, 1, 'Confirmed')
+            """)
+
+    def queue(self, trip_id, *seats):
+        """Queue users 1, 2, ... for the given seat counts"""
+        with connection.cursor() as cursor:
+            for user_id, count in enumerate(seats, start=1):
+                cursor.execute("INSERT INTO trip_waitlist (trip_id, user_id, number_of_seats) VALUES (%s, %s, %s)",
+                               (trip_id, user_id, count))
+
+    def statuses(self):
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT user_id, status FROM trip_waitlist ORDER BY id")
+            return dict(cursor.fetchall())
+
+    def outbox(self):
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT user_id, kind, payload->>'trip_id' FROM notification_outbox ORDER BY id")
+            return cursor.fetchall()
+
+    def test_fifo_prefix_that_fits_is_held(self):
+        self.queue(1, 2, 1, 3, 1)
+        promoted = Waitlist.promote([1])
+        # The fourth waiter would fit but stays behind the third: holds never skip the queue
+        self.assertEqual([entry['user_id'] for entry in promoted], [1, 2])
+        self.assertEqual(self.statuses(), {1: 'Held', 2: 'Held', 3: 'Waiting', 4: 'Waiting'})
+        self.assertTrue(all(entry['hold_expires_at'] > now() for entry in promoted))
+        self.assertEqual(self.outbox(), [(1, 'waitlist_hold', '1'), (2, 'waitlist_hold', '1')])
+
+    def test_live_holds_use_up_free_seats(self):
+        self.queue(1, 3, 2)
+        self.assertEqual(len(Waitlist.promote([1])), 1)
+        # One seat left: the second waiter keeps waiting on a later promotion too
+        self.assertEqual(Waitlist.promote([1]), [])
+        self.assertEqual(self.statuses(), {1: 'Held', 2: 'Waiting'})
+        self.assertEqual(len(self.outbox()), 1)
+
+    def test_departed_trip_is_not_promoted(self):
+        self.queue(2, 1)
+        self.assertEqual(Waitlist.promote([2]), [])
+        self.assertEqual(self.statuses(), {1: 'Waiting'})
+        self.assertEqual(self.outbox(), [])
+
+
+class IdempotencyTests(TestCase):
+    """Idempotency-Key replay of booking and payment creation"""
+
+    @classmethod
+    def setUpTestData(cls):
+        with connection.cursor() as cursor:
+            with open(settings.BASE_DIR / 'migrations' / '0017_idempotency_keys.sql') as migration:
+                cursor.execute(migration.read())
+
+    def setUp(self):
+        self.calls = 0
+        self.status = 201
+        self.session = import_module(settings.SESSION_ENGINE).SessionStore()
+
+        @idempotent('bookings.create')
+        def create(request):
+            self.calls += 1
+            request.session['guest_booking_id'] = self.calls
+            return JsonResponse({'booking_id': self.calls}, status=self.status)
+
+        self.view = create
+
+    def post(self, data, key='retry-1', view=None):
+        headers = {'HTTP_IDEMPOTENCY_KEY': key} if key else {}
+        request = RequestFactory().post('/api/bookings/', json.dumps(data), content_type='application/json',
+                                        **headers)
+        request.user = AnonymousUser()
+        request.session = self.session
+        return (view or self.view)(request)
+
+    def test_retry_replays_the_first_response(self):
+        first = self.post({'trip_id': 1})
+        # Another request of the guest changes the session in between
+        self.session['guest_booking_id'] = None
+        retry = self.post({'trip_id': 1})
+        self.assertEqual(self.calls, 1)
+        self.assertEqual(retry.status_code, 201)
+        self.assertEqual(retry.content, first.content)
+        self.assertEqual(retry['Content-Type'], 'application/json')
+        self.assertEqual(retry['Idempotent-Replayed'], 'true')
+        self.assertNotIn('Idempotent-Replayed', first)
+        self.assertEqual(self.session['guest_booking_id'], 1)
+
+    def test_key_reused_for_another_request(self):
+        self.post({'trip_id': 1})
+        response = self.post({'trip_id': 2})
+        self.assertEqual(response.status_code, 422)
+        self.assertEqual(self.calls, 1)
+
+    def test_keys_are_scoped_to_the_caller(self):
+        self.post({'trip_id': 1})
+        self.session = import_module(settings.SESSION_ENGINE).SessionStore()
+        self.assertNotIn('Idempotent-Replayed', self.post({'trip_id': 1}))
+        self.assertEqual(self.calls, 2)
+
+    def test_server_errors_are_not_stored(self):
+        self.status = 503
+        self.post({'trip_id': 1})
+        self.status = 201
+        response = self.post({'trip_id': 1})
+        self.assertEqual(response.status_code, 201)
+        self.assertNotIn('Idempotent-Replayed', response)
+        self.assertEqual(self.calls, 2)
+
+    def test_request_without_a_key_runs_every_time(self):
+        self.post({'trip_id': 1}, key=None)
+        self.post({'trip_id': 1}, key=None)
+        self.assertEqual(self.calls, 2)
+
+    def test_rest_framework_response_is_stored_as_json(self):
+        view = idempotent('payments.create')(lambda request: Response({'amount': '10.00'}, status=201))
+        self.post({'booking_id': 1}, view=view)
+        retry = self.post({'booking_id': 1}, view=view)
+        self.assertEqual(json.loads(retry.content), {'amount': '10.00'})
+        self.assertEqual(retry['Content-Type'], 'application/json')
+
+    def test_overlong_key(self):
+        self.assertEqual(self.post({'trip_id': 1}, key='k' * 256).status_code, 400)
+        self.assertEqual(self.calls, 0)
+
+
+@override_settings(TICKET_CODE_SECRET='ticket-code-tests')
+class TicketCodeTests(SimpleTestCase):
+    """Signed ticket codes checked offline at boarding"""
+
+    ARRIVAL = _at(12)
+
+    def sign(self, ticket_id=1, trip_id=5, seat_number='A01'):
+        return ticket_codes.sign(ticket_id, trip_id, seat_number, self.ARRIVAL)
+
+    def test_round_trip(self):
+        code = self.sign(ticket_id=2 ** 40, seat_number='B10')
+        self.assertEqual(len(code), ticket_codes.CODE_LENGTH)
+        ticket = ticket_codes.verify(f' {code.lower()}\n')
+        self.assertEqual(ticket, ticket_codes.TicketCode(2 ** 40, 5, 'B10', self.ARRIVAL + ticket_codes.CODE_GRACE))
+
+    def test_code_expires_after_the_grace_period(self):
+        ticket = ticket_codes.verify(self.sign())
+        self.assertFalse(ticket.is_expired(self.ARRIVAL + ticket_codes.CODE_GRACE - timedelta(seconds=1)))
+        self.assertTrue(ticket.is_expired(self.ARRIVAL + ticket_codes.CODE_GRACE))
+
+    def test_tampered_code(self):
+        code = self.sign()
+        tampered = code[:5] + ('B' if code[5] != 'B' else 'C') + code[6:]
+        with self.assertRaisesMessage(ticket_codes.InvalidTicketCode, 'signature does not match'):
+            ticket_codes.verify(tampered)
+
+    def test_code_signed_with_another_secret(self):
+        code = self.sign()
+        with override_settings(TICKET_CODE_SECRET='another-secret'):
+            with self.assertRaises(ticket_codes.InvalidTicketCode):
+                ticket_codes.verify(code)
+
+    def test_malformed_codes(self):
+        with self.assertRaisesMessage(ticket_codes.InvalidTicketCode, 'wrong length'):
+            ticket_codes.verify(self.sign()[:-1])
+        with self.assertRaisesMessage(ticket_codes.InvalidTicketCode, 'not valid base32'):
+            ticket_codes.verify('1' * ticket_codes.CODE_LENGTH)
+
+
+@override_settings(TICKET_CODE_SECRET='ticket-code-tests')
+class CheckInTests(SimpleTestCase):
+    """Check-in statuses, with the boarding tables patched out"""
+
+    def setUp(self):
+        arrival = now() + timedelta(hours=2)
+        self.codes = {ticket_id: ticket_codes.sign(ticket_id, 5, f'A{ticket_id:02d}', arrival)
+                      for ticket_id in (1, 2, 3)}
+        self.boarded_at = now() - timedelta(minutes=10)
+
+    def check_in(self, codes, stored=(), revoked=(), **kwargs):
+        """`stored` tickets were scanned before, by another request or device"""
+        scans = [{'code': code} for code in codes]
+        with mock.patch.object(TicketRevocation, 'get_ticket_ids', return_value=list(revoked)), \
+                mock.patch.object(BoardingScan, 'record_many',
+                                  side_effect=lambda rows: [row[0] for row in rows if row[0] not in stored]) \
+                as record_many, \
+                mock.patch.object(BoardingScan, 'get_scanned_at',
+                                  side_effect=lambda ids: {ticket_id: self.boarded_at for ticket_id in ids}):
+            results = check_in(scans, **kwargs)
+        self.recorded = [row[0] for row in record_many.call_args.args[0]]
+        return [result['status'] for result in results], results
+
+    def test_boarded(self):
+        statuses, results = self.check_in([self.codes[1], self.codes[2]], trip_id=5, device_id='bus-door')
+        self.assertEqual(statuses, ['boarded', 'boarded'])
+        self.assertEqual(self.recorded, [1, 2])
+        self.assertEqual(results[0]['seat_number'], 'A01')
+
+    def test_ticket_scanned_earlier_keeps_its_first_scan(self):
+        statuses, results = self.check_in([self.codes[1], self.codes[2]], stored={2})
+        self.assertEqual(statuses, ['boarded', 'already_boarded'])
+        self.assertEqual(results[1]['boarded_at'], self.boarded_at)
+
+    def test_duplicate_in_one_batch(self):
+        statuses, _ = self.check_in([self.codes[1], self.codes[1]])
+        self.assertEqual(statuses, ['boarded', 'already_boarded'])
+        self.assertEqual(self.recorded, [1])
+
+    def test_rejected_scans_are_not_recorded(self):
+        other_trip = ticket_codes.sign(4, 6, 'A04', now() + timedelta(hours=2))
+        expired = ticket_codes.sign(5, 5, 'A05', now() - ticket_codes.CODE_GRACE - timedelta(minutes=1))
+        statuses, _ = self.check_in(['not-a-code', other_trip, expired, self.codes[3]], trip_id=5, revoked={3})
+        self.assertEqual(statuses, ['invalid', 'wrong_trip', 'expired', 'revoked'])
+        self.assertEqual(self.recorded, [])
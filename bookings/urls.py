@@ -6,6 +6,7 @@ from . import views
 router = DefaultRouter()
 router.register(r'bookings', views.BookingViewSet, basename='booking')
 router.register(r'tickets', views.TicketViewSet, basename='ticket')
+router.register(r'waitlist', views.WaitlistViewSet, basename='waitlist')
 
 # The API URLs are now determined automatically by the router
 urlpatterns = [
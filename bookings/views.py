@@ -5,12 +5,19 @@ from rest_framework import viewsets, status
 from rest_framework.decorators import action
 from rest_framework.response import Response
 from rest_framework.exceptions import NotFound
-from .models import Booking, Ticket
+from rest_framework.permissions import IsAuthenticated
+from utils.db_utils import parse_date_range
+from utils.idempotency import idempotent
+from utils.exports import export_response, EXPORT_RENDERERS
+from .models import Booking, Ticket, Waitlist, BookingConflictError
 from .serializers import (
     BookingSerializer,
     BookingCreateSerializer,
     BookingListSerializer,
-    TicketSerializer
+    JourneyCreateSerializer,
+    TicketSerializer,
+    WaitlistSerializer,
+    CheckInSerializer
 )
 
 
@@ -20,13 +27,16 @@ class BookingViewSet(viewsets.ViewSet):
 
     Endpoints:
     - GET /api/bookings/ - List all bookings for authenticated user
-    - POST /api/bookings/ - Create a new booking
+    - POST /api/bookings/ - Create a new booking ("auto_assign": true picks the seats)
+    - POST /api/bookings/journey/ - Book several trips (e.g. round trip) with one payment (authenticated)
     - GET /api/bookings/{id}/ - Retrieve booking details
     - PUT /api/bookings/{id}/ - Update booking (limited fields)
     - DELETE /api/bookings/{id}/ - Cancel booking
     - POST /api/bookings/{id}/confirm/ - Confirm booking
     - POST /api/bookings/{id}/cancel/ - Cancel booking
+    - POST /api/bookings/bulk-cancel/ - Cancel many bookings or a whole trip (admin only)
     - GET /api/bookings/my-bookings/ - Get current user's bookings
+    - GET /api/bookings/export/ - Stream bookings as CSV or JSON lines (admin only)
     """
 
     # Use integer regex to match booking IDs
@@ -44,16 +54,18 @@ class BookingViewSet(viewsets.ViewSet):
     def list(self, request):
         """List bookings based on user role"""
         user = request.user
+        # Older monthly partitions are only read with ?history=true
+        include_history = request.query_params.get('history') == 'true'
 
         # For testing: allow anonymous access, show all bookings
         if not user or user.is_anonymous:
-            bookings = Booking.get_all()
+            bookings = Booking.get_all(include_history=include_history)
         # Admin can see all bookings
         elif hasattr(user, 'is_admin') and user.is_admin():
-            bookings = Booking.get_all()
+            bookings = Booking.get_all(include_history=include_history)
         else:
             # Regular users can only see their own bookings
-            bookings = Booking.get_all(user_id=user.id)
+            bookings = Booking.get_all(user_id=user.id, include_history=include_history)
 
         # Filter by status
         status_param = request.query_params.get('status', None)
@@ -68,16 +80,43 @@ class BookingViewSet(viewsets.ViewSet):
         serializer = BookingListSerializer(bookings, many=True)
         return Response(serializer.data)
 
+    @idempotent('bookings.create')
     def create(self, request):
-        """Create a new booking"""
+        """Create a new booking (honors the Idempotency-Key header)"""
         serializer = BookingCreateSerializer(data=request.data, context={'request': request})
         serializer.is_valid(raise_exception=True)
-        booking = serializer.save()
+        try:
+            booking = serializer.save()
+        except BookingConflictError as e:
+            return Response({'error': str(e)}, status=status.HTTP_409_CONFLICT)
 
         # Return full booking details
         response_serializer = BookingSerializer(booking)
         return Response(response_serializer.data, status=status.HTTP_201_CREATED)
 
+    @action(detail=False, methods=['post'], permission_classes=[IsAuthenticated])
+    @idempotent('bookings.journey')
+    def journey(self, request):
+        """
+        Book several trips in one transaction, paid with one payment.
+        Body: {"legs": [<booking>, ...], "payment": {"payment_method", "transaction_code", "wallet_id"}}
+        """
+        serializer = JourneyCreateSerializer(data=request.data, context={'request': request})
+        serializer.is_valid(raise_exception=True)
+        try:
+            journey = serializer.save()
+        except BookingConflictError as e:
+            return Response({'error': str(e)}, status=status.HTTP_409_CONFLICT)
+
+        from payments.serializers import PaymentSerializer
+        return Response({
+            'journey_id': journey['journey_id'],
+            'lead_booking_id': journey['lead_booking_id'],
+            'total_amount': str(journey['total_amount']),
+            'bookings': BookingSerializer(journey['bookings'], many=True).data,
+            'payment': PaymentSerializer(journey['payment']).data if journey['payment'] else None
+        }, status=status.HTTP_201_CREATED)
+
     def retrieve(self, request, pk=None):
         """Retrieve booking by ID"""
         booking = Booking.get_by_id(pk)
@@ -105,8 +144,7 @@ class BookingViewSet(viewsets.ViewSet):
         if number_of_seats:
             # Recalculate total_amount
             from transport.models import Trip
-            trip = Trip.get_by_id(booking['trip_id'])
-            total_amount = number_of_seats * trip['price_per_seat']
+            total_amount = number_of_seats * Trip.get_price(booking['trip_id'])
 
             Booking.update(pk, number_of_seats=number_of_seats, total_amount=total_amount)
 
@@ -162,7 +200,7 @@ class BookingViewSet(viewsets.ViewSet):
 
     @action(detail=True, methods=['post'])
     def cancel(self, request, pk=None):
-        """Cancel and completely remove a booking"""
+        """Cancel a booking and refund its payment"""
         booking = Booking.get_by_id(pk)
         if not booking:
             raise NotFound('Booking not found')
@@ -180,26 +218,63 @@ class BookingViewSet(viewsets.ViewSet):
                 status=status.HTTP_400_BAD_REQUEST
             )
 
-        # Cancel booking (this will delete booking, tickets, and payments)
-        Booking.cancel_booking(pk)
+        # Cancel booking (this releases seats, deletes tickets and refunds the payment)
+        result = Booking.cancel_bookings([pk])
 
         return Response(
             {
                 'success': True,
-                'message': 'Booking canceled and removed successfully.',
-                'booking_id': pk
+                'message': 'Booking canceled successfully.',
+                'booking_id': pk,
+                'refunded_amount': str(result['refunded_amount'])
             },
             status=status.HTTP_200_OK
         )
 
+    @action(detail=False, methods=['post'], url_path='bulk-cancel')
+    def bulk_cancel(self, request):
+        """Cancel a list of bookings, or every booking of a withdrawn trip, in one pass (admin only)"""
+        if not hasattr(request.user, 'is_admin') or not request.user.is_admin():
+            return Response(
+                {'error': 'Only admins can cancel bookings in bulk.'},
+                status=status.HTTP_403_FORBIDDEN
+            )
+
+        trip_id = request.data.get('trip_id')
+        booking_ids = request.data.get('booking_ids')
+        reason = request.data.get('reason') or 'Chuyến xe bị hủy'
+        try:
+            if trip_id:
+                result = Booking.cancel_trip_bookings(int(trip_id), reason=reason)
+            elif isinstance(booking_ids, list) and booking_ids:
+                result = Booking.cancel_bookings([int(b) for b in booking_ids], reason=reason)
+            else:
+                return Response(
+                    {'error': 'Provide trip_id or a non-empty booking_ids list.'},
+                    status=status.HTTP_400_BAD_REQUEST
+                )
+        except (TypeError, ValueError):
+            return Response(
+                {'error': 'trip_id and booking_ids must be integers.'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        return Response({
+            'success': True,
+            'canceled_bookings': result['canceled_bookings'],
+            'refunds': len(result['refunds']),
+            'refunded_amount': str(result['refunded_amount'])
+        })
+
     @action(detail=False, methods=['get'], url_path='my-bookings')
     def my_bookings(self, request):
         """Get all bookings for the current user"""
+        include_history = request.query_params.get('history') == 'true'
         # For testing: if no user, return all bookings
         if not request.user or request.user.is_anonymous:
-            bookings = Booking.get_all()
+            bookings = Booking.get_all(include_history=include_history)
         else:
-            bookings = Booking.get_all(user_id=request.user.id)
+            bookings = Booking.get_all(user_id=request.user.id, include_history=include_history)
 
         serializer = BookingListSerializer(bookings, many=True)
         return Response(serializer.data)
@@ -213,7 +288,19 @@ class BookingViewSet(viewsets.ViewSet):
                 status=status.HTTP_403_FORBIDDEN
             )
 
-        stats = Booking.get_statistics()
+        date_range = parse_date_range(request.query_params)
+        if date_range is None:
+            return Response(
+                {'error': 'date_from and date_to must be dates (YYYY-MM-DD).'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        date_from, date_to = date_range
+
+        from payments.models import Payment
+        stats = Booking.get_statistics(date_from=date_from, date_to=date_to)
+        stats['revenue_by_payment_method'] = Payment.get_revenue_by_method(date_from, date_to)
+        if request.query_params.get('daily') == 'true':
+            stats['daily'] = Booking.get_daily_statistics(date_from, date_to)
         return Response(stats)
 
     @action(detail=True, methods=['get'])
@@ -227,6 +314,22 @@ class BookingViewSet(viewsets.ViewSet):
         serializer = TicketSerializer(tickets, many=True)
         return Response(serializer.data)
 
+    @action(detail=False, methods=['get'], renderer_classes=EXPORT_RENDERERS)
+    def export(self, request):
+        """
+        Stream all bookings matching the filters as CSV or JSON lines (admin only).
+        ?format=csv|jsonl&gzip=true&date_from=&date_to= plus the filters in utils.exports
+        """
+        if not hasattr(request.user, 'is_admin') or not request.user.is_admin():
+            return Response(
+                {'error': 'Only admins can export bookings.'},
+                status=status.HTTP_403_FORBIDDEN
+            )
+        try:
+            return export_response('bookings', request.query_params, request.accepted_renderer.format)
+        except ValueError as e:
+            return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
 
 class TicketViewSet(viewsets.ViewSet):
     """
@@ -235,21 +338,26 @@ class TicketViewSet(viewsets.ViewSet):
     Endpoints:
     - GET /api/tickets/ - List all tickets for authenticated user's bookings
     - GET /api/tickets/{id}/ - Retrieve ticket details
+    - POST /api/tickets/check-in/ - Verify signed ticket codes at boarding (admin only)
+    - GET /api/tickets/boarding-pack/?trip={id} - Key and revocations for offline boarding (admin only)
+    - GET /api/tickets/export/ - Stream tickets as CSV or JSON lines (admin only)
     """
 
     def list(self, request):
         """List tickets based on user role"""
         user = request.user
+        # Older monthly partitions are only read with ?history=true
+        include_history = request.query_params.get('history') == 'true'
 
         # For testing: allow anonymous access, show all tickets
         if not user or user.is_anonymous:
-            tickets = Ticket.get_all()
+            tickets = Ticket.get_all(include_history=include_history)
         # Admin can see all tickets
         elif hasattr(user, 'is_admin') and user.is_admin():
-            tickets = Ticket.get_all()
+            tickets = Ticket.get_all(include_history=include_history)
         else:
             # Regular users can only see their own tickets
-            tickets = Ticket.get_all(user_id=user.id)
+            tickets = Ticket.get_all(user_id=user.id, include_history=include_history)
 
         serializer = TicketSerializer(tickets, many=True)
         return Response(serializer.data)
@@ -262,3 +370,111 @@ class TicketViewSet(viewsets.ViewSet):
 
         serializer = TicketSerializer(ticket)
         return Response(serializer.data)
+
+    @action(detail=False, methods=['post'], url_path='check-in')
+    def check_in(self, request):
+        """
+        Verify scanned ticket codes without reading the tickets and record boardings (admin only).
+        Body: {"trip_id": id, "device_id": "...", "scans": [{"code": "...", "scanned_at": "..."}]}
+        """
+        if not hasattr(request.user, 'is_admin') or not request.user.is_admin():
+            return Response(
+                {'error': 'Only admins can check passengers in.'},
+                status=status.HTTP_403_FORBIDDEN
+            )
+
+        serializer = CheckInSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        data = serializer.validated_data
+
+        from .boarding import check_in
+        results = check_in(data['scans'], trip_id=data.get('trip_id'), device_id=data['device_id'])
+        return Response({
+            'boarded': sum(1 for result in results if result['status'] == 'boarded'),
+            'rejected': sum(1 for result in results if result['status'] not in ('boarded', 'already_boarded')),
+            'results': results
+        })
+
+    @action(detail=False, methods=['get'], url_path='boarding-pack')
+    def boarding_pack(self, request):
+        """Trip key, revoked and boarded tickets for a device boarding offline (admin only)"""
+        if not hasattr(request.user, 'is_admin') or not request.user.is_admin():
+            return Response(
+                {'error': 'Only admins can download boarding packs.'},
+                status=status.HTTP_403_FORBIDDEN
+            )
+
+        trip_id = request.query_params.get('trip', None)
+        if not trip_id or not trip_id.isdigit():
+            return Response({'error': 'trip is required.'}, status=status.HTTP_400_BAD_REQUEST)
+
+        from transport.models import Trip
+        if not Trip.get_by_id(int(trip_id)):
+            raise NotFound('Trip not found')
+
+        from .boarding import boarding_pack
+        return Response(boarding_pack(int(trip_id)))
+
+    @action(detail=False, methods=['get'], renderer_classes=EXPORT_RENDERERS)
+    def export(self, request):
+        """
+        Stream all tickets matching the filters as CSV or JSON lines (admin only).
+        ?format=csv|jsonl&gzip=true&date_from=&date_to= plus the filters in utils.exports
+        """
+        if not hasattr(request.user, 'is_admin') or not request.user.is_admin():
+            return Response(
+                {'error': 'Only admins can export tickets.'},
+                status=status.HTTP_403_FORBIDDEN
+            )
+        try:
+            return export_response('tickets', request.query_params, request.accepted_renderer.format)
+        except ValueError as e:
+            return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+
+class WaitlistViewSet(viewsets.ViewSet):
+    """
+    ViewSet for the waitlist of sold-out trips using raw SQL.
+    When a cancellation frees seats, the earliest waiters get a time-limited hold
+    and a notification instead of having to poll the trip.
+
+    Endpoints:
+    - GET /api/waitlist/ - List the current user's waiting and held entries
+    - POST /api/waitlist/ - Join the waitlist of a sold-out trip
+    - GET /api/waitlist/{id}/ - Retrieve an entry with its place in the queue
+    - DELETE /api/waitlist/{id}/ - Leave the waitlist (releases a held entry)
+
+    Entries belong to the signed-in customer, so every endpoint requires authentication.
+    """
+
+    lookup_value_regex = '[0-9]+'
+    permission_classes = [IsAuthenticated]
+
+    def _user_id(self, request):
+        return request.user.id
+
+    def list(self, request):
+        """List the current user's open entries"""
+        entries = Waitlist.get_for_user(self._user_id(request))
+        return Response(WaitlistSerializer(entries, many=True).data)
+
+    def create(self, request):
+        """Join the waitlist of a trip"""
+        serializer = WaitlistSerializer(data=request.data, context={'user_id': self._user_id(request)})
+        serializer.is_valid(raise_exception=True)
+        entry = serializer.save()
+        return Response(WaitlistSerializer(entry).data, status=status.HTTP_201_CREATED)
+
+    def retrieve(self, request, pk=None):
+        """Retrieve a waitlist entry"""
+        entry = Waitlist.get_by_id(int(pk))
+        if not entry or entry['user_id'] != self._user_id(request):
+            raise NotFound('Waitlist entry not found')
+        return Response(WaitlistSerializer(entry).data)
+
+    def destroy(self, request, pk=None):
+        """Leave the waitlist"""
+        if not Waitlist.leave(int(pk), self._user_id(request)):
+            raise NotFound('Waitlist entry not found')
+        return Response({'message': 'Left the waitlist.'}, status=status.HTTP_200_OK)
+
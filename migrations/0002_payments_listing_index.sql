@@ -0,0 +1,15 @@
+-- Migration: Keyset pagination indexes for the admin payment listing
+-- Date: 2026-10-19
+-- Description: Composite indexes matching the default (payment_time, id) DESC sort
+-- of /api/payments/listing/ so each page is an index range scan instead of a full sort
+
+-- Default listing order and cursor predicate: (payment_time, id) < (%s, %s)
+CREATE INDEX IF NOT EXISTS idx_payments_time_id
+    ON public.payments (payment_time DESC, id DESC);
+
+-- Wallet filter keeps the same sort so wallet history pages stay index-ordered
+CREATE INDEX IF NOT EXISTS idx_payments_wallet_time_id
+    ON public.payments (wallet_id, payment_time DESC, id DESC);
+
+-- Display confirmation
+SELECT 'Migration completed: payments listing indexes created' AS status;
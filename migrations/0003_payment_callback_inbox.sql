@@ -0,0 +1,36 @@
+-- Migration: Append-only inbox for payment gateway callbacks
+-- Date: 2026-10-19
+-- Description: Gateway notifications (Momo, VNPay, ZaloPay, ...) are stored raw and
+-- acknowledged immediately; the process_payment_callbacks worker dedupes them by
+-- transaction_code and gateway and applies status transitions to payments in batches.
+-- A notification only completes a payment made with the gateway it was posted to.
+
+CREATE TABLE IF NOT EXISTS public.payment_callbacks
+(
+    id               bigint generated by default as identity primary key,
+    gateway          varchar(20)              not null,
+    transaction_code varchar(255)             not null,
+    status           varchar(20)              not null,
+    event_time       timestamp with time zone not null,
+    payload          jsonb                    not null,
+    received_at      timestamp with time zone not null default now(),
+    processed_at     timestamp with time zone,
+    result           varchar(20)
+);
+
+COMMENT ON TABLE public.payment_callbacks IS 'Append-only inbox of raw payment gateway notifications';
+COMMENT ON COLUMN public.payment_callbacks.result IS 'applied, duplicate, stale, ignored or unmatched once processed';
+
+-- Worker scans only the unprocessed tail in arrival order
+CREATE INDEX IF NOT EXISTS idx_payment_callbacks_unprocessed
+    ON public.payment_callbacks (id) WHERE processed_at IS NULL;
+
+CREATE INDEX IF NOT EXISTS idx_payment_callbacks_transaction_code
+    ON public.payment_callbacks (transaction_code);
+
+-- Batched transitions look payments up by transaction_code
+CREATE INDEX IF NOT EXISTS idx_payments_transaction_code
+    ON public.payments (transaction_code);
+
+-- Display confirmation
+SELECT 'Migration completed: payment_callbacks inbox created' AS status;
@@ -0,0 +1,28 @@
+-- Migration: Refund ledger for booking cancellations
+-- Date: 2026-10-19
+-- Description: Canceling a booking no longer deletes its payment. The booking is kept
+-- with status 'Canceled', the payment moves to 'Refunded' (or 'Canceled' if it was never
+-- paid) and each refunded payment gets a ledger entry in the same transaction.
+
+CREATE TABLE IF NOT EXISTS public.refunds
+(
+    id          bigint generated by default as identity primary key,
+    payment_id  uuid                     not null references public.payments (id),
+    booking_id  bigint                   not null references public.bookings (id),
+    amount      numeric(10, 2)           not null check (amount >= 0),
+    wallet_id   uuid,
+    status      varchar(10)              not null,
+    reason      varchar(255)             not null,
+    created_at  timestamp with time zone not null default now()
+);
+
+COMMENT ON TABLE public.refunds IS 'Append-only refund ledger written when bookings are canceled';
+COMMENT ON COLUMN public.refunds.status IS 'Credited when returned to a wallet, Pending when the gateway still has to pay out';
+
+-- A payment is refunded at most once
+CREATE UNIQUE INDEX IF NOT EXISTS idx_refunds_payment_id ON public.refunds (payment_id);
+CREATE INDEX IF NOT EXISTS idx_refunds_booking_id ON public.refunds (booking_id);
+CREATE INDEX IF NOT EXISTS idx_refunds_pending ON public.refunds (created_at) WHERE status = 'Pending';
+
+-- Display confirmation
+SELECT 'Migration completed: refunds ledger created' AS status;
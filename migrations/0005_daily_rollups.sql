@@ -0,0 +1,160 @@
+-- Migration: Pre-aggregated booking, trip and payment rollups
+-- Date: 2026-10-19
+-- Description: Rollup tables maintained incrementally by triggers on bookings and payments,
+-- so statistics read O(days) rows instead of scanning every booking.
+-- Every write subtracts the old row's contribution and adds the new row's, which covers
+-- inserts, status transitions, seat changes, bulk cancellations and deletes alike.
+-- Rebuild from scratch with: python manage.py backfill_rollups
+-- Dates are bucketed in the application time zone (settings.TIME_ZONE).
+
+CREATE TABLE IF NOT EXISTS public.booking_daily_stats
+(
+    stat_date          date           not null primary key,
+    total_bookings     integer        not null default 0,
+    pending_bookings   integer        not null default 0,
+    confirmed_bookings integer        not null default 0,
+    canceled_bookings  integer        not null default 0,
+    booked_seats       integer        not null default 0,
+    canceled_seats     integer        not null default 0,
+    booked_amount      numeric(14, 2) not null default 0
+);
+
+CREATE TABLE IF NOT EXISTS public.trip_booking_stats
+(
+    trip_id           bigint         not null primary key references public.trips (id) on delete cascade,
+    booked_seats      integer        not null default 0,
+    active_bookings   integer        not null default 0,
+    canceled_bookings integer        not null default 0,
+    canceled_seats    integer        not null default 0,
+    revenue           numeric(14, 2) not null default 0
+);
+
+CREATE TABLE IF NOT EXISTS public.payment_method_daily_stats
+(
+    stat_date          date           not null,
+    payment_method     varchar(20)    not null,
+    completed_payments integer        not null default 0,
+    revenue            numeric(14, 2) not null default 0,
+    refunded_payments  integer        not null default 0,
+    refunded_amount    numeric(14, 2) not null default 0,
+    primary key (stat_date, payment_method)
+);
+
+-- Per-route daily occupancy groups trip rollups by departure day
+CREATE INDEX IF NOT EXISTS idx_trips_departure_time_route
+    ON public.trips (departure_time, route_id);
+
+
+CREATE OR REPLACE FUNCTION rollup_apply_booking(b public.bookings, sign integer) RETURNS void AS $$
+DECLARE
+    is_canceled boolean := b.status = 'Canceled';
+BEGIN
+    INSERT INTO public.booking_daily_stats AS s
+        (stat_date, total_bookings, pending_bookings, confirmed_bookings, canceled_bookings,
+         booked_seats, canceled_seats, booked_amount)
+    VALUES (
+        (b.booking_time AT TIME ZONE 'Asia/Ho_Chi_Minh')::date,
+        sign,
+        sign * (b.status = 'Pending')::integer,
+        sign * (b.status = 'Confirmed')::integer,
+        sign * is_canceled::integer,
+        sign * CASE WHEN is_canceled THEN 0 ELSE b.number_of_seats END,
+        sign * CASE WHEN is_canceled THEN b.number_of_seats ELSE 0 END,
+        sign * CASE WHEN is_canceled THEN 0 ELSE b.total_amount END
+    )
+    ON CONFLICT (stat_date) DO UPDATE SET
+        total_bookings     = s.total_bookings + EXCLUDED.total_bookings,
+        pending_bookings   = s.pending_bookings + EXCLUDED.pending_bookings,
+        confirmed_bookings = s.confirmed_bookings + EXCLUDED.confirmed_bookings,
+        canceled_bookings  = s.canceled_bookings + EXCLUDED.canceled_bookings,
+        booked_seats       = s.booked_seats + EXCLUDED.booked_seats,
+        canceled_seats     = s.canceled_seats + EXCLUDED.canceled_seats,
+        booked_amount      = s.booked_amount + EXCLUDED.booked_amount;
+
+    INSERT INTO public.trip_booking_stats AS s
+        (trip_id, booked_seats, active_bookings, canceled_bookings, canceled_seats, revenue)
+    VALUES (
+        b.trip_id,
+        sign * CASE WHEN is_canceled THEN 0 ELSE b.number_of_seats END,
+        sign * (NOT is_canceled)::integer,
+        sign * is_canceled::integer,
+        sign * CASE WHEN is_canceled THEN b.number_of_seats ELSE 0 END,
+        sign * CASE WHEN is_canceled THEN 0 ELSE b.total_amount END
+    )
+    ON CONFLICT (trip_id) DO UPDATE SET
+        booked_seats      = s.booked_seats + EXCLUDED.booked_seats,
+        active_bookings   = s.active_bookings + EXCLUDED.active_bookings,
+        canceled_bookings = s.canceled_bookings + EXCLUDED.canceled_bookings,
+        canceled_seats    = s.canceled_seats + EXCLUDED.canceled_seats,
+        revenue           = s.revenue + EXCLUDED.revenue;
+END;
+$$ LANGUAGE plpgsql;
+
+
+CREATE OR REPLACE FUNCTION rollup_apply_payment(p public.payments, sign integer) RETURNS void AS $$
+DECLARE
+    -- Refunded payments were still received; their refund is tracked separately
+    is_received boolean := p.status IN ('Completed', 'Refunded');
+    is_refunded boolean := p.status = 'Refunded';
+BEGIN
+    IF NOT is_received THEN
+        RETURN;
+    END IF;
+
+    INSERT INTO public.payment_method_daily_stats AS s
+        (stat_date, payment_method, completed_payments, revenue, refunded_payments, refunded_amount)
+    VALUES (
+        (p.payment_time AT TIME ZONE 'Asia/Ho_Chi_Minh')::date,
+        p.payment_method,
+        sign,
+        sign * p.amount,
+        sign * is_refunded::integer,
+        sign * CASE WHEN is_refunded THEN p.amount ELSE 0 END
+    )
+    ON CONFLICT (stat_date, payment_method) DO UPDATE SET
+        completed_payments = s.completed_payments + EXCLUDED.completed_payments,
+        revenue            = s.revenue + EXCLUDED.revenue,
+        refunded_payments  = s.refunded_payments + EXCLUDED.refunded_payments,
+        refunded_amount    = s.refunded_amount + EXCLUDED.refunded_amount;
+END;
+$$ LANGUAGE plpgsql;
+
+
+CREATE OR REPLACE FUNCTION rollup_bookings_trigger() RETURNS trigger AS $$
+BEGIN
+    IF TG_OP IN ('UPDATE', 'DELETE') THEN
+        PERFORM rollup_apply_booking(OLD, -1);
+    END IF;
+    IF TG_OP IN ('INSERT', 'UPDATE') THEN
+        PERFORM rollup_apply_booking(NEW, 1);
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION rollup_payments_trigger() RETURNS trigger AS $$
+BEGIN
+    IF TG_OP IN ('UPDATE', 'DELETE') THEN
+        PERFORM rollup_apply_payment(OLD, -1);
+    END IF;
+    IF TG_OP IN ('INSERT', 'UPDATE') THEN
+        PERFORM rollup_apply_payment(NEW, 1);
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS trg_bookings_rollup ON public.bookings;
+CREATE TRIGGER trg_bookings_rollup
+    AFTER INSERT OR DELETE OR UPDATE OF status, number_of_seats, total_amount, trip_id, booking_time
+    ON public.bookings
+    FOR EACH ROW EXECUTE FUNCTION rollup_bookings_trigger();
+
+DROP TRIGGER IF EXISTS trg_payments_rollup ON public.payments;
+CREATE TRIGGER trg_payments_rollup
+    AFTER INSERT OR DELETE OR UPDATE OF status, amount, payment_method, payment_time
+    ON public.payments
+    FOR EACH ROW EXECUTE FUNCTION rollup_payments_trigger();
+
+-- Display confirmation
+SELECT 'Migration completed: rollup tables and triggers created (run backfill_rollups next)' AS status;
@@ -0,0 +1,16 @@
+-- Migration: Base fare for load-factor-based dynamic pricing
+-- Date: 2026-10-19
+-- Description: trips.base_price_per_seat keeps the fare set by admins; the reprice_trips
+-- job derives trips.price_per_seat from it using occupancy, days to departure and
+-- route demand, writing only changed prices in one bulk UPDATE.
+
+ALTER TABLE public.trips ADD COLUMN IF NOT EXISTS base_price_per_seat numeric(10, 2);
+
+UPDATE public.trips SET base_price_per_seat = price_per_seat WHERE base_price_per_seat IS NULL;
+
+ALTER TABLE public.trips ALTER COLUMN base_price_per_seat SET NOT NULL;
+
+COMMENT ON COLUMN public.trips.base_price_per_seat IS 'Admin-set fare; price_per_seat is the current dynamic fare derived from it';
+
+-- Display confirmation
+SELECT 'Migration completed: trips.base_price_per_seat added' AS status;
@@ -0,0 +1,11 @@
+-- Migration: Route/departure index for the fare calendar
+-- Date: 2026-10-19
+-- Description: The fare calendar aggregates one route's trips over a month; a
+-- (route_id, departure_time) index turns that into a single range scan, with
+-- bus_id and price_per_seat included so the trips heap is not visited.
+
+CREATE INDEX IF NOT EXISTS idx_trips_route_departure_time
+    ON public.trips (route_id, departure_time) INCLUDE (bus_id, price_per_seat);
+
+-- Display confirmation
+SELECT 'Migration completed: idx_trips_route_departure_time created' AS status;
@@ -0,0 +1,57 @@
+-- Migration: Trip change log for the in-memory connection graph
+-- Date: 2026-10-19
+-- Description: Every insert, delete or schedule change of a trip appends its id to
+-- trip_change_log, so each process's connection graph can patch just those trips
+-- instead of reloading the timetable. Route and location changes append a NULL
+-- trip_id, which tells the graph to rebuild. Entries older than a day are pruned
+-- by the graph on rebuild.
+
+CREATE TABLE IF NOT EXISTS public.trip_change_log
+(
+    id         bigint generated by default as identity primary key,
+    trip_id    bigint,
+    changed_at timestamp with time zone not null default now()
+);
+
+CREATE INDEX IF NOT EXISTS idx_trip_change_log_changed_at
+    ON public.trip_change_log (changed_at);
+
+
+CREATE OR REPLACE FUNCTION log_trip_change() RETURNS trigger AS $$
+BEGIN
+    IF TG_OP IN ('UPDATE', 'DELETE') THEN
+        INSERT INTO public.trip_change_log (trip_id) VALUES (OLD.id);
+    END IF;
+    IF TG_OP = 'INSERT' OR (TG_OP = 'UPDATE' AND NEW.id <> OLD.id) THEN
+        INSERT INTO public.trip_change_log (trip_id) VALUES (NEW.id);
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION log_network_change() RETURNS trigger AS $$
+BEGIN
+    INSERT INTO public.trip_change_log (trip_id) VALUES (NULL);
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Fare changes are not part of the graph, so price_per_seat updates are not logged
+DROP TRIGGER IF EXISTS trg_trips_change_log ON public.trips;
+CREATE TRIGGER trg_trips_change_log
+    AFTER INSERT OR DELETE OR UPDATE OF id, route_id, departure_time, arrival_time
+    ON public.trips
+    FOR EACH ROW EXECUTE FUNCTION log_trip_change();
+
+DROP TRIGGER IF EXISTS trg_routes_change_log ON public.routes;
+CREATE TRIGGER trg_routes_change_log
+    AFTER INSERT OR DELETE OR UPDATE ON public.routes
+    FOR EACH STATEMENT EXECUTE FUNCTION log_network_change();
+
+DROP TRIGGER IF EXISTS trg_locations_change_log ON public.locations;
+CREATE TRIGGER trg_locations_change_log
+    AFTER INSERT OR DELETE OR UPDATE ON public.locations
+    FOR EACH STATEMENT EXECUTE FUNCTION log_network_change();
+
+-- Display confirmation
+SELECT 'Migration completed: trip_change_log and triggers created' AS status;
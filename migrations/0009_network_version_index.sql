@@ -0,0 +1,11 @@
+-- Migration: Network version lookup for the location autocomplete index
+-- Date: 2026-10-19
+-- Description: The autocomplete index rebuilds when the newest route/location change
+-- (a NULL trip_id entry in trip_change_log) moves; this partial index makes that
+-- MAX(id) lookup a single index probe regardless of how many trip changes are logged.
+
+CREATE INDEX IF NOT EXISTS idx_trip_change_log_network
+    ON public.trip_change_log (id) WHERE trip_id IS NULL;
+
+-- Display confirmation
+SELECT 'Migration completed: idx_trip_change_log_network created' AS status;
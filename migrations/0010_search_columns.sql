@@ -0,0 +1,88 @@
+-- Migration: Normalized search columns for buses and locations
+-- Date: 2026-10-19
+-- Description: Adds lowercase, accent-stripped copies of location names/cities and bus
+-- models, plus license plates without separators ('29B-123.45' -> '29b12345').
+-- A BEFORE trigger keeps them current on every insert/update path, and trigram (or,
+-- where pg_trgm is unavailable, prefix) indexes serve Bus.search / Locations.search.
+-- search_normalize() mirrors utils.text_utils.normalize_text.
+
+CREATE OR REPLACE FUNCTION search_normalize(value text) RETURNS text AS $$
+    SELECT btrim(regexp_replace(
+        lower(translate(
+            normalize(value, NFC),
+            'àáạảãâầấậẩẫăằắặẳẵèéẹẻẽêềếệểễìíịỉĩòóọỏõôồốộổỗơờớợởỡùúụủũưừứựửữỳýỵỷỹđÀÁẠẢÃÂẦẤẬẨẪĂẰẮẶẲẴÈÉẸẺẼÊỀẾỆỂỄÌÍỊỈĨÒÓỌỎÕÔỒỐỘỔỖƠỜỚỢỞỠÙÚỤỦŨƯỪỨỰỬỮỲÝỴỶỸĐ',
+            'aaaaaaaaaaaaaaaaaeeeeeeeeeeeiiiiiooooooooooooooooouuuuuuuuuuuyyyyydaaaaaaaaaaaaaaaaaeeeeeeeeeeeiiiiiooooooooooooooooouuuuuuuuuuuyyyyyd'
+        )),
+        '[^0-9a-z]+', ' ', 'g'
+    ))
+$$ LANGUAGE sql IMMUTABLE STRICT;
+
+CREATE OR REPLACE FUNCTION plate_normalize(value text) RETURNS text AS $$
+    SELECT replace(search_normalize(value), ' ', '')
+$$ LANGUAGE sql IMMUTABLE STRICT;
+
+
+ALTER TABLE public.locations ADD COLUMN IF NOT EXISTS name_normalized varchar(255);
+ALTER TABLE public.locations ADD COLUMN IF NOT EXISTS city_normalized varchar(255);
+ALTER TABLE public.buses ADD COLUMN IF NOT EXISTS license_plate_normalized varchar(20);
+ALTER TABLE public.buses ADD COLUMN IF NOT EXISTS model_normalized varchar(255);
+
+CREATE OR REPLACE FUNCTION locations_normalize_trigger() RETURNS trigger AS $$
+BEGIN
+    NEW.name_normalized := search_normalize(NEW.name);
+    NEW.city_normalized := search_normalize(NEW.city);
+    RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION buses_normalize_trigger() RETURNS trigger AS $$
+BEGIN
+    NEW.license_plate_normalized := plate_normalize(NEW.license_plate);
+    NEW.model_normalized := search_normalize(NEW.model);
+    RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS trg_locations_normalize ON public.locations;
+CREATE TRIGGER trg_locations_normalize
+    BEFORE INSERT OR UPDATE OF name, city ON public.locations
+    FOR EACH ROW EXECUTE FUNCTION locations_normalize_trigger();
+
+DROP TRIGGER IF EXISTS trg_buses_normalize ON public.buses;
+CREATE TRIGGER trg_buses_normalize
+    BEFORE INSERT OR UPDATE OF license_plate, model ON public.buses
+    FOR EACH ROW EXECUTE FUNCTION buses_normalize_trigger();
+
+-- Backfill existing rows
+UPDATE public.locations
+SET name_normalized = search_normalize(name), city_normalized = search_normalize(city);
+UPDATE public.buses
+SET license_plate_normalized = plate_normalize(license_plate), model_normalized = search_normalize(model);
+
+-- Prefix lookups (exact plates, autocomplete-style queries)
+CREATE INDEX IF NOT EXISTS idx_buses_license_plate_normalized
+    ON public.buses (license_plate_normalized text_pattern_ops);
+CREATE INDEX IF NOT EXISTS idx_locations_name_normalized
+    ON public.locations (name_normalized text_pattern_ops);
+
+-- Substring lookups (LIKE '%x%') need pg_trgm; skip them where the contrib module is missing
+DO $$
+BEGIN
+    IF EXISTS (SELECT 1 FROM pg_available_extensions WHERE name = 'pg_trgm') THEN
+        CREATE EXTENSION IF NOT EXISTS pg_trgm;
+        CREATE INDEX IF NOT EXISTS idx_buses_license_plate_normalized_trgm
+            ON public.buses USING gin (license_plate_normalized gin_trgm_ops);
+        CREATE INDEX IF NOT EXISTS idx_buses_model_normalized_trgm
+            ON public.buses USING gin (model_normalized gin_trgm_ops);
+        CREATE INDEX IF NOT EXISTS idx_locations_name_normalized_trgm
+            ON public.locations USING gin (name_normalized gin_trgm_ops);
+        CREATE INDEX IF NOT EXISTS idx_locations_city_normalized_trgm
+            ON public.locations USING gin (city_normalized gin_trgm_ops);
+    ELSE
+        RAISE NOTICE 'pg_trgm is not available; substring searches fall back to sequential scans';
+    END IF;
+END;
+$$;
+
+-- Display confirmation
+SELECT 'Migration completed: normalized search columns for buses and locations' AS status;
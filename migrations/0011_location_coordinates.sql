@@ -0,0 +1,17 @@
+-- Migration: Geo coordinates for locations
+-- Date: 2026-10-19
+-- Description: WGS84 latitude/longitude for stations, used by the nearest-station
+-- lookup and to compute/validate routes.distance_km (python manage.py route_distances).
+-- Both are nullable until a station is geocoded, but must be set together.
+
+ALTER TABLE public.locations ADD COLUMN IF NOT EXISTS latitude double precision;
+ALTER TABLE public.locations ADD COLUMN IF NOT EXISTS longitude double precision;
+
+ALTER TABLE public.locations DROP CONSTRAINT IF EXISTS locations_coordinates_check;
+ALTER TABLE public.locations ADD CONSTRAINT locations_coordinates_check CHECK (
+    (latitude IS NULL AND longitude IS NULL)
+    OR (latitude BETWEEN -90 AND 90 AND longitude BETWEEN -180 AND 180)
+);
+
+-- Display confirmation
+SELECT 'Migration completed: locations.latitude/longitude added' AS status;
@@ -0,0 +1,40 @@
+-- Migration: Prevent a bus from being assigned to overlapping trips
+-- Date: 2026-10-19
+-- Description: Exclusion constraint over (bus, [departure_time, arrival_time)) backed by a
+-- GiST index. The bus id is wrapped in a single-value int8range so the constraint only
+-- needs core GiST range operators (no btree_gist extension). Trip.find_bus_conflicts
+-- uses the same expressions so its batch check is served by this index.
+-- Existing overlaps must be resolved first; the migration lists them and stops if any exist.
+
+ALTER TABLE public.trips DROP CONSTRAINT IF EXISTS trips_arrival_after_departure;
+ALTER TABLE public.trips ADD CONSTRAINT trips_arrival_after_departure
+    CHECK (arrival_time > departure_time);
+
+DO $$
+DECLARE
+    conflict_list text;
+BEGIN
+    SELECT string_agg(format('bus %s: trips %s and %s', bus_id, id, other_id), E'\n')
+    INTO conflict_list
+    FROM (
+        SELECT a.bus_id, a.id, b.id as other_id
+        FROM public.trips a
+        JOIN public.trips b ON a.bus_id = b.bus_id AND a.id < b.id
+         AND tstzrange(a.departure_time, a.arrival_time) && tstzrange(b.departure_time, b.arrival_time)
+        LIMIT 50
+    ) pairs;
+
+    IF conflict_list IS NOT NULL THEN
+        RAISE EXCEPTION E'Overlapping trips must be rescheduled before adding trips_bus_no_overlap:\n%', conflict_list;
+    END IF;
+END;
+$$;
+
+ALTER TABLE public.trips DROP CONSTRAINT IF EXISTS trips_bus_no_overlap;
+ALTER TABLE public.trips ADD CONSTRAINT trips_bus_no_overlap EXCLUDE USING gist (
+    int8range(bus_id, bus_id, '[]') WITH =,
+    tstzrange(departure_time, arrival_time) WITH &&
+);
+
+-- Display confirmation
+SELECT 'Migration completed: trips_bus_no_overlap exclusion constraint added' AS status;
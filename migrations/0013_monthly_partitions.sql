@@ -0,0 +1,484 @@
+-- Migration: Monthly range partitioning of trips, bookings and tickets
+-- Date: 2026-10-19
+-- Description: trips are partitioned by departure_time, bookings by booking_time and
+-- tickets by their trip's departure_time (new tickets.departure_time column), one
+-- partition per UTC calendar month plus a DEFAULT partition as a safety net.
+-- create_monthly_partition() is used here and by `manage.py manage_partitions`, which
+-- creates upcoming months and detaches/archives old ones.
+--
+-- PostgreSQL requires the partition key in every primary key / unique constraint of a
+-- partitioned table, so the primary keys become (id, <partition key>) and foreign keys
+-- pointing at these tables are replaced by triggers with the same semantics:
+--   * inserts/updates must reference an existing trip / booking (row is key-share locked)
+--   * deleting a referenced trip or booking fails at commit (deferred, like the old FKs);
+--     rows moved between partitions by an UPDATE are not treated as deleted
+--   * payments and trip_booking_stats rows still go away with their booking / trip
+-- Exclusion constraints cannot span partitions, so trips_bus_no_overlap is created on
+-- every trips partition and a trigger checks the neighbouring months for trips that
+-- cross a month boundary (trips are assumed to last less than a month).
+-- Lookups by id alone (Trip.get_by_id, Booking.get_by_id) cannot prune partitions and
+-- probe the primary key index of every attached month; manage_partitions detaching old
+-- months keeps that number small.
+--
+-- Apply after 0004_refund_ledger, 0005_daily_rollups, 0008_trip_change_log and
+-- 0012_trip_bus_overlap_constraint, whose tables and constraints are rebuilt here.
+
+BEGIN;
+
+-- ============================================
+-- Tickets carry their trip's departure time
+-- ============================================
+
+ALTER TABLE public.tickets ADD COLUMN IF NOT EXISTS departure_time timestamp with time zone;
+
+UPDATE public.tickets tk
+SET departure_time = t.departure_time
+FROM public.trips t
+WHERE t.id = tk.trip_id AND tk.departure_time IS DISTINCT FROM t.departure_time;
+
+ALTER TABLE public.tickets ALTER COLUMN departure_time SET NOT NULL;
+
+-- ============================================
+-- Partition maintenance
+-- ============================================
+
+CREATE OR REPLACE FUNCTION public.add_trip_overlap_constraint(partition_name text)
+RETURNS void AS $$
+BEGIN
+    EXECUTE format(
+        'ALTER TABLE public.%I ADD CONSTRAINT %I EXCLUDE USING gist '
+        '(int8range(bus_id, bus_id, ''[]'') WITH =, tstzrange(departure_time, arrival_time) WITH &&)',
+        partition_name, partition_name || '_bus_no_overlap'
+    );
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION public.create_monthly_partition(parent text, month date)
+RETURNS text AS $$
+DECLARE
+    key_column text := CASE parent
+        WHEN 'trips' THEN 'departure_time'
+        WHEN 'bookings' THEN 'booking_time'
+        WHEN 'tickets' THEN 'departure_time'
+    END;
+    month_start timestamptz := date_trunc('month', month)::timestamp AT TIME ZONE 'UTC';
+    month_end timestamptz := (date_trunc('month', month) + interval '1 month')::timestamp AT TIME ZONE 'UTC';
+    partition_name text := format('%s_p%s', parent, to_char(month, 'YYYYMM'));
+    default_name text := parent || '_default';
+    in_default boolean := false;
+BEGIN
+    IF key_column IS NULL THEN
+        RAISE EXCEPTION 'Table % is not partitioned by month', parent;
+    END IF;
+    IF to_regclass('public.' || partition_name) IS NOT NULL THEN
+        RETURN NULL;
+    END IF;
+
+    IF to_regclass('public.' || default_name) IS NOT NULL THEN
+        EXECUTE format('SELECT EXISTS (SELECT 1 FROM public.%I WHERE %I >= $1 AND %I < $2)',
+                       default_name, key_column, key_column)
+        INTO in_default USING month_start, month_end;
+    END IF;
+
+    IF in_default THEN
+        -- Rows of this month already landed in the DEFAULT partition: move them into a
+        -- standalone table and attach it, so no row triggers fire for the move
+        EXECUTE format('ALTER TABLE public.%I DETACH PARTITION public.%I', parent, default_name);
+        EXECUTE format('CREATE TABLE public.%I (LIKE public.%I INCLUDING DEFAULTS INCLUDING CONSTRAINTS)',
+                       partition_name, parent);
+        EXECUTE format(
+            'WITH moved AS (DELETE FROM public.%I WHERE %I >= $1 AND %I < $2 RETURNING *) '
+            'INSERT INTO public.%I SELECT * FROM moved',
+            default_name, key_column, key_column, partition_name
+        ) USING month_start, month_end;
+        EXECUTE format('ALTER TABLE public.%I ATTACH PARTITION public.%I FOR VALUES FROM (%L) TO (%L)',
+                       parent, partition_name, month_start, month_end);
+        EXECUTE format('ALTER TABLE public.%I ATTACH PARTITION public.%I DEFAULT', parent, default_name);
+    ELSE
+        EXECUTE format('CREATE TABLE public.%I PARTITION OF public.%I FOR VALUES FROM (%L) TO (%L)',
+                       partition_name, parent, month_start, month_end);
+    END IF;
+
+    IF parent = 'trips' THEN
+        PERFORM public.add_trip_overlap_constraint(partition_name);
+    END IF;
+    RETURN partition_name;
+END;
+$$ LANGUAGE plpgsql;
+
+-- ============================================
+-- Convert the tables
+-- ============================================
+
+-- Foreign keys into trips, bookings and tickets cannot survive the conversion
+DO $$
+DECLARE
+    fk record;
+BEGIN
+    FOR fk IN
+        SELECT conrelid::regclass AS table_name, conname
+        FROM pg_constraint
+        WHERE contype = 'f'
+          AND confrelid IN (SELECT c.oid FROM pg_class c
+                            WHERE c.relnamespace = 'public'::regnamespace
+                              AND c.relname IN ('trips', 'bookings', 'tickets')
+                              AND c.relkind = 'r')
+    LOOP
+        EXECUTE format('ALTER TABLE %s DROP CONSTRAINT %I', fk.table_name, fk.conname);
+    END LOOP;
+END $$;
+
+CREATE OR REPLACE FUNCTION pg_temp.partition_by_month(parent text, key_column text)
+RETURNS void AS $$
+DECLARE
+    legacy text := parent || '_unpartitioned';
+    first_month date;
+    last_month date;
+    month date;
+    sequence_name text;
+BEGIN
+    IF (SELECT relkind FROM pg_class WHERE oid = ('public.' || parent)::regclass) = 'p' THEN
+        RETURN;
+    END IF;
+
+    EXECUTE format('ALTER TABLE public.%I RENAME TO %I', parent, legacy);
+    EXECUTE format(
+        'CREATE TABLE public.%I (LIKE public.%I INCLUDING DEFAULTS INCLUDING IDENTITY '
+        'INCLUDING CONSTRAINTS INCLUDING COMMENTS) PARTITION BY RANGE (%I)',
+        parent, legacy, key_column
+    );
+    EXECUTE format('CREATE TABLE public.%I PARTITION OF public.%I DEFAULT', parent || '_default', parent);
+    IF parent = 'trips' THEN
+        PERFORM public.add_trip_overlap_constraint('trips_default');
+    END IF;
+
+    -- Every month with data, through three months ahead
+    EXECUTE format('SELECT date_trunc(''month'', MIN(%I) AT TIME ZONE ''UTC'')::date, '
+                   'date_trunc(''month'', MAX(%I) AT TIME ZONE ''UTC'')::date FROM public.%I',
+                   key_column, key_column, legacy)
+    INTO first_month, last_month;
+    month := LEAST(COALESCE(first_month, CURRENT_DATE), CURRENT_DATE);
+    month := date_trunc('month', month)::date;
+    last_month := GREATEST(COALESCE(last_month, CURRENT_DATE), CURRENT_DATE + interval '3 months')::date;
+    WHILE month <= last_month LOOP
+        PERFORM public.create_monthly_partition(parent, month);
+        month := (month + interval '1 month')::date;
+    END LOOP;
+
+    EXECUTE format('INSERT INTO public.%I SELECT * FROM public.%I', parent, legacy);
+    EXECUTE format('DROP TABLE public.%I', legacy);
+
+    sequence_name := pg_get_serial_sequence('public.' || parent, 'id');
+    EXECUTE format('ALTER SEQUENCE %s RENAME TO %I', sequence_name, parent || '_id_seq');
+    EXECUTE format('SELECT setval(%L, COALESCE((SELECT MAX(id) FROM public.%I), 0) + 1, false)',
+                   'public.' || parent || '_id_seq', parent);
+END;
+$$ LANGUAGE plpgsql;
+
+-- rollup_apply_booking takes a bookings row; it is recreated for the new table below
+DROP FUNCTION IF EXISTS rollup_apply_booking(public.bookings, integer);
+
+SELECT pg_temp.partition_by_month('trips', 'departure_time');
+SELECT pg_temp.partition_by_month('bookings', 'booking_time');
+SELECT pg_temp.partition_by_month('tickets', 'departure_time');
+
+-- Keys, indexes and outgoing foreign keys (indexes cascade to every partition)
+ALTER TABLE public.trips DROP CONSTRAINT IF EXISTS trips_pkey;
+ALTER TABLE public.trips ADD CONSTRAINT trips_pkey PRIMARY KEY (id, departure_time);
+CREATE INDEX IF NOT EXISTS trips_bus_id_0f292d2d ON public.trips (bus_id);
+CREATE INDEX IF NOT EXISTS trips_route_id_715fed1b ON public.trips (route_id);
+CREATE INDEX IF NOT EXISTS idx_trips_departure_time_route ON public.trips (departure_time, route_id);
+CREATE INDEX IF NOT EXISTS idx_trips_route_departure_time
+    ON public.trips (route_id, departure_time) INCLUDE (bus_id, price_per_seat);
+ALTER TABLE public.trips DROP CONSTRAINT IF EXISTS trips_bus_id_0f292d2d_fk_buses_id;
+ALTER TABLE public.trips ADD CONSTRAINT trips_bus_id_0f292d2d_fk_buses_id
+    FOREIGN KEY (bus_id) REFERENCES public.buses DEFERRABLE INITIALLY DEFERRED;
+ALTER TABLE public.trips DROP CONSTRAINT IF EXISTS trips_route_id_715fed1b_fk_routes_id;
+ALTER TABLE public.trips ADD CONSTRAINT trips_route_id_715fed1b_fk_routes_id
+    FOREIGN KEY (route_id) REFERENCES public.routes DEFERRABLE INITIALLY DEFERRED;
+
+ALTER TABLE public.bookings DROP CONSTRAINT IF EXISTS bookings_pkey;
+ALTER TABLE public.bookings ADD CONSTRAINT bookings_pkey PRIMARY KEY (id, booking_time);
+CREATE INDEX IF NOT EXISTS bookings_trip_id_89bc46e9 ON public.bookings (trip_id);
+CREATE INDEX IF NOT EXISTS bookings_user_id_6e734b08 ON public.bookings (user_id);
+ALTER TABLE public.bookings DROP CONSTRAINT IF EXISTS bookings_user_id_6e734b08_fk_users_id;
+ALTER TABLE public.bookings ADD CONSTRAINT bookings_user_id_6e734b08_fk_users_id
+    FOREIGN KEY (user_id) REFERENCES public.users DEFERRABLE INITIALLY DEFERRED;
+
+ALTER TABLE public.tickets DROP CONSTRAINT IF EXISTS tickets_pkey;
+ALTER TABLE public.tickets ADD CONSTRAINT tickets_pkey PRIMARY KEY (id, departure_time);
+ALTER TABLE public.tickets DROP CONSTRAINT IF EXISTS tickets_trip_id_seat_id_a241093c_uniq;
+ALTER TABLE public.tickets ADD CONSTRAINT tickets_trip_id_seat_id_a241093c_uniq
+    UNIQUE (trip_id, seat_id, departure_time);
+CREATE INDEX IF NOT EXISTS tickets_booking_id_d9ce02d0 ON public.tickets (booking_id);
+CREATE INDEX IF NOT EXISTS tickets_seat_id_e8dc5a36 ON public.tickets (seat_id);
+CREATE INDEX IF NOT EXISTS tickets_trip_id_b68c10e7 ON public.tickets (trip_id);
+ALTER TABLE public.tickets DROP CONSTRAINT IF EXISTS tickets_seat_id_e8dc5a36_fk_seats_id;
+ALTER TABLE public.tickets ADD CONSTRAINT tickets_seat_id_e8dc5a36_fk_seats_id
+    FOREIGN KEY (seat_id) REFERENCES public.seats DEFERRABLE INITIALLY DEFERRED;
+
+-- ============================================
+-- Existing triggers (dropped with the old tables)
+-- ============================================
+
+DROP TRIGGER IF EXISTS trg_trips_change_log ON public.trips;
+CREATE TRIGGER trg_trips_change_log
+    AFTER INSERT OR DELETE OR UPDATE OF id, route_id, departure_time, arrival_time ON public.trips
+    FOR EACH ROW EXECUTE FUNCTION log_trip_change();
+
+CREATE OR REPLACE FUNCTION rollup_apply_booking(b public.bookings, sign integer) RETURNS void AS $$
+DECLARE
+    is_canceled boolean := b.status = 'Canceled';
+BEGIN
+    INSERT INTO public.booking_daily_stats AS s
+        (stat_date, total_bookings, pending_bookings, confirmed_bookings, canceled_bookings,
+         booked_seats, canceled_seats, booked_amount)
+    VALUES (
+        (b.booking_time AT TIME ZONE 'Asia/Ho_Chi_Minh')::date,
+        sign,
+        sign * (b.status = 'Pending')::integer,
+        sign * (b.status = 'Confirmed')::integer,
+        sign * is_canceled::integer,
+        sign * CASE WHEN is_canceled THEN 0 ELSE b.number_of_seats END,
+        sign * CASE WHEN is_canceled THEN b.number_of_seats ELSE 0 END,
+        sign * CASE WHEN is_canceled THEN 0 ELSE b.total_amount END
+    )
+    ON CONFLICT (stat_date) DO UPDATE SET
+        total_bookings     = s.total_bookings + EXCLUDED.total_bookings,
+        pending_bookings   = s.pending_bookings + EXCLUDED.pending_bookings,
+        confirmed_bookings = s.confirmed_bookings + EXCLUDED.confirmed_bookings,
+        canceled_bookings  = s.canceled_bookings + EXCLUDED.canceled_bookings,
+        booked_seats       = s.booked_seats + EXCLUDED.booked_seats,
+        canceled_seats     = s.canceled_seats + EXCLUDED.canceled_seats,
+        booked_amount      = s.booked_amount + EXCLUDED.booked_amount;
+
+    INSERT INTO public.trip_booking_stats AS s
+        (trip_id, booked_seats, active_bookings, canceled_bookings, canceled_seats, revenue)
+    VALUES (
+        b.trip_id,
+        sign * CASE WHEN is_canceled THEN 0 ELSE b.number_of_seats END,
+        sign * (NOT is_canceled)::integer,
+        sign * is_canceled::integer,
+        sign * CASE WHEN is_canceled THEN b.number_of_seats ELSE 0 END,
+        sign * CASE WHEN is_canceled THEN 0 ELSE b.total_amount END
+    )
+    ON CONFLICT (trip_id) DO UPDATE SET
+        booked_seats      = s.booked_seats + EXCLUDED.booked_seats,
+        active_bookings   = s.active_bookings + EXCLUDED.active_bookings,
+        canceled_bookings = s.canceled_bookings + EXCLUDED.canceled_bookings,
+        canceled_seats    = s.canceled_seats + EXCLUDED.canceled_seats,
+        revenue           = s.revenue + EXCLUDED.revenue;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS trg_bookings_rollup ON public.bookings;
+CREATE TRIGGER trg_bookings_rollup
+    AFTER INSERT OR DELETE OR UPDATE OF status, number_of_seats, total_amount, trip_id, booking_time
+    ON public.bookings
+    FOR EACH ROW EXECUTE FUNCTION rollup_bookings_trigger();
+
+-- ============================================
+-- Referential integrity triggers
+-- ============================================
+
+CREATE OR REPLACE FUNCTION public.check_trip_reference() RETURNS trigger AS $$
+BEGIN
+    PERFORM 1 FROM public.trips WHERE id = NEW.trip_id FOR KEY SHARE;
+    IF NOT FOUND THEN
+        RAISE EXCEPTION 'insert or update on table "%" violates foreign key: trip % does not exist',
+            TG_TABLE_NAME, NEW.trip_id USING ERRCODE = 'foreign_key_violation';
+    END IF;
+    RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION public.check_booking_reference() RETURNS trigger AS $$
+BEGIN
+    PERFORM 1 FROM public.bookings WHERE id = NEW.booking_id FOR KEY SHARE;
+    IF NOT FOUND THEN
+        RAISE EXCEPTION 'insert or update on table "%" violates foreign key: booking % does not exist',
+            TG_TABLE_NAME, NEW.booking_id USING ERRCODE = 'foreign_key_violation';
+    END IF;
+    RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+-- A ticket's departure_time must be its trip's (it decides the ticket's partition)
+CREATE OR REPLACE FUNCTION public.check_ticket_trip() RETURNS trigger AS $$
+BEGIN
+    PERFORM 1 FROM public.trips
+    WHERE id = NEW.trip_id AND departure_time = NEW.departure_time
+    FOR KEY SHARE;
+    IF NOT FOUND THEN
+        RAISE EXCEPTION 'ticket for trip % must carry the trip''s departure_time', NEW.trip_id
+            USING ERRCODE = 'foreign_key_violation';
+    END IF;
+    RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS trg_bookings_trip_ref ON public.bookings;
+CREATE TRIGGER trg_bookings_trip_ref
+    BEFORE INSERT OR UPDATE OF trip_id ON public.bookings
+    FOR EACH ROW EXECUTE FUNCTION check_trip_reference();
+
+DROP TRIGGER IF EXISTS trg_tickets_trip_ref ON public.tickets;
+CREATE TRIGGER trg_tickets_trip_ref
+    BEFORE INSERT OR UPDATE OF trip_id, departure_time ON public.tickets
+    FOR EACH ROW EXECUTE FUNCTION check_ticket_trip();
+
+DROP TRIGGER IF EXISTS trg_tickets_booking_ref ON public.tickets;
+CREATE TRIGGER trg_tickets_booking_ref
+    BEFORE INSERT OR UPDATE OF booking_id ON public.tickets
+    FOR EACH ROW EXECUTE FUNCTION check_booking_reference();
+
+DROP TRIGGER IF EXISTS trg_payments_booking_ref ON public.payments;
+CREATE TRIGGER trg_payments_booking_ref
+    BEFORE INSERT OR UPDATE OF booking_id ON public.payments
+    FOR EACH ROW EXECUTE FUNCTION check_booking_reference();
+
+DROP TRIGGER IF EXISTS trg_refunds_booking_ref ON public.refunds;
+CREATE TRIGGER trg_refunds_booking_ref
+    BEFORE INSERT OR UPDATE OF booking_id ON public.refunds
+    FOR EACH ROW EXECUTE FUNCTION check_booking_reference();
+
+-- Deleted trips: still referenced -> error at commit; otherwise drop the rollup row.
+-- A trip moved to another partition fires DELETE triggers too, hence the re-check by id.
+CREATE OR REPLACE FUNCTION public.restrict_trip_delete() RETURNS trigger AS $$
+BEGIN
+    IF NOT EXISTS (SELECT 1 FROM public.trips WHERE id = OLD.id)
+       AND (EXISTS (SELECT 1 FROM public.bookings WHERE trip_id = OLD.id)
+            OR EXISTS (SELECT 1 FROM public.tickets WHERE trip_id = OLD.id)) THEN
+        RAISE EXCEPTION 'delete on table "trips" violates foreign key: trip % is still referenced', OLD.id
+            USING ERRCODE = 'foreign_key_violation';
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION public.cascade_trip_delete() RETURNS trigger AS $$
+BEGIN
+    IF NOT EXISTS (SELECT 1 FROM public.trips WHERE id = OLD.id) THEN
+        DELETE FROM public.trip_booking_stats WHERE trip_id = OLD.id;
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS trg_trips_restrict_delete ON public.trips;
+CREATE CONSTRAINT TRIGGER trg_trips_restrict_delete
+    AFTER DELETE ON public.trips
+    DEFERRABLE INITIALLY DEFERRED
+    FOR EACH ROW EXECUTE FUNCTION restrict_trip_delete();
+
+DROP TRIGGER IF EXISTS trg_trips_cascade_delete ON public.trips;
+CREATE TRIGGER trg_trips_cascade_delete
+    AFTER DELETE ON public.trips
+    FOR EACH ROW EXECUTE FUNCTION cascade_trip_delete();
+
+CREATE OR REPLACE FUNCTION public.restrict_booking_delete() RETURNS trigger AS $$
+BEGIN
+    IF NOT EXISTS (SELECT 1 FROM public.bookings WHERE id = OLD.id)
+       AND (EXISTS (SELECT 1 FROM public.tickets WHERE booking_id = OLD.id)
+            OR EXISTS (SELECT 1 FROM public.refunds WHERE booking_id = OLD.id)) THEN
+        RAISE EXCEPTION 'delete on table "bookings" violates foreign key: booking % is still referenced', OLD.id
+            USING ERRCODE = 'foreign_key_violation';
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION public.cascade_booking_delete() RETURNS trigger AS $$
+BEGIN
+    IF NOT EXISTS (SELECT 1 FROM public.bookings WHERE id = OLD.id) THEN
+        DELETE FROM public.payments WHERE booking_id = OLD.id;
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS trg_bookings_restrict_delete ON public.bookings;
+CREATE CONSTRAINT TRIGGER trg_bookings_restrict_delete
+    AFTER DELETE ON public.bookings
+    DEFERRABLE INITIALLY DEFERRED
+    FOR EACH ROW EXECUTE FUNCTION restrict_booking_delete();
+
+DROP TRIGGER IF EXISTS trg_bookings_cascade_delete ON public.bookings;
+CREATE TRIGGER trg_bookings_cascade_delete
+    AFTER DELETE ON public.bookings
+    FOR EACH ROW EXECUTE FUNCTION cascade_booking_delete();
+
+-- ============================================
+-- Bus overlaps across partitions
+-- ============================================
+
+-- Each trips partition has its own trips_bus_no_overlap constraint; a clash across
+-- partitions needs one trip crossing a month boundary, so each written trip is checked
+-- against trips of the same bus departing in another month, at most a month earlier.
+-- Runs once per statement; per-bus advisory locks (taken in bus order) serialize
+-- concurrent writers of the same bus.
+CREATE OR REPLACE FUNCTION public.check_bus_overlap_across_months() RETURNS trigger AS $$
+DECLARE
+    ids bigint[];
+    buses bigint[];
+    departures timestamptz[];
+    arrivals timestamptz[];
+    clash record;
+BEGIN
+    IF TG_OP = 'INSERT' THEN
+        SELECT array_agg(id), array_agg(bus_id), array_agg(departure_time), array_agg(arrival_time)
+        INTO ids, buses, departures, arrivals
+        FROM new_trips;
+    ELSE
+        SELECT array_agg(n.id), array_agg(n.bus_id), array_agg(n.departure_time), array_agg(n.arrival_time)
+        INTO ids, buses, departures, arrivals
+        FROM new_trips n
+        JOIN old_trips o ON o.id = n.id
+        WHERE (n.bus_id, n.departure_time, n.arrival_time)
+              IS DISTINCT FROM (o.bus_id, o.departure_time, o.arrival_time);
+    END IF;
+    IF ids IS NULL THEN
+        RETURN NULL;
+    END IF;
+
+    PERFORM pg_advisory_xact_lock(hashtext('trips_bus_no_overlap'), bus_id::integer)
+    FROM (SELECT DISTINCT bus_id FROM unnest(buses) AS b(bus_id) ORDER BY bus_id) locked;
+
+    SELECT c.id, t.id AS other_id, c.bus_id INTO clash
+    FROM unnest(ids, buses, departures, arrivals) AS c(id, bus_id, departure_time, arrival_time)
+    JOIN public.trips t
+      ON int8range(t.bus_id, t.bus_id, '[]') = int8range(c.bus_id, c.bus_id, '[]')
+     AND tstzrange(t.departure_time, t.arrival_time) && tstzrange(c.departure_time, c.arrival_time)
+     AND t.departure_time >= c.departure_time - interval '1 month'
+     AND t.departure_time < c.arrival_time
+     AND date_trunc('month', t.departure_time AT TIME ZONE 'UTC')
+         <> date_trunc('month', c.departure_time AT TIME ZONE 'UTC')
+     AND t.id <> c.id
+    LIMIT 1;
+    IF FOUND THEN
+        RAISE EXCEPTION 'trip % overlaps trip % on bus %', clash.id, clash.other_id, clash.bus_id
+            USING ERRCODE = 'exclusion_violation', CONSTRAINT = 'trips_bus_no_overlap';
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS trg_trips_bus_overlap_insert ON public.trips;
+CREATE TRIGGER trg_trips_bus_overlap_insert
+    AFTER INSERT ON public.trips
+    REFERENCING NEW TABLE AS new_trips
+    FOR EACH STATEMENT EXECUTE FUNCTION check_bus_overlap_across_months();
+
+DROP TRIGGER IF EXISTS trg_trips_bus_overlap_update ON public.trips;
+CREATE TRIGGER trg_trips_bus_overlap_update
+    AFTER UPDATE ON public.trips
+    REFERENCING OLD TABLE AS old_trips NEW TABLE AS new_trips
+    FOR EACH STATEMENT EXECUTE FUNCTION check_bus_overlap_across_months();
+
+COMMIT;
+
+ANALYZE public.trips;
+ANALYZE public.bookings;
+ANALYZE public.tickets;
+
+SELECT 'Migration completed: monthly partitions for trips, bookings and tickets' AS status;
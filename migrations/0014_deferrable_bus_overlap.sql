@@ -0,0 +1,41 @@
+-- Migration: Check trips_bus_no_overlap at the end of each statement
+-- Date: 2026-10-19
+-- Description: A non-deferrable exclusion constraint is checked row by row, so a single
+-- UPDATE that swaps buses between trips fails half-way even though the final state is
+-- valid. Recreating the per-partition constraints as DEFERRABLE INITIALLY IMMEDIATE
+-- moves the check to the end of the statement (still before the statement returns),
+-- which lets the fleet assignment write its whole plan with one UPDATE.
+-- Apply after 0013_monthly_partitions, which creates the partitions and this function.
+
+CREATE OR REPLACE FUNCTION public.add_trip_overlap_constraint(partition_name text)
+RETURNS void AS $$
+BEGIN
+    EXECUTE format(
+        'ALTER TABLE public.%I ADD CONSTRAINT %I EXCLUDE USING gist '
+        '(int8range(bus_id, bus_id, ''[]'') WITH =, tstzrange(departure_time, arrival_time) WITH &&) '
+        'DEFERRABLE INITIALLY IMMEDIATE',
+        partition_name, partition_name || '_bus_no_overlap'
+    );
+END;
+$$ LANGUAGE plpgsql;
+
+DO $$
+DECLARE
+    part record;
+BEGIN
+    FOR part IN
+        SELECT c.relname
+        FROM pg_inherits i
+        JOIN pg_class c ON c.oid = i.inhrelid
+        WHERE i.inhparent = 'public.trips'::regclass
+          AND NOT EXISTS (SELECT 1 FROM pg_constraint
+                          WHERE conrelid = c.oid AND conname = c.relname || '_bus_no_overlap'
+                            AND condeferrable)
+    LOOP
+        EXECUTE format('ALTER TABLE public.%I DROP CONSTRAINT IF EXISTS %I',
+                       part.relname, part.relname || '_bus_no_overlap');
+        PERFORM public.add_trip_overlap_constraint(part.relname);
+    END LOOP;
+END $$;
+
+SELECT 'Migration completed: trips_bus_no_overlap is deferrable' AS status;
@@ -0,0 +1,17 @@
+-- Migration: Multi-trip journeys
+-- Date: 2026-10-19
+-- Description: A journey (e.g. outbound + return) is several bookings created in one
+-- transaction and paid with one payment. Its legs share bookings.journey_id, taken from
+-- booking_journey_id_seq; the combined payment is recorded against the lead (first) leg,
+-- and cancelling any leg cancels the whole journey.
+
+CREATE SEQUENCE IF NOT EXISTS public.booking_journey_id_seq;
+
+ALTER TABLE public.bookings
+    ADD COLUMN IF NOT EXISTS journey_id bigint;
+
+CREATE INDEX IF NOT EXISTS idx_bookings_journey_id
+    ON public.bookings (journey_id)
+    WHERE journey_id IS NOT NULL;
+
+SELECT 'Migration completed: bookings.journey_id added' AS status;
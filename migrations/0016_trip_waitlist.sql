@@ -0,0 +1,54 @@
+-- Migration: Waitlist for sold-out trips and notification outbox
+-- Date: 2026-10-19
+-- Description: Customers queue for seats on a sold-out trip instead of polling it.
+-- When a cancellation frees seats, the earliest waiters (FIFO) are promoted to a
+-- time-limited hold in the same transaction: held seats are not offered to anyone
+-- else until the hold is booked or expires. Each promotion writes a row to
+-- notification_outbox in that transaction; process_waitlist delivers the outbox,
+-- expires stale holds and promotes the next waiters.
+
+CREATE TABLE IF NOT EXISTS public.trip_waitlist
+(
+    id              bigint generated by default as identity primary key,
+    trip_id         bigint                   not null,
+    user_id         bigint                   not null,
+    number_of_seats integer                  not null check (number_of_seats > 0),
+    status          varchar(10)              not null default 'Waiting',
+    joined_at       timestamp with time zone not null default now(),
+    hold_expires_at timestamp with time zone,
+    booking_id      bigint
+);
+
+COMMENT ON COLUMN public.trip_waitlist.status IS 'Waiting, Held, Booked, Expired or Left';
+
+-- One open entry per customer and trip
+CREATE UNIQUE INDEX IF NOT EXISTS idx_trip_waitlist_open
+    ON public.trip_waitlist (trip_id, user_id) WHERE status IN ('Waiting', 'Held');
+
+-- FIFO promotion reads the queue head of a trip
+CREATE INDEX IF NOT EXISTS idx_trip_waitlist_waiting
+    ON public.trip_waitlist (trip_id, id) WHERE status = 'Waiting';
+
+-- Availability subtracts live holds; the worker finds expired ones
+CREATE INDEX IF NOT EXISTS idx_trip_waitlist_held
+    ON public.trip_waitlist (hold_expires_at, trip_id) WHERE status = 'Held';
+
+CREATE TABLE IF NOT EXISTS public.notification_outbox
+(
+    id         bigint generated by default as identity primary key,
+    user_id    bigint                   not null,
+    kind       varchar(30)              not null,
+    payload    jsonb                    not null,
+    created_at timestamp with time zone not null default now(),
+    sent_at    timestamp with time zone,
+    attempts   integer                  not null default 0,
+    last_error text
+);
+
+COMMENT ON TABLE public.notification_outbox IS 'Notifications written with the change that caused them, delivered by process_waitlist';
+
+CREATE INDEX IF NOT EXISTS idx_notification_outbox_unsent
+    ON public.notification_outbox (id) WHERE sent_at IS NULL;
+
+-- Display confirmation
+SELECT 'Migration completed: trip_waitlist and notification_outbox created' AS status;
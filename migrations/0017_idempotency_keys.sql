@@ -0,0 +1,35 @@
+-- Migration: Idempotency keys for booking and payment creation
+-- Date: 2026-10-19
+-- Description: Clients send an Idempotency-Key header when creating bookings and
+-- payments. The first response for a key (per endpoint and caller) is stored with a
+-- fingerprint of the request and replayed for retries until it expires, so a retried
+-- request repeats no writes. Concurrent duplicates wait on a session advisory lock
+-- taken by the in-flight request (see utils/idempotency.py).
+
+CREATE TABLE IF NOT EXISTS public.idempotency_keys
+(
+    scope          varchar(150)             not null,
+    key            varchar(255)             not null,
+    fingerprint    char(64)                 not null,
+    status_code    integer                  not null,
+    content_type   varchar(100)             not null,
+    body           bytea                    not null,
+    session_writes jsonb,
+    created_at     timestamp with time zone not null default now(),
+    expires_at     timestamp with time zone not null,
+    primary key (scope, key)
+);
+
+COMMENT ON COLUMN public.idempotency_keys.scope IS 'Endpoint and caller (user id or session) the key belongs to';
+COMMENT ON COLUMN public.idempotency_keys.fingerprint IS 'SHA-256 of method, path and body of the original request';
+
+-- Databases created before session_writes was added
+ALTER TABLE public.idempotency_keys ADD COLUMN IF NOT EXISTS session_writes jsonb;
+
+COMMENT ON COLUMN public.idempotency_keys.session_writes IS 'Session values the original request set (guest booking and payment ids), restored on replay';
+
+CREATE INDEX IF NOT EXISTS idx_idempotency_keys_expires_at
+    ON public.idempotency_keys (expires_at);
+
+-- Display confirmation
+SELECT 'Migration completed: idempotency_keys created' AS status;
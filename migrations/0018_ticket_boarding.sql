@@ -0,0 +1,37 @@
+-- Migration: Boarding scans and ticket revocations for signed ticket codes
+-- Date: 2026-10-19
+-- Description: Tickets carry an HMAC-signed code (see bookings/ticket_codes.py) that is
+-- checked at boarding without reading the ticket. The check-in endpoint writes the
+-- accepted scans of each request here in one statement; the first scan of a ticket wins.
+-- Cancelled or deleted tickets are listed in ticket_revocations until their code
+-- expires, so check-in (and offline devices, via the boarding pack) can reject them.
+
+CREATE TABLE IF NOT EXISTS public.boarding_scans
+(
+    ticket_id   bigint primary key,
+    trip_id     bigint                   not null,
+    scanned_at  timestamp with time zone not null,
+    device_id   varchar(64)              not null default '',
+    recorded_at timestamp with time zone not null default now()
+);
+
+CREATE INDEX IF NOT EXISTS idx_boarding_scans_trip_id
+    ON public.boarding_scans (trip_id);
+
+CREATE TABLE IF NOT EXISTS public.ticket_revocations
+(
+    ticket_id  bigint primary key,
+    trip_id    bigint                   not null,
+    revoked_at timestamp with time zone not null default now(),
+    expires_at timestamp with time zone not null
+);
+
+COMMENT ON COLUMN public.ticket_revocations.expires_at IS 'When the revoked code would have expired anyway; the row can be purged after it';
+
+CREATE INDEX IF NOT EXISTS idx_ticket_revocations_trip_id
+    ON public.ticket_revocations (trip_id);
+CREATE INDEX IF NOT EXISTS idx_ticket_revocations_expires_at
+    ON public.ticket_revocations (expires_at);
+
+-- Display confirmation
+SELECT 'Migration completed: boarding_scans and ticket_revocations created' AS status;
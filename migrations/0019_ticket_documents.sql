@@ -0,0 +1,30 @@
+-- Migration: Rendered ticket documents (PDF with QR codes)
+-- Date: 2026-10-19
+-- Description: One row per booking whose ticket PDF has been requested. The
+-- render_ticket_documents worker claims Pending rows, renders them in a process pool
+-- and stores each file on disk under the SHA-256 of its content (digest), which the
+-- booking page links to and browsers may cache forever. Changing a booking's tickets
+-- or its trip puts the row back to Pending.
+
+CREATE TABLE IF NOT EXISTS public.ticket_documents
+(
+    booking_id   bigint primary key,
+    status       varchar(10)              not null default 'Pending',
+    digest       char(64),
+    size         integer,
+    attempts     integer                  not null default 0,
+    last_error   text,
+    requested_at timestamp with time zone not null default now(),
+    claimed_at   timestamp with time zone,
+    rendered_at  timestamp with time zone
+);
+
+COMMENT ON COLUMN public.ticket_documents.status IS 'Pending, Rendering, Ready or Failed';
+COMMENT ON COLUMN public.ticket_documents.digest IS 'SHA-256 of the rendered PDF; also its file name';
+
+CREATE INDEX IF NOT EXISTS idx_ticket_documents_pending
+    ON public.ticket_documents (requested_at)
+    WHERE status IN ('Pending', 'Rendering');
+
+-- Display confirmation
+SELECT 'Migration completed: ticket_documents created' AS status;
@@ -0,0 +1,22 @@
+-- Migration: Timetable import keys
+-- Date: 2026-10-19
+-- Description: Maps the ids used in an operator's timetable files (stop_id, route_id,
+-- trip_id) to the rows they were imported into, per source (operator feed). Lets the
+-- import_timetable command and POST /api/trips/import/ re-run a feed as an upsert:
+-- known ids update their row, new ids insert one. Buses are matched on license_plate
+-- and seats on (bus_id, seat_number), so they need no keys.
+
+CREATE TABLE IF NOT EXISTS public.timetable_import_keys
+(
+    source      varchar(50)              not null,
+    kind        varchar(10)              not null,
+    external_id varchar(64)              not null,
+    local_id    bigint                   not null,
+    imported_at timestamp with time zone not null default now(),
+    PRIMARY KEY (source, kind, external_id)
+);
+
+COMMENT ON COLUMN public.timetable_import_keys.kind IS 'stop (locations), route (routes) or trip (trips)';
+
+-- Display confirmation
+SELECT 'Migration completed: timetable_import_keys created' AS status;
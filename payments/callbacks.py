@@ -0,0 +1,131 @@
+"""
+Batched processing of the payment gateway callback inbox (No ORM)
+"""
+from django.db import transaction
+from utils.db_utils import execute_query
+from .models import Payment, PaymentCallback
+from .notifications import notify_status_change
+from typing import Dict, List, Any
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Higher rank wins when several notifications for one payment are in a batch,
+# so a late 'Pending' can never undo a 'Completed' that arrived earlier
+STATUS_RANK = {
+    'Pending': 0,
+    'Completed': 1,
+}
+
+
+def _payment_key(callback: Dict[str, Any]) -> tuple:
+    """A notification concerns the payment with its transaction_code made through its gateway"""
+    return callback['transaction_code'], callback['gateway']
+
+
+def _pick_winners(callbacks: List[Dict[str, Any]]) -> tuple:
+    """
+    Reduce a batch to one notification per transaction_code and gateway, so a
+    notification posted under another gateway cannot supersede the payment's own.
+    Returns (winners by (transaction_code, gateway), ids of superseded notifications)
+    """
+    winners = {}
+    superseded = []
+    for callback in callbacks:
+        key = (STATUS_RANK.get(callback['status'], -1), callback['event_time'], callback['id'])
+        current = winners.get(_payment_key(callback))
+        if current is None:
+            winners[_payment_key(callback)] = callback
+            continue
+        current_key = (STATUS_RANK.get(current['status'], -1), current['event_time'], current['id'])
+        if key > current_key:
+            superseded.append(current['id'])
+            winners[_payment_key(callback)] = callback
+        else:
+            superseded.append(callback['id'])
+    return winners, superseded
+
+
+def _complete_payments(winners: List[Dict[str, Any]]) -> set:
+    """
+    Move every still-pending payment in `winners` to Completed with one UPDATE
+    (keeping the payment method the customer chose) and notify waiting checkouts.
+    A notification only completes a payment made with the gateway it was posted to.
+    Returns the (transaction_code, gateway) pairs updated.
+    """
+    if not winners:
+        return set()
+    query = f"""
+        UPDATE {Payment.TABLE_NAME} p
+        SET status = 'Completed'
+        FROM unnest(%s::text[], %s::text[]) AS c(transaction_code, gateway)
+        WHERE p.transaction_code = c.transaction_code AND p.payment_method = c.gateway
+          AND p.status = 'Pending'
+        RETURNING p.id, p.transaction_code, p.payment_method
+    """
+    rows = execute_query(query, ([callback['transaction_code'] for callback in winners],
+                                 [callback['gateway'] for callback in winners]))
+    notify_status_change([row['id'] for row in rows])
+    return {(row['transaction_code'], row['payment_method']) for row in rows}
+
+
+def _existing_payments(keys: List[tuple]) -> set:
+    """(transaction_code, gateway) pairs from `keys` that belong to a known payment"""
+    if not keys:
+        return set()
+    query = f"""
+        SELECT p.transaction_code, p.payment_method
+        FROM {Payment.TABLE_NAME} p
+        JOIN unnest(%s::text[], %s::text[]) AS c(transaction_code, gateway)
+          ON p.transaction_code = c.transaction_code AND p.payment_method = c.gateway
+    """
+    rows = execute_query(query, ([code for code, _ in keys], [gateway for _, gateway in keys]))
+    return {(row['transaction_code'], row['payment_method']) for row in rows}
+
+
+def process_callback_batch(batch_size: int = 500) -> Dict[str, int]:
+    """
+    Claim up to `batch_size` unprocessed notifications, dedupe them by
+    transaction_code and gateway and apply the resulting status transitions in one transaction.
+    Returns the number of notifications per result.
+    """
+    with transaction.atomic():
+        callbacks = PaymentCallback.claim_unprocessed(batch_size)
+        if not callbacks:
+            return {}
+
+        winners, superseded = _pick_winners(callbacks)
+        results = {'duplicate': superseded}
+
+        completions = [cb for cb in winners.values() if cb['status'] == 'Completed']
+        results['ignored'] = [cb['id'] for cb in winners.values() if cb['status'] != 'Completed']
+
+        applied = _complete_payments(completions)
+        not_applied = [cb for cb in completions if _payment_key(cb) not in applied]
+        # A code paid through another gateway is unmatched, never applied
+        known = _existing_payments([_payment_key(cb) for cb in not_applied])
+
+        results['applied'] = [cb['id'] for cb in completions if _payment_key(cb) in applied]
+        results['stale'] = [cb['id'] for cb in not_applied if _payment_key(cb) in known]
+        results['unmatched'] = [cb['id'] for cb in not_applied if _payment_key(cb) not in known]
+
+        for result, callback_ids in results.items():
+            PaymentCallback.mark_processed(callback_ids, result)
+
+    counts = {result: len(callback_ids) for result, callback_ids in results.items()}
+    logger.info(f"Processed {len(callbacks)} payment callbacks: {counts}")
+    return counts
+
+
+def drain_callbacks(batch_size: int = 500, max_batches: int = None) -> Dict[str, int]:
+    """Process batches until the inbox is empty (or `max_batches` is reached)"""
+    totals = {}
+    batches = 0
+    while max_batches is None or batches < max_batches:
+        counts = process_callback_batch(batch_size)
+        if not counts:
+            break
+        for result, count in counts.items():
+            totals[result] = totals.get(result, 0) + count
+        batches += 1
+    return totals
@@ -0,0 +1,39 @@
+"""
+Worker that drains the payment gateway callback inbox in batches
+"""
+from django.core.management.base import BaseCommand
+from payments.callbacks import drain_callbacks
+from payments.models import PaymentCallback
+import time
+
+
+class Command(BaseCommand):
+    help = 'Dedupe queued payment gateway callbacks by transaction_code and gateway and apply them in batches'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500,
+                            help='Notifications claimed per transaction (default: 500)')
+        parser.add_argument('--loop', action='store_true',
+                            help='Keep polling the inbox instead of exiting once it is empty')
+        parser.add_argument('--interval', type=float, default=1.0,
+                            help='Seconds to sleep between polls when --loop is set (default: 1)')
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        while True:
+            started = time.monotonic()
+            totals = drain_callbacks(batch_size=batch_size)
+            if totals:
+                processed = sum(totals.values())
+                elapsed = time.monotonic() - started
+                self.stdout.write(self.style.SUCCESS(
+                    f"Processed {processed} callbacks in {elapsed:.2f}s "
+                    f"({processed / max(elapsed, 1e-6):.0f}/s): {totals}"
+                ))
+            if not options['loop']:
+                break
+            time.sleep(options['interval'])
+
+        remaining = PaymentCallback.count_unprocessed()
+        if remaining:
+            self.stdout.write(f"{remaining} callbacks still queued")
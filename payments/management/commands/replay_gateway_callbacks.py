@@ -0,0 +1,109 @@
+"""
+Local fake payment gateway: replays bursts of callbacks against the ingestion endpoint
+"""
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.utils.timezone import now
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from utils.db_utils import execute_query
+from payments.models import Payment
+import hashlib
+import hmac
+import json
+import random
+import threading
+import time
+import uuid
+import requests
+
+
+class Command(BaseCommand):
+    help = ('Act as a fake payment gateway: send bursts of duplicated and out-of-order '
+            'callbacks for pending payments to /api/payments/callback/<gateway>/')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--base-url', default='http://localhost:8000',
+                            help='Server to send callbacks to (default: http://localhost:8000)')
+        parser.add_argument('--count', type=int, default=1000,
+                            help='Number of distinct transactions to notify (default: 1000)')
+        parser.add_argument('--duplicates', type=int, default=3,
+                            help='Times each Completed notification is delivered (default: 3)')
+        parser.add_argument('--stale', action='store_true',
+                            help="Also send an older 'Pending' notification per transaction")
+        parser.add_argument('--synthetic', action='store_true',
+                            help='Use random transaction codes instead of pending payments')
+        parser.add_argument('--concurrency', type=int, default=16,
+                            help='Parallel HTTP connections (default: 16)')
+        parser.add_argument('--seed', type=int, default=None, help='Random seed for the burst order')
+
+    def handle(self, *args, **options):
+        rng = random.Random(options['seed'])
+        gateways = [method[0] for method in Payment.PAYMENT_METHODS]
+
+        if options['synthetic']:
+            transactions = [(f"TXN-{uuid.uuid4().hex[:8].upper()}", rng.choice(gateways))
+                            for _ in range(options['count'])]
+        else:
+            # Each payment is notified through the gateway it was made with
+            rows = execute_query(
+                f"SELECT transaction_code, payment_method FROM {Payment.TABLE_NAME} "
+                f"WHERE status = 'Pending' LIMIT %s",
+                (options['count'],)
+            )
+            transactions = [(row['transaction_code'], row['payment_method']) for row in rows]
+        if not transactions:
+            raise CommandError('No pending payments to notify; use --synthetic to generate codes')
+
+        notifications = self._build_burst(transactions, options, rng)
+        session_local = threading.local()
+        failures = []
+        base_url = options['base_url'].rstrip('/')
+
+        def send(notification):
+            gateway, body = notification
+            session = getattr(session_local, 'session', None)
+            if session is None:
+                session = session_local.session = requests.Session()
+            raw = json.dumps(body).encode()
+            headers = {'Content-Type': 'application/json'}
+            if settings.PAYMENT_CALLBACK_SECRET:
+                headers['X-Callback-Signature'] = hmac.new(
+                    settings.PAYMENT_CALLBACK_SECRET.encode(), raw, hashlib.sha256
+                ).hexdigest()
+            response = session.post(f"{base_url}/api/payments/callback/{gateway}/",
+                                    data=raw, headers=headers, timeout=10)
+            if response.status_code != 202:
+                failures.append(response.status_code)
+
+        started = time.monotonic()
+        with ThreadPoolExecutor(max_workers=options['concurrency']) as executor:
+            list(executor.map(send, notifications))
+        elapsed = time.monotonic() - started
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Sent {len(notifications)} callbacks for {len(transactions)} transactions "
+            f"in {elapsed:.2f}s ({len(notifications) / max(elapsed, 1e-6):.0f}/s)"
+        ))
+        if failures:
+            self.stdout.write(self.style.WARNING(f"{len(failures)} callbacks were not accepted"))
+
+    def _build_burst(self, transactions, options, rng):
+        """Expand transactions into a shuffled list of (gateway, body) notifications"""
+        notifications = []
+        completed_at = now()
+        for transaction_code, gateway in transactions:
+            for _ in range(max(options['duplicates'], 1)):
+                notifications.append((gateway, {
+                    'transaction_code': transaction_code,
+                    'status': 'Completed',
+                    'event_time': completed_at.isoformat(),
+                }))
+            if options['stale']:
+                notifications.append((gateway, {
+                    'transaction_code': transaction_code,
+                    'status': 'Pending',
+                    'event_time': (completed_at - timedelta(minutes=5)).isoformat(),
+                }))
+        rng.shuffle(notifications)
+        return notifications
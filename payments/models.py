@@ -8,15 +8,22 @@ from utils.db_utils import (
 )
 from typing import List, Dict, Any, Optional
 from datetime import datetime
+from django.conf import settings
 from django.utils.timezone import now
 from decimal import Decimal
+import json
 import uuid
 
 
+class WalletError(Exception):
+    """A wallet needed to move money does not exist"""
+
+
 class Payment:
     """Payment model using raw SQL"""
 
     TABLE_NAME = 'payments'
+    STATS_TABLE_NAME = 'payment_method_daily_stats'
     PAYMENT_METHODS = [
         ('Momo', 'Momo'),
         ('VNPay', 'VNPay'),
@@ -31,6 +38,8 @@ class Payment:
     STATUS_CHOICES = [
         ('Pending', 'Chờ xử lý'),
         ('Completed', 'Hoàn thành'),
+        ('Refunded', 'Đã hoàn tiền'),
+        ('Canceled', 'Đã hủy'),
     ]
     
     @classmethod
@@ -56,7 +65,7 @@ class Payment:
                 INSERT INTO {cls.TABLE_NAME}
                 (id, booking_id, amount, payment_method, status, payment_time, transaction_code)
                 VALUES (%s, %s, %s, %s, %s, %s, %s)
-                RETURNING id, booking_id, amount, payment_method, status, payment_time, transaction_code
+                RETURNING id, booking_id, amount, payment_method, status, payment_time, transaction_code, wallet_id
             """
             result = execute_query(query, (payment_id, booking_id, amount, payment_method,
                                           status, payment_time, transaction_code))
@@ -65,7 +74,12 @@ class Payment:
     @classmethod
     def mark_as_completed(cls, payment_id: int) -> bool:
         query = f"UPDATE {cls.TABLE_NAME} SET status = %s WHERE id = %s"
-        return execute_update(query, ('Completed', payment_id))
+        updated = execute_update(query, ('Completed', payment_id))
+        if updated:
+            # Wake long-poll requests waiting on this payment once the update commits
+            from .notifications import notify_status_change
+            notify_status_change([payment_id])
+        return updated
 
     @classmethod
     def check_payment_state(cls, payment_id: int) -> bool:
@@ -79,12 +93,106 @@ class Payment:
         query = f"SELECT id, booking_id, amount, payment_method, status, payment_time, transaction_code FROM {cls.TABLE_NAME} WHERE id = %s"
         return execute_query_one(query, (payment_id,))
 
+    @classmethod
+    def get_page(cls, status: str = None, booking_id: int = None,
+                 payment_method: str = None, wallet_id: str = None,
+                 date_from: datetime = None, date_to: datetime = None,
+                 after: tuple = None, limit: int = 50) -> List[Dict[str, Any]]:
+        """
+        Get one page of payments ordered by (payment_time, id) descending.
+        `after` is the (payment_time, id) of the last row of the previous page;
+        one extra row is fetched so callers can tell whether a next page exists.
+        """
+        conditions = []
+        params = []
+
+        if status:
+            conditions.append("status = %s")
+            params.append(status)
+        if booking_id:
+            conditions.append("booking_id = %s")
+            params.append(booking_id)
+        if payment_method:
+            conditions.append("payment_method = %s")
+            params.append(payment_method)
+        if wallet_id:
+            conditions.append("wallet_id = %s")
+            params.append(wallet_id)
+        if date_from:
+            conditions.append("payment_time >= %s")
+            params.append(date_from)
+        if date_to:
+            conditions.append("payment_time < %s")
+            params.append(date_to)
+        if after:
+            conditions.append("(payment_time, id) < (%s, %s)")
+            params.extend(after)
+
+        where_clause = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+        query = f"""
+            SELECT id, booking_id, wallet_id, amount, payment_method, status, payment_time, transaction_code
+            FROM {cls.TABLE_NAME}
+            {where_clause}
+            ORDER BY payment_time DESC, id DESC
+            LIMIT %s
+        """
+        params.append(limit + 1)
+        return execute_query(query, tuple(params))
+
     @classmethod
     def get_by_booking_id(cls, booking_id: int) -> Optional[Dict[str, Any]]:
         """Get payment by booking_id"""
         query = f"SELECT id, booking_id, amount, payment_method, status, payment_time, transaction_code FROM {cls.TABLE_NAME} WHERE booking_id = %s"
         return execute_query_one(query, (booking_id,))
 
+    @classmethod
+    def get_revenue_by_method(cls, date_from=None, date_to=None) -> List[Dict[str, Any]]:
+        """Revenue and refunds per payment method from the payment_method_daily_stats rollup"""
+        conditions = []
+        params = []
+        if date_from:
+            conditions.append("stat_date >= %s")
+            params.append(date_from)
+        if date_to:
+            conditions.append("stat_date <= %s")
+            params.append(date_to)
+        where_clause = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+
+        query = f"""
+            SELECT payment_method,
+                   SUM(completed_payments) as completed_payments,
+                   SUM(revenue) as revenue,
+                   SUM(refunded_payments) as refunded_payments,
+                   SUM(refunded_amount) as refunded_amount,
+                   SUM(revenue) - SUM(refunded_amount) as net_revenue
+            FROM {cls.STATS_TABLE_NAME}
+            {where_clause}
+            GROUP BY payment_method
+            ORDER BY revenue DESC
+        """
+        return execute_query(query, tuple(params))
+
+    @classmethod
+    def close_for_bookings(cls, booking_ids: List[int]) -> int:
+        """
+        Close the payments of canceled bookings: completed payments become Refunded,
+        payments that were never completed become Canceled
+        """
+        if not booking_ids:
+            return 0
+        query = f"""
+            UPDATE {cls.TABLE_NAME}
+            SET status = CASE WHEN status = 'Completed' THEN 'Refunded' ELSE 'Canceled' END
+            WHERE booking_id = ANY(%s) AND status IN ('Pending', 'Completed')
+            RETURNING id
+        """
+        rows = execute_query(query, (list(booking_ids),))
+        if rows:
+            # Wake long-poll requests waiting on these payments once the update commits
+            from .notifications import notify_status_change
+            notify_status_change([row['id'] for row in rows])
+        return len(rows)
+
     @classmethod
     def delete(cls, payment_id: str) -> bool:
         """Delete a payment"""
@@ -171,6 +279,36 @@ class Wallet:
             return cls.deposit(admin_id, amount)
         return False
 
+    @classmethod
+    def credit_many(cls, credits: Dict[str, Decimal]) -> int:
+        """Add amounts to several wallets (wallet_id -> amount) in one atomic UPDATE"""
+        if not credits:
+            return 0
+        query = f"""
+            UPDATE {cls.TABLE_NAME} w
+            SET balance = w.balance + c.amount, updated_at = %s
+            FROM unnest(%s::uuid[], %s::numeric[]) AS c(wallet_id, amount)
+            WHERE w.id = c.wallet_id
+        """
+        wallet_ids = list(credits)
+        return execute_update(query, (now(), wallet_ids, [credits[w] for w in wallet_ids]))
+
+    @classmethod
+    def refund_many(cls, refunds: Dict[str, Decimal]) -> int:
+        """
+        Give wallet payments back (wallet_id -> amount): credit each customer wallet and
+        debit the total from the admin wallet that Wallet.pay paid it into, in one UPDATE
+        """
+        if not refunds:
+            return 0
+        admin_wallet = cls.get_by_user_id(settings.ADMIN_WALLET_USER_ID)
+        if not admin_wallet:
+            raise WalletError(f'No wallet for the admin account {settings.ADMIN_WALLET_USER_ID}')
+        entries = dict(refunds)
+        admin_wallet_id = str(admin_wallet['id'])
+        entries[admin_wallet_id] = entries.get(admin_wallet_id, Decimal('0')) - sum(refunds.values())
+        return cls.credit_many(entries)
+
     @classmethod
     def get_all_payments(cls, wallet_id: str) -> List[Dict[str, Any]]:
         """Get all payments for a wallet (order by latest time)"""
@@ -182,8 +320,100 @@ class Wallet:
         """
         return execute_query(query, (wallet_id,))
 
-    
 
-        
+class Refund:
+    """Refund ledger entry using raw SQL"""
+
+    TABLE_NAME = 'refunds'
+    STATUS_CHOICES = [
+        ('Pending', 'Chờ hoàn tiền'),
+        ('Credited', 'Đã hoàn vào ví'),
+    ]
+
+    @classmethod
+    def create_for_bookings(cls, booking_ids: List[int], reason: str) -> List[Dict[str, Any]]:
+        """
+        Write one ledger entry per completed payment of the given bookings.
+        Wallet payments are credited immediately; the others wait for a gateway payout.
+        """
+        if not booking_ids:
+            return []
+        query = f"""
+            INSERT INTO {cls.TABLE_NAME}
+            (payment_id, booking_id, amount, wallet_id, status, reason, created_at)
+            SELECT id, booking_id, amount, wallet_id::uuid,
+                   CASE WHEN wallet_id IS NULL THEN 'Pending' ELSE 'Credited' END, %s, %s
+            FROM {Payment.TABLE_NAME}
+            WHERE booking_id = ANY(%s) AND status = 'Completed'
+            ON CONFLICT (payment_id) DO NOTHING
+            RETURNING id, payment_id, booking_id, amount, wallet_id, status, reason, created_at
+        """
+        return execute_query(query, (reason, now(), list(booking_ids)))
+
+    @classmethod
+    def get_by_booking_id(cls, booking_id: int) -> List[Dict[str, Any]]:
+        """Get refund entries for a booking"""
+        query = f"""
+            SELECT id, payment_id, booking_id, amount, wallet_id, status, reason, created_at
+            FROM {cls.TABLE_NAME}
+            WHERE booking_id = %s
+            ORDER BY created_at
+        """
+        return execute_query(query, (booking_id,))
+
 
+class PaymentCallback:
+    """Raw payment gateway notification stored in the append-only inbox"""
 
+    TABLE_NAME = 'payment_callbacks'
+    RESULT_CHOICES = [
+        ('applied', 'Đã cập nhật thanh toán'),
+        ('duplicate', 'Thông báo trùng lặp'),
+        ('stale', 'Thông báo cũ hơn trạng thái hiện tại'),
+        ('ignored', 'Trạng thái không được hỗ trợ'),
+        ('unmatched', 'Không tìm thấy giao dịch'),
+    ]
+
+    @classmethod
+    def create(cls, gateway: str, transaction_code: str, status: str,
+               event_time: datetime, payload: Dict[str, Any]) -> Optional[int]:
+        """Append a raw notification to the inbox, return its id"""
+        query = f"""
+            INSERT INTO {cls.TABLE_NAME}
+            (gateway, transaction_code, status, event_time, payload, received_at)
+            VALUES (%s, %s, %s, %s, %s, %s)
+            RETURNING id
+        """
+        return execute_insert(query, (gateway, transaction_code, status, event_time,
+                                      json.dumps(payload, default=str), now()))
+
+    @classmethod
+    def claim_unprocessed(cls, limit: int = 500) -> List[Dict[str, Any]]:
+        """
+        Lock the oldest unprocessed notifications for the current transaction.
+        SKIP LOCKED lets several workers drain the inbox without blocking each other.
+        """
+        query = f"""
+            SELECT id, gateway, transaction_code, status, event_time
+            FROM {cls.TABLE_NAME}
+            WHERE processed_at IS NULL
+            ORDER BY id
+            LIMIT %s
+            FOR UPDATE SKIP LOCKED
+        """
+        return execute_query(query, (limit,))
+
+    @classmethod
+    def mark_processed(cls, callback_ids: List[int], result: str) -> int:
+        """Mark notifications as processed with the given result"""
+        if not callback_ids:
+            return 0
+        query = f"UPDATE {cls.TABLE_NAME} SET processed_at = %s, result = %s WHERE id = ANY(%s)"
+        return execute_update(query, (now(), result, list(callback_ids)))
+
+    @classmethod
+    def count_unprocessed(cls) -> int:
+        """Number of notifications still waiting for the worker"""
+        query = f"SELECT COUNT(*) as count FROM {cls.TABLE_NAME} WHERE processed_at IS NULL"
+        result = execute_query_one(query)
+        return result['count'] if result else 0
@@ -0,0 +1,126 @@
+"""
+Push-style payment status notifications over PostgreSQL LISTEN/NOTIFY.
+
+Writers call notify_status_change() inside their transaction; PostgreSQL only
+delivers the NOTIFY once that transaction commits. Each web process keeps one
+dedicated listener connection and wakes the long-poll requests waiting on the
+notified payment ids, so waiting checkouts do not each poll the database.
+
+A waiting request still occupies a worker thread, so each process lets at most
+PAYMENT_STATUS_MAX_WAITERS requests wait at once; further requests get the
+current status straight away and poll again.
+"""
+from django.conf import settings
+from utils.db_utils import execute_query
+from typing import List
+import logging
+import select
+import threading
+import psycopg2
+import psycopg2.extensions
+
+logger = logging.getLogger(__name__)
+
+CHANNEL = 'payment_status'
+
+
+def notify_status_change(payment_ids: List[str]) -> None:
+    """Queue a notification for each payment id, delivered when the transaction commits"""
+    if not payment_ids:
+        return
+    execute_query(
+        "SELECT pg_notify(%s, payment_id) FROM unnest(%s::text[]) AS payment_id",
+        (CHANNEL, [str(payment_id) for payment_id in payment_ids])
+    )
+
+
+class PaymentStatusListener:
+    """Per-process LISTEN connection that fans notifications out to waiting requests"""
+
+    RECONNECT_DELAY = 5
+
+    def __init__(self, max_waiters: int = None):
+        if max_waiters is None:
+            max_waiters = getattr(settings, 'PAYMENT_STATUS_MAX_WAITERS', 8)
+        self._lock = threading.Lock()
+        self._waiters = {}
+        self._thread = None
+        self._slots = threading.BoundedSemaphore(max_waiters) if max_waiters > 0 else None
+
+    def acquire_slot(self) -> bool:
+        """Reserve one of the process's waiting slots; False when they are all taken"""
+        return self._slots is not None and self._slots.acquire(blocking=False)
+
+    def release_slot(self) -> None:
+        """Give back a slot reserved by acquire_slot()"""
+        self._slots.release()
+
+    def subscribe(self, payment_id: str) -> threading.Event:
+        """
+        Register interest in `payment_id`; the returned event is set on its next
+        notification. Subscribe before reading the current status so a change
+        committed in between is not missed.
+        """
+        self._ensure_started()
+        event = threading.Event()
+        with self._lock:
+            self._waiters.setdefault(payment_id, set()).add(event)
+        return event
+
+    def unsubscribe(self, payment_id: str, event: threading.Event) -> None:
+        """Drop a subscription created by subscribe()"""
+        with self._lock:
+            waiters = self._waiters.get(payment_id)
+            if waiters is not None:
+                waiters.discard(event)
+                if not waiters:
+                    del self._waiters[payment_id]
+
+    def _wake(self, payment_id: str) -> None:
+        with self._lock:
+            for event in self._waiters.get(payment_id, ()):
+                event.set()
+
+    def _ensure_started(self) -> None:
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name='payment-status-listener',
+                                                daemon=True)
+                self._thread.start()
+
+    def _connect(self):
+        db = settings.DATABASES['default']
+        connection = psycopg2.connect(
+            host=db['HOST'],
+            port=db['PORT'],
+            dbname=db['NAME'],
+            user=db['USER'],
+            password=db['PASSWORD']
+        )
+        connection.set_isolation_level(psycopg2.extensions.ISOLATION_LEVEL_AUTOCOMMIT)
+        with connection.cursor() as cursor:
+            cursor.execute(f"LISTEN {CHANNEL}")
+        return connection
+
+    def _run(self) -> None:
+        stop = threading.Event()
+        while True:
+            connection = None
+            try:
+                connection = self._connect()
+                while True:
+                    if select.select([connection], [], [], 60) == ([], [], []):
+                        continue
+                    connection.poll()
+                    while connection.notifies:
+                        self._wake(connection.notifies.pop(0).payload)
+            except Exception as e:
+                # Waiters simply time out and re-read the status while we reconnect
+                logger.error(f"Payment status listener error: {e}")
+            finally:
+                if connection is not None and not connection.closed:
+                    connection.close()
+            stop.wait(self.RECONNECT_DELAY)
+
+
+listener = PaymentStatusListener()
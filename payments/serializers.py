@@ -2,7 +2,8 @@
 Payment serializers for dictionary data (No ORM)
 """
 from rest_framework import serializers
-from .models import Payment, Wallet
+from .models import Payment, Wallet, PaymentCallback
+from django.utils.timezone import now
 from decimal import Decimal
 
 
@@ -92,4 +93,21 @@ class WalletTransactionSerializer(serializers.Serializer):
         """Validate transaction amount is positive"""
         if value <= Decimal('0.00'):
             raise serializers.ValidationError('Transaction amount must be greater than zero.')
-        return value
\ No newline at end of file
+        return value
+
+
+class PaymentCallbackSerializer(serializers.Serializer):
+    """Serializer for a gateway notification posted to the callback inbox"""
+    transaction_code = serializers.CharField(max_length=255, required=True)
+    status = serializers.CharField(max_length=20, required=True)
+    event_time = serializers.DateTimeField(required=False)
+
+    def create(self, validated_data):
+        """Append the notification to the inbox"""
+        return PaymentCallback.create(
+            gateway=self.context['gateway'],
+            transaction_code=validated_data['transaction_code'],
+            status=validated_data['status'],
+            event_time=validated_data.get('event_time') or now(),
+            payload=self.context['payload']
+        )
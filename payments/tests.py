@@ -1,3 +1,106 @@
-from django.test import TestCase
+from decimal import Decimal
+from unittest import mock
 
-# Create your tests here.
+from django.conf import settings
+from django.db import connection
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.utils.timezone import now
+
+from .callbacks import process_callback_batch
+from .models import PaymentCallback, Wallet, WalletError
+
+
+@override_settings(ADMIN_WALLET_USER_ID=7)
+class WalletRefundTests(SimpleTestCase):
+    """Wallet.refund_many moves refunds from the admin wallet back to the customers"""
+
+    ADMIN_WALLET = {'id': 'a0000000-0000-0000-0000-000000000000', 'user_id': 7, 'balance': Decimal('1000')}
+
+    def refund(self, refunds, admin_wallet=ADMIN_WALLET):
+        with mock.patch.object(Wallet, 'get_by_user_id', return_value=admin_wallet) as get_wallet, \
+                mock.patch.object(Wallet, 'credit_many', return_value=len(refunds) + 1) as credit_many:
+            Wallet.refund_many(refunds)
+        get_wallet.assert_called_once_with(7)
+        return credit_many.call_args.args[0]
+
+    def test_admin_wallet_is_debited_by_the_total(self):
+        entries = self.refund({'c1': Decimal('300.00'), 'c2': Decimal('150.50')})
+        self.assertEqual(entries, {
+            'c1': Decimal('300.00'),
+            'c2': Decimal('150.50'),
+            self.ADMIN_WALLET['id']: Decimal('-450.50'),
+        })
+        self.assertEqual(sum(entries.values()), 0)
+
+    def test_admin_refunding_itself_nets_out(self):
+        admin_id = self.ADMIN_WALLET['id']
+        entries = self.refund({admin_id: Decimal('100'), 'c1': Decimal('50')})
+        self.assertEqual(entries, {admin_id: Decimal('-50'), 'c1': Decimal('50')})
+
+    def test_nothing_to_refund(self):
+        with mock.patch.object(Wallet, 'credit_many') as credit_many:
+            self.assertEqual(Wallet.refund_many({}), 0)
+        credit_many.assert_not_called()
+
+    def test_missing_admin_wallet_refuses_the_refund(self):
+        with self.assertRaises(WalletError):
+            self.refund({'c1': Decimal('10')}, admin_wallet=None)
+
+
+class CallbackBatchTests(TestCase):
+    """process_callback_batch against the callback inbox migration"""
+
+    @classmethod
+    def setUpTestData(cls):
+        with connection.cursor() as cursor:
+            cursor.execute("""
+                CREATE TABLE payments (id uuid primary key default gen_random_uuid(),
+                                       transaction_code varchar(255) not null,
+                                       payment_method varchar(20) not null,
+                                       status varchar(20) not null);
+            """)
+            with open(settings.BASE_DIR / 'migrations' / '0003_payment_callback_inbox.sql') as migration:
+                cursor.execute(migration.read())
+            cursor.execute("""
+                INSERT INTO payments (transaction_code, payment_method, status)
+                VALUES ('TXN-MOMO', 'Momo', 'Pending'), ('TXN-VNPAY', 'VNPay', 'Pending'),
+                       ('TXN-DONE', 'Momo', 'Completed')
+            """)
+
+    def notify(self, gateway, transaction_code, status='Completed'):
+        return PaymentCallback.create(gateway, transaction_code, status, now(), {})
+
+    def results(self):
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT gateway, transaction_code, result FROM payment_callbacks ORDER BY id")
+            return cursor.fetchall()
+
+    def payment_status(self, transaction_code):
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT status FROM payments WHERE transaction_code = %s", (transaction_code,))
+            return cursor.fetchone()[0]
+
+    def test_notification_completes_the_payment_of_its_gateway(self):
+        self.notify('Momo', 'TXN-MOMO')
+        self.notify('Momo', 'TXN-MOMO')
+        self.notify('Momo', 'TXN-DONE')
+        self.notify('Momo', 'TXN-NONE')
+        self.assertEqual(process_callback_batch(),
+                         {'duplicate': 1, 'ignored': 0, 'applied': 1, 'stale': 1, 'unmatched': 1})
+        self.assertEqual(self.payment_status('TXN-MOMO'), 'Completed')
+
+    def test_notification_under_another_gateway_is_unmatched(self):
+        self.notify('Momo', 'TXN-VNPAY')
+        self.notify('ZaloPay', 'TXN-MOMO')
+        process_callback_batch()
+        self.assertEqual(self.results(), [('Momo', 'TXN-VNPAY', 'unmatched'), ('ZaloPay', 'TXN-MOMO', 'unmatched')])
+        self.assertEqual(self.payment_status('TXN-VNPAY'), 'Pending')
+        self.assertEqual(self.payment_status('TXN-MOMO'), 'Pending')
+
+    def test_foreign_notification_does_not_supersede_the_payments_own(self):
+        self.notify('VNPay', 'TXN-VNPAY')
+        # Later, so it would win a per-code dedupe
+        self.notify('Momo', 'TXN-VNPAY')
+        process_callback_batch()
+        self.assertEqual([result for _, _, result in self.results()], ['applied', 'unmatched'])
+        self.assertEqual(self.payment_status('TXN-VNPAY'), 'Completed')
@@ -9,35 +9,158 @@ from rest_framework import viewsets, status
 from rest_framework.decorators import action
 from rest_framework.response import Response
 from rest_framework.exceptions import NotFound
+from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
+from datetime import datetime, time, timedelta
 from decimal import Decimal
-from utils.db_utils import execute_query, execute_query_one, execute_update
+from utils.db_utils import (
+    execute_query, execute_query_one, execute_update,
+    encode_cursor, decode_cursor
+)
+from django.conf import settings
+from django.db import connection
 from .models import Payment, Wallet
-from .serializers import PaymentSerializer, WalletSerializer
+from .serializers import PaymentSerializer, WalletSerializer, PaymentCallbackSerializer
+from .notifications import listener as status_listener
 from accounts.decorators import login_required
+from utils.idempotency import idempotent
+from utils.exports import export_response, EXPORT_RENDERERS
+import hashlib
+import hmac
 import json
+import uuid
 
 
 class PaymentViewSet(viewsets.ViewSet):
     """ViewSet for managing payments using raw SQL"""
     lookup_value_regex = '[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12}'
 
+    LISTING_PAGE_SIZE = 50
+    LISTING_MAX_PAGE_SIZE = 200
+
+    @action(detail=False, methods=['get'], renderer_classes=EXPORT_RENDERERS)
+    def export(self, request):
+        """
+        Stream all payments matching the filters as CSV or JSON lines (admin only).
+        ?format=csv|jsonl&gzip=true&date_from=&date_to= plus the filters in utils.exports
+        """
+        if not hasattr(request.user, 'is_admin') or not request.user.is_admin():
+            return Response(
+                {'error': 'Only admins can export payments.'},
+                status=status.HTTP_403_FORBIDDEN
+            )
+        try:
+            return export_response('payments', request.query_params, request.accepted_renderer.format)
+        except ValueError as e:
+            return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
     @action(detail=False, methods=['get'], url_path='listing')
     def listing(self, request):
-        """List all payments, can be based on filters"""
-        query = "SELECT * FROM payments WHERE 1=1"
-        params = []
-        if status_param := request.query_params.get('status'):
-            query += " AND status = %s"
-            params.append(status_param)
-        if booking_id := request.query_params.get('booking_id'):
-            query += " AND booking_id = %s"
-            params.append(booking_id)
-        query += " ORDER BY payment_time DESC"
-        payments = execute_query(query, tuple(params))
-        return Response(PaymentSerializer(payments, many=True).data)
-    
+        """
+        List payments one page at a time, newest first, can be based on filters.
+        Pass the returned `next_cursor` back as `?cursor=` to get the next page.
+        """
+        params = request.query_params
+
+        try:
+            page_size = min(int(params.get('page_size', self.LISTING_PAGE_SIZE)),
+                            self.LISTING_MAX_PAGE_SIZE)
+        except ValueError:
+            return Response({'error': 'page_size must be an integer'},
+                            status=status.HTTP_400_BAD_REQUEST)
+        if page_size < 1:
+            return Response({'error': 'page_size must be greater than zero'},
+                            status=status.HTTP_400_BAD_REQUEST)
+
+        payment_method = params.get('payment_method')
+        if payment_method and payment_method not in [m[0] for m in Payment.PAYMENT_METHODS]:
+            return Response({'error': 'Invalid payment method'},
+                            status=status.HTTP_400_BAD_REQUEST)
+
+        date_from, error = self._parse_date_param(params.get('date_from'), 'date_from')
+        if error:
+            return error
+        date_to, error = self._parse_date_param(params.get('date_to'), 'date_to', end_of_day=True)
+        if error:
+            return error
+
+        booking_id = params.get('booking_id')
+        if booking_id and not booking_id.isdigit():
+            return Response({'error': 'booking_id must be an integer'},
+                            status=status.HTTP_400_BAD_REQUEST)
+        wallet_id = params.get('wallet_id')
+        if wallet_id and not self._is_uuid(wallet_id):
+            return Response({'error': 'wallet_id must be a UUID'},
+                            status=status.HTTP_400_BAD_REQUEST)
+
+        after = None
+        if cursor := params.get('cursor'):
+            values = decode_cursor(cursor)
+            try:
+                payment_time = parse_datetime(values[0]) if values and len(values) == 2 else None
+            except (TypeError, ValueError):
+                payment_time = None
+            if not payment_time or not self._is_uuid(values[1]):
+                return Response({'error': 'Invalid cursor'}, status=status.HTTP_400_BAD_REQUEST)
+            after = (payment_time, values[1])
+
+        payments = Payment.get_page(
+            status=params.get('status'),
+            booking_id=int(booking_id) if booking_id else None,
+            payment_method=payment_method,
+            wallet_id=wallet_id,
+            date_from=date_from,
+            date_to=date_to,
+            after=after,
+            limit=page_size
+        )
+
+        next_cursor = None
+        if len(payments) > page_size:
+            payments = payments[:page_size]
+            last = payments[-1]
+            next_cursor = encode_cursor((last['payment_time'], last['id']))
+
+        return Response({
+            'results': PaymentSerializer(payments, many=True).data,
+            'next_cursor': next_cursor,
+            'page_size': page_size
+        })
+
+    def _is_uuid(self, value):
+        """Whether a query value is a UUID (payment and wallet ids)"""
+        try:
+            uuid.UUID(str(value))
+        except ValueError:
+            return False
+        return True
+
+    def _parse_date_param(self, value, name, end_of_day=False):
+        """
+        Parse a date (YYYY-MM-DD) or datetime query parameter into an aware datetime.
+        A plain date used as an upper bound covers the whole day.
+        """
+        if not value:
+            return None, None
+        try:
+            parsed = parse_datetime(value)
+            day = parse_date(value) if parsed is None else None
+        except ValueError:
+            parsed = day = None
+        if parsed is None:
+            if day is None:
+                return None, Response({'error': f'{name} must be a date (YYYY-MM-DD) or datetime'},
+                                      status=status.HTTP_400_BAD_REQUEST)
+            if end_of_day:
+                day += timedelta(days=1)
+            parsed = datetime.combine(day, time.min)
+        if timezone.is_naive(parsed):
+            parsed = timezone.make_aware(parsed)
+        return parsed, None
+
+    @idempotent('payments.create')
     def create(self, request):
-        """Create a new payment"""
+        """Create a new payment (honors the Idempotency-Key header)"""
         serializer = PaymentSerializer(data=request.data)
         serializer.is_valid(raise_exception=True)
         payment = serializer.save()
@@ -63,11 +186,66 @@ class PaymentViewSet(viewsets.ViewSet):
     def check_status(self, request, pk=None):
         """Check if payment is successful"""
         payment = Payment.get_payment(pk)
+        if not payment:
+            raise NotFound('Payment not found')
         return Response({
             'payment_id': pk,
             'status': payment['status']
         })
 
+    WAIT_STATUS_TIMEOUT = 25
+    WAIT_STATUS_MAX_TIMEOUT = 60
+    WAIT_STATUS_RETRY_AFTER = 2
+
+    @action(detail=True, methods=['get'], url_path='wait-status')
+    def wait_status(self, request, pk=None):
+        """
+        Long-poll for a payment status change.
+        Returns as soon as the status differs from `?status=` (default: Pending)
+        or after `?timeout=` seconds, woken by LISTEN/NOTIFY instead of polling.
+        When the process has no free waiting slot it answers at once with
+        `retry_after` seconds; the database connection is released while waiting.
+        """
+        known_status = request.query_params.get('status', 'Pending')
+        try:
+            timeout = min(float(request.query_params.get('timeout', self.WAIT_STATUS_TIMEOUT)),
+                          self.WAIT_STATUS_MAX_TIMEOUT)
+        except ValueError:
+            return Response({'error': 'timeout must be a number'},
+                            status=status.HTTP_400_BAD_REQUEST)
+
+        if timeout <= 0 or not status_listener.acquire_slot():
+            payment = Payment.get_payment(pk)
+            if not payment:
+                raise NotFound('Payment not found')
+            response = {'payment_id': pk, 'status': payment['status'],
+                        'changed': payment['status'] != known_status}
+            if timeout > 0:
+                response['retry_after'] = self.WAIT_STATUS_RETRY_AFTER
+            return Response(response)
+
+        try:
+            event = status_listener.subscribe(pk)
+            try:
+                payment = Payment.get_payment(pk)
+                if not payment:
+                    raise NotFound('Payment not found')
+                if payment['status'] == known_status:
+                    # Don't hold a database connection for the whole wait
+                    connection.close()
+                    if event.wait(timeout):
+                        payment = Payment.get_payment(pk) or payment
+            finally:
+                status_listener.unsubscribe(pk, event)
+        finally:
+            status_listener.release_slot()
+
+        return Response({
+            'payment_id': pk,
+            'status': payment['status'],
+            'changed': payment['status'] != known_status
+        })
+
     @action(detail=True, methods=['put', 'patch'], url_path='update-status')
     def update_status(self, request, pk=None):
         """update from pending to completed"""
@@ -78,6 +256,9 @@ class PaymentViewSet(viewsets.ViewSet):
         if payment['status'] == 'Completed':
             return Response({'error': 'Payment is already completed.'},
                         status=status.HTTP_400_BAD_REQUEST)
+        if payment['status'] != 'Pending':
+            return Response({'error': f"Cannot complete a payment with status: {payment['status']}"},
+                        status=status.HTTP_400_BAD_REQUEST)
 
         success = Payment.mark_as_completed(pk)
 
@@ -88,6 +269,35 @@ class PaymentViewSet(viewsets.ViewSet):
         updated_payment = Payment.get_payment(pk)
         return Response(PaymentSerializer(updated_payment).data)
 
+    @action(detail=False, methods=['post'], url_path=r'callback/(?P<gateway>[A-Za-z]+)')
+    def callback(self, request, gateway=None):
+        """
+        Ingest a gateway notification: store it raw in the inbox and acknowledge.
+        Status transitions are applied later, in batches, by process_payment_callbacks.
+        """
+        if gateway not in [method[0] for method in Payment.PAYMENT_METHODS]:
+            raise NotFound('Unknown payment gateway')
+
+        secret = settings.PAYMENT_CALLBACK_SECRET
+        if not secret and not settings.DEBUG:
+            # Unsigned callbacks would let anyone mark their own payment as paid
+            return Response({'error': 'Payment callbacks are not configured'},
+                            status=status.HTTP_503_SERVICE_UNAVAILABLE)
+        if secret:
+            expected = hmac.new(secret.encode(), request.body, hashlib.sha256).hexdigest()
+            signature = request.headers.get('X-Callback-Signature', '')
+            if not hmac.compare_digest(expected, signature):
+                return Response({'error': 'Invalid signature'}, status=status.HTTP_403_FORBIDDEN)
+
+        serializer = PaymentCallbackSerializer(
+            data=request.data,
+            context={'gateway': gateway, 'payload': dict(request.data.items())}
+        )
+        serializer.is_valid(raise_exception=True)
+        callback_id = serializer.save()
+        return Response({'received': True, 'callback_id': callback_id},
+                        status=status.HTTP_202_ACCEPTED)
+
 
 class WalletViewSet(viewsets.ViewSet):
     """ViewSet for managing wallets"""
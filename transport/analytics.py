@@ -0,0 +1,205 @@
+"""
+Vectorized occupancy and revenue analytics over trips (NumPy, No ORM)
+
+Trips are bulk-loaded with their route distance, bus capacity and booked seats
+in a single query into columnar arrays; every metric is then a NumPy group-by
+(np.unique + np.bincount) instead of per-trip Trip.available_seats calls.
+"""
+from django.conf import settings
+from django.db import connection
+from typing import List, Dict, Any, Optional
+from datetime import datetime
+import numpy as np
+from .models import Trip
+
+WEEKDAYS = ['Mon', 'Tue', 'Wed', 'Thu', 'Fri', 'Sat', 'Sun']
+
+
+class TripFrame:
+    """Columnar view of trips: one NumPy array per column, one element per trip"""
+
+    COLUMNS = ('trip_id', 'route_id', 'distance_km', 'total_seats',
+               'weekday', 'hour', 'booked_seats', 'revenue')
+
+    def __init__(self, trip_id, route_id, distance_km, total_seats,
+                 weekday, hour, booked_seats, revenue):
+        self.trip_id = np.asarray(trip_id, dtype=np.int64)
+        self.route_id = np.asarray(route_id, dtype=np.int64)
+        self.distance_km = np.asarray(distance_km, dtype=np.float64)
+        self.total_seats = np.asarray(total_seats, dtype=np.int64)
+        self.weekday = np.asarray(weekday, dtype=np.int64)
+        self.hour = np.asarray(hour, dtype=np.int64)
+        self.booked_seats = np.asarray(booked_seats, dtype=np.int64)
+        self.revenue = np.asarray(revenue, dtype=np.float64)
+
+    def __len__(self):
+        return len(self.trip_id)
+
+    @classmethod
+    def load(cls, date_from: datetime = None, date_to: datetime = None,
+             route_id: int = None) -> 'TripFrame':
+        """
+        Load trips departing in [date_from, date_to) in one query, joining buses,
+        routes and the trip_booking_stats rollup for booked seats and revenue
+        """
+        conditions = []
+        params = [settings.TIME_ZONE, settings.TIME_ZONE]
+        if date_from:
+            conditions.append("t.departure_time >= %s")
+            params.append(date_from)
+        if date_to:
+            conditions.append("t.departure_time < %s")
+            params.append(date_to)
+        if route_id is not None:
+            conditions.append("t.route_id = %s")
+            params.append(route_id)
+        where_clause = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+
+        query = f"""
+            SELECT
+                t.id, t.route_id, r.distance_km, b.total_seats,
+                EXTRACT(ISODOW FROM t.departure_time AT TIME ZONE %s)::int - 1,
+                EXTRACT(HOUR FROM t.departure_time AT TIME ZONE %s)::int,
+                COALESCE(s.booked_seats, 0),
+                COALESCE(s.revenue, 0)::float8
+            FROM {Trip.TABLE_NAME} t
+            JOIN routes r ON t.route_id = r.id
+            JOIN buses b ON t.bus_id = b.id
+            LEFT JOIN {Trip.STATS_TABLE_NAME} s ON s.trip_id = t.id
+            {where_clause}
+        """
+        with connection.cursor() as cursor:
+            cursor.execute(query, tuple(params))
+            rows = cursor.fetchall()
+
+        if not rows:
+            return cls(*[[] for _ in cls.COLUMNS])
+        table = np.array(rows, dtype=np.float64)
+        return cls(*[table[:, i] for i in range(len(cls.COLUMNS))])
+
+    @classmethod
+    def generate(cls, n_trips: int = 50_000, n_bookings: int = 1_000_000,
+                 n_routes: int = 300, seed: Optional[int] = None) -> 'TripFrame':
+        """
+        Build a synthetic frame from `n_bookings` random bookings, aggregated
+        per trip the same way the rollup does. Used for benchmarking.
+        """
+        rng = np.random.default_rng(seed)
+        route_distance = rng.uniform(30, 1700, n_routes)
+        route_popularity = rng.pareto(1.5, n_routes) + 1
+
+        route_id = rng.integers(0, n_routes, n_trips)
+        total_seats = rng.choice([16, 29, 34, 40, 45], n_trips)
+        price = np.round(route_distance[route_id] * rng.uniform(450, 650, n_trips), -3)
+
+        weights = route_popularity[route_id]
+        booking_trip = rng.choice(n_trips, n_bookings, p=weights / weights.sum())
+        booking_seats = rng.integers(1, 5, n_bookings)
+        booked_seats = np.minimum(np.bincount(booking_trip, weights=booking_seats,
+                                              minlength=n_trips).astype(np.int64), total_seats)
+
+        return cls(
+            trip_id=np.arange(1, n_trips + 1),
+            route_id=route_id + 1,
+            distance_km=route_distance[route_id],
+            total_seats=total_seats,
+            weekday=rng.integers(0, 7, n_trips),
+            hour=rng.choice(24, n_trips, p=_departure_hour_profile()),
+            booked_seats=booked_seats,
+            revenue=booked_seats * price
+        )
+
+    def load_factors(self) -> np.ndarray:
+        """Booked seats / capacity per trip"""
+        return np.divide(self.booked_seats, self.total_seats,
+                         out=np.zeros(len(self), dtype=np.float64),
+                         where=self.total_seats > 0)
+
+    def summary(self) -> Dict[str, Any]:
+        """Network-wide totals"""
+        capacity = int(self.total_seats.sum())
+        booked = int(self.booked_seats.sum())
+        seat_km = float((self.booked_seats * self.distance_km).sum())
+        revenue = float(self.revenue.sum())
+        return {
+            'trips': len(self),
+            'total_seats': capacity,
+            'booked_seats': booked,
+            'revenue': round(revenue, 2),
+            'load_factor': round(booked / capacity, 4) if capacity else 0.0,
+            'revenue_per_km': round(revenue / float(self.distance_km.sum()), 2) if len(self) else 0.0,
+            'revenue_per_seat_km': round(revenue / seat_km, 2) if seat_km else 0.0,
+        }
+
+    def route_metrics(self) -> List[Dict[str, Any]]:
+        """
+        Per-route trips, capacity, booked seats, revenue, load factor and
+        revenue per km (per bus-km driven) / per seat-km sold, best routes first
+        """
+        if not len(self):
+            return []
+        routes, index = np.unique(self.route_id, return_inverse=True)
+        size = len(routes)
+
+        trips = np.bincount(index, minlength=size)
+        capacity = np.bincount(index, weights=self.total_seats, minlength=size)
+        booked = np.bincount(index, weights=self.booked_seats, minlength=size)
+        revenue = np.bincount(index, weights=self.revenue, minlength=size)
+        bus_km = np.bincount(index, weights=self.distance_km, minlength=size)
+        seat_km = np.bincount(index, weights=self.booked_seats * self.distance_km, minlength=size)
+
+        load_factor = _safe_divide(booked, capacity)
+        revenue_per_km = _safe_divide(revenue, bus_km)
+        revenue_per_seat_km = _safe_divide(revenue, seat_km)
+
+        order = np.argsort(-revenue_per_km, kind='stable')
+        return [
+            {
+                'route_id': int(routes[i]),
+                'distance_km': round(float(bus_km[i] / trips[i]), 1),
+                'trips': int(trips[i]),
+                'total_seats': int(capacity[i]),
+                'booked_seats': int(booked[i]),
+                'revenue': round(float(revenue[i]), 2),
+                'load_factor': round(float(load_factor[i]), 4),
+                'revenue_per_km': round(float(revenue_per_km[i]), 2),
+                'revenue_per_seat_km': round(float(revenue_per_seat_km[i]), 2),
+            }
+            for i in order
+        ]
+
+    def departure_heatmap(self) -> Dict[str, Any]:
+        """Trip counts and load factor by departure weekday (rows) and hour (columns)"""
+        cell = self.weekday * 24 + self.hour
+        trips = np.bincount(cell, minlength=7 * 24).reshape(7, 24)
+        capacity = np.bincount(cell, weights=self.total_seats, minlength=7 * 24).reshape(7, 24)
+        booked = np.bincount(cell, weights=self.booked_seats, minlength=7 * 24).reshape(7, 24)
+        return {
+            'weekdays': WEEKDAYS,
+            'hours': list(range(24)),
+            'trips': trips.tolist(),
+            'load_factor': np.round(_safe_divide(booked, capacity), 4).tolist(),
+        }
+
+    def report(self, top_routes: int = None) -> Dict[str, Any]:
+        """Summary, route metrics and departure heatmap in one JSON-ready dict"""
+        routes = self.route_metrics()
+        return {
+            'summary': self.summary(),
+            'routes': routes[:top_routes] if top_routes else routes,
+            'heatmap': self.departure_heatmap(),
+        }
+
+
+def _safe_divide(numerator: np.ndarray, denominator: np.ndarray) -> np.ndarray:
+    """Element-wise division that yields 0 where the denominator is 0"""
+    return np.divide(numerator, denominator,
+                     out=np.zeros(np.shape(numerator), dtype=np.float64),
+                     where=denominator > 0)
+
+
+def _departure_hour_profile() -> np.ndarray:
+    """Typical coach departure distribution: morning and evening peaks, few night runs"""
+    hours = np.arange(24)
+    profile = (np.exp(-((hours - 7) ** 2) / 8) + np.exp(-((hours - 20) ** 2) / 6)) + 0.05
+    return profile / profile.sum()
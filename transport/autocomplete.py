@@ -0,0 +1,142 @@
+"""
+In-process location autocomplete index (No ORM)
+
+Location names and cities are normalized (lowercase, Vietnamese diacritics
+stripped) and indexed twice: a word-prefix trie for the common "type the start
+of a word" case, and a trigram posting list as a typo-tolerant fallback.
+The index is rebuilt when the network version changes (route or location writes
+append a NULL entry to trip_change_log) and at least every POPULARITY_TTL, so
+lookups run entirely in memory. Results rank prefix matches first, then by
+route popularity.
+"""
+from django.db import connection
+from typing import List, Dict, Any, Optional
+from utils.text_utils import normalize_text, tokenize, trigrams
+import threading
+import time
+from .models import Locations
+
+VERSION_CHECK_INTERVAL = 5.0
+POPULARITY_TTL = 3600.0
+MIN_SIMILARITY = 0.5
+MIN_FUZZY_LENGTH = 4
+
+# Match classes, best first
+FULL_PREFIX, WORD_PREFIX, FUZZY = 3, 2, 1
+
+
+class LocationIndex:
+    """Trie + trigram index over location names and cities"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._version: Optional[int] = None
+        self._built_at = 0.0
+        self._checked_at = 0.0
+        # (locations, popularity, normalized text, trie, trigram postings), swapped atomically
+        self._state = ({}, {}, {}, {}, {})
+
+    def refresh(self):
+        """Rebuild if the network version moved; checked at most every VERSION_CHECK_INTERVAL"""
+        current = time.monotonic()
+        if current - self._checked_at < VERSION_CHECK_INTERVAL and self._version is not None:
+            return
+        with self._lock:
+            if current - self._checked_at < VERSION_CHECK_INTERVAL and self._version is not None:
+                return
+            version = Locations.network_version()
+            if version != self._version or current - self._built_at > POPULARITY_TTL:
+                self._build()
+                self._version = version
+                self._built_at = current
+            self._checked_at = current
+
+    def _build(self):
+        """Load locations with their route popularity (trips touching them, last/next 30 days)"""
+        query = """
+            SELECT l.id, l.name, l.city, COALESCE(p.trips, 0)
+            FROM locations l
+            LEFT JOIN (
+                SELECT location_id, COUNT(*) as trips
+                FROM (
+                    SELECT r.start_location_id as location_id FROM trips t JOIN routes r ON t.route_id = r.id
+                    WHERE t.departure_time BETWEEN now() - interval '30 days' AND now() + interval '30 days'
+                    UNION ALL
+                    SELECT r.end_location_id FROM trips t JOIN routes r ON t.route_id = r.id
+                    WHERE t.departure_time BETWEEN now() - interval '30 days' AND now() + interval '30 days'
+                ) touched
+                GROUP BY location_id
+            ) p ON p.location_id = l.id
+        """
+        with connection.cursor() as cursor:
+            cursor.execute(query)
+            rows = cursor.fetchall()
+
+        locations, popularity, normalized, trie, grams = {}, {}, {}, {}, {}
+        for location_id, name, city, trips in rows:
+            locations[location_id] = {'id': location_id, 'name': name, 'city': city}
+            popularity[location_id] = trips
+            normalized[location_id] = normalize_text(f"{name} {city}")
+            for word in tokenize(f"{name} {city}"):
+                node = trie
+                for char in word:
+                    node = node.setdefault(char, {})
+                    node.setdefault('', set()).add(location_id)
+            for gram in trigrams(f"{name} {city}"):
+                grams.setdefault(gram, set()).add(location_id)
+
+        self._state = (locations, popularity, normalized, trie, grams)
+
+    @staticmethod
+    def _prefix_ids(trie: Dict[str, Any], word: str) -> set:
+        """Locations having a word that starts with `word`"""
+        node = trie
+        for char in word:
+            node = node.get(char)
+            if node is None:
+                return set()
+        return node.get('', set())
+
+    def search(self, query: str, limit: int = 10) -> List[Dict[str, Any]]:
+        """Locations matching a partial query, best first"""
+        self.refresh()
+        words = tokenize(query)
+        if not words:
+            return []
+        normalized_query = ' '.join(words)
+        locations, popularity, normalized, trie, postings = self._state
+
+        # Prefix pass: every query word must prefix a word of the location
+        matches = self._prefix_ids(trie, words[0])
+        for word in words[1:]:
+            matches = matches & self._prefix_ids(trie, word)
+        scored = {
+            location_id: (FULL_PREFIX if normalized[location_id].startswith(normalized_query)
+                          else WORD_PREFIX, 1.0)
+            for location_id in matches
+        }
+
+        # Trigram pass for typos when prefixes do not fill the page
+        if len(scored) < limit and len(normalized_query) >= MIN_FUZZY_LENGTH:
+            query_grams = trigrams(normalized_query)
+            shared: Dict[int, int] = {}
+            for gram in query_grams:
+                for location_id in postings.get(gram, ()):
+                    shared[location_id] = shared.get(location_id, 0) + 1
+            for location_id, count in shared.items():
+                similarity = count / len(query_grams)
+                if location_id not in scored and similarity >= MIN_SIMILARITY:
+                    scored[location_id] = (FUZZY, similarity)
+
+        ranked = sorted(
+            scored.items(),
+            key=lambda item: (-item[1][0], -item[1][1], -popularity[item[0]],
+                              locations[item[0]]['name'])
+        )
+        return [
+            dict(locations[location_id], popularity=popularity[location_id])
+            for location_id, _ in ranked[:limit]
+        ]
+
+
+index = LocationIndex()
@@ -0,0 +1,280 @@
+"""
+Multi-leg connection search over the route graph (No ORM)
+
+Each process keeps an in-memory timetable of the trips departing in the next
+WINDOW_DAYS: locations are nodes and trips are timed edges, indexed per origin
+by departure time. Changes are applied incrementally from trip_change_log
+(filled by triggers on trips, routes and locations), so queries never reload the
+whole timetable. Searches run a round-based earliest-arrival pass with a minimum
+transfer time, then enumerate itineraries of up to MAX_TRANSFERS transfers that
+arrive within ARRIVAL_SLACK of the earliest arrival, ranked by arrival time,
+transfers and total fare.
+"""
+from django.db import connection
+from django.utils.timezone import now, localdate, make_aware
+from typing import List, Dict, Any, Optional, NamedTuple
+from datetime import date, datetime, time, timedelta
+from bisect import bisect_left, insort
+import threading
+from .models import Trip
+
+WINDOW_DAYS = 14
+MIN_TRANSFER = timedelta(minutes=30)
+MAX_WAIT = timedelta(hours=12)
+MAX_TRANSFERS = 2
+ARRIVAL_SLACK = timedelta(hours=12)
+# Re-read log entries this far behind the last sync, for transactions that commit late
+SYNC_OVERLAP = timedelta(minutes=5)
+LOG_RETENTION = timedelta(days=1)
+
+
+class Leg(NamedTuple):
+    """A trip as a timed edge between two locations"""
+    departure_time: datetime
+    trip_id: int
+    route_id: int
+    origin_id: int
+    destination_id: int
+    arrival_time: datetime
+
+
+class ConnectionGraph:
+    """Per-process timetable graph, patched from trip_change_log before each search"""
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._loaded = False
+        self._window_start: Optional[date] = None
+        self._synced_at: Optional[datetime] = None
+        self._legs: Dict[int, Leg] = {}
+        self._departures: Dict[int, List[Leg]] = {}
+        self._routes_to: Dict[int, set] = {}
+        self._locations: Dict[int, Dict[str, Any]] = {}
+
+    def refresh(self):
+        """Bring the graph up to date: full rebuild on a new day, otherwise apply logged changes"""
+        with self._lock:
+            if (not self._loaded or self._window_start != localdate()
+                    or now() - self._synced_at > LOG_RETENTION - SYNC_OVERLAP):
+                self._rebuild()
+                return
+
+            with connection.cursor() as cursor:
+                cursor.execute("SELECT now()")
+                synced_at = cursor.fetchone()[0]
+                cursor.execute(
+                    "SELECT DISTINCT trip_id FROM trip_change_log WHERE changed_at >= %s",
+                    (self._synced_at - SYNC_OVERLAP,)
+                )
+                changed = [row[0] for row in cursor.fetchall()]
+
+            if None in changed:
+                self._rebuild()
+                return
+            if changed:
+                for trip_id in changed:
+                    self._remove(trip_id)
+                for leg in self._load_legs(changed):
+                    self._add(leg)
+            self._synced_at = synced_at
+
+    def _rebuild(self):
+        """Reload locations, routes and the trips departing in the window"""
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT now()")
+            synced_at = cursor.fetchone()[0]
+            cursor.execute("DELETE FROM trip_change_log WHERE changed_at < %s",
+                           (synced_at - LOG_RETENTION,))
+            cursor.execute("SELECT id, name, city FROM locations")
+            locations = {row[0]: {'id': row[0], 'name': row[1], 'city': row[2]}
+                         for row in cursor.fetchall()}
+            cursor.execute("SELECT start_location_id, end_location_id FROM routes")
+            routes = cursor.fetchall()
+
+        self._legs = {}
+        self._departures = {}
+        self._locations = locations
+        self._routes_to = {}
+        for start_id, end_id in routes:
+            self._routes_to.setdefault(end_id, set()).add(start_id)
+
+        self._window_start = localdate()
+        for leg in self._load_legs():
+            self._add(leg)
+        self._synced_at = synced_at
+        self._loaded = True
+
+    def _load_legs(self, trip_ids: List[int] = None) -> List[Leg]:
+        """Trips of the window (optionally only these ids) as legs"""
+        window_start = make_aware(datetime.combine(self._window_start, time.min))
+        params = [window_start, window_start + timedelta(days=WINDOW_DAYS + 1)]
+        id_filter = ""
+        if trip_ids is not None:
+            id_filter = "AND t.id = ANY(%s)"
+            params.append([int(trip_id) for trip_id in trip_ids])
+
+        query = f"""
+            SELECT t.departure_time, t.id, t.route_id, r.start_location_id, r.end_location_id,
+                   t.arrival_time
+            FROM {Trip.TABLE_NAME} t
+            JOIN routes r ON t.route_id = r.id
+            WHERE t.departure_time >= %s AND t.departure_time < %s
+            {id_filter}
+        """
+        with connection.cursor() as cursor:
+            cursor.execute(query, tuple(params))
+            return [Leg(*row) for row in cursor.fetchall()]
+
+    def _add(self, leg: Leg):
+        self._legs[leg.trip_id] = leg
+        insort(self._departures.setdefault(leg.origin_id, []), leg)
+
+    def _remove(self, trip_id: int):
+        leg = self._legs.pop(trip_id, None)
+        if leg is None:
+            return
+        departures = self._departures[leg.origin_id]
+        del departures[bisect_left(departures, leg)]
+
+    def _departing(self, location_id: int, earliest: datetime, latest: datetime) -> List[Leg]:
+        """Legs leaving a location with earliest <= departure_time <= latest"""
+        departures = self._departures.get(location_id, [])
+        start = bisect_left(departures, (earliest,))
+        result = []
+        for leg in departures[start:]:
+            if leg.departure_time > latest:
+                break
+            result.append(leg)
+        return result
+
+    def _can_reach(self, destination_id: int, max_legs: int) -> List[set]:
+        """reach[k]: locations with a route path of at most k legs to the destination"""
+        reach = [{destination_id}]
+        for _ in range(max_legs):
+            frontier = set(reach[-1])
+            for location_id in reach[-1]:
+                frontier |= self._routes_to.get(location_id, set())
+            reach.append(frontier)
+        return reach
+
+    def earliest_arrival(self, origin_id: int, destination_id: int, depart_after: datetime,
+                         depart_before: datetime, max_transfers: int = MAX_TRANSFERS) -> Optional[datetime]:
+        """Round-based earliest arrival at the destination using at most max_transfers transfers"""
+        best: Dict[int, datetime] = {}
+        # Round 1: direct departures from the origin inside the departure window
+        improved = {}
+        for leg in self._departing(origin_id, depart_after, depart_before):
+            current = improved.get(leg.destination_id)
+            if current is None or leg.arrival_time < current:
+                improved[leg.destination_id] = leg.arrival_time
+        best.update(improved)
+
+        for _ in range(max_transfers):
+            next_improved = {}
+            for location_id, arrival in improved.items():
+                if location_id in (origin_id, destination_id):
+                    continue
+                for leg in self._departing(location_id, arrival + MIN_TRANSFER, arrival + MAX_WAIT):
+                    current = next_improved.get(leg.destination_id, best.get(leg.destination_id))
+                    if current is None or leg.arrival_time < current:
+                        next_improved[leg.destination_id] = leg.arrival_time
+            best.update(next_improved)
+            improved = next_improved
+            if not improved:
+                break
+        return best.get(destination_id)
+
+    def search(self, origin_id: int, destination_id: int, travel_date: date,
+               max_transfers: int = MAX_TRANSFERS, limit: int = 10) -> List[Dict[str, Any]]:
+        """Ranked itineraries from origin to destination departing on travel_date"""
+        self.refresh()
+        depart_after = max(make_aware(datetime.combine(travel_date, time.min)), now())
+        depart_before = make_aware(datetime.combine(travel_date, time.max))
+        if depart_after >= depart_before or origin_id == destination_id:
+            return []
+
+        with self._lock:
+            earliest = self.earliest_arrival(origin_id, destination_id, depart_after,
+                                             depart_before, max_transfers)
+            if earliest is None:
+                return []
+            cutoff = earliest + ARRIVAL_SLACK
+            reach = self._can_reach(destination_id, max_transfers + 1)
+            paths = []
+
+            def extend(path: List[Leg], visited: set):
+                legs_left = max_transfers + 1 - len(path)
+                last = path[-1]
+                if last.destination_id == destination_id:
+                    paths.append(list(path))
+                    return
+                if not legs_left or last.destination_id not in reach[legs_left]:
+                    return
+                for leg in self._departing(last.destination_id, last.arrival_time + MIN_TRANSFER,
+                                           last.arrival_time + MAX_WAIT):
+                    if leg.arrival_time <= cutoff and leg.destination_id not in visited:
+                        path.append(leg)
+                        visited.add(leg.destination_id)
+                        extend(path, visited)
+                        visited.discard(leg.destination_id)
+                        path.pop()
+
+            for leg in self._departing(origin_id, depart_after, depart_before):
+                if leg.arrival_time <= cutoff and leg.destination_id in reach[max_transfers + 1]:
+                    extend([leg], {origin_id, leg.destination_id})
+
+            locations = self._locations
+
+        return _rank(paths, locations, limit)
+
+
+def _rank(paths: List[List[Leg]], locations: Dict[int, Dict[str, Any]],
+          limit: int) -> List[Dict[str, Any]]:
+    """Attach live fares and seats (one query), drop sold-out itineraries, rank and format"""
+    trip_ids = list({leg.trip_id for path in paths for leg in path})
+    if not trip_ids:
+        return []
+    with connection.cursor() as cursor:
+        cursor.execute(f"""
+            SELECT t.id, t.price_per_seat, b.total_seats - COALESCE(s.booked_seats, 0)
+            FROM {Trip.TABLE_NAME} t
+            JOIN buses b ON t.bus_id = b.id
+            LEFT JOIN {Trip.STATS_TABLE_NAME} s ON s.trip_id = t.id
+            WHERE t.id = ANY(%s)
+        """, (trip_ids,))
+        live = {row[0]: (row[1], row[2]) for row in cursor.fetchall()}
+
+    itineraries = []
+    for path in paths:
+        if any(leg.trip_id not in live or live[leg.trip_id][1] <= 0 for leg in path):
+            continue
+        itineraries.append({
+            'departure_time': path[0].departure_time,
+            'arrival_time': path[-1].arrival_time,
+            'duration_minutes': int((path[-1].arrival_time - path[0].departure_time).total_seconds() // 60),
+            'transfers': len(path) - 1,
+            'total_price': sum(live[leg.trip_id][0] for leg in path),
+            'seats_left': min(live[leg.trip_id][1] for leg in path),
+            'legs': [
+                {
+                    'trip_id': leg.trip_id,
+                    'route_id': leg.route_id,
+                    'from_location': locations.get(leg.origin_id),
+                    'to_location': locations.get(leg.destination_id),
+                    'departure_time': leg.departure_time,
+                    'arrival_time': leg.arrival_time,
+                    'price_per_seat': live[leg.trip_id][0],
+                    'seats_left': live[leg.trip_id][1],
+                    'transfer_minutes': int((leg.departure_time - path[i - 1].arrival_time)
+                                            .total_seconds() // 60) if i else 0,
+                }
+                for i, leg in enumerate(path)
+            ]
+        })
+
+    itineraries.sort(key=lambda it: (it['arrival_time'], it['transfers'],
+                                     it['total_price'], -it['departure_time'].timestamp()))
+    return itineraries[:limit]
+
+
+graph = ConnectionGraph()
@@ -0,0 +1,202 @@
+"""
+Fleet-to-trip assignment for upcoming trips (No ORM)
+
+Buses are reassigned to the trips of a date window so that no bus is on two trips
+at once (with MIN_TURNAROUND between trips) and as few seats as possible run empty.
+Demand per trip is forecast as the larger of its booked seats and the average booked
+seats of recent departures on the same route at the same hour. Trips that already
+have tickets keep their bus (tickets point at that bus's seats), as do trips leaving
+within FREEZE_WINDOW; they still block their bus for everyone else.
+
+Trips are swept in departure order (greedy interval partitioning): buses coming
+back from a trip re-enter an idle pool kept sorted by capacity, and each trip takes
+the smallest idle bus covering its forecast (best fit), or the largest idle bus when
+none does. The plan is written with one UPDATE ... FROM unnest in one transaction;
+trips_bus_no_overlap is checked at the end of that statement.
+"""
+from django.conf import settings
+from django.db import connection, transaction, IntegrityError
+from django.utils.timezone import now
+from typing import List, Dict, Any, NamedTuple, Tuple
+from datetime import datetime, timedelta
+from bisect import bisect_left, insort
+from itertools import chain
+import heapq
+from utils.partitions import recent_cutoff
+from .models import Trip, EXCLUSION_VIOLATION
+
+MIN_TURNAROUND = timedelta(minutes=30)
+FREEZE_WINDOW = timedelta(hours=2)
+MAX_TRIPS = 20_000
+# Fixed trips this far outside the window can still block a bus inside it
+BLOCKING_MARGIN = timedelta(days=2)
+PREVIEW_SIZE = 50
+
+
+class FleetTrip(NamedTuple):
+    """A trip as an interval to cover with a bus"""
+    departure_time: datetime
+    trip_id: int
+    bus_id: int
+    arrival_time: datetime
+    demand: int
+    fixed: bool
+
+
+class StalePlanError(Exception):
+    """Trips changed (or got tickets) between planning and writing the plan"""
+
+
+class FleetPlanner:
+    """Snapshot of the fleet and of the trips around a window, and the assignment over it"""
+
+    def __init__(self, trips: List[FleetTrip], seats: Dict[int, int]):
+        self.trips = trips
+        self.seats = seats
+        self.free = [trip for trip in trips if not trip.fixed]
+        self._fixed: Dict[int, List[Tuple[datetime, datetime]]] = {}
+        for trip in trips:
+            if trip.fixed:
+                self._fixed.setdefault(trip.bus_id, []).append((trip.departure_time, trip.arrival_time))
+        for intervals in self._fixed.values():
+            intervals.sort()
+
+    @classmethod
+    def load(cls, date_from: datetime, date_to: datetime, route_id: int = None) -> 'FleetPlanner':
+        """Trips overlapping the window (free ones: departing in it) with their demand forecast"""
+        current_time = now()
+        route_filter = "AND t.route_id = %s" if route_id is not None else ""
+        query = f"""
+            WITH history AS (
+                SELECT t.route_id,
+                       EXTRACT(HOUR FROM t.departure_time AT TIME ZONE %s) as hour,
+                       AVG(COALESCE(s.booked_seats, 0)) as booked_seats
+                FROM {Trip.TABLE_NAME} t
+                LEFT JOIN {Trip.STATS_TABLE_NAME} s ON s.trip_id = t.id
+                WHERE t.departure_time >= %s AND t.departure_time < %s
+                GROUP BY t.route_id, hour
+            )
+            SELECT
+                t.departure_time, t.id, t.bus_id, t.arrival_time,
+                GREATEST(COALESCE(s.booked_seats, 0), CEIL(COALESCE(h.booked_seats, 0)))::int,
+                NOT (t.departure_time >= GREATEST(%s, %s) AND t.departure_time < %s {route_filter})
+                    OR EXISTS (SELECT 1 FROM tickets tk
+                               WHERE tk.trip_id = t.id AND tk.departure_time = t.departure_time)
+            FROM {Trip.TABLE_NAME} t
+            LEFT JOIN {Trip.STATS_TABLE_NAME} s ON s.trip_id = t.id
+            LEFT JOIN history h ON h.route_id = t.route_id
+                 AND h.hour = EXTRACT(HOUR FROM t.departure_time AT TIME ZONE %s)
+            WHERE t.departure_time < %s AND t.arrival_time > %s
+            ORDER BY t.departure_time, t.id
+        """
+        params = [settings.TIME_ZONE, recent_cutoff(), current_time,
+                  date_from, current_time + FREEZE_WINDOW, date_to]
+        if route_id is not None:
+            params.append(route_id)
+        params += [settings.TIME_ZONE, date_to + BLOCKING_MARGIN, date_from - BLOCKING_MARGIN]
+
+        with connection.cursor() as cursor:
+            cursor.execute(query, tuple(params))
+            trips = [FleetTrip(*row) for row in cursor.fetchall()]
+            cursor.execute("SELECT id, total_seats FROM buses")
+            seats = dict(cursor.fetchall())
+        return cls(trips, seats)
+
+    def _clear(self, bus_id: int, trip: FleetTrip) -> bool:
+        """No fixed trip of the bus within MIN_TURNAROUND of this trip"""
+        intervals = self._fixed.get(bus_id)
+        if not intervals:
+            return True
+        # Fixed trips of one bus never overlap, so the last one starting before this
+        # trip ends (plus turnaround) is the only one that can clash
+        index = bisect_left(intervals, (trip.arrival_time + MIN_TURNAROUND,))
+        return index == 0 or intervals[index - 1][1] + MIN_TURNAROUND <= trip.departure_time
+
+    def assign(self) -> Tuple[Dict[int, int], List[FleetTrip]]:
+        """Best-fit greedy sweep; returns trip_id -> bus_id and the trips no bus could take"""
+        pool = sorted((seats, bus_id) for bus_id, seats in self.seats.items())
+        returning: List[Tuple[datetime, int]] = []
+        assignment: Dict[int, int] = {}
+        unassigned = []
+
+        for trip in self.free:
+            while returning and returning[0][0] <= trip.departure_time:
+                _, bus_id = heapq.heappop(returning)
+                insort(pool, (self.seats[bus_id], bus_id))
+
+            # Smallest bus covering the demand first, then the largest ones that fall short
+            start = bisect_left(pool, (trip.demand,))
+            for index in chain(range(start, len(pool)), range(start - 1, -1, -1)):
+                bus_id = pool[index][1]
+                if self._clear(bus_id, trip):
+                    del pool[index]
+                    heapq.heappush(returning, (trip.arrival_time + MIN_TURNAROUND, bus_id))
+                    assignment[trip.trip_id] = bus_id
+                    break
+            else:
+                unassigned.append(trip)
+        return assignment, unassigned
+
+    def empty_seats(self, assignment: Dict[int, int] = None) -> Dict[str, int]:
+        """Seats running empty and forecast passengers without a seat, over the free trips"""
+        empty = unserved = 0
+        for trip in self.free:
+            capacity = self.seats.get((assignment or {}).get(trip.trip_id, trip.bus_id), 0)
+            empty += max(capacity - trip.demand, 0)
+            unserved += max(trip.demand - capacity, 0)
+        return {'empty_seats': empty, 'unserved_demand': unserved}
+
+
+def assign_fleet(date_from: datetime, date_to: datetime, route_id: int = None,
+                 dry_run: bool = False) -> Dict[str, Any]:
+    """Plan bus assignments for trips departing in [date_from, date_to) and write the changes"""
+    planner = FleetPlanner.load(date_from, date_to, route_id)
+    if len(planner.free) > MAX_TRIPS:
+        raise ValueError(f'{len(planner.free)} trips to assign; the limit is {MAX_TRIPS}.')
+
+    assignment, unassigned = planner.assign()
+    changes = [(trip.trip_id, assignment[trip.trip_id], trip.bus_id) for trip in planner.free
+               if trip.trip_id in assignment and assignment[trip.trip_id] != trip.bus_id]
+    result = {
+        'trips': len(planner.free),
+        'fixed': len(planner.trips) - len(planner.free),
+        'buses': len(planner.seats),
+        'changed': len(changes),
+        'before': planner.empty_seats(),
+        'after': planner.empty_seats(assignment),
+        'unassigned': [trip.trip_id for trip in unassigned],
+        'updated': 0,
+    }
+    if dry_run:
+        result['preview'] = [{'trip_id': trip_id, 'bus_id': bus_id, 'previous_bus_id': old_bus_id}
+                             for trip_id, bus_id, old_bus_id in changes[:PREVIEW_SIZE]]
+        return result
+    if unassigned or not changes:
+        return result
+
+    trip_ids = [change[0] for change in changes]
+    try:
+        with transaction.atomic(), connection.cursor() as cursor:
+            # Wait for bookings in flight (ticket inserts key-share lock their trip)
+            cursor.execute(f"SELECT id FROM {Trip.TABLE_NAME} WHERE id = ANY(%s) ORDER BY id FOR UPDATE",
+                           (trip_ids,))
+            cursor.execute(f"""
+                UPDATE {Trip.TABLE_NAME} t
+                SET bus_id = v.bus_id
+                FROM unnest(%s::bigint[], %s::bigint[], %s::bigint[]) AS v(id, bus_id, previous_bus_id)
+                WHERE t.id = v.id AND t.bus_id = v.previous_bus_id
+                  AND NOT EXISTS (SELECT 1 FROM tickets tk
+                                  WHERE tk.trip_id = t.id AND tk.departure_time = t.departure_time)
+            """, (trip_ids, [change[1] for change in changes], [change[2] for change in changes]))
+            if cursor.rowcount != len(changes):
+                raise StalePlanError(f'{len(changes) - cursor.rowcount} trips changed while planning; '
+                                     f'nothing was reassigned.')
+            result['updated'] = cursor.rowcount
+    except IntegrityError as e:
+        if getattr(e.__cause__, 'pgcode', None) != EXCLUSION_VIOLATION:
+            raise
+        # A trip was added to one of the buses after the plan was made
+        raise StalePlanError('Bus schedules changed while planning; nothing was reassigned.') from e
+    Trip.invalidate_fare_calendar(trip_ids)
+    Trip.invalidate_manifest(trip_ids)
+    return result
@@ -0,0 +1,207 @@
+"""
+Geo utilities for locations and routes (NumPy, No ORM)
+
+- haversine_km / distance_matrix: vectorized great-circle distances
+- LocationGrid: in-process grid index over geocoded locations for k-nearest and
+  radius queries, rebuilt when the network version changes
+- check_route_distances: compares every routes.distance_km with the great-circle
+  distance between its stations in one pass, and optionally backfills estimates
+  with a single bulk UPDATE
+"""
+from django.db import connection, transaction
+from typing import List, Dict, Any, Optional, Tuple
+import math
+import threading
+import time
+import numpy as np
+from .models import Locations, Route
+
+EARTH_RADIUS_KM = 6371.0088
+# Typical road distance / great-circle distance for intercity coach routes
+ROAD_FACTOR = 1.3
+# A road distance outside [1, MAX_ROAD_FACTOR] x great-circle distance is flagged
+MAX_ROAD_FACTOR = 2.5
+
+CELL_DEGREES = 0.5
+KM_PER_DEGREE = math.pi * EARTH_RADIUS_KM / 180
+VERSION_CHECK_INTERVAL = 5.0
+
+
+def haversine_km(lat1, lon1, lat2, lon2) -> np.ndarray:
+    """Great-circle distance in km; inputs broadcast like any NumPy ufunc"""
+    lat1, lon1, lat2, lon2 = (np.radians(np.asarray(value, dtype=np.float64))
+                              for value in (lat1, lon1, lat2, lon2))
+    a = (np.sin((lat2 - lat1) / 2) ** 2
+         + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2)
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(np.clip(a, 0.0, 1.0)))
+
+
+def distance_matrix(lat_a, lon_a, lat_b=None, lon_b=None) -> np.ndarray:
+    """len(a) x len(b) distance matrix in km (b defaults to a)"""
+    lat_a, lon_a = np.asarray(lat_a, dtype=np.float64), np.asarray(lon_a, dtype=np.float64)
+    if lat_b is None:
+        lat_b, lon_b = lat_a, lon_a
+    return haversine_km(lat_a[:, None], lon_a[:, None],
+                        np.asarray(lat_b, dtype=np.float64)[None, :],
+                        np.asarray(lon_b, dtype=np.float64)[None, :])
+
+
+class LocationGrid:
+    """Buckets geocoded locations into CELL_DEGREES cells and searches outward ring by ring"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._version: Optional[int] = None
+        self._checked_at = 0.0
+        # (locations, latitudes, longitudes, cells: (row, col) -> index array), swapped atomically
+        self._state = ([], np.zeros(0), np.zeros(0), {})
+
+    def refresh(self):
+        """Rebuild if the network version moved; checked at most every VERSION_CHECK_INTERVAL"""
+        current = time.monotonic()
+        if current - self._checked_at < VERSION_CHECK_INTERVAL and self._version is not None:
+            return
+        with self._lock:
+            if current - self._checked_at < VERSION_CHECK_INTERVAL and self._version is not None:
+                return
+            version = Locations.network_version()
+            if version != self._version:
+                self._build()
+                self._version = version
+            self._checked_at = current
+
+    def _build(self):
+        with connection.cursor() as cursor:
+            cursor.execute("""
+                SELECT id, name, city, latitude, longitude FROM locations
+                WHERE latitude IS NOT NULL AND longitude IS NOT NULL
+            """)
+            rows = cursor.fetchall()
+
+        locations = [{'id': row[0], 'name': row[1], 'city': row[2],
+                      'latitude': row[3], 'longitude': row[4]} for row in rows]
+        latitudes = np.array([row[3] for row in rows], dtype=np.float64)
+        longitudes = np.array([row[4] for row in rows], dtype=np.float64)
+
+        cells: Dict[Tuple[int, int], List[int]] = {}
+        for i, key in enumerate(zip(np.floor(latitudes / CELL_DEGREES).astype(int),
+                                    np.floor(longitudes / CELL_DEGREES).astype(int))):
+            cells.setdefault(key, []).append(i)
+        self._state = (locations, latitudes, longitudes,
+                       {key: np.array(indexes) for key, indexes in cells.items()})
+
+    def nearest(self, latitude: float, longitude: float, k: int = 5,
+                radius_km: float = None) -> List[Dict[str, Any]]:
+        """Up to k locations closest to a point, optionally within radius_km, nearest first"""
+        self.refresh()
+        locations, latitudes, longitudes, cells = self._state
+        if not locations:
+            return []
+
+        row, col = int(math.floor(latitude / CELL_DEGREES)), int(math.floor(longitude / CELL_DEGREES))
+        # Every cell lies within max_ring rings of the query cell
+        rows = [key[0] for key in cells]
+        cols = [key[1] for key in cells]
+        max_ring = max(abs(row - min(rows)), abs(row - max(rows)),
+                       abs(col - min(cols)), abs(col - max(cols)))
+
+        candidates = np.zeros(0, dtype=int)
+        distances = np.zeros(0)
+        for ring in range(max_ring + 1):
+            found = [cells[key] for key in _ring_cells(row, col, ring) if key in cells]
+            if found:
+                indexes = np.concatenate(found)
+                candidates = np.concatenate([candidates, indexes])
+                distances = np.concatenate([distances, haversine_km(
+                    latitude, longitude, latitudes[indexes], longitudes[indexes])])
+
+            # Anything outside this ring is at least `reach` km away
+            reach = ring * CELL_DEGREES * KM_PER_DEGREE * math.cos(
+                math.radians(min(abs(latitude) + (ring + 1) * CELL_DEGREES, 89.0)))
+            if radius_km is not None and reach >= radius_km:
+                break
+            if radius_km is None and len(candidates) >= k and np.partition(distances, k - 1)[k - 1] <= reach:
+                break
+
+        if radius_km is not None:
+            within = distances <= radius_km
+            candidates, distances = candidates[within], distances[within]
+        order = np.argsort(distances, kind='stable')[:k]
+        return [dict(locations[candidates[i]], distance_km=round(float(distances[i]), 3)) for i in order]
+
+
+def _ring_cells(row: int, col: int, ring: int):
+    """Cells on the square ring at Chebyshev distance `ring` from (row, col)"""
+    if ring == 0:
+        yield row, col
+        return
+    for d in range(-ring, ring + 1):
+        yield row - ring, col + d
+        yield row + ring, col + d
+    for d in range(-ring + 1, ring):
+        yield row + d, col - ring
+        yield row + d, col + ring
+
+
+def check_route_distances(fix: bool = False, overwrite: bool = False) -> Dict[str, Any]:
+    """
+    Validate every route's distance_km against ROAD_FACTOR x great-circle distance in one pass.
+    fix: write the estimate for routes whose distance is missing or implausible;
+    overwrite: write it for every route whose stations are geocoded.
+    """
+    with connection.cursor() as cursor:
+        cursor.execute(f"""
+            SELECT r.id, r.distance_km, sl.latitude, sl.longitude, el.latitude, el.longitude
+            FROM {Route.TABLE_NAME} r
+            JOIN locations sl ON r.start_location_id = sl.id
+            JOIN locations el ON r.end_location_id = el.id
+            ORDER BY r.id
+        """)
+        rows = cursor.fetchall()
+
+    if not rows:
+        return {'routes': 0, 'ok': 0, 'missing_coordinates': [], 'too_short': [],
+                'too_long': [], 'updated': 0}
+    table = np.array(rows, dtype=np.float64)  # NULL coordinates become NaN
+    route_id, recorded = table[:, 0].astype(np.int64), table[:, 1]
+
+    great_circle = haversine_km(table[:, 2], table[:, 3], table[:, 4], table[:, 5])
+    geocoded = ~np.isnan(great_circle)
+    estimate = np.round(great_circle * ROAD_FACTOR, 1)
+    too_short = geocoded & ((recorded <= 0) | (recorded < great_circle))
+    too_long = geocoded & (recorded > great_circle * MAX_ROAD_FACTOR) & (great_circle > 0)
+
+    if overwrite:
+        to_write = geocoded & (estimate != recorded)
+    elif fix:
+        to_write = too_short | too_long
+    else:
+        to_write = np.zeros(len(route_id), dtype=bool)
+
+    updated = 0
+    if to_write.any():
+        with transaction.atomic(), connection.cursor() as cursor:
+            cursor.execute(f"""
+                UPDATE {Route.TABLE_NAME} r
+                SET distance_km = v.distance_km
+                FROM unnest(%s::bigint[], %s::float8[]) AS v(id, distance_km)
+                WHERE r.id = v.id
+            """, (route_id[to_write].tolist(), estimate[to_write].tolist()))
+            updated = cursor.rowcount
+
+    def describe(mask):
+        return [{'route_id': int(route_id[i]), 'distance_km': float(recorded[i]),
+                 'great_circle_km': round(float(great_circle[i]), 1),
+                 'estimate_km': float(estimate[i])} for i in np.flatnonzero(mask)]
+
+    return {
+        'routes': len(route_id),
+        'ok': int((geocoded & ~too_short & ~too_long).sum()),
+        'missing_coordinates': route_id[~geocoded].tolist(),
+        'too_short': describe(too_short),
+        'too_long': describe(too_long),
+        'updated': updated,
+    }
+
+
+grid = LocationGrid()
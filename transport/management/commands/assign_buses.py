@@ -0,0 +1,43 @@
+"""
+Reassign buses to upcoming trips to minimise empty seats
+"""
+from django.core.management.base import BaseCommand, CommandError
+from django.utils.timezone import make_aware, localdate
+from datetime import datetime, time, timedelta
+from transport.fleet import assign_fleet, StalePlanError
+import time as clock
+
+
+class Command(BaseCommand):
+    help = 'Reassign buses to the trips of the next days so no bus overlaps and fewer seats run empty'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=7,
+                            help='Assign trips departing within this many days (default: 7)')
+        parser.add_argument('--route', type=int, help='Only reassign trips of this route')
+        parser.add_argument('--dry-run', action='store_true',
+                            help='Compute the plan without writing it')
+
+    def handle(self, *args, **options):
+        today = localdate()
+        started = clock.perf_counter()
+        try:
+            result = assign_fleet(
+                make_aware(datetime.combine(today, time.min)),
+                make_aware(datetime.combine(today + timedelta(days=options['days']), time.min)),
+                route_id=options['route'],
+                dry_run=options['dry_run']
+            )
+        except (ValueError, StalePlanError) as e:
+            raise CommandError(str(e))
+        elapsed = clock.perf_counter() - started
+
+        self.stdout.write(
+            f"{result['trips']} trips on {result['buses']} buses: {result['changed']} changed, "
+            f"{result['updated']} updated in {elapsed:.2f}s; empty seats "
+            f"{result['before']['empty_seats']} -> {result['after']['empty_seats']}"
+            + (' [dry run]' if options['dry_run'] else '')
+        )
+        if result['unassigned']:
+            self.stderr.write(f"{len(result['unassigned'])} trips left without a bus; "
+                              f"nothing was reassigned.")
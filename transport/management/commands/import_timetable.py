@@ -0,0 +1,68 @@
+"""
+Import an operator's stops, routes, buses and trips from CSV / GTFS-style files
+"""
+from django.core.management.base import BaseCommand, CommandError
+from transport.timetable import import_timetable, open_feed, FILES, BATCH_SIZE
+import json
+
+
+class Command(BaseCommand):
+    help = ('Load stops, routes, buses (with seats) and trips from a feed directory or .zip, '
+            'updating rows imported earlier from the same source')
+
+    def add_arguments(self, parser):
+        parser.add_argument('feed', nargs='?',
+                            help='Directory or .zip with stops.txt, routes.txt, buses.txt, trips.txt (or .csv)')
+        for kind in FILES:
+            parser.add_argument(f'--{kind}', metavar='FILE', help=f'{kind} file (overrides the feed)')
+        parser.add_argument('--source', default='default',
+                            help='Operator the feed ids belong to (default: default)')
+        parser.add_argument('--batch-size', type=int, default=BATCH_SIZE,
+                            help=f'Rows written per statement (default: {BATCH_SIZE})')
+        parser.add_argument('--dry-run', action='store_true',
+                            help='Validate and load everything, then roll it back')
+        parser.add_argument('--json', action='store_true', help='Print the full report as JSON')
+
+    def handle(self, *args, **options):
+        try:
+            files = open_feed(options['feed']) if options['feed'] else {}
+            for kind in FILES:
+                if options[kind]:
+                    files[kind] = open(options[kind], 'rb')
+        except (OSError, ValueError) as e:
+            raise CommandError(str(e))
+        if not files:
+            raise CommandError('Give a feed or at least one of --stops, --routes, --buses, --trips.')
+
+        def progress(kind, counts):
+            if not options['json']:
+                self.stdout.write(
+                    f"  {kind}: {counts['rows']} rows, {counts['inserted']} inserted, "
+                    f"{counts['updated']} updated, {counts['unchanged']} unchanged, {counts['errors']} errors"
+                )
+
+        try:
+            report = import_timetable(files, source=options['source'], dry_run=options['dry_run'],
+                                      batch_size=options['batch_size'], progress=progress)
+        except ValueError as e:
+            raise CommandError(str(e))
+        finally:
+            for stream in files.values():
+                stream.close()
+
+        if options['json']:
+            self.stdout.write(json.dumps(report, indent=2, default=str))
+            return
+        for error in report['errors']:
+            self.stdout.write(self.style.WARNING(
+                f"  {error['file']} line {error['line']}"
+                + (f" ({error['id']})" if error['id'] else '') + f": {error['error']}"
+            ))
+        if report['error_count'] > len(report['errors']):
+            self.stdout.write(f"  ... {report['error_count'] - len(report['errors'])} more errors")
+        self.stdout.write(self.style.SUCCESS(
+            ', '.join(f"{kind}: {counts['inserted']} inserted, {counts['updated']} updated"
+                      for kind, counts in report['files'].items())
+            + f"; {report['seats_created']} seats created, {report['error_count']} rows rejected "
+            f"in {report['elapsed_seconds']}s" + (' [dry run, rolled back]' if report['dry_run'] else '')
+        ))
@@ -0,0 +1,48 @@
+"""
+Create upcoming monthly partitions of trips, bookings and tickets and archive old ones
+"""
+from django.core.management.base import BaseCommand
+from utils.partitions import (
+    ARCHIVE_SCHEMA, list_partitions, create_partitions, archive_partitions
+)
+
+
+class Command(BaseCommand):
+    help = 'Create future monthly partitions and detach/archive partitions past the retention window'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--ahead', type=int, default=3,
+                            help='Months ahead of the current one to create (default: 3)')
+        parser.add_argument('--archive', action='store_true',
+                            help=f'Detach months older than --retain into the {ARCHIVE_SCHEMA} schema')
+        parser.add_argument('--retain', type=int, default=24,
+                            help='Months of history kept attached (default: 24)')
+        parser.add_argument('--drop', action='store_true',
+                            help='With --archive, drop detached partitions instead of keeping them')
+        parser.add_argument('--dry-run', action='store_true',
+                            help='Only report what --archive would detach')
+        parser.add_argument('--list', action='store_true', help='List partitions and exit')
+
+    def handle(self, *args, **options):
+        if options['list']:
+            for partition in list_partitions():
+                self.stdout.write(f"{partition['name']:<24} ~{partition['estimated_rows']} rows")
+            return
+
+        created = create_partitions(months_ahead=options['ahead'])
+        self.stdout.write(f"Created {len(created)} partitions" + (f": {', '.join(created)}" if created else ''))
+
+        if options['archive']:
+            result = archive_partitions(retain_months=options['retain'], drop=options['drop'],
+                                        dry_run=options['dry_run'])
+            suffix = ' [dry run]' if options['dry_run'] else ''
+            if result['archived']:
+                self.stdout.write(f"Archived to {ARCHIVE_SCHEMA}: {', '.join(result['archived'])}{suffix}")
+            if result['dropped']:
+                self.stdout.write(f"Dropped: {', '.join(result['dropped'])}{suffix}")
+            if result['kept']:
+                self.stdout.write(self.style.WARNING(
+                    f"Kept (bookings for trips still in the window): {', '.join(result['kept'])}"
+                ))
+            if not any(result.values()):
+                self.stdout.write(f"Nothing older than {options['retain']} months")
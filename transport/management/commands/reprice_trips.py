@@ -0,0 +1,34 @@
+"""
+Recompute dynamic fares for all upcoming trips
+"""
+from django.core.management.base import BaseCommand
+from transport.pricing import PricingEngine
+import time as clock
+
+
+class Command(BaseCommand):
+    help = 'Reprice upcoming trips from load factor, days to departure and route demand'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true',
+                            help='Compute new prices without writing them')
+        parser.add_argument('--loop', action='store_true', help='Keep repricing until interrupted')
+        parser.add_argument('--interval', type=float, default=300.0,
+                            help='Seconds between runs with --loop (default: 300)')
+
+    def handle(self, *args, **options):
+        while True:
+            started = clock.perf_counter()
+            engine = PricingEngine.load()
+            result = engine.reprice(dry_run=options['dry_run'])
+            elapsed = clock.perf_counter() - started
+
+            self.stdout.write(
+                f"{result['trips']} upcoming trips: {result['changed']} changed "
+                f"({result['raised']} up, {result['lowered']} down), "
+                f"{result['updated']} updated in {elapsed:.2f}s"
+                + (' [dry run]' if options['dry_run'] else '')
+            )
+            if not options['loop']:
+                break
+            clock.sleep(options['interval'])
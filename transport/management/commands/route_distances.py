@@ -0,0 +1,38 @@
+"""
+Validate routes.distance_km against station coordinates and backfill estimates
+"""
+from django.core.management.base import BaseCommand
+from transport.geo import check_route_distances, ROAD_FACTOR, MAX_ROAD_FACTOR
+import json
+
+
+class Command(BaseCommand):
+    help = (f'Compare each route distance with {ROAD_FACTOR} x the great-circle distance '
+            f'between its stations (flagged outside 1x-{MAX_ROAD_FACTOR}x)')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--fix', action='store_true',
+                            help='Replace missing or implausible distances with the estimate')
+        parser.add_argument('--overwrite', action='store_true',
+                            help='Replace every distance whose stations are geocoded')
+        parser.add_argument('--json', action='store_true', help='Print the full report as JSON')
+
+    def handle(self, *args, **options):
+        report = check_route_distances(fix=options['fix'], overwrite=options['overwrite'])
+        if options['json']:
+            self.stdout.write(json.dumps(report, indent=2))
+            return
+
+        self.stdout.write(
+            f"{report['routes']} routes: {report['ok']} ok, "
+            f"{len(report['too_short'])} too short, {len(report['too_long'])} too long, "
+            f"{len(report['missing_coordinates'])} without coordinates"
+        )
+        for label in ('too_short', 'too_long'):
+            for route in report[label]:
+                self.stdout.write(
+                    f"  route {route['route_id']}: {route['distance_km']} km recorded, "
+                    f"{route['great_circle_km']} km great-circle, estimate {route['estimate_km']} km"
+                )
+        if report['updated']:
+            self.stdout.write(self.style.SUCCESS(f"Updated {report['updated']} routes"))
@@ -0,0 +1,74 @@
+"""
+Occupancy and revenue analytics report, or a benchmark on a generated dataset
+"""
+from django.core.management.base import BaseCommand, CommandError
+from django.utils.dateparse import parse_date
+from django.utils.timezone import make_aware
+from datetime import datetime, time, timedelta
+from transport.analytics import TripFrame
+import json
+import time as clock
+
+
+class Command(BaseCommand):
+    help = 'Compute load factors, revenue per km and departure-hour heatmaps with NumPy'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--date-from', help='First departure date (YYYY-MM-DD)')
+        parser.add_argument('--date-to', help='Last departure date (YYYY-MM-DD)')
+        parser.add_argument('--route', type=int, help='Only this route id')
+        parser.add_argument('--top', type=int, default=10, help='Routes to print (default: 10)')
+        parser.add_argument('--json', action='store_true', help='Print the full report as JSON')
+        parser.add_argument('--benchmark', action='store_true',
+                            help='Run on a generated dataset instead of the database')
+        parser.add_argument('--trips', type=int, default=50_000,
+                            help='Generated trips for --benchmark (default: 50000)')
+        parser.add_argument('--bookings', type=int, default=1_000_000,
+                            help='Generated bookings for --benchmark (default: 1000000)')
+        parser.add_argument('--seed', type=int, default=0, help='Random seed for --benchmark')
+
+    def handle(self, *args, **options):
+        started = clock.perf_counter()
+        if options['benchmark']:
+            frame = TripFrame.generate(n_trips=options['trips'], n_bookings=options['bookings'],
+                                       seed=options['seed'])
+            source = f"generated {options['bookings']} bookings over {options['trips']} trips"
+        else:
+            frame = TripFrame.load(
+                date_from=self._parse_day(options['date_from']),
+                date_to=self._parse_day(options['date_to'], next_day=True),
+                route_id=options['route']
+            )
+            source = 'database'
+        loaded = clock.perf_counter()
+
+        report = frame.report()
+        computed = clock.perf_counter()
+
+        if options['json']:
+            self.stdout.write(json.dumps(report, ensure_ascii=False, indent=2))
+            return
+
+        self.stdout.write(f"Source: {source}")
+        self.stdout.write(f"Load: {loaded - started:.3f}s, compute: {computed - loaded:.3f}s "
+                          f"({len(frame)} trips)")
+        for key, value in report['summary'].items():
+            self.stdout.write(f"  {key}: {value}")
+
+        self.stdout.write(f"\nTop {options['top']} routes by revenue per km:")
+        for route in report['routes'][:options['top']]:
+            self.stdout.write(
+                f"  route {route['route_id']:>6}  trips {route['trips']:>6}  "
+                f"load {route['load_factor']:.1%}  revenue/km {route['revenue_per_km']:>12,.0f}"
+            )
+
+    def _parse_day(self, value, next_day=False):
+        """Turn a YYYY-MM-DD option into an aware datetime bound"""
+        if not value:
+            return None
+        day = parse_date(value)
+        if day is None:
+            raise CommandError(f"Invalid date: {value}")
+        if next_day:
+            day += timedelta(days=1)
+        return make_aware(datetime.combine(day, time.min))
@@ -8,7 +8,12 @@ from utils.db_utils import (
 )
 from typing import List, Dict, Any, Optional
 from datetime import datetime
-from django.utils.timezone import now
+from utils.text_utils import normalize_text, normalize_plate
+from utils.partitions import recent_cutoff
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction, IntegrityError
+from django.utils.timezone import now, make_aware, localtime
 from decimal import Decimal
 
 
@@ -18,49 +23,52 @@ class Locations:
     TABLE_NAME = 'locations'
 
     @classmethod
-    def create(cls, name: str, city: str) -> Dict[str, Any]:
+    def create(cls, name: str, city: str, latitude: float = None,
+               longitude: float = None) -> Dict[str, Any]:
         """Create a new location"""
         query = f"""
-            INSERT INTO {cls.TABLE_NAME} (name, city)
-            VALUES (%s, %s)
-            RETURNING id, name, city
+            INSERT INTO {cls.TABLE_NAME} (name, city, latitude, longitude)
+            VALUES (%s, %s, %s, %s)
+            RETURNING id, name, city, latitude, longitude
         """
-        result = execute_query(query, (name, city))
+        result = execute_query(query, (name, city, latitude, longitude))
         return result[0] if result else None
 
     @classmethod
     def get_by_id(cls, location_id: int) -> Optional[Dict[str, Any]]:
         """Get location by ID"""
-        query = f"SELECT id, name, city FROM {cls.TABLE_NAME} WHERE id = %s"
+        query = f"SELECT id, name, city, latitude, longitude FROM {cls.TABLE_NAME} WHERE id = %s"
         return execute_query_one(query, (location_id,))
 
     @classmethod
     def get_all(cls, ordering: List[str] = None) -> List[Dict[str, Any]]:
         """Get all locations"""
         order_clause = build_order_clause(ordering or ['name'])
-        query = f"SELECT id, name, city FROM {cls.TABLE_NAME} {order_clause}"
+        query = f"SELECT id, name, city, latitude, longitude FROM {cls.TABLE_NAME} {order_clause}"
         return execute_query(query)
 
     @classmethod
     def search(cls, name: str = None, city: str = None) -> List[Dict[str, Any]]:
-        """Search locations by name or city"""
+        """Search locations by name or city, ignoring case and accents"""
         conditions = []
         params = []
 
+        # Normalized values only contain [0-9a-z ], so no LIKE wildcards need escaping
         if name:
-            conditions.append("name ILIKE %s")
-            params.append(f"%{name}%")
+            conditions.append("name_normalized LIKE %s")
+            params.append(f"%{normalize_text(name)}%")
         if city:
-            conditions.append("city ILIKE %s")
-            params.append(f"%{city}%")
+            conditions.append("city_normalized LIKE %s")
+            params.append(f"%{normalize_text(city)}%")
 
         where_clause = f"WHERE {' AND '.join(conditions)}" if conditions else ""
-        query = f"SELECT id, name, city FROM {cls.TABLE_NAME} {where_clause} ORDER BY name"
+        query = f"SELECT id, name, city, latitude, longitude FROM {cls.TABLE_NAME} {where_clause} ORDER BY name"
 
         return execute_query(query, tuple(params))
 
     @classmethod
-    def update(cls, location_id: int, name: str = None, city: str = None) -> bool:
+    def update(cls, location_id: int, name: str = None, city: str = None,
+               latitude: float = None, longitude: float = None) -> bool:
         """Update a location"""
         updates = []
         params = []
@@ -71,6 +79,12 @@ class Locations:
         if city is not None:
             updates.append("city = %s")
             params.append(city)
+        if latitude is not None:
+            updates.append("latitude = %s")
+            params.append(latitude)
+        if longitude is not None:
+            updates.append("longitude = %s")
+            params.append(longitude)
 
         if not updates:
             return False
@@ -85,6 +99,12 @@ class Locations:
         query = f"DELETE FROM {cls.TABLE_NAME} WHERE id = %s"
         return execute_delete(query, (location_id,)) > 0
 
+    @classmethod
+    def network_version(cls) -> int:
+        """Id of the newest route/location change in trip_change_log (bumped by triggers)"""
+        result = execute_query_one("SELECT COALESCE(MAX(id), 0) as version FROM trip_change_log WHERE trip_id IS NULL")
+        return result['version']
+
     @classmethod
     def full_address(cls, location: Dict[str, Any]) -> str:
         """Get full address of location"""
@@ -220,16 +240,16 @@ class Bus:
 
     @classmethod
     def search(cls, license_plate: str = None, model: str = None) -> List[Dict[str, Any]]:
-        """Search buses by license plate or model"""
+        """Search buses by license plate (separators ignored) or model"""
         conditions = []
         params = []
 
         if license_plate:
-            conditions.append("license_plate ILIKE %s")
-            params.append(f"%{license_plate}%")
+            conditions.append("license_plate_normalized LIKE %s")
+            params.append(f"%{normalize_plate(license_plate)}%")
         if model:
-            conditions.append("model ILIKE %s")
-            params.append(f"%{model}%")
+            conditions.append("model_normalized LIKE %s")
+            params.append(f"%{normalize_text(model)}%")
 
         where_clause = f"WHERE {' AND '.join(conditions)}" if conditions else ""
         query = f"SELECT id, license_plate, model, total_seats, manufacture_year FROM {cls.TABLE_NAME} {where_clause} ORDER BY license_plate"
@@ -274,6 +294,13 @@ class Seat:
     """Seat model using raw SQL"""
 
     TABLE_NAME = 'seats'
+    SEATS_PER_ROW = 10
+
+    @classmethod
+    def seat_number(cls, seat_index: int, seats_per_row: int = SEATS_PER_ROW) -> str:
+        """Seat number of a zero-based seat index: A01, A02, ..., B01, B02, etc."""
+        row_letter = chr(65 + (seat_index // seats_per_row))  # A, B, C, ...
+        return f"{row_letter}{seat_index % seats_per_row + 1:02d}"
 
     @classmethod
     def create(cls, seat_number: str, bus_id: int, is_available: bool = True) -> Dict[str, Any]:
@@ -355,26 +382,135 @@ class Seat:
         return execute_delete(query, (seat_id,)) > 0
 
 
+EXCLUSION_VIOLATION = '23P01'
+
+
+class TripConflictError(Exception):
+    """A trip would put its bus on two trips at once"""
+
+    def __init__(self, conflicts: List[Dict[str, Any]]):
+        self.conflicts = conflicts
+        super().__init__('; '.join(conflict['message'] for conflict in conflicts)
+                         or 'Bus is already assigned to an overlapping trip')
+
+
 class Trip:
     """Trip model using raw SQL"""
 
     TABLE_NAME = 'trips'
+    STATS_TABLE_NAME = 'trip_booking_stats'
 
     @classmethod
     def create(cls, route_id: int, bus_id: int, departure_time: datetime,
                arrival_time: datetime, price_per_seat: Decimal) -> Dict[str, Any]:
         """Create a new trip"""
         query = f"""
-            INSERT INTO {cls.TABLE_NAME} (route_id, bus_id, departure_time, arrival_time, price_per_seat)
-            VALUES (%s, %s, %s, %s, %s)
+            INSERT INTO {cls.TABLE_NAME}
+            (route_id, bus_id, departure_time, arrival_time, price_per_seat, base_price_per_seat)
+            VALUES (%s, %s, %s, %s, %s, %s)
             RETURNING id, route_id, bus_id, departure_time, arrival_time, price_per_seat
         """
-        result = execute_query(query, (route_id, bus_id, departure_time, arrival_time, price_per_seat))
+        try:
+            with transaction.atomic():
+                result = execute_query(query, (route_id, bus_id, departure_time, arrival_time,
+                                               price_per_seat, price_per_seat))
+        except IntegrityError as e:
+            cls._raise_if_bus_conflict(e, [{'bus_id': bus_id, 'departure_time': departure_time,
+                                            'arrival_time': arrival_time}])
+        if result:
+            cls.invalidate_fare_calendar([result[0]['id']])
         return result[0] if result else None
 
+    @classmethod
+    def bulk_create(cls, trips: List[Dict[str, Any]]) -> List[int]:
+        """
+        Insert many trips with one INSERT ... SELECT FROM unnest statement.
+        Each trip dict has route_id, bus_id, departure_time, arrival_time, price_per_seat.
+        """
+        if not trips:
+            return []
+        query = f"""
+            INSERT INTO {cls.TABLE_NAME}
+            (route_id, bus_id, departure_time, arrival_time, price_per_seat, base_price_per_seat)
+            SELECT route_id, bus_id, departure_time, arrival_time, price, price
+            FROM unnest(%s::bigint[], %s::bigint[], %s::timestamptz[], %s::timestamptz[], %s::numeric[])
+                AS v(route_id, bus_id, departure_time, arrival_time, price)
+            RETURNING id
+        """
+        try:
+            with transaction.atomic():
+                rows = execute_query(query, (
+                    [trip['route_id'] for trip in trips],
+                    [trip['bus_id'] for trip in trips],
+                    [trip['departure_time'] for trip in trips],
+                    [trip['arrival_time'] for trip in trips],
+                    [trip['price_per_seat'] for trip in trips],
+                ))
+        except IntegrityError as e:
+            cls._raise_if_bus_conflict(e, trips)
+        ids = [row['id'] for row in rows]
+        cls.invalidate_fare_calendar(ids)
+        return ids
+
+    @classmethod
+    def find_bus_conflicts(cls, trips: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """
+        Existing trips whose bus is already on the road during a proposed trip, in one query
+        served by the trips_bus_no_overlap GiST index. A proposed trip may carry its own 'id'
+        (when rescheduling) so it does not clash with itself.
+        Returns one row per clash: the proposed trip's index and the existing trip.
+        """
+        if not trips:
+            return []
+        query = f"""
+            SELECT
+                v.idx - 1 as index, t.id as trip_id, t.bus_id, b.license_plate as bus_license_plate,
+                t.route_id, sl.name as start_location_name, el.name as end_location_name,
+                t.departure_time, t.arrival_time
+            FROM unnest(%s::bigint[], %s::bigint[], %s::timestamptz[], %s::timestamptz[])
+                WITH ORDINALITY AS v(trip_id, bus_id, departure_time, arrival_time, idx)
+            JOIN {cls.TABLE_NAME} t
+              ON int8range(t.bus_id, t.bus_id, '[]') = int8range(v.bus_id, v.bus_id, '[]')
+             AND tstzrange(t.departure_time, t.arrival_time) && tstzrange(v.departure_time, v.arrival_time)
+             AND t.id IS DISTINCT FROM v.trip_id
+            JOIN buses b ON t.bus_id = b.id
+            JOIN routes r ON t.route_id = r.id
+            JOIN locations sl ON r.start_location_id = sl.id
+            JOIN locations el ON r.end_location_id = el.id
+            ORDER BY v.idx, t.departure_time
+        """
+        conflicts = execute_query(query, (
+            [trip.get('id') for trip in trips],
+            [trip['bus_id'] for trip in trips],
+            [trip['departure_time'] for trip in trips],
+            [trip['arrival_time'] for trip in trips],
+        ))
+        for conflict in conflicts:
+            conflict['message'] = cls.describe_conflict(conflict)
+        return conflicts
+
+    @classmethod
+    def describe_conflict(cls, conflict: Dict[str, Any]) -> str:
+        """Human-readable clash, e.g. 'Bus 29B-123.45 is already on trip #12 (A -> B, ...)'"""
+        departure = localtime(conflict['departure_time']).strftime('%d/%m/%Y %H:%M')
+        arrival = localtime(conflict['arrival_time']).strftime('%d/%m/%Y %H:%M')
+        return (f"Bus {conflict['bus_license_plate']} is already on trip #{conflict['trip_id']} "
+                f"({conflict['start_location_name']} -> {conflict['end_location_name']}, "
+                f"{departure} - {arrival})")
+
+    @classmethod
+    def _raise_if_bus_conflict(cls, error: IntegrityError, trips: List[Dict[str, Any]]):
+        """Turn a trips_bus_no_overlap violation into TripConflictError naming the clashing trips"""
+        if getattr(error.__cause__, 'pgcode', None) != EXCLUSION_VIOLATION:
+            raise error
+        raise TripConflictError(cls.find_bus_conflicts(trips)) from error
+
     @classmethod
     def get_by_id(cls, trip_id: int) -> Optional[Dict[str, Any]]:
-        """Get trip by ID with route and bus details"""
+        """
+        Get trip by ID with route and bus details. Without departure_time no partition is
+        pruned; every live month is probed through its (id, departure_time) primary key.
+        """
         query = f"""
             SELECT
                 t.id, t.route_id, t.bus_id, t.departure_time, t.arrival_time, t.price_per_seat,
@@ -394,8 +530,11 @@ class Trip:
 
     @classmethod
     def get_all(cls, route_id: int = None, bus_id: int = None, upcoming_only: bool = False,
-                ordering: List[str] = None) -> List[Dict[str, Any]]:
-        """Get all trips with optional filters"""
+                include_history: bool = False, ordering: List[str] = None) -> List[Dict[str, Any]]:
+        """
+        Get all trips with optional filters. Only trips departing within the recent
+        window are read unless include_history is set, so older partitions are pruned.
+        """
         conditions = []
         params = []
 
@@ -408,6 +547,9 @@ class Trip:
         if upcoming_only:
             conditions.append("t.departure_time > %s")
             params.append(now())
+        elif not include_history:
+            conditions.append("t.departure_time >= %s")
+            params.append(recent_cutoff())
 
         where_clause = f"WHERE {' AND '.join(conditions)}" if conditions else ""
         order_clause = build_order_clause(ordering or ['-departure_time'])
@@ -452,22 +594,184 @@ class Trip:
             updates.append("arrival_time = %s")
             params.append(arrival_time)
         if price_per_seat is not None:
+            # An admin-set price is the new base fare; the pricing job re-derives from it
             updates.append("price_per_seat = %s")
             params.append(price_per_seat)
+            updates.append("base_price_per_seat = %s")
+            params.append(price_per_seat)
 
         if not updates:
             return False
 
         params.append(trip_id)
         query = f"UPDATE {cls.TABLE_NAME} SET {', '.join(updates)} WHERE id = %s"
-        return execute_update(query, tuple(params)) > 0
+        # Invalidate the calendar month the trip leaves as well as the one it moves to
+        cls.invalidate_fare_calendar([trip_id])
+        try:
+            with transaction.atomic():
+                updated = execute_update(query, tuple(params)) > 0
+                if updated and departure_time is not None:
+                    # Tickets are partitioned by their trip's departure time
+                    execute_update(
+                        "UPDATE tickets SET departure_time = %s WHERE trip_id = %s AND departure_time <> %s",
+                        (departure_time, trip_id, departure_time)
+                    )
+        except IntegrityError as e:
+            trip = execute_query_one(
+                f"SELECT id, bus_id, departure_time, arrival_time FROM {cls.TABLE_NAME} WHERE id = %s",
+                (trip_id,)
+            )
+            trip.update({key: value for key, value in (('bus_id', bus_id), ('departure_time', departure_time),
+                                                       ('arrival_time', arrival_time)) if value is not None})
+            cls._raise_if_bus_conflict(e, [trip])
+        if updated:
+            cls.invalidate_fare_calendar([trip_id])
+            cls.invalidate_manifest([trip_id])
+        if updated and (bus_id is not None or departure_time is not None or arrival_time is not None):
+            # Printed tickets show the bus and times, and their codes expire after arrival
+            from bookings.models import TicketDocument
+            TicketDocument.refresh_for_trips([trip_id])
+        return updated
 
     @classmethod
     def delete(cls, trip_id: int) -> bool:
         """Delete a trip"""
+        cls.invalidate_fare_calendar([trip_id])
+        cls.invalidate_manifest([trip_id])
         query = f"DELETE FROM {cls.TABLE_NAME} WHERE id = %s"
         return execute_delete(query, (trip_id,)) > 0
 
+    @classmethod
+    def get_price(cls, trip_id: int) -> Optional[Decimal]:
+        """
+        Current price per seat, read from the trip row so every booking path charges
+        the fare the reprice_trips job last wrote. Inside a booking transaction the row
+        is share-locked, so a concurrent reprice waits until the booking commits.
+        """
+        result = execute_query_one(f"SELECT price_per_seat FROM {cls.TABLE_NAME} WHERE id = %s FOR SHARE",
+                                   (trip_id,))
+        return result['price_per_seat'] if result else None
+
+    FARE_CALENDAR_CACHE_TTL = 600
+
+    @classmethod
+    def fare_calendar_cache_key(cls, route_id: int, month: str) -> str:
+        return f"fare_calendar:{route_id}:{month}"
+
+    @classmethod
+    def get_fare_calendar(cls, route_id: int, year: int, month: int) -> List[Dict[str, Any]]:
+        """
+        Cheapest available fare, departures and seats left per departure day of a month
+        for one route, in one aggregate query. Cached per (route, month) in the shared
+        cache (settings.CACHES) and dropped on commit by invalidate_fare_calendar.
+        """
+        key = cls.fare_calendar_cache_key(route_id, f"{year:04d}-{month:02d}")
+        days = cache.get(key)
+        if days is not None:
+            return days
+
+        month_start = make_aware(datetime(year, month, 1))
+        month_end = make_aware(datetime(year + month // 12, month % 12 + 1, 1))
+        query = f"""
+            SELECT
+                (t.departure_time AT TIME ZONE %s)::date as date,
+                MIN(t.price_per_seat) FILTER (
+                    WHERE b.total_seats > COALESCE(s.booked_seats, 0)
+                ) as min_price,
+                COUNT(*) as departures,
+                SUM(GREATEST(b.total_seats - COALESCE(s.booked_seats, 0), 0)) as seats_left
+            FROM {cls.TABLE_NAME} t
+            JOIN buses b ON t.bus_id = b.id
+            LEFT JOIN {cls.STATS_TABLE_NAME} s ON s.trip_id = t.id
+            WHERE t.route_id = %s
+              AND t.departure_time >= %s AND t.departure_time < %s
+              AND t.departure_time > %s
+            GROUP BY date
+            ORDER BY date
+        """
+        days = execute_query(query, (settings.TIME_ZONE, route_id, month_start, month_end, now()))
+        cache.set(key, days, cls.FARE_CALENDAR_CACHE_TTL)
+        return days
+
+    @classmethod
+    def invalidate_fare_calendar(cls, trip_ids: List[int]):
+        """Drop cached calendar months containing these trips, once the transaction commits"""
+        if not trip_ids:
+            return
+        rows = execute_query(f"""
+            SELECT DISTINCT route_id, to_char(departure_time AT TIME ZONE %s, 'YYYY-MM') as month
+            FROM {cls.TABLE_NAME}
+            WHERE id = ANY(%s)
+        """, (settings.TIME_ZONE, [int(trip_id) for trip_id in trip_ids]))
+        keys = [cls.fare_calendar_cache_key(row['route_id'], row['month']) for row in rows]
+        if keys:
+            transaction.on_commit(lambda: cache.delete_many(keys))
+
+    MANIFEST_CACHE_TTL = 300
+
+    @classmethod
+    def manifest_cache_key(cls, trip_id: int) -> str:
+        return f"trip_manifest:{trip_id}"
+
+    @classmethod
+    def get_manifest(cls, trip_id: int) -> Optional[Dict[str, Any]]:
+        """
+        Boarding manifest of a trip: the trip header and one row per seat of its bus with
+        the passenger, booking and boarding time on it (empty for free seats). The seat rows
+        come from a single query over seats, tickets and bookings only. Cached per trip in
+        the shared cache (settings.CACHES) and dropped on commit by invalidate_manifest.
+        """
+        key = cls.manifest_cache_key(trip_id)
+        manifest = cache.get(key)
+        if manifest is not None:
+            return manifest
+
+        trip = cls.get_by_id(trip_id)
+        if not trip:
+            return None
+        query = f"""
+            SELECT
+                s.seat_number, s.id as seat_id, tk.id as ticket_id, tk.passenger_name,
+                bk.id as booking_id, bk.status as booking_status, u.email as contact_email,
+                bs.scanned_at as boarded_at
+            FROM {cls.TABLE_NAME} t
+            JOIN seats s ON s.bus_id = t.bus_id
+            LEFT JOIN tickets tk ON tk.seat_id = s.id AND tk.trip_id = t.id
+                 AND tk.departure_time = t.departure_time
+            LEFT JOIN bookings bk ON bk.id = tk.booking_id AND bk.trip_id = t.id
+            LEFT JOIN users u ON u.id = bk.user_id
+            LEFT JOIN boarding_scans bs ON bs.ticket_id = tk.id
+            WHERE t.id = %s
+            ORDER BY s.seat_number
+        """
+        seats = execute_query(query, (trip_id,))
+        booked = sum(1 for seat in seats if seat['ticket_id'] is not None)
+        boarded = sum(1 for seat in seats if seat['boarded_at'] is not None)
+        manifest = {
+            'trip': {
+                'id': trip['id'],
+                'departure_time': trip['departure_time'],
+                'arrival_time': trip['arrival_time'],
+                'start_location_name': trip['start_location_name'],
+                'end_location_name': trip['end_location_name'],
+                'bus_id': trip['bus_id'],
+                'bus_license_plate': trip['bus_license_plate'],
+                'total_seats': len(seats),
+                'booked_seats': booked,
+                'boarded': boarded,
+            },
+            'seats': seats,
+        }
+        cache.set(key, manifest, cls.MANIFEST_CACHE_TTL)
+        return manifest
+
+    @classmethod
+    def invalidate_manifest(cls, trip_ids: List[int]):
+        """Drop the cached manifests of these trips, once the transaction commits"""
+        keys = [cls.manifest_cache_key(int(trip_id)) for trip_id in trip_ids]
+        if keys:
+            transaction.on_commit(lambda: cache.delete_many(keys))
+
     @classmethod
     def is_upcoming(cls, trip: Dict[str, Any]) -> bool:
         """Check if the trip is upcoming"""
@@ -482,16 +786,61 @@ class Trip:
         return f"{int(hours)}h {int(minutes)}m"
 
     @classmethod
-    def available_seats(cls, trip_id: int) -> int:
-        """Get the number of available seats on the bus for this trip"""
+    def get_occupancy(cls, date_from: datetime = None, date_to: datetime = None,
+                      route_id: int = None) -> List[Dict[str, Any]]:
+        """
+        Booked seats, revenue and load factor per route and departure day,
+        read from the trip_booking_stats rollup instead of counting bookings
+        """
+        conditions = []
+        params = []
+        if date_from:
+            conditions.append("t.departure_time >= %s")
+            params.append(date_from)
+        if date_to:
+            conditions.append("t.departure_time < %s")
+            params.append(date_to)
+        if route_id is not None:
+            conditions.append("t.route_id = %s")
+            params.append(route_id)
+        where_clause = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+
+        query = f"""
+            SELECT
+                t.route_id,
+                (t.departure_time AT TIME ZONE %s)::date as departure_date,
+                COUNT(*) as trips,
+                SUM(b.total_seats) as total_seats,
+                COALESCE(SUM(s.booked_seats), 0) as booked_seats,
+                COALESCE(SUM(s.canceled_bookings), 0) as canceled_bookings,
+                COALESCE(SUM(s.revenue), 0) as revenue,
+                ROUND(COALESCE(SUM(s.booked_seats), 0)::numeric / NULLIF(SUM(b.total_seats), 0), 4) as load_factor
+            FROM {cls.TABLE_NAME} t
+            JOIN buses b ON t.bus_id = b.id
+            LEFT JOIN {cls.STATS_TABLE_NAME} s ON s.trip_id = t.id
+            {where_clause}
+            GROUP BY t.route_id, departure_date
+            ORDER BY departure_date, t.route_id
+        """
+        return execute_query(query, (settings.TIME_ZONE, *params))
+
+    @classmethod
+    def available_seats(cls, trip_id: int, user_id: int = None) -> int:
+        """
+        Get the number of available seats on the bus for this trip. Seats held for
+        waitlisted customers are not available, except to the customer holding them.
+        """
         query = """
             SELECT
-                b.total_seats - COALESCE(SUM(bk.number_of_seats), 0) as available
+                b.total_seats - COALESCE(SUM(bk.number_of_seats), 0)
+                - COALESCE((SELECT SUM(w.number_of_seats) FROM trip_waitlist w
+                            WHERE w.trip_id = t.id AND w.status = 'Held' AND w.hold_expires_at > %s
+                              AND w.user_id IS DISTINCT FROM %s), 0) as available
             FROM trips t
             JOIN buses b ON t.bus_id = b.id
             LEFT JOIN bookings bk ON t.id = bk.trip_id AND bk.status != 'Canceled'
             WHERE t.id = %s
-            GROUP BY b.total_seats
+            GROUP BY t.id, b.total_seats
         """
-        result = execute_query_one(query, (trip_id,))
+        result = execute_query_one(query, (now(), user_id, trip_id))
         return result['available'] if result else 0
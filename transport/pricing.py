@@ -0,0 +1,131 @@
+"""
+Load-factor-based dynamic pricing for upcoming trips (NumPy, No ORM)
+
+Fares are derived from each trip's admin-set base fare (trips.base_price_per_seat)
+and three demand signals: the trip's own load factor, days left to departure
+and the route's average load factor over its upcoming trips. All upcoming trips
+are repriced in one vectorized pass; only changed prices are written back, in a
+single bulk UPDATE; bookings read the fare from the trip row (Trip.get_price).
+"""
+from django.db import connection, transaction
+from django.utils.timezone import now
+from typing import Dict, Any
+import numpy as np
+from .models import Trip
+
+# Piecewise-linear multiplier curves (x points -> multiplier), applied with np.interp
+LOAD_FACTOR_CURVE = ([0.0, 0.5, 0.8, 1.0], [0.9, 1.0, 1.2, 1.4])
+DAYS_TO_DEPARTURE_CURVE = ([0.0, 1.0, 3.0, 7.0, 30.0], [1.15, 1.1, 1.0, 0.95, 0.9])
+ROUTE_DEMAND_CURVE = ([0.0, 0.4, 0.7, 1.0], [0.95, 1.0, 1.05, 1.1])
+
+MIN_MULTIPLIER = 0.8
+MAX_MULTIPLIER = 1.5
+PRICE_STEP = 1000  # round fares to the nearest 1,000 VND
+
+
+class PricingEngine:
+    """Columnar snapshot of upcoming trips and their demand signals"""
+
+    def __init__(self, trip_id, route_id, base_price, current_price,
+                 total_seats, booked_seats, days_to_departure):
+        self.trip_id = np.asarray(trip_id, dtype=np.int64)
+        self.route_id = np.asarray(route_id, dtype=np.int64)
+        self.base_price = np.asarray(base_price, dtype=np.float64)
+        self.current_price = np.asarray(current_price, dtype=np.float64)
+        self.total_seats = np.asarray(total_seats, dtype=np.int64)
+        self.booked_seats = np.asarray(booked_seats, dtype=np.int64)
+        self.days_to_departure = np.asarray(days_to_departure, dtype=np.float64)
+
+    def __len__(self):
+        return len(self.trip_id)
+
+    @classmethod
+    def load(cls) -> 'PricingEngine':
+        """Load every upcoming trip with capacity and booked seats in one query"""
+        query = f"""
+            SELECT
+                t.id, t.route_id,
+                t.base_price_per_seat::float8, t.price_per_seat::float8,
+                b.total_seats,
+                COALESCE(s.booked_seats, 0),
+                EXTRACT(EPOCH FROM (t.departure_time - %s)) / 86400.0
+            FROM {Trip.TABLE_NAME} t
+            JOIN buses b ON t.bus_id = b.id
+            LEFT JOIN {Trip.STATS_TABLE_NAME} s ON s.trip_id = t.id
+            WHERE t.departure_time > %s
+        """
+        current_time = now()
+        with connection.cursor() as cursor:
+            cursor.execute(query, (current_time, current_time))
+            rows = cursor.fetchall()
+
+        if not rows:
+            return cls(*[[] for _ in range(7)])
+        table = np.array(rows, dtype=np.float64)
+        return cls(*[table[:, i] for i in range(7)])
+
+    def load_factors(self) -> np.ndarray:
+        """Booked seats / capacity per trip"""
+        return np.divide(self.booked_seats, self.total_seats,
+                         out=np.zeros(len(self), dtype=np.float64),
+                         where=self.total_seats > 0)
+
+    def route_demand(self) -> np.ndarray:
+        """Average load factor of each trip's route, broadcast back to trips"""
+        if not len(self):
+            return np.zeros(0, dtype=np.float64)
+        _, index = np.unique(self.route_id, return_inverse=True)
+        capacity = np.bincount(index, weights=self.total_seats)
+        booked = np.bincount(index, weights=self.booked_seats)
+        demand = np.divide(booked, capacity, out=np.zeros_like(capacity), where=capacity > 0)
+        return demand[index]
+
+    def multipliers(self) -> np.ndarray:
+        """Combined fare multiplier per trip, clipped to [MIN_MULTIPLIER, MAX_MULTIPLIER]"""
+        multiplier = (
+            np.interp(self.load_factors(), *LOAD_FACTOR_CURVE)
+            * np.interp(self.days_to_departure, *DAYS_TO_DEPARTURE_CURVE)
+            * np.interp(self.route_demand(), *ROUTE_DEMAND_CURVE)
+        )
+        return np.clip(multiplier, MIN_MULTIPLIER, MAX_MULTIPLIER)
+
+    def prices(self) -> np.ndarray:
+        """New price per seat for every trip, rounded to PRICE_STEP"""
+        return np.round(self.base_price * self.multipliers() / PRICE_STEP) * PRICE_STEP
+
+    def reprice(self, dry_run: bool = False) -> Dict[str, Any]:
+        """
+        Compute new prices and write the changed ones with a single UPDATE ... FROM unnest.
+        Rows whose base fare was edited since load() are left alone.
+        """
+        prices = self.prices()
+        changed = prices != self.current_price
+        trip_ids = self.trip_id[changed]
+        new_prices = prices[changed]
+
+        result = {
+            'trips': len(self),
+            'changed': int(changed.sum()),
+            'raised': int((prices > self.current_price).sum()),
+            'lowered': int((prices < self.current_price).sum()),
+            'updated': 0,
+        }
+        if dry_run:
+            return result
+        if not len(trip_ids):
+            return result
+
+        with transaction.atomic():
+            with connection.cursor() as cursor:
+                cursor.execute(f"""
+                    UPDATE {Trip.TABLE_NAME} t
+                    SET price_per_seat = v.price
+                    FROM unnest(%s::bigint[], %s::numeric[], %s::numeric[]) AS v(id, price, base)
+                    WHERE t.id = v.id AND t.price_per_seat <> v.price
+                      AND t.base_price_per_seat = v.base
+                """, ([int(i) for i in trip_ids], [float(p) for p in new_prices],
+                      [float(b) for b in self.base_price[changed]]))
+                result['updated'] = cursor.rowcount
+
+            Trip.invalidate_fare_calendar([int(trip_id) for trip_id in trip_ids])
+        return result
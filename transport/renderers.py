@@ -0,0 +1,31 @@
+"""
+Transport renderers
+"""
+from rest_framework.renderers import BaseRenderer
+import csv
+import io
+
+
+class ManifestCSVRenderer(BaseRenderer):
+    """Trip manifest as one CSV line per seat, for boarding devices working offline"""
+
+    media_type = 'text/csv'
+    format = 'csv'
+    charset = 'utf-8'
+    COLUMNS = ('seat_number', 'passenger_name', 'booking_id', 'booking_status',
+               'ticket_id', 'contact_email', 'boarded_at')
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        output = io.StringIO()
+        writer = csv.writer(output)
+        if isinstance(data, dict) and 'seats' in data:
+            writer.writerow(self.COLUMNS)
+            for seat in data['seats']:
+                writer.writerow(['' if seat[column] is None else seat[column] for column in self.COLUMNS])
+        else:
+            # Errors (403, 404) are still answered in the negotiated format
+            writer.writerow(['error'])
+            message = (data.get('error') or data.get('detail', '')) if isinstance(data, dict) else data
+            writer.writerow([message])
+        # BOM so spreadsheet apps read Vietnamese passenger names as UTF-8
+        return ('﻿' + output.getvalue()).encode(self.charset)
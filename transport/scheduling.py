@@ -0,0 +1,119 @@
+"""
+Recurring trip schedules (No ORM)
+
+A schedule template (route, bus, daily departure times, travel time, days of
+week, date range, fare) is expanded into concrete trips server-side, checked for
+bus conflicts in one query (the trips_bus_no_overlap constraint is the final
+guard against concurrent writers), and inserted BATCH_SIZE trips per statement inside a
+single transaction.
+"""
+from django.db import transaction
+from django.utils.timezone import make_aware
+from typing import List, Dict, Any
+from datetime import datetime, timedelta
+from .models import Trip, TripConflictError
+
+BATCH_SIZE = 1000
+MAX_TRIPS = 50_000
+PREVIEW_SIZE = 50
+
+
+def expand_template(template: Dict[str, Any]) -> List[Dict[str, Any]]:
+    """Concrete trips for every selected weekday in [date_from, date_to] at every departure time"""
+    duration = timedelta(minutes=template['duration_minutes'])
+    days_of_week = set(template['days_of_week'])
+    trips = []
+    day = template['date_from']
+    while day <= template['date_to']:
+        if day.weekday() in days_of_week:
+            for departure in template['departure_times']:
+                departure_time = make_aware(datetime.combine(day, departure))
+                trips.append({
+                    'route_id': template['route_id'],
+                    'bus_id': template['bus_id'],
+                    'departure_time': departure_time,
+                    'arrival_time': departure_time + duration,
+                    'price_per_seat': template['price_per_seat'],
+                })
+        day += timedelta(days=1)
+    return trips
+
+
+def find_batch_overlaps(trips: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """Pairs of proposed trips that put the same bus on the road at the same time"""
+    overlaps = []
+    by_bus: Dict[int, List[int]] = {}
+    for index, trip in enumerate(trips):
+        by_bus.setdefault(trip['bus_id'], []).append(index)
+    for indexes in by_bus.values():
+        indexes.sort(key=lambda i: trips[i]['departure_time'])
+        latest = None
+        for index in indexes:
+            if latest is not None and trips[index]['departure_time'] < trips[latest]['arrival_time']:
+                overlaps.append({
+                    'index': index,
+                    'overlaps_index': latest,
+                    'message': f"Proposed trips {latest} and {index} both use bus {trips[index]['bus_id']} "
+                               f"at {trips[index]['departure_time']:%d/%m/%Y %H:%M}"
+                })
+            if latest is None or trips[index]['arrival_time'] > trips[latest]['arrival_time']:
+                latest = index
+    return overlaps
+
+
+def publish_schedule(templates: List[Dict[str, Any]], dry_run: bool = False,
+                     skip_conflicts: bool = False) -> Dict[str, Any]:
+    """
+    Expand templates and insert the trips. Conflicting trips abort the whole publish
+    unless skip_conflicts is set, in which case only they are left out.
+    """
+    trips = [trip for template in templates for trip in expand_template(template)]
+    if len(trips) > MAX_TRIPS:
+        raise ValueError(f'Schedule expands to {len(trips)} trips; the limit is {MAX_TRIPS}.')
+
+    conflicts = Trip.find_bus_conflicts(trips)
+    overlaps = find_batch_overlaps(trips)
+    rejected = {conflict['index'] for conflict in conflicts} | {overlap['index'] for overlap in overlaps}
+    accepted = [trip for index, trip in enumerate(trips) if index not in rejected]
+
+    result = {
+        'trips': len(trips),
+        'conflicts': [
+            dict(conflict, proposed=_describe(trips[conflict['index']])) for conflict in conflicts
+        ],
+        'batch_overlaps': [
+            dict(overlap, proposed=_describe(trips[overlap['index']]),
+                 overlaps=_describe(trips[overlap['overlaps_index']]))
+            for overlap in overlaps
+        ],
+        'created': 0,
+        'trip_ids': [],
+    }
+    if dry_run:
+        result['preview'] = [_describe(trip) for trip in accepted[:PREVIEW_SIZE]]
+        return result
+    if rejected and not skip_conflicts:
+        return result
+
+    try:
+        with transaction.atomic():
+            for start in range(0, len(accepted), BATCH_SIZE):
+                result['trip_ids'].extend(Trip.bulk_create(accepted[start:start + BATCH_SIZE]))
+    except TripConflictError:
+        # A concurrent write took the bus after the check; trips_bus_no_overlap rolled us back
+        result['trip_ids'] = []
+        result['conflicts'] = [dict(conflict, proposed=_describe(trips[conflict['index']]))
+                               for conflict in Trip.find_bus_conflicts(trips)]
+        return result
+    result['created'] = len(result['trip_ids'])
+    return result
+
+
+def _describe(trip: Dict[str, Any]) -> Dict[str, Any]:
+    return {
+        'route_id': trip['route_id'],
+        'bus_id': trip['bus_id'],
+        'departure_time': trip['departure_time'],
+        'arrival_time': trip['arrival_time'],
+        'price_per_seat': trip['price_per_seat'],
+    }
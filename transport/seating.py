@@ -0,0 +1,131 @@
+"""
+Automatic seat assignment for group bookings (No ORM)
+
+Seats are laid out the way BusSerializer._generate_seat_number numbers them: row
+letters A, B, ... of SEATS_PER_ROW seats each (A01..A10, B01..B10, ...). A trip's
+occupancy is loaded in one query into one free-seat bitmask per row. A group that
+fits in a row gets the tightest contiguous run of free seats (best fit, front rows
+first). Larger groups get the shortest band of adjacent rows holding enough free
+seats (two-pointer sweep), filled row by row with the longest runs first.
+"""
+from django.db import connection
+from typing import List, Dict, Optional, Tuple
+import re
+
+# Default of BusSerializer._generate_seat_number
+SEATS_PER_ROW = 10
+SEAT_NUMBER = re.compile(r'^(?P<row>[A-Z])(?P<column>\d{2})$')
+
+
+class SeatAssignmentError(Exception):
+    """The trip does not have enough free seats for the group"""
+
+
+class SeatMap:
+    """Free seats of one trip as a bitmask per row (bit i = column i + 1 is free)"""
+
+    def __init__(self, seats: List[Tuple[int, str, bool]]):
+        self.rows: List[List[Optional[int]]] = []
+        self.free: List[int] = []
+        by_row: Dict[str, List[Optional[int]]] = {}
+        masks: Dict[str, int] = {}
+        loose = []
+        for seat_id, seat_number, taken in seats:
+            match = SEAT_NUMBER.match(seat_number or '')
+            if not match or not 1 <= int(match['column']) <= SEATS_PER_ROW:
+                # Seats renamed outside the generated layout are kept apart, searched last
+                if not taken:
+                    loose.append(seat_id)
+                continue
+            row, column = match['row'], int(match['column']) - 1
+            by_row.setdefault(row, [None] * SEATS_PER_ROW)[column] = seat_id
+            if not taken:
+                masks[row] = masks.get(row, 0) | (1 << column)
+        for row in sorted(by_row):
+            self.rows.append(by_row[row])
+            self.free.append(masks.get(row, 0))
+        if loose:
+            self.rows.append(loose)
+            self.free.append((1 << len(loose)) - 1)
+
+    @classmethod
+    def load(cls, trip_id: int) -> 'SeatMap':
+        """Seats of the trip's bus with whether each is taken on this trip"""
+        with connection.cursor() as cursor:
+            cursor.execute("""
+                SELECT s.id, s.seat_number, tk.id IS NOT NULL
+                FROM trips t
+                JOIN seats s ON s.bus_id = t.bus_id
+                LEFT JOIN tickets tk ON tk.seat_id = s.id AND tk.trip_id = t.id
+                     AND tk.departure_time = t.departure_time
+                WHERE t.id = %s
+                ORDER BY s.id
+            """, (trip_id,))
+            return cls(cursor.fetchall())
+
+    @property
+    def free_count(self) -> int:
+        return sum(mask.bit_count() for mask in self.free)
+
+    @staticmethod
+    def _runs(mask: int) -> List[Tuple[int, int]]:
+        """(start column, length) of every run of free seats in a row"""
+        runs = []
+        column = 0
+        while mask >> column:
+            if mask >> column & 1:
+                start = column
+                while mask >> column & 1:
+                    column += 1
+                runs.append((start, column - start))
+            else:
+                column += 1
+        return runs
+
+    def best_block(self, count: int) -> List[int]:
+        """Seat ids for a group of `count`, as contiguous as the free seats allow"""
+        if count < 1 or count > self.free_count:
+            raise SeatAssignmentError(f'Only {self.free_count} free seats left on this trip.')
+
+        # Tightest contiguous run in a single row, front rows first
+        best = None
+        for index, mask in enumerate(self.free):
+            for start, length in self._runs(mask):
+                if length >= count and (best is None or length < best[0]):
+                    best = (length, index, start)
+        if best is not None:
+            _, index, start = best
+            return self.rows[index][start:start + count]
+
+        # Shortest band of adjacent rows with enough free seats, front rows first
+        counts = [mask.bit_count() for mask in self.free]
+        band = None
+        total = first = 0
+        for last, free in enumerate(counts):
+            total += free
+            while total - counts[first] >= count:
+                total -= counts[first]
+                first += 1
+            if total >= count and (band is None or last - first < band[1] - band[0]):
+                band = (first, last)
+
+        seats = []
+        for index in range(band[0], band[1] + 1):
+            for start, length in sorted(self._runs(self.free[index]), key=lambda run: (-run[1], run[0])):
+                take = min(length, count - len(seats))
+                seats.extend(self.rows[index][start:start + take])
+                if len(seats) == count:
+                    return seats
+        return seats
+
+
+def assign_seats(trip_id: int, count: int) -> List[int]:
+    """
+    Pick `count` seats on the trip. Call inside the booking transaction: concurrent
+    assignments for the same trip are serialized until it commits, and the tickets
+    unique index still rejects a seat taken by a manual booking meanwhile.
+    """
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT pg_advisory_xact_lock(hashtext('seat_assignment'), %s::integer)",
+                       (trip_id,))
+    return SeatMap.load(trip_id).best_block(count)
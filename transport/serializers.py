@@ -2,7 +2,7 @@
 Transport serializers for dictionary data (No ORM)
 """
 from rest_framework import serializers
-from .models import Locations, Route, Bus, Trip, Seat
+from .models import Locations, Route, Bus, Trip, Seat, TripConflictError
 
 
 class LocationSerializer(serializers.Serializer):
@@ -10,6 +10,8 @@ class LocationSerializer(serializers.Serializer):
     id = serializers.IntegerField(read_only=True)
     name = serializers.CharField(max_length=255, required=True)
     city = serializers.CharField(max_length=100, required=True)
+    latitude = serializers.FloatField(required=False, allow_null=True, min_value=-90, max_value=90)
+    longitude = serializers.FloatField(required=False, allow_null=True, min_value=-180, max_value=180)
     full_address = serializers.SerializerMethodField(read_only=True)
 
     def get_full_address(self, obj):
@@ -18,11 +20,20 @@ class LocationSerializer(serializers.Serializer):
             return Locations.full_address(obj)
         return f"{obj.get('name', '')}, {obj.get('city', '')}"
 
+    def validate(self, data):
+        """Coordinates are set together"""
+        if ('latitude' in data) != ('longitude' in data) or \
+                (data.get('latitude') is None) != (data.get('longitude') is None):
+            raise serializers.ValidationError('latitude and longitude must be provided together.')
+        return data
+
     def create(self, validated_data):
         """Create a new location"""
         return Locations.create(
             name=validated_data['name'],
-            city=validated_data['city']
+            city=validated_data['city'],
+            latitude=validated_data.get('latitude'),
+            longitude=validated_data.get('longitude')
         )
 
     def update(self, instance, validated_data):
@@ -31,7 +42,9 @@ class LocationSerializer(serializers.Serializer):
         Locations.update(
             location_id=location_id,
             name=validated_data.get('name'),
-            city=validated_data.get('city')
+            city=validated_data.get('city'),
+            latitude=validated_data.get('latitude'),
+            longitude=validated_data.get('longitude')
         )
         return Locations.get_by_id(location_id)
 
@@ -43,7 +56,7 @@ class RouteSerializer(serializers.Serializer):
     start_location_name = serializers.CharField(read_only=True)
     end_location = serializers.IntegerField(source='end_location_id', required=True)
     end_location_name = serializers.CharField(read_only=True)
-    distance_km = serializers.FloatField(required=True)
+    distance_km = serializers.FloatField(required=False)
     route_info = serializers.SerializerMethodField(read_only=True)
 
     def get_route_info(self, obj):
@@ -52,6 +65,21 @@ class RouteSerializer(serializers.Serializer):
             return Route.route_info(obj)
         return ''
 
+    def validate(self, data):
+        """Estimate distance_km from station coordinates when it is not given"""
+        if self.instance is None and data.get('distance_km') is None:
+            from .geo import haversine_km, ROAD_FACTOR
+            start = Locations.get_by_id(data['start_location_id'])
+            end = Locations.get_by_id(data['end_location_id'])
+            if not start or not end or start['latitude'] is None or end['latitude'] is None:
+                raise serializers.ValidationError({
+                    'distance_km': 'Required unless both locations have coordinates.'
+                })
+            great_circle = haversine_km(start['latitude'], start['longitude'],
+                                        end['latitude'], end['longitude'])
+            data['distance_km'] = round(float(great_circle) * ROAD_FACTOR, 1)
+        return data
+
     def create(self, validated_data):
         """Create a new route"""
         return Route.create(
@@ -89,9 +117,7 @@ class BusSerializer(serializers.Serializer):
         Returns:
             Seat number string (e.g., "A01", "B05")
         """
-        row_letter = chr(65 + (seat_index // seats_per_row))  # A, B, C, ...
-        seat_in_row = (seat_index % seats_per_row) + 1
-        return f"{row_letter}{seat_in_row:02d}"
+        return Seat.seat_number(seat_index, seats_per_row)
 
     def create(self, validated_data):
         """Create a new bus and automatically create seats"""
@@ -215,32 +241,99 @@ class TripSerializer(serializers.Serializer):
 
     def validate(self, data):
         """Validate trip data"""
-        if data.get('arrival_time') and data.get('departure_time'):
-            if data['arrival_time'] <= data['departure_time']:
+        # Check against the stored values for fields a partial update leaves out
+        instance = self.instance if isinstance(self.instance, dict) else {}
+        proposed = {
+            'id': instance.get('id'),
+            'bus_id': data.get('bus_id', instance.get('bus_id')),
+            'departure_time': data.get('departure_time', instance.get('departure_time')),
+            'arrival_time': data.get('arrival_time', instance.get('arrival_time')),
+        }
+        if proposed['arrival_time'] and proposed['departure_time']:
+            if proposed['arrival_time'] <= proposed['departure_time']:
                 raise serializers.ValidationError({
                     'arrival_time': 'Arrival time must be after departure time.'
                 })
+            conflicts = Trip.find_bus_conflicts([proposed])
+            if conflicts:
+                raise serializers.ValidationError({
+                    'bus': [conflict['message'] for conflict in conflicts]
+                })
         return data
 
     def create(self, validated_data):
         """Create a new trip"""
-        return Trip.create(
-            route_id=validated_data['route_id'],
-            bus_id=validated_data['bus_id'],
-            departure_time=validated_data['departure_time'],
-            arrival_time=validated_data['arrival_time'],
-            price_per_seat=validated_data['price_per_seat']
-        )
+        try:
+            return Trip.create(
+                route_id=validated_data['route_id'],
+                bus_id=validated_data['bus_id'],
+                departure_time=validated_data['departure_time'],
+                arrival_time=validated_data['arrival_time'],
+                price_per_seat=validated_data['price_per_seat']
+            )
+        except TripConflictError as e:
+            raise serializers.ValidationError({'bus': [c['message'] for c in e.conflicts] or [str(e)]})
 
     def update(self, instance, validated_data):
         """Update a trip"""
         trip_id = instance['id'] if isinstance(instance, dict) else instance
-        Trip.update(
-            trip_id=trip_id,
-            route_id=validated_data.get('route_id'),
-            bus_id=validated_data.get('bus_id'),
-            departure_time=validated_data.get('departure_time'),
-            arrival_time=validated_data.get('arrival_time'),
-            price_per_seat=validated_data.get('price_per_seat')
-        )
+        try:
+            Trip.update(
+                trip_id=trip_id,
+                route_id=validated_data.get('route_id'),
+                bus_id=validated_data.get('bus_id'),
+                departure_time=validated_data.get('departure_time'),
+                arrival_time=validated_data.get('arrival_time'),
+                price_per_seat=validated_data.get('price_per_seat')
+            )
+        except TripConflictError as e:
+            raise serializers.ValidationError({'bus': [c['message'] for c in e.conflicts] or [str(e)]})
         return Trip.get_by_id(trip_id)
+
+
+class ScheduleTemplateSerializer(serializers.Serializer):
+    """Serializer for a recurring trip schedule template"""
+    route = serializers.IntegerField(source='route_id', required=True)
+    bus = serializers.IntegerField(source='bus_id', required=True)
+    departure_times = serializers.ListField(child=serializers.TimeField(), allow_empty=False)
+    duration_minutes = serializers.IntegerField(min_value=1, max_value=48 * 60)
+    days_of_week = serializers.ListField(
+        child=serializers.IntegerField(min_value=0, max_value=6),
+        allow_empty=False,
+        help_text='0 = Monday ... 6 = Sunday'
+    )
+    date_from = serializers.DateField()
+    date_to = serializers.DateField()
+    price_per_seat = serializers.DecimalField(max_digits=10, decimal_places=2, min_value=0)
+
+    def validate(self, data):
+        """Validate schedule template"""
+        if data['date_to'] < data['date_from']:
+            raise serializers.ValidationError({'date_to': 'date_to must not be before date_from.'})
+        if (data['date_to'] - data['date_from']).days > 366:
+            raise serializers.ValidationError({'date_to': 'A template can span at most one year.'})
+        if len(set(data['departure_times'])) != len(data['departure_times']):
+            raise serializers.ValidationError({'departure_times': 'Departure times must be unique.'})
+        if not Route.get_by_id(data['route_id']):
+            raise serializers.ValidationError({'route': 'Route not found.'})
+        if not Bus.get_by_id(data['bus_id']):
+            raise serializers.ValidationError({'bus': 'Bus not found.'})
+        return data
+
+
+class FleetAssignmentSerializer(serializers.Serializer):
+    """Serializer for a fleet assignment request over a range of departure dates"""
+    date_from = serializers.DateField()
+    date_to = serializers.DateField()
+    route = serializers.IntegerField(source='route_id', required=False)
+    dry_run = serializers.BooleanField(default=False)
+
+    def validate(self, data):
+        """Validate the date range"""
+        if data['date_to'] < data['date_from']:
+            raise serializers.ValidationError({'date_to': 'date_to must not be before date_from.'})
+        if (data['date_to'] - data['date_from']).days > 92:
+            raise serializers.ValidationError({'date_to': 'Assign at most three months at a time.'})
+        if 'route_id' in data and not Route.get_by_id(data['route_id']):
+            raise serializers.ValidationError({'route': 'Route not found.'})
+        return data
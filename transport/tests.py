@@ -1,3 +1,365 @@
-from django.test import TestCase
+from datetime import date, datetime, time, timedelta
+from decimal import Decimal
+from unittest import mock
+import io
 
-# Create your tests here.
+from django.test import SimpleTestCase
+from django.utils.timezone import make_aware
+from rest_framework.test import APIRequestFactory, force_authenticate
+
+from .analytics import TripFrame
+from .fleet import FleetPlanner, FleetTrip, MIN_TURNAROUND
+from .models import Trip
+from .scheduling import expand_template, find_batch_overlaps
+from .seating import SEATS_PER_ROW, SeatAssignmentError, SeatMap
+from .timetable import TimetableImport, _datetime, _number, _text, import_timetable, open_feed
+from .views import TripViewSet
+
+
+class TripFrameTests(SimpleTestCase):
+    """Vectorized occupancy and revenue metrics"""
+
+    def setUp(self):
+        # Route 1: two trips of 100 km; route 2: one trip of 50 km on an empty bus
+        self.frame = TripFrame(
+            trip_id=[1, 2, 3],
+            route_id=[1, 1, 2],
+            distance_km=[100, 100, 50],
+            total_seats=[40, 40, 0],
+            weekday=[0, 0, 5],
+            hour=[8, 20, 8],
+            booked_seats=[30, 10, 0],
+            revenue=[3000, 1000, 0],
+        )
+
+    def test_load_factors_skip_buses_without_seats(self):
+        self.assertEqual(self.frame.load_factors().tolist(), [0.75, 0.25, 0.0])
+
+    def test_summary(self):
+        self.assertEqual(self.frame.summary(), {
+            'trips': 3,
+            'total_seats': 80,
+            'booked_seats': 40,
+            'revenue': 4000.0,
+            'load_factor': 0.5,
+            'revenue_per_km': 16.0,
+            'revenue_per_seat_km': 1.0,
+        })
+
+    def test_route_metrics_best_route_first(self):
+        routes = self.frame.route_metrics()
+        self.assertEqual([route['route_id'] for route in routes], [1, 2])
+        self.assertEqual(routes[0], {
+            'route_id': 1,
+            'distance_km': 100.0,
+            'trips': 2,
+            'total_seats': 80,
+            'booked_seats': 40,
+            'revenue': 4000.0,
+            'load_factor': 0.5,
+            'revenue_per_km': 20.0,
+            'revenue_per_seat_km': 1.0,
+        })
+        self.assertEqual(routes[1]['load_factor'], 0.0)
+
+    def test_departure_heatmap(self):
+        heatmap = self.frame.departure_heatmap()
+        self.assertEqual(heatmap['trips'][0][8], 1)
+        self.assertEqual(heatmap['trips'][5][8], 1)
+        self.assertEqual(heatmap['load_factor'][0][20], 0.25)
+        self.assertEqual(sum(map(sum, heatmap['trips'])), 3)
+
+    def test_empty_frame(self):
+        frame = TripFrame([], [], [], [], [], [], [], [])
+        self.assertEqual(frame.route_metrics(), [])
+        self.assertEqual(frame.summary()['load_factor'], 0.0)
+
+
+def _at(hour, minute=0, day=1):
+    return make_aware(datetime(2030, 1, day, hour, minute))
+
+
+class ScheduleTests(SimpleTestCase):
+    """Template expansion and bus overlap checks of a schedule batch"""
+
+    def trip(self, bus_id, departure_hour, arrival_hour):
+        return {'bus_id': bus_id, 'departure_time': _at(departure_hour), 'arrival_time': _at(arrival_hour)}
+
+    def test_expand_template_selected_weekdays_and_times(self):
+        trips = expand_template({
+            'route_id': 1,
+            'bus_id': 2,
+            # 2030-01-07 is a Monday
+            'date_from': date(2030, 1, 7),
+            'date_to': date(2030, 1, 13),
+            'days_of_week': [0, 2],
+            'departure_times': [time(8), time(14, 30)],
+            'duration_minutes': 150,
+            'price_per_seat': Decimal('200000'),
+        })
+        self.assertEqual([trip['departure_time'] for trip in trips], [
+            _at(8, day=7), _at(14, 30, day=7), _at(8, day=9), _at(14, 30, day=9),
+        ])
+        self.assertEqual(trips[0]['arrival_time'], _at(10, 30, day=7))
+        self.assertTrue(all(trip['bus_id'] == 2 and trip['route_id'] == 1 for trip in trips))
+
+    def test_back_to_back_trips_do_not_overlap(self):
+        self.assertEqual(find_batch_overlaps([self.trip(1, 8, 10), self.trip(1, 10, 12)]), [])
+
+    def test_same_bus_overlap_is_reported(self):
+        overlaps = find_batch_overlaps([self.trip(1, 12, 14), self.trip(1, 8, 13)])
+        self.assertEqual([(o['index'], o['overlaps_index']) for o in overlaps], [(0, 1)])
+
+    def test_other_buses_are_independent(self):
+        self.assertEqual(find_batch_overlaps([self.trip(1, 8, 12), self.trip(2, 9, 11)]), [])
+
+    def test_long_trip_overlaps_every_later_trip_it_covers(self):
+        overlaps = find_batch_overlaps([self.trip(1, 8, 20), self.trip(1, 9, 10), self.trip(1, 12, 13)])
+        self.assertEqual([(o['index'], o['overlaps_index']) for o in overlaps], [(1, 0), (2, 0)])
+
+
+class FleetPlannerTests(SimpleTestCase):
+    """Greedy best-fit bus assignment without overlaps"""
+
+    SEATS = {1: 16, 2: 30, 3: 45}
+
+    def trip(self, trip_id, departure_hour, hours=2, demand=20, bus_id=1, fixed=False, minute=0):
+        departure_time = _at(departure_hour, minute)
+        return FleetTrip(departure_time, trip_id, bus_id, departure_time + timedelta(hours=hours), demand, fixed)
+
+    def assign(self, trips, seats=SEATS):
+        return FleetPlanner(trips, seats).assign()
+
+    def assert_no_bus_overlaps(self, trips, assignment):
+        by_bus = {}
+        for trip in trips:
+            by_bus.setdefault(assignment.get(trip.trip_id, trip.bus_id), []).append(trip)
+        for bus_trips in by_bus.values():
+            bus_trips.sort()
+            for previous, trip in zip(bus_trips, bus_trips[1:]):
+                self.assertLessEqual(previous.arrival_time + MIN_TURNAROUND, trip.departure_time)
+
+    def test_smallest_bus_covering_demand(self):
+        assignment, unassigned = self.assign([self.trip(10, 8, demand=20)])
+        self.assertEqual(assignment, {10: 2})
+        self.assertEqual(unassigned, [])
+
+    def test_largest_bus_when_none_covers_demand(self):
+        assignment, _ = self.assign([self.trip(10, 8, demand=60)])
+        self.assertEqual(assignment, {10: 3})
+
+    def test_overlapping_trips_get_different_buses(self):
+        trips = [self.trip(10, 8), self.trip(11, 9), self.trip(12, 9, minute=30)]
+        assignment, unassigned = self.assign(trips)
+        self.assertEqual(len(set(assignment.values())), 3)
+        self.assertEqual(unassigned, [])
+        self.assert_no_bus_overlaps(trips, assignment)
+
+    def test_bus_is_reused_only_after_turnaround(self):
+        trips = [self.trip(10, 8, demand=10), self.trip(11, 10, minute=15, demand=10),
+                 self.trip(12, 10, minute=30, demand=10)]
+        assignment, _ = self.assign(trips, seats={1: 16, 2: 30})
+        self.assertEqual(assignment, {10: 1, 11: 2, 12: 1})
+        self.assert_no_bus_overlaps(trips, assignment)
+
+    def test_fixed_trip_blocks_its_bus(self):
+        fixed = self.trip(1, 9, bus_id=2, fixed=True)
+        assignment, _ = self.assign([fixed, self.trip(10, 10, demand=20)])
+        self.assertEqual(assignment, {10: 3})
+
+    def test_trip_without_a_free_bus_is_unassigned(self):
+        trips = [self.trip(10, 8), self.trip(11, 9)]
+        assignment, unassigned = self.assign(trips, seats={1: 45})
+        self.assertEqual(assignment, {10: 1})
+        self.assertEqual([trip.trip_id for trip in unassigned], [11])
+
+    def test_empty_seats(self):
+        planner = FleetPlanner([self.trip(10, 8, demand=20, bus_id=3), self.trip(11, 12, demand=40, bus_id=2)],
+                               self.SEATS)
+        self.assertEqual(planner.empty_seats(), {'empty_seats': 25, 'unserved_demand': 10})
+        self.assertEqual(planner.empty_seats({10: 2, 11: 3}), {'empty_seats': 15, 'unserved_demand': 0})
+
+
+class SeatMapTests(SimpleTestCase):
+    """Contiguous seat assignment for group bookings"""
+
+    def seat_map(self, free, rows='ABC', extra=()):
+        """Seat A01 has id 1, B01 id 11, ...; `free` maps a row to its free columns"""
+        seats = []
+        for index, row in enumerate(rows):
+            for column in range(1, SEATS_PER_ROW + 1):
+                seat_id = index * SEATS_PER_ROW + column
+                seats.append((seat_id, f'{row}{column:02d}', column not in free.get(row, ())))
+        return SeatMap(seats + list(extra))
+
+    def test_tightest_run_in_one_row(self):
+        seat_map = self.seat_map({'A': [1, 2, 3, 6, 7, 8, 9, 10], 'B': range(1, 11)})
+        self.assertEqual(seat_map.best_block(3), [1, 2, 3])
+        self.assertEqual(seat_map.best_block(4), [6, 7, 8, 9])
+        self.assertEqual(seat_map.best_block(6), [11, 12, 13, 14, 15, 16])
+
+    def test_front_row_wins_a_tie(self):
+        seat_map = self.seat_map({'A': [5, 6], 'B': [1, 2]})
+        self.assertEqual(seat_map.best_block(2), [5, 6])
+
+    def test_large_group_gets_a_band_of_adjacent_rows(self):
+        seat_map = self.seat_map({'A': [1, 2], 'B': [1, 2, 3, 6, 7], 'C': [1, 2, 3, 4, 5]})
+        self.assertEqual(seat_map.best_block(8), [11, 12, 13, 16, 17, 21, 22, 23])
+
+    def test_seats_outside_the_layout_are_used_last(self):
+        extra = [(100, 'VIP1', False), (101, None, False), (102, 'Z99', True)]
+        seat_map = self.seat_map({'A': [4]}, rows='A', extra=extra)
+        self.assertEqual(seat_map.free_count, 3)
+        self.assertEqual(seat_map.best_block(1), [4])
+        self.assertEqual(seat_map.best_block(2), [100, 101])
+
+    def test_not_enough_free_seats(self):
+        seat_map = self.seat_map({'A': [1, 2], 'C': [10]})
+        self.assertEqual(seat_map.free_count, 3)
+        with self.assertRaisesMessage(SeatAssignmentError, 'Only 3 free seats'):
+            seat_map.best_block(4)
+        with self.assertRaises(SeatAssignmentError):
+            seat_map.best_block(0)
+
+
+class ReportParameterTests(SimpleTestCase):
+    """Query parameters of the admin occupancy and analytics reports"""
+
+    admin = mock.Mock(is_authenticated=True, is_admin=lambda: True)
+
+    def get(self, report, **params):
+        request = APIRequestFactory().get(f'/api/trips/{report}/', params)
+        force_authenticate(request, user=self.admin)
+        return TripViewSet.as_view({'get': report})(request)
+
+    def test_occupancy_route_must_be_an_id(self):
+        with mock.patch.object(Trip, 'get_occupancy', return_value=[]) as get_occupancy:
+            self.assertEqual(self.get('occupancy', route='abc').status_code, 400)
+            get_occupancy.assert_not_called()
+            self.assertEqual(self.get('occupancy', route='3').status_code, 200)
+        self.assertEqual(get_occupancy.call_args.kwargs['route_id'], 3)
+
+    def test_analytics_route_and_top_must_be_numbers(self):
+        frame = TripFrame([1, 2], [1, 2], [100, 50], [40, 40], [0, 0], [8, 9], [20, 10], [2000, 500])
+        with mock.patch.object(TripFrame, 'load', return_value=frame) as load:
+            self.assertEqual(self.get('analytics', route='abc').status_code, 400)
+            self.assertEqual(self.get('analytics', top='abc').status_code, 400)
+            self.assertEqual(self.get('analytics', top='-1').status_code, 400)
+            load.assert_not_called()
+            response = self.get('analytics', route='1', top='1')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(load.call_args.kwargs['route_id'], 1)
+        self.assertEqual(len(response.data['routes']), 1)
+
+
+class TimetableParsingTests(SimpleTestCase):
+    """Column parsers of the timetable import"""
+
+    def test_text(self):
+        self.assertEqual(_text({'model': '  Universe  '}, 'model', 10), 'Universe')
+        self.assertIsNone(_text({'model': ' '}, 'model', 10, required=False))
+        with self.assertRaisesMessage(ValueError, 'model is required.'):
+            _text({}, 'model', 10)
+        with self.assertRaisesMessage(ValueError, 'model is longer than 3 characters.'):
+            _text({'model': 'Universe'}, 'model', 3)
+
+    def test_number(self):
+        self.assertEqual(_number({'total_seats': '40'}, 'total_seats', int, 1, 260), 40)
+        self.assertEqual(_number({'price': '1.5'}, 'price', Decimal), Decimal('1.5'))
+        with self.assertRaisesMessage(ValueError, "total_seats is not a number: '4o'."):
+            _number({'total_seats': '4o'}, 'total_seats', int)
+        with self.assertRaisesMessage(ValueError, 'stop_lat must be between -90 and 90.'):
+            _number({'stop_lat': '91'}, 'stop_lat', minimum=-90, maximum=90)
+        with self.assertRaisesMessage(ValueError, 'must be between'):
+            _number({'stop_lat': 'nan'}, 'stop_lat', minimum=-90, maximum=90)
+
+    def test_datetime(self):
+        self.assertEqual(_datetime({'departure_time': '2030-01-01 08:00'}, 'departure_time'), _at(8))
+        with self.assertRaisesMessage(ValueError, 'departure_time must be a date and time'):
+            _datetime({'departure_time': '08:00 01/01/2030'}, 'departure_time')
+        with self.assertRaisesMessage(ValueError, 'departure_time must be a date and time'):
+            _datetime({'departure_time': '2030-13-01 08:00'}, 'departure_time')
+
+
+class TimetableImportTests(SimpleTestCase):
+    """Row validation of the timetable import, with the database writes patched out"""
+
+    def load(self, kind, text, batch_size=1000, **maps):
+        self.importer = TimetableImport(batch_size=batch_size)
+        for name, ids in maps.items():
+            setattr(self.importer, name, ids)
+        with mock.patch.object(TimetableImport, '_flush') as flush:
+            self.importer._load_file(kind, io.BytesIO(text.encode()))
+        self.batches = [call.args[1] for call in flush.call_args_list if call.args[1]]
+        return [(error['line'], error['id'], error['error']) for error in self.importer.errors]
+
+    def test_missing_columns(self):
+        errors = self.load('stops', 'stop_id,stop_name\nS1,Ben xe Mien Dong\n')
+        self.assertEqual(errors, [(1, None, 'Missing columns: stop_city')])
+        self.assertEqual(self.batches, [])
+
+    def test_bad_rows_are_reported_and_skipped(self):
+        errors = self.load('stops', (
+            '\ufeffstop_id,stop_name,stop_city,stop_lat,stop_lon\n'
+            'S1,Ben xe Mien Dong,Ho Chi Minh,10.81,106.71\n'
+            'S2,Ben xe Da Lat,Da Lat,95,108.44\n'
+            'S1,Ben xe Mien Tay,Ho Chi Minh,,\n'
+            'S3,Ben xe Nha Trang,Nha Trang,12.26,\n'
+        ))
+        self.assertEqual(errors, [
+            (3, 'S2', 'stop_lat must be between -90 and 90.'),
+            (4, 'S1', "Duplicate stop_id 'S1'."),
+            (5, 'S3', 'stop_lat and stop_lon must be given together.'),
+        ])
+        self.assertEqual(self.importer.files['stops']['rows'], 4)
+        self.assertEqual(self.importer.files['stops']['errors'], 3)
+        self.assertEqual([record['key'] for batch in self.batches for record in batch], ['S1'])
+
+    def test_rows_are_written_in_batches(self):
+        rows = ''.join(f'S{index},Stop {index},City,,\n' for index in range(5))
+        self.load('stops', 'stop_id,stop_name,stop_city,stop_lat,stop_lon\n' + rows, batch_size=2)
+        self.assertEqual([len(batch) for batch in self.batches], [2, 2, 1])
+        self.assertEqual(self.batches[2][0]['line'], 6)
+
+    def test_route_distance(self):
+        header = 'route_id,origin_stop_id,destination_stop_id,distance_km\n'
+        stops = {'stops': {'S1': 1, 'S2': 2, 'S3': 3},
+                 'coordinates': {1: (10.81, 106.71), 2: (11.94, 108.44), 3: (None, None)}}
+        errors = self.load('routes', header + 'R1,S1,S2,\nR2,S1,S3,\nR3,S1,S3,300\nR4,S2,S2,10\nR5,S1,S9,10\n',
+                           **stops)
+        self.assertEqual(errors, [
+            (3, 'R2', 'distance_km is required when a stop has no coordinates.'),
+            (5, 'R4', 'origin_stop_id and destination_stop_id are the same stop.'),
+            (6, 'R5', "Unknown stop 'S9' in destination_stop_id."),
+        ])
+        estimated, given = self.batches[0]
+        self.assertGreater(estimated['distance_km'], 200)
+        self.assertEqual(given['distance_km'], 300)
+
+    def test_trip_references_and_times(self):
+        header = 'trip_id,route_id,license_plate,departure_time,arrival_time,price\n'
+        errors = self.load('trips', header + (
+            'T1,R1,51B-12345,2030-01-01 08:00,2030-01-01 14:00,250000.456\n'
+            'T2,R0,51B-12345,2030-01-01 08:00,2030-01-01 14:00,250000\n'
+            'T3,R1,99Z-00000,2030-01-01 08:00,2030-01-01 14:00,250000\n'
+            'T4,R1,51B-12345,2030-01-01 14:00,2030-01-01 08:00,250000\n'
+            'T5,R1,51B-12345,2030-01-01 08:00,2030-01-01 14:00,-1\n'
+        ), routes={'R1': 7}, buses={'51B-12345': 3})
+        self.assertEqual([error[2] for error in errors], [
+            "Unknown route 'R0'.",
+            "Unknown bus '99Z-00000'.",
+            'arrival_time must be after departure_time.',
+            'price must be between 0 and 99999999.99.',
+        ])
+        [trip] = self.batches[0]
+        self.assertEqual((trip['route_id'], trip['bus_id']), (7, 3))
+        self.assertEqual(trip['departure_time'], _at(8))
+        self.assertEqual(trip['price_per_seat'], Decimal('250000.46'))
+
+    def test_feed_files_are_checked_before_loading(self):
+        with self.assertRaisesMessage(ValueError, 'Unknown feed files: agency.'):
+            import_timetable({'agency': io.BytesIO()})
+        with self.assertRaisesMessage(ValueError, 'source must be 1 to 50 characters.'):
+            import_timetable({}, source='')
+        with self.assertRaisesMessage(ValueError, 'A feed must be a directory or a .zip file.'):
+            open_feed(io.BytesIO(b'stop_id\n'))
@@ -0,0 +1,562 @@
+"""
+Timetable import from CSV / GTFS-style feeds (No ORM)
+
+A feed is up to four CSV files (stops.txt or stops.csv, ...; in a directory, a .zip
+or uploaded one by one), loaded in this order so every reference points at rows
+already written:
+
+- stops:  stop_id, stop_name, stop_city [, stop_lat, stop_lon]           -> locations
+- routes: route_id, origin_stop_id, destination_stop_id [, distance_km]  -> routes
+- buses:  license_plate, model, total_seats, manufacture_year            -> buses, seats
+- trips:  trip_id, route_id, license_plate, departure_time, arrival_time, price -> trips
+
+Files are read row by row and written BATCH_SIZE rows per statement (INSERT / UPDATE
+over unnest arrays). Stop and route ids of the feed are resolved through in-memory
+maps primed from timetable_import_keys, so a feed may reference what an earlier run
+loaded, and running a feed again updates the rows it created instead of duplicating
+them; buses are matched on license plate. A bad row is reported with its file and
+line and skipped, and a batch the database refuses is retried row by row so only the
+offending rows are lost. Batches commit one by one: an interrupted load resumes by
+running the feed again.
+"""
+from django.db import connection, transaction, DatabaseError
+from django.utils.dateparse import parse_datetime
+from django.utils.timezone import make_aware, is_naive
+from typing import List, Dict, Any, Optional, Callable, IO, Tuple
+from decimal import Decimal, InvalidOperation
+from pathlib import Path
+import csv
+import io
+import time
+import zipfile
+from utils.db_utils import execute_query, execute_update
+from .models import Locations, Route, Bus, Seat, Trip
+from .geo import haversine_km, ROAD_FACTOR
+from .scheduling import find_batch_overlaps
+
+BATCH_SIZE = 1000
+MAX_REPORTED_ERRORS = 500
+KEYS_TABLE = 'timetable_import_keys'
+# Seat rows A to Z
+MAX_SEATS = 26 * Seat.SEATS_PER_ROW
+MAX_PRICE = Decimal('99999999.99')
+
+FILES = ('stops', 'routes', 'buses', 'trips')
+# file -> (required columns, the first one identifying the row; optional columns)
+COLUMNS = {
+    'stops': (('stop_id', 'stop_name', 'stop_city'), ('stop_lat', 'stop_lon')),
+    'routes': (('route_id', 'origin_stop_id', 'destination_stop_id'), ('distance_km',)),
+    'buses': (('license_plate', 'model', 'total_seats', 'manufacture_year'), ()),
+    'trips': (('trip_id', 'route_id', 'license_plate', 'departure_time', 'arrival_time', 'price'), ()),
+}
+
+
+def open_feed(feed) -> Dict[str, IO[bytes]]:
+    """Binary streams of the feed files in a directory or a .zip (path or file object)"""
+    if zipfile.is_zipfile(feed):
+        archive = zipfile.ZipFile(feed)
+        names = {Path(name).name: name for name in archive.namelist() if not name.endswith('/')}
+        opener = archive.open
+    elif isinstance(feed, (str, Path)) and Path(feed).is_dir():
+        names = {path.name: path for path in Path(feed).iterdir() if path.is_file()}
+        opener = lambda path: open(path, 'rb')
+    else:
+        raise ValueError('A feed must be a directory or a .zip file.')
+
+    files = {}
+    for kind in FILES:
+        for name in (f'{kind}.txt', f'{kind}.csv'):
+            if name in names:
+                files[kind] = opener(names[name])
+                break
+    if not files:
+        raise ValueError(f"The feed has none of {', '.join(f'{kind}.txt' for kind in FILES)}.")
+    return files
+
+
+def _text(row: Dict[str, str], column: str, max_length: int, required: bool = True) -> Optional[str]:
+    value = (row.get(column) or '').strip()
+    if not value:
+        if required:
+            raise ValueError(f'{column} is required.')
+        return None
+    if len(value) > max_length:
+        raise ValueError(f'{column} is longer than {max_length} characters.')
+    return value
+
+
+def _number(row: Dict[str, str], column: str, kind: type = float, minimum=None, maximum=None,
+            required: bool = True):
+    raw = _text(row, column, 40, required)
+    if raw is None:
+        return None
+    try:
+        value = kind(raw)
+    except (ValueError, InvalidOperation):
+        raise ValueError(f'{column} is not a number: {raw!r}.')
+    if value != value or (minimum is not None and value < minimum) or (maximum is not None and value > maximum):
+        raise ValueError(f'{column} must be between {minimum} and {maximum}.')
+    return value
+
+
+def _datetime(row: Dict[str, str], column: str):
+    raw = _text(row, column, 40)
+    try:
+        value = parse_datetime(raw)
+        if value is None:
+            raise ValueError
+        return make_aware(value) if is_naive(value) else value
+    except ValueError:
+        raise ValueError(f'{column} must be a date and time (YYYY-MM-DD HH:MM): {raw!r}.')
+
+
+def _rescheduled(trip: Dict[str, Any]) -> bool:
+    """Whether a proposed trip is new or changes bus or times"""
+    previous = trip.get('previous')
+    return previous is None or any(previous[name] != trip[name]
+                                   for name in ('bus_id', 'departure_time', 'arrival_time'))
+
+
+def _db_message(error: DatabaseError) -> str:
+    return str(error).strip().split('\n')[0]
+
+
+class TimetableImport:
+    """One load of a feed: the id maps, per-file counters and the rows rejected"""
+
+    def __init__(self, source: str = 'default', batch_size: int = BATCH_SIZE,
+                 progress: Callable[[str, Dict[str, int]], None] = None):
+        self.source = source
+        self.batch_size = batch_size
+        self.progress = progress
+        # feed stop_id -> location id, feed route_id -> route id, license plate -> bus id
+        self.stops: Dict[str, int] = {}
+        self.routes: Dict[str, int] = {}
+        self.buses: Dict[str, int] = {}
+        # location id -> (latitude, longitude), to estimate missing route distances
+        self.coordinates: Dict[int, Tuple[Optional[float], Optional[float]]] = {}
+        self.files: Dict[str, Dict[str, int]] = {}
+        self.seats_created = 0
+        self.errors: List[Dict[str, Any]] = []
+        self.error_count = 0
+
+    def run(self, files: Dict[str, IO[bytes]], dry_run: bool = False) -> Dict[str, Any]:
+        """Load the given files (kind -> binary stream); with dry_run everything is rolled back"""
+        started = time.perf_counter()
+        if dry_run:
+            with transaction.atomic():
+                self._load(files)
+                transaction.set_rollback(True)
+        else:
+            self._load(files)
+        return {
+            'source': self.source,
+            'dry_run': dry_run,
+            'files': self.files,
+            'seats_created': self.seats_created,
+            'error_count': self.error_count,
+            'errors': sorted(self.errors, key=lambda error: (FILES.index(error['file']), error['line'])),
+            'elapsed_seconds': round(time.perf_counter() - started, 2),
+        }
+
+    def _load(self, files: Dict[str, IO[bytes]]):
+        self._load_maps()
+        for kind in FILES:
+            if kind in files:
+                self._load_file(kind, files[kind])
+
+    def _load_maps(self):
+        for row in execute_query(f"""
+            SELECT k.external_id, l.id, l.latitude, l.longitude
+            FROM {KEYS_TABLE} k
+            JOIN {Locations.TABLE_NAME} l ON l.id = k.local_id
+            WHERE k.source = %s AND k.kind = 'stop'
+        """, (self.source,)):
+            self.stops[row['external_id']] = row['id']
+            self.coordinates[row['id']] = (row['latitude'], row['longitude'])
+        for row in execute_query(f"""
+            SELECT k.external_id, r.id
+            FROM {KEYS_TABLE} k
+            JOIN {Route.TABLE_NAME} r ON r.id = k.local_id
+            WHERE k.source = %s AND k.kind = 'route'
+        """, (self.source,)):
+            self.routes[row['external_id']] = row['id']
+        for row in execute_query(f"SELECT id, license_plate FROM {Bus.TABLE_NAME}"):
+            self.buses[row['license_plate']] = row['id']
+
+    def _load_file(self, kind: str, stream: IO[bytes]):
+        counts = self.files[kind] = {'rows': 0, 'inserted': 0, 'updated': 0, 'unchanged': 0, 'errors': 0}
+        required, optional = COLUMNS[kind]
+        reader = csv.DictReader(io.TextIOWrapper(stream, encoding='utf-8-sig', newline=''))
+        try:
+            header = reader.fieldnames or []
+        except (csv.Error, UnicodeDecodeError) as e:
+            self._error(kind, 1, None, f'Unreadable file: {e}')
+            return
+        missing = [column for column in required if column not in header]
+        if missing:
+            self._error(kind, 1, None, f"Missing columns: {', '.join(missing)}")
+            return
+
+        parse = getattr(self, f'_parse_{kind}')
+        seen = set()
+        batch = []
+        try:
+            for row in reader:
+                counts['rows'] += 1
+                key = (row.get(required[0]) or '').strip()
+                try:
+                    if key in seen:
+                        raise ValueError(f'Duplicate {required[0]} {key!r}.')
+                    record = parse(row)
+                except ValueError as e:
+                    self._error(kind, reader.line_num, key or None, str(e))
+                    continue
+                seen.add(key)
+                record.update(key=key, line=reader.line_num)
+                batch.append(record)
+                if len(batch) >= self.batch_size:
+                    self._flush(kind, batch)
+                    batch = []
+        except (csv.Error, UnicodeDecodeError) as e:
+            self._error(kind, reader.line_num, None, f'Unreadable file: {e}')
+        self._flush(kind, batch)
+
+    def _error(self, kind: str, line: int, key: Optional[str], message: str):
+        self.error_count += 1
+        self.files[kind]['errors'] += 1
+        if len(self.errors) < MAX_REPORTED_ERRORS:
+            self.errors.append({'file': kind, 'line': line, 'id': key, 'error': message})
+
+    def _flush(self, kind: str, batch: List[Dict[str, Any]]):
+        """Write a batch in one transaction, or row by row to isolate what the database refuses"""
+        if not batch:
+            return
+        write = getattr(self, f'_write_{kind}')
+        try:
+            results = [(batch, self._atomic(write, batch))]
+        except DatabaseError:
+            results = []
+            for record in batch:
+                try:
+                    results.append(([record], self._atomic(write, [record])))
+                except DatabaseError as e:
+                    self._error(kind, record['line'], record['key'], _db_message(e))
+
+        # Only what committed reaches the maps and counters
+        counts = self.files[kind]
+        for records, result in results:
+            for record, message in result.get('rejected', []):
+                self._error(kind, record['line'], record['key'], message)
+            for name in ('inserted', 'updated', 'unchanged'):
+                counts[name] += result.get(name, 0)
+            self.seats_created += result.get('seats', 0)
+            ids = result.get('ids', {})
+            if kind == 'stops':
+                for record in records:
+                    self.stops[record['key']] = ids[record['key']]
+                    self.coordinates[ids[record['key']]] = (record['latitude'], record['longitude'])
+            elif kind == 'routes':
+                self.routes.update(ids)
+            elif kind == 'buses':
+                self.buses.update(ids)
+        if self.progress:
+            self.progress(kind, counts)
+
+    @staticmethod
+    def _atomic(write: Callable, batch: List[Dict[str, Any]]) -> Dict[str, Any]:
+        with transaction.atomic():
+            with connection.cursor() as cursor:
+                # Report foreign key violations at the failing statement, not at commit
+                cursor.execute("SET CONSTRAINTS ALL IMMEDIATE")
+            return write(batch)
+
+    # Parsing: each returns the row's values or raises ValueError
+
+    def _parse_stops(self, row: Dict[str, str]) -> Dict[str, Any]:
+        _text(row, 'stop_id', 64)
+        latitude = _number(row, 'stop_lat', minimum=-90, maximum=90, required=False)
+        longitude = _number(row, 'stop_lon', minimum=-180, maximum=180, required=False)
+        if (latitude is None) != (longitude is None):
+            raise ValueError('stop_lat and stop_lon must be given together.')
+        return {
+            'name': _text(row, 'stop_name', 255),
+            'city': _text(row, 'stop_city', 100),
+            'latitude': latitude,
+            'longitude': longitude,
+        }
+
+    def _stop(self, row: Dict[str, str], column: str) -> int:
+        stop_id = _text(row, column, 64)
+        if stop_id not in self.stops:
+            raise ValueError(f'Unknown stop {stop_id!r} in {column}.')
+        return self.stops[stop_id]
+
+    def _parse_routes(self, row: Dict[str, str]) -> Dict[str, Any]:
+        _text(row, 'route_id', 64)
+        start = self._stop(row, 'origin_stop_id')
+        end = self._stop(row, 'destination_stop_id')
+        if start == end:
+            raise ValueError('origin_stop_id and destination_stop_id are the same stop.')
+        distance = _number(row, 'distance_km', minimum=0, maximum=10000, required=False)
+        if not distance:
+            (lat1, lon1), (lat2, lon2) = self.coordinates.get(start, (None, None)), self.coordinates.get(end, (None, None))
+            if None in (lat1, lat2):
+                raise ValueError('distance_km is required when a stop has no coordinates.')
+            # Same estimate as the route_distances command
+            distance = round(float(haversine_km(lat1, lon1, lat2, lon2)) * ROAD_FACTOR, 1)
+        return {'start_location_id': start, 'end_location_id': end, 'distance_km': distance}
+
+    def _parse_buses(self, row: Dict[str, str]) -> Dict[str, Any]:
+        return {
+            'license_plate': _text(row, 'license_plate', 30),
+            'model': _text(row, 'model', 100),
+            'total_seats': _number(row, 'total_seats', int, 1, MAX_SEATS),
+            'manufacture_year': _number(row, 'manufacture_year', int, 1900, 2100),
+        }
+
+    def _parse_trips(self, row: Dict[str, str]) -> Dict[str, Any]:
+        _text(row, 'trip_id', 64)
+        route_id = _text(row, 'route_id', 64)
+        if route_id not in self.routes:
+            raise ValueError(f'Unknown route {route_id!r}.')
+        license_plate = _text(row, 'license_plate', 30)
+        if license_plate not in self.buses:
+            raise ValueError(f'Unknown bus {license_plate!r}.')
+        departure_time = _datetime(row, 'departure_time')
+        arrival_time = _datetime(row, 'arrival_time')
+        if arrival_time <= departure_time:
+            raise ValueError('arrival_time must be after departure_time.')
+        price = _number(row, 'price', Decimal, 0, MAX_PRICE).quantize(Decimal('0.01'))
+        return {
+            'route_id': self.routes[route_id],
+            'bus_id': self.buses[license_plate],
+            'departure_time': departure_time,
+            'arrival_time': arrival_time,
+            'price_per_seat': price,
+            'base_price_per_seat': price,
+        }
+
+    # Writing: each runs inside a transaction and returns what to apply once it commits
+
+    def _current(self, kind: str, table: str, columns: str, batch: List[Dict[str, Any]]) -> Dict[str, Dict]:
+        """Rows previously imported under the batch's feed ids"""
+        rows = execute_query(f"""
+            SELECT k.external_id, t.id, {columns}
+            FROM {KEYS_TABLE} k
+            JOIN {table} t ON t.id = k.local_id
+            WHERE k.source = %s AND k.kind = %s AND k.external_id = ANY(%s)
+        """, (self.source, kind, [record['key'] for record in batch]))
+        return {row['external_id']: row for row in rows}
+
+    def _save_keys(self, kind: str, ids: Dict[str, int]):
+        if ids:
+            execute_update(f"""
+                INSERT INTO {KEYS_TABLE} (source, kind, external_id, local_id)
+                SELECT %s, %s, v.external_id, v.local_id
+                FROM unnest(%s::varchar[], %s::bigint[]) AS v(external_id, local_id)
+                ON CONFLICT (source, kind, external_id)
+                DO UPDATE SET local_id = EXCLUDED.local_id, imported_at = now()
+            """, (self.source, kind, list(ids), list(ids.values())))
+
+    def _insert(self, kind: str, table: str, columns: Tuple[Tuple[str, str], ...],
+                records: List[Dict[str, Any]]) -> Dict[str, int]:
+        """
+        Insert rows under ids taken from the table's sequence beforehand, so each feed id
+        is known to map to its row without relying on RETURNING order
+        """
+        if not records:
+            return {}
+        new_ids = [row['id'] for row in execute_query(
+            "SELECT nextval(pg_get_serial_sequence(%s, 'id')) AS id FROM generate_series(1, %s)",
+            (table, len(records))
+        )]
+        names = ', '.join(name for name, _ in columns)
+        arrays = ', '.join(f'%s::{sql_type}[]' for _, sql_type in columns)
+        execute_update(
+            f"INSERT INTO {table} (id, {names}) SELECT * FROM unnest(%s::bigint[], {arrays})",
+            (new_ids, *([record[name] for record in records] for name, _ in columns))
+        )
+        ids = {record['key']: new_id for record, new_id in zip(records, new_ids)}
+        self._save_keys(kind, ids)
+        return ids
+
+    def _write_stops(self, batch: List[Dict[str, Any]]) -> Dict[str, Any]:
+        current = self._current('stop', Locations.TABLE_NAME, 't.name, t.city, t.latitude, t.longitude', batch)
+        ids, new, changed = {}, [], []
+        for record in batch:
+            row = current.get(record['key'])
+            if row is None:
+                new.append(record)
+                continue
+            ids[record['key']] = row['id']
+            if (row['name'], row['city'], row['latitude'], row['longitude']) != \
+                    (record['name'], record['city'], record['latitude'], record['longitude']):
+                changed.append(dict(record, id=row['id']))
+
+        if changed:
+            execute_update(f"""
+                UPDATE {Locations.TABLE_NAME} l
+                SET name = v.name, city = v.city, latitude = v.latitude, longitude = v.longitude
+                FROM unnest(%s::bigint[], %s::varchar[], %s::varchar[], %s::float8[], %s::float8[])
+                    AS v(id, name, city, latitude, longitude)
+                WHERE l.id = v.id
+            """, tuple([record[name] for record in changed]
+                       for name in ('id', 'name', 'city', 'latitude', 'longitude')))
+        ids.update(self._insert('stop', Locations.TABLE_NAME, (
+            ('name', 'varchar'), ('city', 'varchar'), ('latitude', 'float8'), ('longitude', 'float8')
+        ), new))
+        return {'ids': ids, 'inserted': len(new), 'updated': len(changed),
+                'unchanged': len(batch) - len(new) - len(changed)}
+
+    def _write_routes(self, batch: List[Dict[str, Any]]) -> Dict[str, Any]:
+        # Routes are unique per (start, end); several feed ids may name the same one
+        pairs = {(record['start_location_id'], record['end_location_id']): record for record in batch}
+        starts, ends = zip(*pairs)
+        existing = {(row['start_location_id'], row['end_location_id']): row for row in execute_query(f"""
+            SELECT r.id, r.start_location_id, r.end_location_id, r.distance_km
+            FROM {Route.TABLE_NAME} r
+            JOIN unnest(%s::bigint[], %s::bigint[]) AS v(start_location_id, end_location_id)
+              ON r.start_location_id = v.start_location_id AND r.end_location_id = v.end_location_id
+        """, (list(starts), list(ends)))}
+        writes = [record for pair, record in pairs.items()
+                  if pair not in existing or existing[pair]['distance_km'] != record['distance_km']]
+
+        route_ids = {pair: row['id'] for pair, row in existing.items()}
+        if writes:
+            for row in execute_query(f"""
+                INSERT INTO {Route.TABLE_NAME} (start_location_id, end_location_id, distance_km)
+                SELECT * FROM unnest(%s::bigint[], %s::bigint[], %s::float8[])
+                ON CONFLICT (start_location_id, end_location_id)
+                DO UPDATE SET distance_km = EXCLUDED.distance_km
+                RETURNING id, start_location_id, end_location_id
+            """, tuple([record[name] for record in writes]
+                       for name in ('start_location_id', 'end_location_id', 'distance_km'))):
+                route_ids[(row['start_location_id'], row['end_location_id'])] = row['id']
+
+        ids = {record['key']: route_ids[(record['start_location_id'], record['end_location_id'])]
+               for record in batch}
+        self._save_keys('route', {key: route_id for key, route_id in ids.items()
+                                  if self.routes.get(key) != route_id})
+        inserted = sum(1 for record in writes
+                       if (record['start_location_id'], record['end_location_id']) not in existing)
+        return {'ids': ids, 'inserted': inserted, 'updated': len(writes) - inserted,
+                'unchanged': len(batch) - len(writes)}
+
+    def _write_buses(self, batch: List[Dict[str, Any]]) -> Dict[str, Any]:
+        existing = {row['license_plate']: row for row in execute_query(f"""
+            SELECT id, license_plate, model, total_seats, manufacture_year
+            FROM {Bus.TABLE_NAME}
+            WHERE license_plate = ANY(%s)
+        """, ([record['license_plate'] for record in batch],))}
+        fields = ('license_plate', 'model', 'total_seats', 'manufacture_year')
+        writes = [record for record in batch
+                  if record['license_plate'] not in existing
+                  or any(existing[record['license_plate']][name] != record[name] for name in fields)]
+
+        ids = {plate: row['id'] for plate, row in existing.items()}
+        if writes:
+            for row in execute_query(f"""
+                INSERT INTO {Bus.TABLE_NAME} (license_plate, model, total_seats, manufacture_year)
+                SELECT * FROM unnest(%s::varchar[], %s::varchar[], %s::int[], %s::int[])
+                ON CONFLICT (license_plate) DO UPDATE
+                SET model = EXCLUDED.model, total_seats = EXCLUDED.total_seats,
+                    manufacture_year = EXCLUDED.manufacture_year
+                RETURNING id, license_plate
+            """, tuple([record[name] for record in writes] for name in fields)):
+                ids[row['license_plate']] = row['id']
+
+        # Seats a bus lacks are added; surplus seats are kept, tickets may point at them
+        bus_ids, seat_numbers = [], []
+        for record in batch:
+            for seat_index in range(record['total_seats']):
+                bus_ids.append(ids[record['license_plate']])
+                seat_numbers.append(Seat.seat_number(seat_index))
+        seats = execute_update(f"""
+            INSERT INTO {Seat.TABLE_NAME} (seat_number, bus_id, is_available)
+            SELECT v.seat_number, v.bus_id, true
+            FROM unnest(%s::varchar[], %s::bigint[]) AS v(seat_number, bus_id)
+            ON CONFLICT (bus_id, seat_number) DO NOTHING
+        """, (seat_numbers, bus_ids))
+
+        inserted = sum(1 for record in writes if record['license_plate'] not in existing)
+        return {'ids': ids, 'inserted': inserted, 'updated': len(writes) - inserted,
+                'unchanged': len(batch) - len(writes), 'seats': seats}
+
+    def _write_trips(self, batch: List[Dict[str, Any]]) -> Dict[str, Any]:
+        current = self._current('trip', Trip.TABLE_NAME,
+                                't.route_id, t.bus_id, t.departure_time, t.arrival_time, t.base_price_per_seat',
+                                batch)
+        fields = ('route_id', 'bus_id', 'departure_time', 'arrival_time', 'base_price_per_seat')
+        proposed, unchanged = [], 0
+        for record in batch:
+            row = current.get(record['key'])
+            if row is None:
+                proposed.append(record)
+            elif any(row[name] != record[name] for name in fields):
+                proposed.append(dict(record, id=row['id'], previous=row))
+            else:
+                unchanged += 1
+
+        # Bus clashes with the trips already stored or within the batch; the
+        # trips_bus_no_overlap constraint still guards against concurrent writers. Trips
+        # keeping their bus and times (fare changes) cannot clash and are not checked.
+        moving = [index for index, record in enumerate(proposed) if _rescheduled(record)]
+        scheduled = [proposed[index] for index in moving]
+        rejected: Dict[int, str] = {}
+        for conflict in Trip.find_bus_conflicts(scheduled):
+            rejected.setdefault(moving[conflict['index']], conflict['message'])
+        for overlap in find_batch_overlaps(scheduled):
+            other = scheduled[overlap['overlaps_index']]['key']
+            rejected.setdefault(moving[overlap['index']], f"The bus is also on trip {other!r} at that time.")
+        accepted = [record for index, record in enumerate(proposed) if index not in rejected]
+        new = [record for record in accepted if 'id' not in record]
+        changed = [record for record in accepted if 'id' in record]
+
+        if changed:
+            changed_ids = [record['id'] for record in changed]
+            # The months the trips leave as well as the ones they move to
+            Trip.invalidate_fare_calendar(changed_ids)
+            execute_update(f"""
+                UPDATE {Trip.TABLE_NAME} t
+                SET route_id = v.route_id, bus_id = v.bus_id,
+                    departure_time = v.departure_time, arrival_time = v.arrival_time,
+                    price_per_seat = CASE WHEN t.base_price_per_seat = v.price
+                                          THEN t.price_per_seat ELSE v.price END,
+                    base_price_per_seat = v.price
+                FROM unnest(%s::bigint[], %s::bigint[], %s::bigint[], %s::timestamptz[], %s::timestamptz[],
+                            %s::numeric[])
+                    AS v(id, route_id, bus_id, departure_time, arrival_time, price)
+                WHERE t.id = v.id
+            """, (changed_ids, *([record[name] for record in changed] for name in fields)))
+            # Tickets are partitioned by their trip's departure time
+            execute_update("""
+                UPDATE tickets tk SET departure_time = v.departure_time
+                FROM unnest(%s::bigint[], %s::timestamptz[]) AS v(trip_id, departure_time)
+                WHERE tk.trip_id = v.trip_id AND tk.departure_time <> v.departure_time
+            """, (changed_ids, [record['departure_time'] for record in changed]))
+            Trip.invalidate_manifest(changed_ids)
+            rescheduled = [record['id'] for record in changed if _rescheduled(record)]
+            if rescheduled:
+                from bookings.models import TicketDocument
+                TicketDocument.refresh_for_trips(rescheduled)
+
+        ids = self._insert('trip', Trip.TABLE_NAME, (
+            ('route_id', 'bigint'), ('bus_id', 'bigint'), ('departure_time', 'timestamptz'),
+            ('arrival_time', 'timestamptz'), ('price_per_seat', 'numeric'), ('base_price_per_seat', 'numeric')
+        ), new)
+        Trip.invalidate_fare_calendar([record['id'] for record in changed] + list(ids.values()))
+        return {'inserted': len(new), 'updated': len(changed), 'unchanged': unchanged,
+                'rejected': [(proposed[index], message) for index, message in sorted(rejected.items())]}
+
+
+def import_timetable(files: Dict[str, IO[bytes]], source: str = 'default', dry_run: bool = False,
+                     batch_size: int = BATCH_SIZE,
+                     progress: Callable[[str, Dict[str, int]], None] = None) -> Dict[str, Any]:
+    """Load a feed's files (kind -> binary stream) and report what was written and rejected"""
+    if not source or len(source) > 50:
+        raise ValueError('source must be 1 to 50 characters.')
+    unknown = set(files) - set(FILES)
+    if unknown:
+        raise ValueError(f"Unknown feed files: {', '.join(sorted(unknown))}.")
+    return TimetableImport(source, batch_size, progress).run(files, dry_run=dry_run)
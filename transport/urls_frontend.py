@@ -12,6 +12,10 @@ urlpatterns = [
     path('trip/<int:trip_id>/', views_frontend.trip_detail, name='trip_detail'),
     path('booking/create/<int:trip_id>/', views_frontend.booking_create, name='booking_create'),
     path('booking/<int:booking_id>/confirmation/', views_frontend.booking_confirmation, name='booking_confirmation'),
+    path('booking/<int:booking_id>/ticket/status/', views_frontend.booking_ticket_document_status,
+         name='booking_ticket_document_status'),
+    path('booking/<int:booking_id>/ticket/<str:digest>.pdf', views_frontend.booking_ticket_document,
+         name='booking_ticket_document'),
     path('my-bookings/', views_frontend.my_bookings, name='my_bookings'),
     # Admin pages
     path('manage/trips/', views_frontend.admin_trips, name='admin_trips'),
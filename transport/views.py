@@ -5,14 +5,22 @@ from rest_framework import viewsets, status
 from rest_framework.decorators import action
 from rest_framework.response import Response
 from rest_framework.exceptions import NotFound
+from rest_framework.settings import api_settings
+from django.utils.timezone import make_aware, localtime, localdate
+from django.utils.dateparse import parse_date
+from datetime import datetime, time, timedelta
+from utils.db_utils import parse_date_range
 from .models import Locations, Route, Bus, Trip, Seat
 from .serializers import (
     LocationSerializer,
     RouteSerializer,
     BusSerializer,
     TripSerializer,
-    SeatSerializer
+    SeatSerializer,
+    ScheduleTemplateSerializer,
+    FleetAssignmentSerializer
 )
+from .renderers import ManifestCSVRenderer
 
 
 class LocationViewSet(viewsets.ViewSet):
@@ -25,6 +33,8 @@ class LocationViewSet(viewsets.ViewSet):
     - GET /api/locations/{id}/ - Retrieve location details
     - PUT /api/locations/{id}/ - Update location
     - DELETE /api/locations/{id}/ - Delete location
+    - GET /api/locations/autocomplete/?q= - Accent-insensitive location suggestions
+    - GET /api/locations/nearby/?lat=&lng= - Nearest stations (k or radius_km)
     """
 
     def list(self, request):
@@ -84,6 +94,42 @@ class LocationViewSet(viewsets.ViewSet):
             raise NotFound('Location not found')
         return Response(status=status.HTTP_204_NO_CONTENT)
 
+    @action(detail=False, methods=['get'])
+    def autocomplete(self, request):
+        """Location suggestions for a partial, accent-insensitive query"""
+        from .autocomplete import index
+
+        query = request.query_params.get('q', '')
+        try:
+            limit = min(max(int(request.query_params.get('limit', 10)), 1), 50)
+        except ValueError:
+            limit = 10
+        return Response(index.search(query, limit=limit))
+
+    @action(detail=False, methods=['get'])
+    def nearby(self, request):
+        """Stations nearest to a point: the k closest, optionally within radius_km"""
+        from .geo import grid
+
+        try:
+            latitude = float(request.query_params['lat'])
+            longitude = float(request.query_params['lng'])
+            k = min(max(int(request.query_params.get('k', 5)), 1), 50)
+            radius_km = request.query_params.get('radius_km', None)
+            radius_km = float(radius_km) if radius_km else None
+        except (KeyError, ValueError):
+            return Response(
+                {'error': 'lat and lng are required numbers; k and radius_km must be numbers.'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        if not (-90 <= latitude <= 90 and -180 <= longitude <= 180):
+            return Response(
+                {'error': 'lat/lng out of range.'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        return Response(grid.nearest(latitude, longitude, k=k, radius_km=radius_km))
+
 
 class RouteViewSet(viewsets.ViewSet):
     """
@@ -95,6 +141,7 @@ class RouteViewSet(viewsets.ViewSet):
     - GET /api/routes/{id}/ - Retrieve route details
     - PUT /api/routes/{id}/ - Update route
     - DELETE /api/routes/{id}/ - Delete route
+    - GET /api/routes/{id}/calendar/?month=YYYY-MM - Cheapest fare and seats left per day
     """
 
     def list(self, request):
@@ -157,6 +204,29 @@ class RouteViewSet(viewsets.ViewSet):
             raise NotFound('Route not found')
         return Response(status=status.HTTP_204_NO_CONTENT)
 
+    @action(detail=True, methods=['get'])
+    def calendar(self, request, pk=None):
+        """Cheapest available fare, departures and seats left per day of a month"""
+        route = Route.get_by_id(int(pk))
+        if not route:
+            raise NotFound('Route not found')
+
+        month = request.query_params.get('month', None)
+        try:
+            month_start = datetime.strptime(month, '%Y-%m') if month else localtime().replace(day=1)
+        except ValueError:
+            return Response(
+                {'error': 'month must be in YYYY-MM format.'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        days = Trip.get_fare_calendar(route['id'], month_start.year, month_start.month)
+        return Response({
+            'route_id': route['id'],
+            'month': f"{month_start.year:04d}-{month_start.month:02d}",
+            'days': days
+        })
+
 
 class BusViewSet(viewsets.ViewSet):
     """
@@ -317,6 +387,13 @@ class TripViewSet(viewsets.ViewSet):
     - DELETE /api/trips/{id}/ - Delete trip
     - GET /api/trips/upcoming/ - List upcoming trips
     - GET /api/trips/{id}/available_seats/ - Get available seats for a trip
+    - GET /api/trips/occupancy/ - Load factor per route and departure day (admin only)
+    - GET /api/trips/analytics/ - Route and departure-hour analytics (admin only)
+    - GET /api/trips/connections/ - Itineraries with up to 2 transfers between two locations
+    - POST /api/trips/schedule/ - Expand recurring schedule templates into trips (admin only)
+    - POST /api/trips/assign-buses/ - Reassign buses to upcoming trips to cut empty seats (admin only)
+    - POST /api/trips/import/ - Load stops, routes, buses and trips from CSV / GTFS-style files (admin only)
+    - GET /api/trips/{id}/manifest/ - Passenger manifest per seat, ?format=csv to download (admin only)
     """
 
     def list(self, request):
@@ -328,6 +405,7 @@ class TripViewSet(viewsets.ViewSet):
         trips = Trip.get_all(
             route_id=int(route_id) if route_id else None,
             bus_id=int(bus_id) if bus_id else None,
+            include_history=request.query_params.get('history') == 'true',
             ordering=[ordering]
         )
 
@@ -403,3 +481,227 @@ class TripViewSet(viewsets.ViewSet):
             'available_seats': available,
             'booked_seats': total_seats - available
         })
+
+    @action(detail=False, methods=['get'])
+    def occupancy(self, request):
+        """Booked seats, revenue and load factor per route and departure day (admin only)"""
+        if not hasattr(request.user, 'is_admin') or not request.user.is_admin():
+            return Response(
+                {'error': 'Only admins can view occupancy.'},
+                status=status.HTTP_403_FORBIDDEN
+            )
+
+        date_range = parse_date_range(request.query_params)
+        if date_range is None:
+            return Response(
+                {'error': 'date_from and date_to must be dates (YYYY-MM-DD).'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        date_from, date_to = date_range
+        route_id = request.query_params.get('route', None)
+        if route_id and not route_id.isdigit():
+            return Response(
+                {'error': 'route must be a route ID.'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        rows = Trip.get_occupancy(
+            date_from=make_aware(datetime.combine(date_from, time.min)) if date_from else None,
+            date_to=make_aware(datetime.combine(date_to + timedelta(days=1), time.min)) if date_to else None,
+            route_id=int(route_id) if route_id else None
+        )
+        return Response(rows)
+
+    @action(detail=False, methods=['get'])
+    def analytics(self, request):
+        """Load factors, revenue per km and departure heatmap computed with NumPy (admin only)"""
+        if not hasattr(request.user, 'is_admin') or not request.user.is_admin():
+            return Response(
+                {'error': 'Only admins can view analytics.'},
+                status=status.HTTP_403_FORBIDDEN
+            )
+
+        date_range = parse_date_range(request.query_params)
+        if date_range is None:
+            return Response(
+                {'error': 'date_from and date_to must be dates (YYYY-MM-DD).'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        date_from, date_to = date_range
+        route_id = request.query_params.get('route', None)
+        top = request.query_params.get('top', None)
+        if (route_id and not route_id.isdigit()) or (top and not top.isdigit()):
+            return Response(
+                {'error': 'route must be a route ID and top a number of routes.'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        from .analytics import TripFrame
+        frame = TripFrame.load(
+            date_from=make_aware(datetime.combine(date_from, time.min)) if date_from else None,
+            date_to=make_aware(datetime.combine(date_to + timedelta(days=1), time.min)) if date_to else None,
+            route_id=int(route_id) if route_id else None
+        )
+        return Response(frame.report(top_routes=int(top) if top else None))
+
+    @action(detail=False, methods=['get'])
+    def connections(self, request):
+        """Direct and connecting itineraries between two locations on a date"""
+        from .connections import graph, WINDOW_DAYS, MAX_TRANSFERS
+
+        try:
+            origin_id = int(request.query_params['from'])
+            destination_id = int(request.query_params['to'])
+            max_transfers = int(request.query_params.get('max_transfers', MAX_TRANSFERS))
+            limit = int(request.query_params.get('limit', 10))
+        except (KeyError, ValueError):
+            return Response(
+                {'error': 'from and to must be location IDs.'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        travel_date = request.query_params.get('date', None)
+        try:
+            travel_date = parse_date(travel_date) if travel_date else localdate()
+        except ValueError:
+            travel_date = None
+        if travel_date is None:
+            return Response(
+                {'error': 'date must be in YYYY-MM-DD format.'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        if not localdate() <= travel_date <= localdate() + timedelta(days=WINDOW_DAYS):
+            return Response(
+                {'error': f'date must be within the next {WINDOW_DAYS} days.'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        itineraries = graph.search(
+            origin_id, destination_id, travel_date,
+            max_transfers=min(max(max_transfers, 0), MAX_TRANSFERS),
+            limit=min(max(limit, 1), 50)
+        )
+        return Response(itineraries)
+
+    @action(detail=False, methods=['post'])
+    def schedule(self, request):
+        """
+        Publish recurring trips from schedule templates (admin only).
+        Body: {"templates": [...], "dry_run": bool, "skip_conflicts": bool}
+        """
+        if not hasattr(request.user, 'is_admin') or not request.user.is_admin():
+            return Response(
+                {'error': 'Only admins can publish schedules.'},
+                status=status.HTTP_403_FORBIDDEN
+            )
+
+        serializer = ScheduleTemplateSerializer(data=request.data.get('templates', []), many=True)
+        serializer.is_valid(raise_exception=True)
+        if not serializer.validated_data:
+            return Response(
+                {'error': 'At least one template is required.'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        from .scheduling import publish_schedule
+        dry_run = bool(request.data.get('dry_run', False))
+        skip_conflicts = bool(request.data.get('skip_conflicts', False))
+        try:
+            result = publish_schedule(serializer.validated_data, dry_run=dry_run,
+                                      skip_conflicts=skip_conflicts)
+        except ValueError as e:
+            return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+        if result['created']:
+            return Response(result, status=status.HTTP_201_CREATED)
+        if not dry_run and (result['conflicts'] or result['batch_overlaps']):
+            result['error'] = 'Schedule conflicts with existing trips; nothing was created.'
+            return Response(result, status=status.HTTP_409_CONFLICT)
+        return Response(result)
+
+    @action(detail=False, methods=['post'], url_path='assign-buses')
+    def assign_buses(self, request):
+        """
+        Reassign buses to trips departing between date_from and date_to (admin only).
+        Body: {"date_from": "YYYY-MM-DD", "date_to": "YYYY-MM-DD", "route": id, "dry_run": bool}
+        """
+        if not hasattr(request.user, 'is_admin') or not request.user.is_admin():
+            return Response(
+                {'error': 'Only admins can assign buses.'},
+                status=status.HTTP_403_FORBIDDEN
+            )
+
+        serializer = FleetAssignmentSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        data = serializer.validated_data
+
+        from .fleet import assign_fleet, StalePlanError
+        try:
+            result = assign_fleet(
+                make_aware(datetime.combine(data['date_from'], time.min)),
+                make_aware(datetime.combine(data['date_to'] + timedelta(days=1), time.min)),
+                route_id=data.get('route_id'),
+                dry_run=data['dry_run']
+            )
+        except ValueError as e:
+            return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        except StalePlanError as e:
+            return Response({'error': str(e)}, status=status.HTTP_409_CONFLICT)
+
+        if not data['dry_run'] and result['unassigned']:
+            result['error'] = 'Not enough buses to cover every trip; nothing was reassigned.'
+            return Response(result, status=status.HTTP_409_CONFLICT)
+        return Response(result)
+
+    @action(detail=False, methods=['post'], url_path='import')
+    def import_timetable(self, request):
+        """
+        Load an operator's timetable (admin only). Multipart upload of a feed .zip as
+        `feed`, or of the `stops`, `routes`, `buses` and `trips` CSV files; `source` names
+        the operator and `dry_run=true` validates without saving. Bad rows are reported
+        and skipped, the rest is loaded.
+        """
+        if not hasattr(request.user, 'is_admin') or not request.user.is_admin():
+            return Response(
+                {'error': 'Only admins can import timetables.'},
+                status=status.HTTP_403_FORBIDDEN
+            )
+
+        from .timetable import import_timetable, open_feed, FILES
+        try:
+            files = open_feed(request.FILES['feed']) if 'feed' in request.FILES else {}
+            files.update({kind: request.FILES[kind] for kind in FILES if kind in request.FILES})
+            if not files:
+                raise ValueError('Upload a feed .zip or at least one of the stops, routes, buses, trips files.')
+            report = import_timetable(
+                files,
+                source=request.data.get('source') or 'default',
+                dry_run=str(request.data.get('dry_run', '')).lower() in ('true', '1')
+            )
+        except ValueError as e:
+            return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        return Response(report)
+
+    @action(detail=True, methods=['get'],
+            renderer_classes=[*api_settings.DEFAULT_RENDERER_CLASSES, ManifestCSVRenderer])
+    def manifest(self, request, pk=None):
+        """
+        Seat-by-seat passenger manifest of a trip (admin only).
+        ?format=csv (or Accept: text/csv) downloads it for boarding devices.
+        """
+        if not hasattr(request.user, 'is_admin') or not request.user.is_admin():
+            return Response(
+                {'error': 'Only admins can view trip manifests.'},
+                status=status.HTTP_403_FORBIDDEN
+            )
+
+        manifest = Trip.get_manifest(int(pk))
+        if not manifest:
+            raise NotFound('Trip not found')
+
+        if request.accepted_renderer.format == 'csv':
+            departure = localtime(manifest['trip']['departure_time']).strftime('%Y%m%d-%H%M')
+            return Response(manifest, headers={
+                'Content-Disposition': f'attachment; filename="manifest-trip-{pk}-{departure}.csv"'
+            })
+        return Response(manifest)
@@ -4,11 +4,15 @@ Frontend views for trip booking
 from django.shortcuts import render, redirect, get_object_or_404
 from django.contrib.auth.decorators import login_required
 from django.contrib import messages
-from django.http import JsonResponse
+from django.http import JsonResponse, FileResponse, Http404, HttpResponseNotModified
+from django.urls import reverse
+from django.db import transaction
 from .models import Trip, Seat, Bus
-from bookings.models import Booking, Ticket
+from bookings.models import Booking, Ticket, TicketDocument
+from bookings.documents import document_path
 from payments.models import Payment
 from accounts.decorators import admin_required
+from utils.idempotency import idempotent, ensure_session
 from decimal import Decimal
 import json
 import uuid
@@ -44,6 +48,10 @@ def trip_detail(request, trip_id):
     # Get available seats count
     available_seats = Trip.available_seats(int(trip_id))
 
+    # Guests need their session cookie before booking, so a retried booking request
+    # (same Idempotency-Key) is matched to the original
+    ensure_session(request)
+
     context = {
         'trip': trip,
         'available_seats': available_seats,
@@ -53,87 +61,97 @@ def trip_detail(request, trip_id):
     return render(request, 'transport/trip_detail.html', context)
 
 
+@idempotent('booking_create')
 def booking_create(request, trip_id):
-    """Create a booking for selected trip - allows guest users"""
+    """
+    Create a booking for selected trip - allows guest users.
+    Retries carrying the same Idempotency-Key header get the original response.
+    """
     if request.method == 'POST':
         try:
-            trip = Trip.get_by_id(int(trip_id))
-            if not trip:
-                return JsonResponse({'error': 'Chuyến xe không tồn tại'}, status=404)
-
-            # Get selected seats from request
-            data = json.loads(request.body)
-            selected_seat_ids = data.get('seat_ids', [])
-            passenger_names = data.get('passenger_names', [])
-
-            if not selected_seat_ids:
-                return JsonResponse({'error': 'Vui lòng chọn ít nhất một ghế'}, status=400)
-
-            # Check if seats are available
-            for seat_id in selected_seat_ids:
-                if Ticket.check_seat_booked(int(trip_id), int(seat_id)):
-                    return JsonResponse({'error': f'Ghế đã được đặt trước'}, status=400)
-
-            # Calculate total amount
-            number_of_seats = len(selected_seat_ids)
-            total_amount = Decimal(trip['price_per_seat']) * number_of_seats
-
-            # Get user ID (None for guest users)
-            from accounts.utils import get_current_user
-            current_user = get_current_user(request)
-            user_id = current_user.id if current_user else None
-
-            # Create booking (can be for guest or logged-in user)
-            booking = Booking.create(
-                user_id=user_id,
-                trip_id=int(trip_id),
-                number_of_seats=number_of_seats,
-                total_amount=total_amount,
-                status='Pending'
-            )
-
-            if not booking:
-                return JsonResponse({'error': 'Không thể tạo booking'}, status=500)
-
-            # Get passenger name for guest users
-            default_passenger_name = current_user.get_full_name() if current_user else 'Khách'
-
-            # Create tickets for each seat
-            for i, seat_id in enumerate(selected_seat_ids):
-                passenger_name = passenger_names[i] if i < len(passenger_names) else ''
-                Ticket.create(
-                    booking_id=booking['id'],
-                    seat_id=int(seat_id),
+            # One transaction: a 5xx (never stored for Idempotency-Key replay) means
+            # nothing was written, so the client's retry cannot leave a half booking behind
+            with transaction.atomic():
+                trip = Trip.get_by_id(int(trip_id))
+                if not trip:
+                    return JsonResponse({'error': 'Chuyến xe không tồn tại'}, status=404)
+
+                # Get selected seats from request
+                data = json.loads(request.body)
+                selected_seat_ids = data.get('seat_ids', [])
+                passenger_names = data.get('passenger_names', [])
+
+                if not selected_seat_ids:
+                    return JsonResponse({'error': 'Vui lòng chọn ít nhất một ghế'}, status=400)
+
+                # Check if seats are available
+                for seat_id in selected_seat_ids:
+                    if Ticket.check_seat_booked(int(trip_id), int(seat_id)):
+                        return JsonResponse({'error': f'Ghế đã được đặt trước'}, status=400)
+
+                # Calculate total amount
+                number_of_seats = len(selected_seat_ids)
+                price_per_seat = Decimal(Trip.get_price(trip['id']))
+                total_amount = price_per_seat * number_of_seats
+
+                # Get user ID (None for guest users)
+                from accounts.utils import get_current_user
+                current_user = get_current_user(request)
+                user_id = current_user.id if current_user else None
+
+                # Create booking (can be for guest or logged-in user)
+                booking = Booking.create(
+                    user_id=user_id,
                     trip_id=int(trip_id),
-                    price=Decimal(trip['price_per_seat']),
-                    passenger_name=passenger_name or default_passenger_name
+                    number_of_seats=number_of_seats,
+                    total_amount=total_amount,
+                    status='Pending'
+                )
+
+                if not booking:
+                    transaction.set_rollback(True)
+                    return JsonResponse({'error': 'Không thể tạo booking'}, status=500)
+
+                # Get passenger name for guest users
+                default_passenger_name = current_user.get_full_name() if current_user else 'Khách'
+
+                # Create tickets for each seat
+                for i, seat_id in enumerate(selected_seat_ids):
+                    passenger_name = passenger_names[i] if i < len(passenger_names) else ''
+                    Ticket.create(
+                        booking_id=booking['id'],
+                        seat_id=int(seat_id),
+                        trip_id=int(trip_id),
+                        price=price_per_seat,
+                        passenger_name=passenger_name or default_passenger_name
+                    )
+
+                # Automatically create a payment for this booking
+                transaction_code = f"TXN-{uuid.uuid4().hex[:8].upper()}"
+                payment = Payment.create(
+                    booking_id=booking['id'],
+                    amount=total_amount,
+                    payment_method='Pending',  # Will be selected by user later
+                    transaction_code=transaction_code,
+                    status='Pending'
                 )
 
-            # Automatically create a payment for this booking
-            transaction_code = f"TXN-{uuid.uuid4().hex[:8].upper()}"
-            payment = Payment.create(
-                booking_id=booking['id'],
-                amount=total_amount,
-                payment_method='Pending',  # Will be selected by user later
-                transaction_code=transaction_code,
-                status='Pending'
-            )
-
-            if not payment:
-                return JsonResponse({'error': 'Không thể tạo payment'}, status=500)
-
-            # Store booking info in session for guest users
-            if not current_user:
-                request.session['guest_booking_id'] = booking['id']
-                request.session['guest_payment_id'] = payment['id']
-
-            return JsonResponse({
-                'success': True,
-                'booking_id': booking['id'],
-                'payment_id': payment['id'],
-                'transaction_code': transaction_code,
-                'redirect_url': f'/booking/{booking["id"]}/confirmation/'
-            })
+                if not payment:
+                    transaction.set_rollback(True)
+                    return JsonResponse({'error': 'Không thể tạo payment'}, status=500)
+
+                # Store booking info in session for guest users
+                if not current_user:
+                    request.session['guest_booking_id'] = booking['id']
+                    request.session['guest_payment_id'] = str(payment['id'])
+
+                return JsonResponse({
+                    'success': True,
+                    'booking_id': booking['id'],
+                    'payment_id': payment['id'],
+                    'transaction_code': transaction_code,
+                    'redirect_url': f'/booking/{booking["id"]}/confirmation/'
+                })
 
         except Exception as e:
             return JsonResponse({'error': str(e)}, status=500)
@@ -153,13 +171,7 @@ def booking_confirmation(request, booking_id):
     from accounts.utils import get_current_user
     current_user = get_current_user(request)
 
-    # Check access permissions
-    # Allow if: user owns booking, user is admin, or guest with session
-    is_owner = current_user and booking['user_id'] == current_user.id
-    is_admin = current_user and current_user.is_admin()
-    is_guest_session = not current_user and request.session.get('guest_booking_id') == booking_id
-
-    if not (is_owner or is_admin or is_guest_session):
+    if not _can_view_booking(request, booking, current_user):
         messages.error(request, 'Bạn không có quyền truy cập booking này.')
         return redirect('trip_list')
 
@@ -169,17 +181,78 @@ def booking_confirmation(request, booking_id):
     # Get payment information for this booking
     payment = Payment.get_by_booking_id(booking_id)
 
+    # The PDF is rendered in the background; the page shows a placeholder until then
+    ticket_document = None
+    if tickets and booking['status'] != 'Canceled':
+        TicketDocument.request([booking_id])
+        ticket_document = TicketDocument.get(booking_id)
+
     context = {
         'booking': booking,
         'tickets': tickets,
         'payment': payment,
         'payment_methods': Payment.PAYMENT_METHODS,
         'is_guest': not current_user,
+        'ticket_document': ticket_document,
     }
 
     return render(request, 'transport/booking_confirmation.html', context)
 
 
+def _can_view_booking(request, booking, current_user) -> bool:
+    """Owner, admin, or the guest session that made the booking"""
+    is_owner = current_user and booking['user_id'] == current_user.id
+    is_admin = current_user and current_user.is_admin()
+    is_guest_session = not current_user and request.session.get('guest_booking_id') == booking['id']
+    return bool(is_owner or is_admin or is_guest_session)
+
+
+def booking_ticket_document_status(request, booking_id):
+    """Whether the booking's ticket PDF is ready, polled by the confirmation page"""
+    booking = Booking.get_by_id(booking_id)
+    from accounts.utils import get_current_user
+    if not booking or not _can_view_booking(request, booking, get_current_user(request)):
+        return JsonResponse({'error': 'Booking not found'}, status=404)
+
+    document = TicketDocument.get(booking_id)
+    if not document:
+        return JsonResponse({'status': None, 'url': None})
+    url = None
+    if document['status'] == 'Ready':
+        url = reverse('booking:booking_ticket_document', args=[booking_id, document['digest']])
+    return JsonResponse({'status': document['status'], 'url': url})
+
+
+def booking_ticket_document(request, booking_id, digest):
+    """
+    Serve a rendered ticket PDF. The URL names the file's content hash, so the
+    response never changes and may be cached by the browser indefinitely.
+    """
+    booking = Booking.get_by_id(booking_id)
+    from accounts.utils import get_current_user
+    if not booking or not _can_view_booking(request, booking, get_current_user(request)):
+        raise Http404('Booking not found')
+
+    document = TicketDocument.get(booking_id)
+    if not document or document['status'] != 'Ready' or document['digest'] != digest:
+        raise Http404('Ticket document not found')
+
+    etag = f'"{digest}"'
+    if request.META.get('HTTP_IF_NONE_MATCH') == etag:
+        response = HttpResponseNotModified()
+    else:
+        path = document_path(digest)
+        if not path.exists():
+            # Rendered on another host or removed; render it again
+            TicketDocument.refresh([booking_id])
+            raise Http404('Ticket document not found')
+        response = FileResponse(open(path, 'rb'), content_type='application/pdf',
+                                filename=f've-xe-{booking_id}.pdf')
+    response['ETag'] = etag
+    response['Cache-Control'] = 'private, max-age=31536000, immutable'
+    return response
+
+
 def get_trip_seats(request, trip_id):
     """API endpoint to get seats for a trip with booking status"""
     try:
@@ -229,8 +302,9 @@ def my_bookings(request):
         messages.info(request, 'Vui lòng đăng nhập để xem vé của bạn.')
         return redirect('login')
 
-    # Get all bookings for the current user
-    bookings = Booking.get_all(user_id=current_user.id)
+    # Get the current user's bookings (older months with ?history=true)
+    bookings = Booking.get_all(user_id=current_user.id,
+                               include_history=request.GET.get('history') == 'true')
 
     # Get tickets for each booking
     for booking in bookings:
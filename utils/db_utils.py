@@ -2,9 +2,12 @@
 Database utility functions for raw SQL operations
 """
 from django.db import connection
+from django.utils.dateparse import parse_date
 from typing import List, Dict, Any, Optional
 from datetime import datetime
 from decimal import Decimal
+import base64
+import json
 import uuid
 
 
@@ -131,3 +134,49 @@ def paginate_query(query: str, page: int = 1, page_size: int = 100) -> str:
     """
     offset = (page - 1) * page_size
     return f"{query} LIMIT {page_size} OFFSET {offset}"
+
+
+def encode_cursor(values: tuple) -> str:
+    """
+    Encode keyset pagination values (e.g. last row's sort key and id)
+    into an opaque, URL-safe cursor string
+    """
+    payload = json.dumps([
+        value.isoformat() if isinstance(value, datetime) else str(value)
+        for value in values
+    ])
+    return base64.urlsafe_b64encode(payload.encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor: str) -> Optional[list]:
+    """
+    Decode a cursor produced by encode_cursor
+    Returns the list of raw string values, or None if the cursor is malformed
+    """
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        values = json.loads(base64.urlsafe_b64decode(padded.encode()).decode())
+    except (ValueError, TypeError):
+        return None
+    return values if isinstance(values, list) else None
+
+
+def parse_date_range(query_params) -> Optional[tuple]:
+    """
+    Parse optional `date_from` / `date_to` (YYYY-MM-DD) query parameters
+    Returns (date_from, date_to) with None for missing values, or None if either is malformed
+    """
+    values = []
+    for name in ('date_from', 'date_to'):
+        raw = query_params.get(name)
+        if not raw:
+            values.append(None)
+            continue
+        try:
+            parsed = parse_date(raw)
+        except ValueError:
+            parsed = None
+        if parsed is None:
+            return None
+        values.append(parsed)
+    return tuple(values)
@@ -0,0 +1,222 @@
+"""
+Streaming CSV / JSON-lines exports of bookings, tickets, payments and users
+
+Rows are read through a server-side (named) cursor BATCH_SIZE at a time inside a
+read-only transaction, so the database streams them too, and each batch is encoded
+and handed to the client before the next one is fetched: memory stays constant
+whatever the size of the export. JSON lines are built by PostgreSQL itself
+(row_to_json) and CSV by the csv module over plain row tuples; neither goes through
+DRF serializers. With gzip the stream is compressed on the fly into a .gz download.
+Used by the export endpoints and the export_data management command.
+"""
+from django.db import connection, transaction
+from django.http import StreamingHttpResponse
+from django.utils.timezone import make_aware, localdate
+from rest_framework.renderers import BaseRenderer, JSONRenderer
+from rest_framework.utils.encoders import JSONEncoder
+from datetime import datetime, time, timedelta
+from typing import Dict, Any, Iterator, List, NamedTuple, Tuple, Iterable
+import csv
+import io
+import json
+import zlib
+from .db_utils import parse_date_range
+
+BATCH_SIZE = 5000
+FORMATS = ('csv', 'jsonl')
+CONTENT_TYPES = {'csv': 'text/csv; charset=utf-8', 'jsonl': 'application/x-ndjson'}
+
+
+class Export(NamedTuple):
+    """One exportable dataset: its query, the column date filters apply to and its filters"""
+    select: str
+    date_column: str
+    # query parameter -> (SQL condition, value type)
+    filters: Dict[str, Tuple[str, type]]
+    order: str
+
+
+EXPORTS = {
+    'bookings': Export(
+        select="""
+            SELECT b.id, b.booking_time, b.status, b.trip_id, t.route_id, t.departure_time,
+                   b.user_id, b.number_of_seats, b.total_amount, b.journey_id
+            FROM bookings b
+            JOIN trips t ON t.id = b.trip_id
+        """,
+        date_column='b.booking_time',
+        filters={
+            'status': ('b.status = %s', str),
+            'trip': ('b.trip_id = %s', int),
+            'route': ('t.route_id = %s', int),
+            'user': ('b.user_id = %s', int),
+        },
+        order='b.id',
+    ),
+    'tickets': Export(
+        select="""
+            SELECT tk.id, tk.booking_id, tk.trip_id, tk.departure_time, s.seat_number,
+                   tk.passenger_name, tk.price
+            FROM tickets tk
+            JOIN seats s ON s.id = tk.seat_id
+        """,
+        date_column='tk.departure_time',
+        filters={
+            'trip': ('tk.trip_id = %s', int),
+            'booking': ('tk.booking_id = %s', int),
+        },
+        order='tk.id',
+    ),
+    'payments': Export(
+        select="""
+            SELECT p.id, p.booking_id, p.amount, p.payment_method, p.status, p.payment_time,
+                   p.transaction_code, p.wallet_id
+            FROM payments p
+        """,
+        date_column='p.payment_time',
+        filters={
+            'status': ('p.status = %s', str),
+            'payment_method': ('p.payment_method = %s', str),
+            'booking': ('p.booking_id = %s', int),
+        },
+        order='p.payment_time, p.id',
+    ),
+    'users': Export(
+        select="""
+            SELECT u.id, u.username, u.email, u.first_name, u.last_name, u.role,
+                   u.is_active, u.is_verified, u.date_joined, u.last_login
+            FROM users u
+        """,
+        date_column='u.date_joined',
+        filters={
+            'role': ('u.role = %s', str),
+            'is_active': ('u.is_active = %s', bool),
+        },
+        order='u.id',
+    ),
+}
+
+
+def build_query(dataset: str, params) -> Tuple[str, List[Any]]:
+    """
+    SQL and parameters of an export from query-string style filters: date_from /
+    date_to (YYYY-MM-DD, inclusive) plus the dataset's own filters. Raises ValueError.
+    """
+    export = EXPORTS[dataset]
+    date_range = parse_date_range(params)
+    if date_range is None:
+        raise ValueError('date_from and date_to must be dates (YYYY-MM-DD).')
+
+    conditions = []
+    values = []
+    date_from, date_to = date_range
+    if date_from:
+        conditions.append(f"{export.date_column} >= %s")
+        values.append(make_aware(datetime.combine(date_from, time.min)))
+    if date_to:
+        conditions.append(f"{export.date_column} < %s")
+        values.append(make_aware(datetime.combine(date_to + timedelta(days=1), time.min)))
+    for name, (condition, kind) in export.filters.items():
+        raw = params.get(name)
+        if raw in (None, ''):
+            continue
+        if kind is int:
+            if not str(raw).isdigit():
+                raise ValueError(f'{name} must be an integer.')
+            value = int(raw)
+        elif kind is bool:
+            value = str(raw) == 'true'
+        else:
+            value = raw
+        conditions.append(condition)
+        values.append(value)
+
+    where_clause = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+    return f"{export.select} {where_clause} ORDER BY {export.order}", values
+
+
+def stream_rows(query: str, params: List[Any], fmt: str = 'csv',
+                batch_size: int = BATCH_SIZE) -> Iterator[str]:
+    """Encoded chunks of the query's rows (a CSV header first), one chunk per batch"""
+    if fmt == 'jsonl':
+        query = f"SELECT row_to_json(e)::text FROM ({query}) e"
+    # Named cursors only stream inside a transaction; in autocommit they are materialized
+    with transaction.atomic(), connection.chunked_cursor() as cursor:
+        cursor.execute(query, params)
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        rows = cursor.fetchmany(batch_size)
+        if fmt == 'csv':
+            # A named cursor only has a description once the first batch is fetched
+            writer.writerow([column[0] for column in cursor.description])
+        while rows:
+            if fmt == 'csv':
+                writer.writerows(rows)
+            else:
+                buffer.write('\n'.join(row[0] for row in rows))
+                buffer.write('\n')
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+            rows = cursor.fetchmany(batch_size)
+        if buffer.tell():
+            yield buffer.getvalue()
+
+
+def encode(chunks: Iterable[str], gzip: bool = False) -> Iterator[bytes]:
+    """UTF-8 bytes of the chunks, gzip-compressed on the fly if asked"""
+    if not gzip:
+        for chunk in chunks:
+            yield chunk.encode()
+        return
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31)
+    for chunk in chunks:
+        data = compressor.compress(chunk.encode())
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+def export_response(dataset: str, params, fmt: str = 'csv') -> StreamingHttpResponse:
+    """Streaming download of a dataset; raises ValueError for bad filters"""
+    if fmt not in FORMATS:
+        raise ValueError(f"format must be one of {', '.join(FORMATS)}.")
+    query, values = build_query(dataset, params)
+    gzip = params.get('gzip') == 'true'
+
+    filename = f"{dataset}-{localdate():%Y%m%d}.{fmt}" + ('.gz' if gzip else '')
+    response = StreamingHttpResponse(
+        encode(stream_rows(query, values, fmt), gzip=gzip),
+        content_type='application/gzip' if gzip else CONTENT_TYPES[fmt]
+    )
+    response['Content-Disposition'] = f'attachment; filename="{filename}"'
+    response['Cache-Control'] = 'no-store'
+    return response
+
+
+class ExportRenderer(BaseRenderer):
+    """
+    Lets DRF negotiate ?format=csv / ?format=jsonl for export actions. Exports are
+    streamed past the renderer; only error payloads are rendered here, as JSON and
+    labelled application/json.
+    """
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        response = (renderer_context or {}).get('response')
+        if response is not None:
+            response['Content-Type'] = 'application/json'
+        return json.dumps(data, cls=JSONEncoder).encode()
+
+
+class CSVExportRenderer(ExportRenderer):
+    media_type = 'text/csv'
+    format = 'csv'
+
+
+class JSONLinesExportRenderer(ExportRenderer):
+    media_type = 'application/x-ndjson'
+    format = 'jsonl'
+
+
+# JSONRenderer comes last so clients asking for JSON get a JSON error, not a 406
+EXPORT_RENDERERS = [CSVExportRenderer, JSONLinesExportRenderer, JSONRenderer]
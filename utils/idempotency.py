@@ -0,0 +1,182 @@
+"""
+Idempotency-Key support for endpoints that create bookings and payments
+
+A client retrying a request sends the same Idempotency-Key header. The first
+response for a key is stored in idempotency_keys with a fingerprint of the request
+and replayed (with an Idempotent-Replayed header) for IDEMPOTENCY_TTL, without
+running the view again. Keys are scoped to the endpoint and the caller, and reusing
+one for a different request is rejected with 422. Guests are scoped by their session,
+which is created if needed; what the original request wrote into the session (such as
+the guest's booking id) is stored with the response and written again on replay. A
+duplicate arriving while the original is still running waits for it on a
+session-level advisory lock, then replays its stored response. Server errors (5xx)
+are not stored, so they can be retried.
+"""
+from django.db import connection
+from django.http import HttpResponse, JsonResponse
+from django.utils.timezone import now
+from rest_framework.response import Response
+from rest_framework.utils.encoders import JSONEncoder
+from datetime import timedelta
+from functools import wraps
+from typing import Any, Dict, Optional
+import hashlib
+import json
+import time
+
+IDEMPOTENCY_HEADER = 'Idempotency-Key'
+IDEMPOTENCY_TTL = timedelta(hours=24)
+MAX_KEY_LENGTH = 255
+# How long a duplicate waits for the in-flight original before giving up with 409
+LOCK_WAIT_SECONDS = 30.0
+LOCK_POLL_SECONDS = 0.05
+PURGE_BATCH = 100
+_MISSING = object()
+
+
+def ensure_session(request) -> str:
+    """
+    Session key of the request, creating the session if there is none yet. Pages that
+    lead to an idempotent POST call it so the browser holds the cookie before retrying.
+    """
+    session = request.session
+    if not session.session_key:
+        # Empty sessions are never saved or sent as a cookie
+        session['idempotency'] = True
+        session.save()
+    return session.session_key
+
+
+def _caller(request) -> Optional[str]:
+    """Who the key belongs to: the API user, the logged-in session user, or the session"""
+    user = getattr(request, 'user', None)
+    if getattr(user, 'is_authenticated', False) and getattr(user, 'id', None) is not None:
+        return f'user:{user.id}'
+    session = getattr(request, 'session', None)
+    if session is None:
+        return None
+    if session.get('is_authenticated') and session.get('username'):
+        return f"username:{session['username']}"
+    return f'session:{ensure_session(request)}'
+
+
+def _fingerprint(request) -> str:
+    digest = hashlib.sha256()
+    for part in (request.method.encode(), request.path.encode(), request.body):
+        digest.update(part)
+        digest.update(b'\0')
+    return digest.hexdigest()
+
+
+def _error(message: str, status: int) -> JsonResponse:
+    return JsonResponse({'error': message}, status=status)
+
+
+def _acquire(cursor, scope: str, key: str) -> bool:
+    """Take the session advisory lock of (scope, key), waiting up to LOCK_WAIT_SECONDS"""
+    deadline = time.monotonic() + LOCK_WAIT_SECONDS
+    while True:
+        cursor.execute("SELECT pg_try_advisory_lock(hashtext('idempotency'), hashtext(%s))",
+                       (f'{scope}:{key}',))
+        if cursor.fetchone()[0]:
+            return True
+        if time.monotonic() >= deadline:
+            return False
+        time.sleep(LOCK_POLL_SECONDS)
+
+
+def _release(cursor, scope: str, key: str):
+    cursor.execute("SELECT pg_advisory_unlock(hashtext('idempotency'), hashtext(%s))",
+                   (f'{scope}:{key}',))
+
+
+def _replay(request, row) -> HttpResponse:
+    if row[4]:
+        # Django's database adapter hands jsonb back as text
+        request.session.update(json.loads(row[4]) if isinstance(row[4], str) else row[4])
+    response = HttpResponse(bytes(row[2]), status=row[0], content_type=row[1])
+    response['Idempotent-Replayed'] = 'true'
+    return response
+
+
+def _session_writes(request, before: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    """Session values the view set or changed"""
+    session = getattr(request, 'session', None)
+    if session is None:
+        return None
+    writes = {name: value for name, value in session.items() if before.get(name, _MISSING) != value}
+    return writes or None
+
+
+def _store(cursor, scope: str, key: str, fingerprint: str, response, session_writes=None):
+    if isinstance(response, Response):
+        # DRF responses are rendered after the view returns; store the JSON it will render
+        body = json.dumps(response.data, cls=JSONEncoder).encode()
+        content_type = 'application/json'
+    else:
+        body = response.content
+        content_type = response.get('Content-Type', 'application/json')
+    current_time = now()
+    cursor.execute("""
+        INSERT INTO idempotency_keys
+        (scope, key, fingerprint, status_code, content_type, body, session_writes, created_at, expires_at)
+        VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s)
+        ON CONFLICT (scope, key) DO UPDATE SET
+            fingerprint = EXCLUDED.fingerprint, status_code = EXCLUDED.status_code,
+            content_type = EXCLUDED.content_type, body = EXCLUDED.body,
+            session_writes = EXCLUDED.session_writes,
+            created_at = EXCLUDED.created_at, expires_at = EXCLUDED.expires_at
+    """, (scope, key, fingerprint, response.status_code, content_type, body,
+          json.dumps(session_writes, cls=JSONEncoder) if session_writes else None,
+          current_time, current_time + IDEMPOTENCY_TTL))
+    # Keep the table small without a separate job
+    cursor.execute("""
+        DELETE FROM idempotency_keys
+        WHERE ctid IN (SELECT ctid FROM idempotency_keys WHERE expires_at < %s LIMIT %s)
+    """, (current_time, PURGE_BATCH))
+
+
+def idempotent(endpoint: str):
+    """
+    Honor the Idempotency-Key header on a view. Works on function views and on
+    DRF view methods; requests without the header run unchanged.
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            request = next(arg for arg in args if hasattr(arg, 'META'))
+            key = request.headers.get(IDEMPOTENCY_HEADER)
+            if not key:
+                return view(*args, **kwargs)
+            if len(key) > MAX_KEY_LENGTH:
+                return _error(f'{IDEMPOTENCY_HEADER} must be at most {MAX_KEY_LENGTH} characters.', 400)
+
+            caller = _caller(request)
+            if caller is None:
+                return _error(f'{IDEMPOTENCY_HEADER} needs a session or an authenticated user.', 400)
+            scope = f'{endpoint}:{caller}'
+            fingerprint = _fingerprint(request)
+            with connection.cursor() as cursor:
+                if not _acquire(cursor, scope, key):
+                    return _error('A request with this Idempotency-Key is still being processed.', 409)
+                try:
+                    cursor.execute("""
+                        SELECT status_code, content_type, body, fingerprint, session_writes
+                        FROM idempotency_keys
+                        WHERE scope = %s AND key = %s AND expires_at > %s
+                    """, (scope, key, now()))
+                    row = cursor.fetchone()
+                    if row:
+                        if row[3] != fingerprint:
+                            return _error(f'{IDEMPOTENCY_HEADER} was already used for a different request.', 422)
+                        return _replay(request, row)
+
+                    before = dict(request.session.items()) if hasattr(request, 'session') else {}
+                    response = view(*args, **kwargs)
+                    if response.status_code < 500:
+                        _store(cursor, scope, key, fingerprint, response, _session_writes(request, before))
+                    return response
+                finally:
+                    _release(cursor, scope, key)
+        return wrapper
+    return decorator
@@ -0,0 +1,114 @@
+"""
+Monthly partitions of trips, bookings and tickets (No ORM)
+
+Partitions are named <table>_pYYYYMM and cover one UTC calendar month; rows outside
+every monthly partition land in <table>_default. create_monthly_partition() (see
+migrations/0013_monthly_partitions.sql) does the DDL. Listing queries only read the last
+RECENT_WINDOW by default so the planner prunes older partitions; archived months are
+detached into the ARCHIVE_SCHEMA, where they stay queryable for audits.
+"""
+from django.db import connection, transaction
+from django.utils.timezone import now
+from typing import List, Dict, Any
+from datetime import date, datetime, timedelta, timezone
+import re
+
+# Archive order: bookings are checked against the trips they reference, so they go first
+PARTITIONED_TABLES = ('bookings', 'tickets', 'trips')
+RECENT_WINDOW = timedelta(days=90)
+ARCHIVE_SCHEMA = 'archive'
+
+PARTITION_NAME = re.compile(r'^(?P<table>\w+)_p(?P<year>\d{4})(?P<month>\d{2})$')
+
+
+def recent_cutoff() -> datetime:
+    """Oldest time listing queries read unless history is requested"""
+    return now() - RECENT_WINDOW
+
+
+def add_months(month: date, months: int) -> date:
+    """First day of the month `months` after (or before) `month`"""
+    index = month.year * 12 + month.month - 1 + months
+    return date(index // 12, index % 12 + 1, 1)
+
+
+def list_partitions() -> List[Dict[str, Any]]:
+    """Monthly partitions of every partitioned table with estimated row counts, oldest first"""
+    with connection.cursor() as cursor:
+        cursor.execute("""
+            SELECT parent.relname, child.relname, GREATEST(child.reltuples, 0)::bigint
+            FROM pg_inherits i
+            JOIN pg_class parent ON parent.oid = i.inhparent
+            JOIN pg_class child ON child.oid = i.inhrelid
+            WHERE parent.relnamespace = 'public'::regnamespace
+              AND parent.relname = ANY(%s)
+        """, (list(PARTITIONED_TABLES),))
+        rows = cursor.fetchall()
+
+    partitions = []
+    for table, name, estimated_rows in rows:
+        match = PARTITION_NAME.match(name)
+        partitions.append({
+            'table': table,
+            'name': name,
+            'month': date(int(match['year']), int(match['month']), 1) if match else None,
+            'estimated_rows': estimated_rows,
+        })
+    partitions.sort(key=lambda p: (p['table'], p['month'] is None, p['month'] or date.min))
+    return partitions
+
+
+def create_partitions(months_ahead: int = 3) -> List[str]:
+    """Make sure every table has partitions from the current month through months_ahead"""
+    current = now().date().replace(day=1)
+    created = []
+    with transaction.atomic(), connection.cursor() as cursor:
+        for table in PARTITIONED_TABLES:
+            for offset in range(months_ahead + 1):
+                cursor.execute("SELECT create_monthly_partition(%s, %s)",
+                               (table, add_months(current, offset)))
+                name = cursor.fetchone()[0]
+                if name:
+                    created.append(name)
+    return created
+
+
+def archive_partitions(retain_months: int = 24, drop: bool = False,
+                       dry_run: bool = False) -> Dict[str, List[str]]:
+    """
+    Detach monthly partitions older than retain_months and move them into ARCHIVE_SCHEMA
+    (or drop them). A bookings month is kept while any of its bookings belongs to a trip
+    that departs inside the retained window.
+    """
+    cutoff = add_months(now().date().replace(day=1), -retain_months)
+    result = {'archived': [], 'dropped': [], 'kept': []}
+    old = [p for p in list_partitions() if p['month'] is not None and p['month'] < cutoff]
+    old.sort(key=lambda p: (PARTITIONED_TABLES.index(p['table']), p['month']))
+
+    with transaction.atomic(), connection.cursor() as cursor:
+        if not dry_run and not drop:
+            cursor.execute(f"CREATE SCHEMA IF NOT EXISTS {ARCHIVE_SCHEMA}")
+        for partition in old:
+            if partition['table'] == 'bookings':
+                cursor.execute(f"""
+                    SELECT EXISTS (
+                        SELECT 1 FROM public.{partition['name']} b
+                        JOIN public.trips t ON t.id = b.trip_id
+                        WHERE t.departure_time >= %s
+                    )
+                """, (datetime(cutoff.year, cutoff.month, 1, tzinfo=timezone.utc),))
+                if cursor.fetchone()[0]:
+                    result['kept'].append(partition['name'])
+                    continue
+            if dry_run:
+                result['dropped' if drop else 'archived'].append(partition['name'])
+                continue
+            cursor.execute(f"ALTER TABLE public.{partition['table']} "
+                           f"DETACH PARTITION public.{partition['name']}")
+            if drop:
+                cursor.execute(f"DROP TABLE public.{partition['name']}")
+                result['dropped'].append(partition['name'])
+            else:
+                cursor.execute(f"ALTER TABLE public.{partition['name']} SET SCHEMA {ARCHIVE_SCHEMA}")
+                result['archived'].append(partition['name'])
+    return result
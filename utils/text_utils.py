@@ -0,0 +1,39 @@
+"""
+Text normalization helpers for search
+"""
+from typing import List, Set
+import re
+import unicodedata
+
+_NON_ALNUM = re.compile(r'[^0-9a-z]+')
+
+
+def normalize_text(value: str) -> str:
+    """
+    Lowercase, strip Vietnamese diacritics (including đ) and collapse
+    punctuation/whitespace to single spaces: 'Bến xe Mỹ Đình' -> 'ben xe my dinh'
+    """
+    if not value:
+        return ''
+    value = unicodedata.normalize('NFD', value.lower().replace('đ', 'd').replace('Đ', 'd'))
+    value = ''.join(char for char in value if unicodedata.category(char) != 'Mn')
+    return _NON_ALNUM.sub(' ', value).strip()
+
+
+def normalize_plate(value: str) -> str:
+    """License plate without separators: '29B-123.45' -> '29b12345'"""
+    return normalize_text(value).replace(' ', '')
+
+
+def tokenize(value: str) -> List[str]:
+    """Normalized words of a string"""
+    return normalize_text(value).split()
+
+
+def trigrams(value: str) -> Set[str]:
+    """Trigrams of each normalized word, padded like pg_trgm ('  w', ' wo', ..., 'rd ')"""
+    grams = set()
+    for word in tokenize(value):
+        padded = f"  {word} "
+        grams.update(padded[i:i + 3] for i in range(len(padded) - 2))
+    return grams